@@ -1,13 +1,16 @@
 """Avatar Manager REST API服务"""
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
 import threading
 import time
 
 from manager import get_manager
-from config import API_PORT, IDLE_TIMEOUT, HEALTH_CHECK_INTERVAL
+from config import (
+    API_PORT, IDLE_TIMEOUT, HEALTH_CHECK_INTERVAL, POOL_SIZE, POOL_REFILL_INTERVAL, PROBE_INTERVAL,
+    ENABLE_MONITORING, MONITOR_INTERVAL
+)
 from monitor import get_monitor
 
 app = Flask(__name__)
@@ -53,7 +56,17 @@ def start_avatar():
             logger.info(f"接收到avatar_name: {avatar_name}")
         
         manager = get_manager()
-        info = manager.start(instance_id, real_avatar_name=avatar_name)
+        future = manager.start_async(instance_id, real_avatar_name=avatar_name)
+        
+        # wait=false：立即返回启动状态，之后通过 /avatar/info/<avatar_id> 查询
+        if not data.get('wait', True) and not future.done():
+            return jsonify({
+                'status': 'starting',
+                'message': f'Avatar {instance_id} (真实名称: {avatar_name}) 正在启动',
+                'data': manager.get_info(avatar_name)
+            }), 202
+        
+        info = future.result()
         
         return jsonify({
             'status': 'success',
@@ -235,6 +248,77 @@ def get_status():
         }), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus抓取端点：各GPU和实例指标的最新值"""
+    body = get_manager().metrics.render_prometheus(stale_after=MONITOR_INTERVAL * 3)
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/query', methods=['GET'])
+def metrics_query():
+    """
+    时间范围查询
+    参数: name（指标名，必填）, start/end（unix秒；负数表示相对现在，如 start=-600；默认最近1小时）,
+         step（降采样间隔秒，可选），其他参数作为标签过滤（如 avatar=g_user_1、gpu=1）
+    """
+    try:
+        args = request.args.to_dict()
+        name = args.pop('name', None)
+        if not name:
+            return jsonify({'status': 'error', 'message': 'name is required'}), 400
+        now = time.time()
+        start = float(args.pop('start', -3600))
+        end = float(args.pop('end', now))
+        step = float(args.pop('step')) if 'step' in args else None
+        start = now + start if start <= 0 else start
+        end = now + end if end <= 0 else end
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'name': name,
+                'start': start,
+                'end': end,
+                'series': get_manager().metrics.query(name, start, end, step, args)
+            }
+        })
+        
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid parameter: {e}'}), 400
+    except Exception as e:
+        logger.error(f"指标查询失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/usage/report', methods=['GET'])
+def usage_report():
+    """每天的冷启动次数、命中空闲实例次数、淘汰次数和GPU-hours；参数 days（默认7）"""
+    try:
+        days = int(request.args.get('days', 7))
+        eviction = get_manager().eviction
+        
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'days': eviction.get_report(days),
+                'predicted': eviction.get_info()['predicted']
+            }
+        })
+        
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid parameter: {e}'}), 400
+    except Exception as e:
+        logger.error(f"获取使用报告失败: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
 @app.route('/avatar/stop-all', methods=['POST'])
 def stop_all():
     """停止所有Avatar"""
@@ -270,8 +354,10 @@ def background_tasks():
             manager.health_check()
             
             # 清理空闲实例
-            if IDLE_TIMEOUT > 0:
-                manager.cleanup_idle(IDLE_TIMEOUT)
+            manager.cleanup_idle(IDLE_TIMEOUT)
+            
+            # 累计GPU占用时长，保存请求历史
+            manager.account_usage()
             
         except Exception as e:
             logger.error(f"后台任务错误: {e}")
@@ -280,6 +366,45 @@ def background_tasks():
         time.sleep(HEALTH_CHECK_INTERVAL)
 
 
+def probe_tasks():
+    """后台任务：并发探测各实例的 /health"""
+    logger.info("健康探测线程启动")
+    
+    while True:
+        try:
+            get_manager().probe_health()
+        except Exception as e:
+            logger.error(f"健康探测错误: {e}")
+        
+        time.sleep(PROBE_INTERVAL)
+
+
+def pool_tasks():
+    """后台任务：补充预热实例"""
+    logger.info("预热池线程启动")
+    
+    while True:
+        try:
+            get_manager().replenish_pool()
+        except Exception as e:
+            logger.error(f"预热池任务错误: {e}")
+        
+        time.sleep(POOL_REFILL_INTERVAL)
+
+
+def metrics_tasks():
+    """后台任务：采样GPU和实例指标"""
+    logger.info("指标采样线程启动")
+    
+    while True:
+        try:
+            get_manager().sample_metrics()
+        except Exception as e:
+            logger.error(f"指标采样错误: {e}")
+        
+        time.sleep(MONITOR_INTERVAL)
+
+
 # ============================================================================
 # 启动服务
 # ============================================================================
@@ -287,10 +412,27 @@ def background_tasks():
 if __name__ == '__main__':
     logger.info(f"启动Avatar Manager API服务 (端口: {API_PORT})")
     
+    # 先创建管理器：从状态日志接管上次运行留下的实例
+    get_manager()
+    
     # 启动后台任务线程
     bg_thread = threading.Thread(target=background_tasks, daemon=True)
     bg_thread.start()
     
+    # 启动健康探测线程
+    probe_thread = threading.Thread(target=probe_tasks, daemon=True)
+    probe_thread.start()
+    
+    # 启动指标采样线程
+    if ENABLE_MONITORING:
+        metrics_thread = threading.Thread(target=metrics_tasks, daemon=True)
+        metrics_thread.start()
+    
+    # 启动预热池线程
+    if POOL_SIZE > 0:
+        pool_thread = threading.Thread(target=pool_tasks, daemon=True)
+        pool_thread.start()
+    
     # 启动Flask应用
     app.run(
         host='0.0.0.0',
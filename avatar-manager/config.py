@@ -11,6 +11,20 @@ MAX_AVATARS = 5  # 最大Avatar数量
 PRIMARY_GPU = 1  # 主要使用的GPU（0或1）- 改用GPU 1，因为GPU 0被LLM占用
 BACKUP_GPU = 0   # 备用GPU
 
+# GPU放置配置（见scheduler.py）
+GPU_IDS = [PRIMARY_GPU, BACKUP_GPU]  # 可调度的GPU，顺序即同等条件下的优先级
+GPU_PROVIDER = 'nvml'  # 'nvml' 真实GPU；'fake' 无GPU环境测试；'none' 不读显存，只按预留量均衡
+FAKE_GPU_TOTAL_MB = [24576, 24576]  # GPU_PROVIDER='fake' 时每张卡的显存
+MODEL_FOOTPRINT_MB = {  # 各模型实例的显存初始估计，运行中按实际观测学习
+    'musetalk': 11000,
+    'wav2lip': 6000,
+    'ultralight': 4000,
+}
+DEFAULT_FOOTPRINT_MB = 11000  # 未知模型的显存估计
+GPU_HEADROOM_MB = 1024  # 每张卡保留不分配的显存
+GPU_STRICT_PLACEMENT = False  # True: 放不下时拒绝启动；False: 退回有效空闲最多的卡
+FOOTPRINT_FILE = 'logs/gpu_footprints.json'  # 学习到的footprint
+
 # 端口配置（从统一配置导入）
 BASE_PORT = AVATAR_BASE_PORT  # Avatar起始端口
 API_PORT = AVATAR_MANAGER_API_PORT   # Manager API端口
@@ -35,14 +49,50 @@ CONDA_ENV = '/workspace/conda/envs/avatar'  # lip-sync使用的conda环境
 
 # 超时配置（秒）
 STARTUP_TIMEOUT = 30  # Avatar启动超时
-IDLE_TIMEOUT = 1800   # 空闲30分钟自动关闭（0表示不自动关闭）
+IDLE_TIMEOUT = 1800   # 超过30分钟没有新请求（0表示不检查）：'idle'策略关闭实例，'predictive'策略只把连接数清零、保留为空闲实例
 HEALTH_CHECK_INTERVAL = 60  # 健康检查间隔
+STOP_GRACE_SECONDS = 3  # 停止实例时SIGTERM后等待优雅退出的时间，超时SIGKILL
+STOP_KILL_WAIT = 2  # SIGKILL后等待进程消失的时间
+GPU_RELEASE_TIMEOUT = 5  # 进程退出后等待NVML中其显存消失的最长时间
+
+# 实例健康探测配置（见prober.py）
+PROBE_INTERVAL = 5  # 探测间隔（秒）
+PROBE_TIMEOUT = 1.0  # 单个 /health 请求超时（秒），一轮探测的耗时约等于它
+PROBE_UNHEALTHY_AFTER = 3  # 连续失败次数达到后判定unhealthy
+PROBE_RECOVER_AFTER = 2  # 连续成功次数达到后恢复healthy
+PROBE_SLOW_MS = 500  # 响应超过该值视为degraded
+PROBE_RESTART_UNHEALTHY = True  # unhealthy（进程还在但不响应）时自动重启
+
+# 预热池配置：保持若干常用Avatar实例常驻（无连接时作为standby），首次登录直接复用
+POOL_SIZE = 2  # 预热的Avatar数量（0表示关闭）
+POOL_AVATARS = []  # 固定预热的Avatar名称，剩余名额按近期使用次数补足
+POOL_USAGE_WINDOW = 24 * 3600  # 统计使用次数的时间窗口（秒）
+POOL_REFILL_INTERVAL = 15  # 后台补充预热实例的间隔（秒）
+POOL_RESERVED_SLOTS = 1  # 预热不占用的实例名额，留给冷启动
+POOL_GPU_HEADROOM_MB = 2000  # 预热一个实例后GPU上仍需保留的空闲显存（MB）
+
+# 实例淘汰配置（见eviction.py）
+EVICTION_POLICY = 'predictive'  # 'predictive': 空闲实例保留，启动时显存/名额不够才按价值淘汰；'idle': 空闲超过IDLE_TIMEOUT即关闭
+EVICTION_HORIZON = 3600  # 预测窗口（秒）：实例价值按这段时间内被再次使用的概率计算
+EVICTION_HISTORY_DAYS = 14  # 保留的请求历史（天），够两周才能看出每周固定时间的课程
+EVICTION_SLOT_SECONDS = 900  # 请求历史的时间槽（秒）
+EVICTION_HALF_LIFE = 3600  # 近期请求的衰减半衰期（秒）
+EVICTION_MAX_IDLE = 4 * 3600  # 空闲实例超过该时长且复用概率低于EVICTION_KEEP_PROBABILITY时关闭（0表示只在需要空间时淘汰）
+EVICTION_KEEP_PROBABILITY = 0.2
+PREWARM_PREDICTED = True  # 预热池按预测的下一窗口需求选Avatar（False时按POOL_USAGE_WINDOW内的启动次数）
+PREWARM_MIN_PROBABILITY = 0.3  # 复用概率达到该值才预热
+USAGE_HISTORY_FILE = 'logs/usage_history.json'  # 请求历史、每天的冷启动次数和GPU-hours
+
+# 状态日志：实例注册表持久化，manager重启后按PID接管仍在运行的实例
+STATE_FILE = 'logs/manager_state.json'
+ADOPT_ON_START = True  # False时忽略状态文件（不接管旧实例）
 
 # 日志配置
 LOG_FILE = 'logs/avatar_manager.log'
 LOG_LEVEL = 'INFO'
 
-# 监控配置
+# 监控配置（见metrics.py）：GPU和实例指标按固定间隔采样，保存在环形缓冲里，/metrics 导出
 ENABLE_MONITORING = True
 MONITOR_INTERVAL = 10  # GPU监控间隔（秒）
+METRICS_RETENTION = 720  # 每条时间序列保留的点数（720 × 10秒 = 2小时）
 
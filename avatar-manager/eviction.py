@@ -0,0 +1,323 @@
+"""实例淘汰策略 - 按显存压力、复用频率和时段规律决定保留哪些空闲实例
+
+- 不按固定的 IDLE_TIMEOUT 关闭实例：最后一个用户断开后实例保留为空闲（standby），
+  启动新实例时显存或实例名额不够，才按价值从低到高淘汰空闲实例
+- 价值 = 预测窗口内被再次使用的概率 × 冷启动耗时 / 显存(GB)：快要用到、启动慢、占显存少的实例最值得保留
+- 复用概率取两者较大值：最近有请求的时间槽（指数衰减）和历史上同一时段有请求的比例（按天、按周，如每周固定时间的课程）；
+  只看时间槽里有没有请求，不看请求数，一节课几十个用户登录不会被当成全天都有需求
+- 同一预测用于预热池：下一个窗口可能用到的Avatar提前启动
+- 按天统计冷启动次数和GPU占用时长（GPU-hours），和历史一起持久化
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger('Eviction')
+
+DAY = 86400
+WEEK = 7 * DAY
+
+
+class UsageHistory:
+    """
+    每个Avatar按时间槽计数的启动请求（只存计数，占用与请求量无关）。
+
+    Args:
+        slot_seconds (int): 时间槽长度（秒）
+        history_days (int): 保留的天数
+        half_life (float): 近期请求的衰减半衰期（秒）
+    """
+
+    def __init__(self, slot_seconds: int = 900, history_days: int = 14, half_life: float = 3600):
+        self.slot_seconds = slot_seconds
+        self.history_days = history_days
+        self.half_life = half_life
+        self.slots: Dict[str, Dict[int, int]] = {}  # name -> slot -> 请求数
+        self.since: Optional[float] = None  # 最早一条记录的时间，决定有几天/几周的历史可用
+
+    def record(self, name: str, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        slot = int(ts // self.slot_seconds)
+        counts = self.slots.setdefault(name, {})
+        counts[slot] = counts.get(slot, 0) + 1
+        if self.since is None or ts < self.since:
+            self.since = ts
+
+    def prune(self, now: float):
+        oldest = int((now - self.history_days * DAY) // self.slot_seconds)
+        for name in list(self.slots):
+            counts = self.slots[name]
+            for slot in [s for s in counts if s < oldest]:
+                del counts[slot]
+            if not counts:
+                del self.slots[name]
+        if self.since is not None:
+            self.since = max(self.since, now - self.history_days * DAY)
+
+    def names(self) -> List[str]:
+        return list(self.slots)
+
+    def _count(self, counts: Dict[int, int], start: float, end: float) -> int:
+        lo, hi = int(start // self.slot_seconds), int(end // self.slot_seconds)
+        return sum(counts.get(slot, 0) for slot in range(lo, hi))
+
+    def recent_probability(self, name: str, now: float, horizon: float) -> float:
+        """按近期活跃程度估计的复用概率：有请求的槽按年龄指数衰减，折算成活跃槽的出现率（泊松）"""
+        counts = self.slots.get(name)
+        if not counts:
+            return 0.0
+        decayed = 0.0
+        for slot in counts:
+            age = max(0.0, now - (slot + 0.5) * self.slot_seconds)
+            decayed += 0.5 ** (age / self.half_life)
+        rate = decayed * math.log(2) / self.half_life
+        return 1.0 - math.exp(-rate * horizon)
+
+    def seasonal_probability(self, name: str, now: float, horizon: float) -> float:
+        """过去每天、每周的 [同一时刻, +horizon) 里有请求的比例，取较大值"""
+        counts = self.slots.get(name)
+        if not counts or self.since is None:
+            return 0.0
+        covered = now - self.since
+        fractions = []
+        for period, n in ((DAY, min(self.history_days, int(covered // DAY))),
+                          (WEEK, min(self.history_days // 7, int(covered // WEEK)))):
+            if n > 0:
+                active = sum(1 for k in range(1, n + 1)
+                             if self._count(counts, now - k * period, now - k * period + horizon) > 0)
+                fractions.append(active / n)
+        return max(fractions, default=0.0)
+
+    def reuse_probability(self, name: str, now: float, horizon: float) -> float:
+        """接下来horizon秒内被请求的概率"""
+        return max(self.recent_probability(name, now, horizon), self.seasonal_probability(name, now, horizon))
+
+    def to_state(self) -> dict:
+        return {
+            'slot_seconds': self.slot_seconds,
+            'since': self.since,
+            'slots': {name: {str(slot): count for slot, count in counts.items()} for name, counts in self.slots.items()}
+        }
+
+    def load_state(self, state: dict):
+        if state.get('slot_seconds') != self.slot_seconds:
+            logger.warning(f"Usage history slot size changed ({state.get('slot_seconds')} -> {self.slot_seconds}), ignored")
+            return
+        self.since = state.get('since')
+        self.slots = {name: {int(slot): count for slot, count in counts.items()}
+                      for name, counts in state.get('slots', {}).items()}
+
+
+class UsageReport:
+    """
+    按天统计：冷启动（用户请求时没有可用实例）、命中空闲实例、预热启动、淘汰次数，
+    以及实例占用GPU的时长（gpu_hours，其中没有连接的部分计入idle_gpu_hours）和显存×时长（gpu_gb_hours）。
+
+    Args:
+        keep_days (int): 保留的天数
+        max_gap (float): 两次tick间隔超过该值（manager停过）时只按max_gap计时
+    """
+
+    COUNTERS = ('cold_starts', 'cold_start_seconds', 'warm_hits', 'prewarms', 'evictions')
+    HOURS = ('gpu_hours', 'idle_gpu_hours', 'gpu_gb_hours')
+
+    def __init__(self, keep_days: int = 30, max_gap: float = 300):
+        self.keep_days = keep_days
+        self.max_gap = max_gap
+        self.days: Dict[str, dict] = {}
+        self.last_tick: Optional[float] = None
+
+    def _day(self, ts: float) -> dict:
+        key = datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = {name: 0 for name in self.COUNTERS + self.HOURS}
+            for old in sorted(self.days)[:-self.keep_days]:
+                del self.days[old]
+        return day
+
+    def count(self, counter: str, ts: Optional[float] = None, amount: float = 1):
+        self._day(time.time() if ts is None else ts)[counter] += amount
+
+    def tick(self, instances: List[dict], now: Optional[float] = None):
+        """instances: 当前实例 [{'memory_mb', 'idle'}]，从上次tick到now的时长计入当天"""
+        now = time.time() if now is None else now
+        if self.last_tick is not None:
+            hours = min(max(0.0, now - self.last_tick), self.max_gap) / 3600
+            day = self._day(now)
+            for inst in instances:
+                day['gpu_hours'] += hours
+                day['gpu_gb_hours'] += hours * inst['memory_mb'] / 1024
+                if inst['idle']:
+                    day['idle_gpu_hours'] += hours
+        self.last_tick = now
+
+    def get_report(self, days: int = 7) -> List[dict]:
+        result = []
+        for key in sorted(self.days)[-days:]:
+            day = self.days[key]
+            result.append({
+                'date': key,
+                **{name: day[name] for name in ('cold_starts', 'warm_hits', 'prewarms', 'evictions')},
+                'avg_cold_start_seconds': round(day['cold_start_seconds'] / day['cold_starts'], 2) if day['cold_starts'] else None,
+                **{name: round(day[name], 3) for name in self.HOURS}
+            })
+        return result
+
+
+class EvictionPolicy:
+    """
+    Args:
+        history (UsageHistory): 启动请求历史
+        horizon (float): 预测窗口（秒）
+        default_cold_start (float): 还没观测到启动耗时的Avatar按该值估计（秒）
+        state_file (str): 历史和统计的持久化文件，None表示不保存
+    """
+
+    def __init__(self, history: UsageHistory, horizon: float = 3600, default_cold_start: float = 30.0,
+                 report: Optional[UsageReport] = None, state_file: Optional[str] = None):
+        self.history = history
+        self.horizon = horizon
+        self.default_cold_start = default_cold_start
+        self.report = report or UsageReport()
+        self.state_file = state_file
+        self.cold_start: Dict[str, float] = {}  # name -> 启动耗时的滑动平均（秒）
+        self._lock = threading.Lock()
+        self._load()
+
+    # ---------- 记录 ----------
+
+    def record_request(self, name: str, ts: Optional[float] = None):
+        with self._lock:
+            self.history.record(name, ts)
+
+    def record_start(self, name: str, seconds: Optional[float], cold: bool, ts: Optional[float] = None):
+        """实例启动完成：cold=True是用户等待的冷启动，False是预热"""
+        with self._lock:
+            if seconds is not None:
+                old = self.cold_start.get(name)
+                self.cold_start[name] = seconds if old is None else old + 0.3 * (seconds - old)
+            if cold:
+                self.report.count('cold_starts', ts)
+                self.report.count('cold_start_seconds', ts, seconds or 0)
+            else:
+                self.report.count('prewarms', ts)
+
+    def record(self, counter: str, ts: Optional[float] = None):
+        with self._lock:
+            self.report.count(counter, ts)
+
+    def tick(self, instances: List[dict], now: Optional[float] = None):
+        with self._lock:
+            self.report.tick(instances, now)
+
+    def get_report(self, days: int = 7) -> List[dict]:
+        with self._lock:
+            return self.report.get_report(days)
+
+    # ---------- 预测 ----------
+
+    def reuse_probability(self, name: str, now: Optional[float] = None) -> float:
+        with self._lock:
+            return self.history.reuse_probability(name, time.time() if now is None else now, self.horizon)
+
+    def value(self, name: str, memory_mb: float, now: Optional[float] = None) -> float:
+        """保留该Avatar一个实例的价值：预期省下的冷启动秒数 / 占用的显存GB"""
+        cold_start = self.cold_start.get(name, self.default_cold_start)
+        return self.reuse_probability(name, now) * cold_start / max(memory_mb / 1024, 0.5)
+
+    def predict(self, now: Optional[float] = None, min_probability: float = 0.0) -> List[Tuple[str, float]]:
+        """预测窗口内可能被请求的Avatar，按概率从高到低"""
+        now = time.time() if now is None else now
+        with self._lock:
+            probs = [(name, self.history.reuse_probability(name, now, self.horizon)) for name in self.history.names()]
+        return sorted([(n, p) for n, p in probs if p >= min_probability and p > 0], key=lambda item: -item[1])
+
+    # ---------- 淘汰 ----------
+
+    def choose_victims(self, candidates: List[dict], shortfall: Dict[int, float], need_slot: bool,
+                       now: Optional[float] = None, max_value: Optional[float] = None
+                       ) -> Optional[Tuple[Optional[int], List[dict]]]:
+        """
+        选出要淘汰的空闲实例。
+
+        Args:
+            candidates: 可淘汰的实例 [{'avatar_id', 'name', 'gpu_id', 'memory_mb'}]
+            shortfall: 各卡放下新实例还差的显存（MB），空dict表示显存够
+            need_slot: 实例名额是否已满
+            max_value: 只淘汰价值低于它的实例（预热时用新Avatar自己的价值，用户请求不限）
+
+        Returns:
+            (新实例应放的GPU（None表示不限）, 淘汰列表)；腾不出空间时返回None
+        """
+        scored = sorted(({**c, 'value': self.value(c['name'], c['memory_mb'], now)} for c in candidates),
+                        key=lambda c: c['value'])
+        if max_value is not None:
+            scored = [c for c in scored if c['value'] < max_value]
+
+        if not shortfall:
+            if not need_slot:
+                return None, []
+            return (None, scored[:1]) if scored else None
+
+        best = None
+        for gpu_id, missing in shortfall.items():
+            victims, freed = [], 0.0
+            for c in scored:
+                if freed >= missing:
+                    break
+                if c['gpu_id'] == gpu_id:
+                    victims.append(c)
+                    freed += c['memory_mb']
+            if freed < missing:
+                continue
+            cost = sum(c['value'] for c in victims)
+            if best is None or cost < best[0]:
+                best = (cost, gpu_id, victims)
+        if best is None:
+            return None
+        return best[1], best[2]
+
+    # ---------- 持久化 / 状态 ----------
+
+    def _load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.history.load_state(state.get('history', {}))
+            self.history.prune(time.time())
+            self.report.days = state.get('report', {})
+            self.cold_start = {k: float(v) for k, v in state.get('cold_start', {}).items()}
+        except Exception as e:
+            logger.warning(f"Failed to load usage history from {self.state_file}: {e}")
+
+    def save(self):
+        if not self.state_file:
+            return
+        with self._lock:
+            self.history.prune(time.time())
+            state = {'history': self.history.to_state(), 'report': self.report.days, 'cold_start': self.cold_start}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+        except Exception as e:
+            logger.warning(f"Failed to save usage history to {self.state_file}: {e}")
+
+    def get_info(self, now: Optional[float] = None) -> dict:
+        return {
+            'horizon': self.horizon,
+            'predicted': [{'avatar': n, 'probability': round(p, 3)} for n, p in self.predict(now)[:10]],
+            'cold_start_seconds': {k: round(v, 2) for k, v in self.cold_start.items()},
+            'latest_day': (self.get_report(1) or [None])[0]
+        }
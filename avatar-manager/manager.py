@@ -8,26 +8,28 @@ import logging
 import json
 from typing import Dict, Optional, List
 from datetime import datetime
+from collections import deque
 import psutil
 import threading
-
-# Try to import pynvml for GPU memory management
-try:
-    import pynvml
-    pynvml.nvmlInit()
-    NVML_AVAILABLE = True
-except ImportError:
-    NVML_AVAILABLE = False
-    print("Warning: pynvml not available, GPU memory checking disabled")
-except Exception as e:
-    NVML_AVAILABLE = False
-    print(f"Warning: Failed to initialize pynvml: {e}")
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 
 from config import (
     MAX_AVATARS, PRIMARY_GPU, BACKUP_GPU, BASE_PORT,
     AVATAR_CONFIG, LIP_SYNC_PATH, AVATAR_DATA_PATH, STARTUP_TIMEOUT,
-    LOG_FILE, LOG_LEVEL, CONDA_INIT, CONDA_ENV, TTS_PORT, TTS_TACOTRON_PORT, get_tts_port_for_model
+    LOG_FILE, LOG_LEVEL, CONDA_INIT, CONDA_ENV, TTS_PORT, TTS_TACOTRON_PORT, get_tts_port_for_model,
+    POOL_SIZE, POOL_AVATARS, POOL_USAGE_WINDOW, POOL_RESERVED_SLOTS, POOL_GPU_HEADROOM_MB,
+    GPU_IDS, GPU_PROVIDER, FAKE_GPU_TOTAL_MB, MODEL_FOOTPRINT_MB, DEFAULT_FOOTPRINT_MB,
+    GPU_HEADROOM_MB, GPU_STRICT_PLACEMENT, FOOTPRINT_FILE,
+    PROBE_TIMEOUT, PROBE_UNHEALTHY_AFTER, PROBE_RECOVER_AFTER, PROBE_SLOW_MS, PROBE_RESTART_UNHEALTHY,
+    STOP_GRACE_SECONDS, STOP_KILL_WAIT, GPU_RELEASE_TIMEOUT, STATE_FILE, ADOPT_ON_START,
+    MONITOR_INTERVAL, METRICS_RETENTION, HEALTH_CHECK_INTERVAL,
+    EVICTION_POLICY, EVICTION_HORIZON, EVICTION_HISTORY_DAYS, EVICTION_SLOT_SECONDS, EVICTION_HALF_LIFE,
+    EVICTION_MAX_IDLE, EVICTION_KEEP_PROBABILITY, PREWARM_PREDICTED, PREWARM_MIN_PROBABILITY, USAGE_HISTORY_FILE
 )
+from scheduler import PlacementScheduler, create_provider
+from prober import HealthProber, HealthState, HEALTH_UNKNOWN, HEALTH_HEALTHY, HEALTH_DEGRADED, HEALTH_UNHEALTHY
+from metrics import MetricsStore, MetricsSampler
+from eviction import EvictionPolicy, UsageHistory, UsageReport
 
 # 配置日志
 logging.basicConfig(
@@ -41,6 +43,43 @@ logging.basicConfig(
 logger = logging.getLogger('AvatarManager')
 
 
+def _process_create_time(pid: int) -> Optional[float]:
+    try:
+        return psutil.Process(pid).create_time()
+    except Exception:
+        return None
+
+
+class AdoptedProcess:
+    """manager重启后接管的实例进程：不是当前进程的子进程，用psutil提供实例用到的Popen接口（poll/wait）"""
+    
+    def __init__(self, pid: int, create_time: Optional[float] = None):
+        self.pid = pid
+        self.create_time = create_time  # 防止PID被其他进程复用后误接管
+        self.returncode = None
+    
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                proc = psutil.Process(self.pid)
+                if proc.status() == psutil.STATUS_ZOMBIE or \
+                        (self.create_time and abs(proc.create_time() - self.create_time) > 1):
+                    self.returncode = -1
+            except psutil.NoSuchProcess:
+                self.returncode = -1
+        return self.returncode
+    
+    def wait(self, timeout: Optional[float] = None) -> int:
+        try:
+            psutil.Process(self.pid).wait(timeout)
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        self.returncode = -1
+        return self.returncode
+
+
 class AvatarInstance:
     """Avatar实例类"""
     
@@ -49,11 +88,16 @@ class AvatarInstance:
         self.real_avatar_name = real_avatar_name or avatar_id  # 真实名称 (g)
         self.port = port
         self.gpu_id = gpu_id
-        self.process = process
+        self.process = process  # subprocess.Popen，或manager重启后接管的AdoptedProcess
         self.pid = process.pid
+        self.create_time = getattr(process, 'create_time', None) or _process_create_time(process.pid)
+        self.adopted = isinstance(process, AdoptedProcess)
         self.start_time = datetime.now()
         self.last_activity = datetime.now()
         self.connections = 0
+        self.startup_seconds = None  # 从请求到端口可连接的耗时
+        self.standby = False  # 预热池中的空闲实例（没有连接，不参与空闲清理）
+        self.health = HealthState()  # /health 探测结果
     
     def is_running(self) -> bool:
         """检查进程是否运行"""
@@ -71,7 +115,26 @@ class AvatarInstance:
             'start_time': self.start_time.isoformat(),
             'uptime_seconds': (datetime.now() - self.start_time).total_seconds(),
             'webrtc_url': f'http://localhost:{self.port}/offer',
-            'connections': self.connections
+            'connections': self.connections,
+            'startup_seconds': self.startup_seconds,
+            'standby': self.standby,
+            'adopted': self.adopted,
+            'health': self.health.get_info()
+        }
+    
+    def to_state(self) -> dict:
+        """写入状态日志的字段"""
+        return {
+            'avatar_id': self.avatar_id,
+            'real_avatar_name': self.real_avatar_name,
+            'port': self.port,
+            'gpu_id': self.gpu_id,
+            'pid': self.pid,
+            'create_time': self.create_time,
+            'start_time': self.start_time.isoformat(),
+            'connections': self.connections,
+            'startup_seconds': self.startup_seconds,
+            'standby': self.standby
         }
     
     def update_activity(self):
@@ -83,6 +146,41 @@ class AvatarInstance:
         return (datetime.now() - self.last_activity).total_seconds()
 
 
+# 启动状态机：reserving（锁内预占端口/GPU）→ spawning（锁外拉起进程、等待端口）→ ready / failed
+START_RESERVING = 'reserving'
+START_SPAWNING = 'spawning'
+START_READY = 'ready'
+START_FAILED = 'failed'
+
+
+class PendingStart:
+    """正在启动的Avatar（按真实名称唯一），同名的并发请求共享同一个future"""
+    
+    def __init__(self, avatar_id: str, real_avatar_name: str, standby: bool = False):
+        self.avatar_id = avatar_id
+        self.real_avatar_name = real_avatar_name
+        self.standby = standby
+        self.state = START_RESERVING
+        self.port = None
+        self.gpu_id = None
+        self.waiters = 0 if standby else 1  # 等待该实例的请求数，就绪后作为初始连接数
+        self.requested_at = time.time()
+        self.evicting: List[Future] = []  # 为它腾空间而淘汰的实例的拆除任务，拉起进程前等待完成
+        self.future = Future()
+    
+    def get_info(self) -> dict:
+        return {
+            'avatar_id': self.avatar_id,
+            'real_avatar_name': self.real_avatar_name,
+            'state': self.state,
+            'port': self.port,
+            'gpu': self.gpu_id,
+            'waiters': self.waiters,
+            'standby': self.standby,
+            'elapsed_seconds': round(time.time() - self.requested_at, 2)
+        }
+
+
 class AvatarManager:
     """Avatar管理器"""
     
@@ -95,11 +193,43 @@ class AvatarManager:
         self.base_port = BASE_PORT
         self._lock = threading.Lock()  # 添加线程锁防止并发端口分配冲突
         self._allocating_ports: set = set()  # 正在分配中的端口集合（防止并发冲突）
+        self._starting: Dict[str, PendingStart] = {}  # 正在启动的实例: real_avatar_name -> PendingStart
+        self._tts_locks: Dict[str, threading.Lock] = {}  # 同一TTS服务只由一个启动线程拉起
+        # 进程拉起和端口等待在这里执行，不占用self._lock，不同Avatar并行启动
+        self._spawn_pool = ThreadPoolExecutor(max_workers=max_instances, thread_name_prefix='avatar-start')
+        # GPU放置：按模型footprint预留显存，best-fit装箱
+        gpu_ids = GPU_IDS or [primary_gpu, self.backup_gpu]
+        self.scheduler = PlacementScheduler(
+            create_provider(GPU_PROVIDER, FAKE_GPU_TOTAL_MB), gpu_ids,
+            footprints=MODEL_FOOTPRINT_MB, default_footprint_mb=DEFAULT_FOOTPRINT_MB,
+            headroom_mb=GPU_HEADROOM_MB, strict=GPU_STRICT_PLACEMENT, footprint_file=FOOTPRINT_FILE
+        )
+        self._teardown_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='avatar-stop')
+        self.prober = HealthProber(PROBE_TIMEOUT, PROBE_UNHEALTHY_AFTER, PROBE_RECOVER_AFTER, PROBE_SLOW_MS)
+        self._recovering: set = set()  # 正在因unhealthy重启的实例
+        self._usage: Dict[str, deque] = {}  # real_avatar_name -> 最近的启动请求时间，用于选择预热的Avatar
+        self.pool_stats = {'hits': 0, 'joined': 0, 'misses': 0, 'prestarted': 0}
+        self._state_lock = threading.Lock()  # 串行写状态日志，与self._lock无关
+        # 指标时间序列：GPU数据和调度器共用同一个provider
+        self.metrics = MetricsStore(METRICS_RETENTION)
+        self.sampler = MetricsSampler(self.metrics, self.scheduler.provider, self.scheduler.gpu_ids,
+                                      self._metrics_snapshot, MONITOR_INTERVAL)
+        # 淘汰策略：请求历史、实例价值预测、每天的冷启动次数和GPU-hours
+        self.eviction = EvictionPolicy(
+            UsageHistory(EVICTION_SLOT_SECONDS, EVICTION_HISTORY_DAYS, EVICTION_HALF_LIFE), EVICTION_HORIZON,
+            default_cold_start=STARTUP_TIMEOUT, report=UsageReport(max_gap=HEALTH_CHECK_INTERVAL * 2),
+            state_file=USAGE_HISTORY_FILE
+        )
         
         logger.info(f"Avatar Manager 初始化")
         logger.info(f"  最大实例数: {self.max_instances}")
         logger.info(f"  主GPU: {self.primary_gpu}")
+        logger.info(f"  可调度GPU: {self.scheduler.gpu_ids} ({type(self.scheduler.provider).__name__})")
         logger.info(f"  起始端口: {self.base_port}")
+        logger.info(f"  淘汰策略: {EVICTION_POLICY}")
+        
+        if ADOPT_ON_START:
+            self._restore_state()
     
     def _allocate_port(self, exclude_port: Optional[int] = None) -> int:
         """分配端口（检查manager内部和系统层面的端口占用）
@@ -178,7 +308,7 @@ class AvatarManager:
             logger.error(f"检查端口 {port} 状态时发生异常: {e}", exc_info=True)
             return False
 
-    def _wait_for_port_binding(self, port: int, timeout: int = 30) -> bool:
+    def _wait_for_port_binding(self, port: int, timeout: int = 30, process: Optional[subprocess.Popen] = None) -> bool:
         """等待端口真正被subprocess bind（socket成功监听）
 
         通过主动轮询检查，验证subprocess是否已成功绑定到指定端口
@@ -187,15 +317,19 @@ class AvatarManager:
         Args:
             port: 端口号
             timeout: 最大等待时间（秒）
+            process: 被等待的进程，进程提前退出时立即返回False
 
         Returns:
-            True if port successfully bound and listening, False if timeout
+            True if port successfully bound and listening, False if timeout or process exited
         """
         import socket
         start_time = time.time()
         poll_interval = 0.1  # 100ms轮询间隔
 
         while time.time() - start_time < timeout:
+            if process is not None and process.poll() is not None:
+                logger.error(f"✗ 进程 PID {process.pid} 在端口 {port} 绑定前已退出 (返回码: {process.returncode})")
+                return False
             try:
                 # 尝试连接到该端口，如果成功说明socket已listening
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -222,96 +356,29 @@ class AvatarManager:
         Returns:
             dict with 'total', 'used', 'free' in MB, or None if unavailable
         """
-        if not NVML_AVAILABLE:
-            return None
-        
-        try:
-            handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
-            info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            return {
-                'total': info.total / (1024 ** 2),  # Convert to MB
-                'used': info.used / (1024 ** 2),
-                'free': info.free / (1024 ** 2)
-            }
-        except Exception as e:
-            logger.warning(f"Failed to get GPU {gpu_id} memory info: {e}")
-            return None
+        return self.scheduler.provider.memory_info(gpu_id)
     
-    def _allocate_gpu(self, required_mb: int = 11000) -> int:
-        """自动分配GPU，选择显存最充足的GPU
+    def _allocate_gpu(self, instance_id: str, avatar_model: str, real_avatar_name: str,
+                      force_gpu: Optional[int] = None) -> int:
+        """为实例预留显存并选择GPU（调度细节见scheduler.py）
         
         Args:
-            required_mb: 需要的显存（MB），默认11GB（降低阈值以便更好分配）
+            instance_id: 实例ID，预留以此为key，实例停止或启动失败时释放
+            avatar_model: 模型类型（musetalk/wav2lip/ultralight），决定预留多少显存
+            real_avatar_name: 真实Avatar名称，同名实例尽量分到不同GPU
+            force_gpu: 强制使用的GPU（仍登记预留）
         
         Returns:
             GPU ID
         """
-        # 获取所有可用的GPU
-        available_gpus = [self.primary_gpu, self.backup_gpu]
-        
-        if not NVML_AVAILABLE:
-            # 如果无法获取GPU信息，使用简单的轮询策略
-            logger.warning("NVML not available, using simple round-robin GPU allocation")
-            gpu_usage = {}
-            for inst in self.instances.values():
-                gpu_id = inst.gpu_id
-                gpu_usage[gpu_id] = gpu_usage.get(gpu_id, 0) + 1
-            
-            # 选择使用最少的GPU
-            best_gpu = self.primary_gpu
-            min_count = gpu_usage.get(self.primary_gpu, 0)
-            
-            for gpu_id in available_gpus:
-                count = gpu_usage.get(gpu_id, 0)
-                if count < min_count:
-                    min_count = count
-                    best_gpu = gpu_id
-            
-            logger.info(f"Allocated GPU {best_gpu} (round-robin, instances: {gpu_usage})")
-            return best_gpu
-        
-        # 基于显存分配
-        best_gpu = self.primary_gpu
-        max_free_mb = -1
-        candidates_with_enough_mem = []
-        
-        for gpu_id in available_gpus:
-            mem_info = self._get_gpu_memory_info(gpu_id)
-            if mem_info is None:
-                continue
-            
-            free_mb = mem_info['free']
-            used_mb = mem_info['used']
-            total_mb = mem_info['total']
-            
-            logger.debug(f"GPU {gpu_id}: {free_mb:.0f} MB free / {total_mb:.0f} MB total ({used_mb:.0f} MB used)")
-            
-            # 检查是否有足够的显存
-            if free_mb >= required_mb:
-                candidates_with_enough_mem.append((gpu_id, free_mb))
-                if free_mb > max_free_mb:
-                    max_free_mb = free_mb
-                    best_gpu = gpu_id
-        
-        if max_free_mb < 0:
-            # 如果没有GPU有足够的显存，选择显存最多的
-            logger.warning(f"No GPU has {required_mb} MB free, selecting GPU with most free memory")
-            for gpu_id in available_gpus:
-                mem_info = self._get_gpu_memory_info(gpu_id)
-                if mem_info and mem_info['free'] > max_free_mb:
-                    max_free_mb = mem_info['free']
-                    best_gpu = gpu_id
-        else:
-            # 有足够的显存，从候选者中选择显存最多的
-            logger.info(f"Found {len(candidates_with_enough_mem)} GPU(s) with enough memory: {candidates_with_enough_mem}")
-        
-        mem_info = self._get_gpu_memory_info(best_gpu)
-        if mem_info:
-            logger.info(f"Allocated GPU {best_gpu}: {mem_info['free']:.0f} MB free / {mem_info['total']:.0f} MB total")
-        else:
-            logger.info(f"Allocated GPU {best_gpu} (memory info unavailable)")
-        
-        return best_gpu
+        return self.scheduler.reserve(instance_id, avatar_model, label=real_avatar_name, gpu_id=force_gpu)
+    
+    def _pid_tree(self, pid: int) -> List[int]:
+        """进程及其所有子进程（实例进程是bash，真正占显存的是子进程python）"""
+        try:
+            return [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except Exception:
+            return [pid]
     
     def _normalize_tts_model(self, tts_model: str) -> str:
         """标准化TTS模型名称
@@ -556,75 +623,166 @@ class AvatarManager:
             logger.error(f"Failed to start TTS service for {tts_model}: {e}")
             return False
     
-    def start(self, avatar_id: str, force_gpu: Optional[int] = None, real_avatar_name: str = None) -> dict:
-        """启动Avatar实例（支持多用户共享同一个avatar）
+    def _get_tts_lock(self, tts_model: str) -> threading.Lock:
+        with self._lock:
+            return self._tts_locks.setdefault(tts_model, threading.Lock())
+    
+    def _kill_process_tree(self, pid: int):
+        """SIGKILL进程及其所有子进程"""
+        try:
+            parent = psutil.Process(pid)
+            children = parent.children(recursive=True)
+            
+            # 先杀所有子进程
+            for child in children:
+                try:
+                    logger.info(f"   杀死子进程 PID: {child.pid}")
+                    os.kill(child.pid, signal.SIGKILL)
+                except:
+                    pass
+            
+            # 再杀父进程
+            os.kill(pid, signal.SIGKILL)
+        except Exception as kill_err:
+            logger.warning(f"杀死进程失败: {kill_err}")
+    
+    def _discard_instance(self, instance: AvatarInstance):
+        """拆除已经从注册表摘除的实例（调用方已把GPU预留改挂到stopping key）"""
+        logger.info(f"回收实例 {instance.avatar_id} (PID: {instance.pid}, 端口: {instance.port})")
+        self._teardown(instance)
+    
+    def start(self, avatar_id: str, force_gpu: Optional[int] = None, real_avatar_name: str = None,
+              standby: bool = False) -> dict:
+        """启动Avatar实例（支持多用户共享同一个avatar），阻塞直到实例就绪或失败
         
         Args:
             avatar_id: 实例ID（如 g_user_1）
             force_gpu: 强制使用的GPU
             real_avatar_name: 真实Avatar名称（如 g）
+            standby: 作为预热池实例启动（初始连接数为0）
+        """
+        return self.start_async(avatar_id, force_gpu, real_avatar_name, standby).result()
+    
+    def start_async(self, avatar_id: str, force_gpu: Optional[int] = None, real_avatar_name: str = None,
+                    standby: bool = False) -> Future:
+        """非阻塞启动，返回结果为实例信息的future
+        
+        self._lock只保护复用检查和端口/GPU预占；拉起进程、等待端口在启动线程池中完成。
+        同一真实Avatar的并发请求拿到同一个future，不同Avatar并行启动。
         """
         actual_avatar_name = real_avatar_name if real_avatar_name else avatar_id
-        logger.info(f"请求启动Avatar: {avatar_id} (真实名称: {actual_avatar_name})")
+        logger.info(f"请求启动Avatar: {avatar_id} (真实名称: {actual_avatar_name}{', 预热' if standby else ''})")
         
-        # 使用锁保护整个端口分配和实例创建过程，防止并发冲突
         with self._lock:
+            if not standby:
+                self._record_usage(actual_avatar_name)
+            
             # 检查该真实avatar是否已有实例在运行（实现共享）
             if actual_avatar_name in self.avatar_map:
                 existing_instance_id = self.avatar_map[actual_avatar_name]
                 existing_instance = self.instances.get(existing_instance_id)
                 
-                if existing_instance and existing_instance.is_running():
-                    # 复用现有实例
+                if existing_instance and existing_instance.is_running() \
+                        and existing_instance.health.status == HEALTH_UNHEALTHY:
+                    # 进程还在但 /health 持续失败：不再分配用户，后台回收，下面重新启动
+                    logger.warning(f"Avatar实例 {existing_instance_id} 不健康，不再复用，将创建新实例")
+                    del self.avatar_map[actual_avatar_name]
+                    del self.instances[existing_instance_id]
+                    self.scheduler.rename(existing_instance_id, f"{existing_instance_id}#stopping-{existing_instance.pid}")
+                    self._teardown_pool.submit(self._discard_instance, existing_instance)
+                    self._save_state()
+                elif existing_instance and existing_instance.is_running():
+                    if standby:
+                        future = Future()
+                        future.set_result(existing_instance.get_info())
+                        return future
+                    # 复用现有实例（预热实例在这里交给用户）
+                    if existing_instance.standby:
+                        existing_instance.standby = False
+                        self.pool_stats['hits'] += 1
+                        self.eviction.record('warm_hits')
+                        logger.info(f"命中预热实例: {existing_instance_id} (真实名称: {actual_avatar_name})")
                     existing_instance.connections += 1
                     existing_instance.update_activity()
+                    self._save_state()
                     logger.info(f"复用现有Avatar实例: {existing_instance_id} (真实名称: {actual_avatar_name}, 连接数: {existing_instance.connections})")
-                    return existing_instance.get_info()
+                    future = Future()
+                    future.set_result(existing_instance.get_info())
+                    return future
                 else:
                     # 实例已失效，清理映射
                     logger.warning(f"Avatar实例 {existing_instance_id} 已失效，将创建新实例")
                     del self.avatar_map[actual_avatar_name]
                     if existing_instance_id in self.instances:
                         del self.instances[existing_instance_id]
+                    self.scheduler.release(existing_instance_id)
+                    self._save_state()
             
-            # 再次检查（防止并发时两个请求都通过了第一次检查）
-            if actual_avatar_name in self.avatar_map:
-                existing_instance_id = self.avatar_map[actual_avatar_name]
-                existing_instance = self.instances.get(existing_instance_id)
-                if existing_instance and existing_instance.is_running():
-                    # 在两次检查之间，另一个线程已经创建了实例
-                    existing_instance.connections += 1
-                    existing_instance.update_activity()
-                    logger.info(f"复用现有Avatar实例（二次检查）: {existing_instance_id} (真实名称: {actual_avatar_name}, 连接数: {existing_instance.connections})")
-                    return existing_instance.get_info()
+            # 同一Avatar正在启动：加入等待，不重复拉起进程
+            pending = self._starting.get(actual_avatar_name)
+            if pending is not None:
+                if standby:
+                    return pending.future
+                pending.waiters += 1
+                if pending.standby:
+                    self.pool_stats['joined'] += 1
+                logger.info(f"Avatar {actual_avatar_name} 正在启动 ({pending.state})，加入等待 (等待数: {pending.waiters})")
+                return pending.future
             
-            # 检查数量限制
-            if len(self.instances) >= self.max_instances:
+            avatar_model = self._load_avatar_config(actual_avatar_name).get('avatar_model', AVATAR_CONFIG['model']).lower()
+            
+            # 名额或显存不够时淘汰价值最低的空闲实例（预热由replenish_pool自己判断是否值得淘汰）
+            gpu_hint, evicted = None, []
+            if EVICTION_POLICY == 'predictive' and not standby:
+                gpu_hint, evicted = self._evict(actual_avatar_name, avatar_model)
+            
+            # 检查数量限制（正在启动的也占名额）
+            if len(self.instances) + len(self._starting) >= self.max_instances:
                 raise Exception(f"已达到最大限制: {self.max_instances}个Avatar")
             
+            # 分配资源（关键：必须在锁内分配端口）
+            pending = PendingStart(avatar_id, actual_avatar_name, standby)
+            pending.evicting = [self._teardown_pool.submit(self._teardown, instance) for instance in evicted]
+            self._starting[actual_avatar_name] = pending
+            self.pool_stats['prestarted' if standby else 'misses'] += 1
+            try:
+                pending.port = self._allocate_port()
+                
+                # GPU分配：如果指定了force_gpu则使用，其次是淘汰腾出空间的卡，否则按模型显存占用装箱
+                pending.gpu_id = self._allocate_gpu(avatar_id, avatar_model, actual_avatar_name,
+                                                    force_gpu if force_gpu is not None else gpu_hint)
+            except Exception:
+                del self._starting[actual_avatar_name]
+                if pending.port is not None:
+                    self._allocating_ports.discard(pending.port)
+                raise
+            pending.state = START_SPAWNING
+        
+        self._spawn_pool.submit(self._spawn, pending)
+        return pending.future
+    
+    def _spawn(self, pending: PendingStart):
+        """启动线程：按需拉起TTS服务、启动进程并等待端口，结果写入pending.future"""
+        avatar_id = pending.avatar_id
+        actual_avatar_name = pending.real_avatar_name
+        port, gpu_id = pending.port, pending.gpu_id
+        try:
+            # 等被淘汰的实例退出、显存释放
+            if pending.evicting:
+                wait(pending.evicting)
+            
             # 获取Avatar配置以确定需要的TTS模型
-            actual_avatar_name = real_avatar_name if real_avatar_name else avatar_id
             avatar_config = self._load_avatar_config(actual_avatar_name)
             tts_model = avatar_config.get('tts_model', 'edgeTTS')
             tts_normalized = self._normalize_tts_model(tts_model)
             
-            # 检查并启动对应的TTS服务（按需启动）
-            if not self._check_and_start_tts_service(tts_normalized):
-                logger.warning(f"Failed to start TTS service for {tts_normalized}, proceeding anyway")
-            
-            # 分配资源（关键：必须在锁内分配端口）
-            # 先预占avatar_map，防止并发时重复分配
-            self.avatar_map[actual_avatar_name] = avatar_id  # 预占位置
-            port = self._allocate_port()
-            
-            # GPU分配：如果指定了force_gpu则使用，否则自动选择最合适的GPU
-            if force_gpu is not None:
-                gpu_id = force_gpu
-            else:
-                gpu_id = self._allocate_gpu()
+            # 检查并启动对应的TTS服务（按需启动，同一TTS只拉起一次）
+            with self._get_tts_lock(tts_normalized):
+                if not self._check_and_start_tts_service(tts_normalized):
+                    logger.warning(f"Failed to start TTS service for {tts_normalized}, proceeding anyway")
             
             # 构建启动命令（传递真实Avatar名称）
-            cmd = self._build_command(avatar_id, port, real_avatar_name)
+            cmd = self._build_command(avatar_id, port, actual_avatar_name)
             
             # 设置环境变量
             env = os.environ.copy()
@@ -643,197 +801,213 @@ class AvatarManager:
             # 在命令中添加输出重定向（使用绝对路径）
             cmd_with_redirect = f"{cmd} >> {log_file_path} 2>&1"
             
-            try:
-                # 启动进程（使用bash执行conda命令），输出重定向到日志文件
-                process = subprocess.Popen(
-                    cmd_with_redirect,
-                    cwd=LIP_SYNC_PATH,
-                    env=env,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                    shell=True,
-                    executable='/bin/bash'
-                )
-
-                # 第一步：快速检查进程是否立即崩溃（缩短为1秒）
-                time.sleep(1)
-
+            # 启动进程（使用bash执行conda命令），输出重定向到日志文件
+            process = subprocess.Popen(
+                cmd_with_redirect,
+                cwd=LIP_SYNC_PATH,
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                shell=True,
+                executable='/bin/bash',
+                start_new_session=True  # 独立会话：manager重启/收到Ctrl-C时实例不随之退出，重启后接管
+            )
+            
+            # 主动验证socket已真正bind，进程提前退出时立即失败
+            if not self._wait_for_port_binding(port, timeout=STARTUP_TIMEOUT, process=process):
                 if process.poll() is not None:
-                    # 进程已退出，启动失败
-                    # 读取日志文件的最后几行
+                    # 进程已退出，读取日志文件的最后几行
                     try:
                         with open(log_file_path, 'r') as f:
                             lines = f.readlines()
                             error_msg = ''.join(lines[-10:])  # 最后10行
                     except:
                         error_msg = "无法读取日志"
-                    # ✓ 立即释放端口
-                    if actual_avatar_name in self.avatar_map and self.avatar_map[actual_avatar_name] == avatar_id:
-                        del self.avatar_map[actual_avatar_name]
-                    self._allocating_ports.discard(port)
                     raise Exception(f"Avatar启动失败（立即退出），查看日志: {log_file_path}\n{error_msg[:500]}")
-
-                # 第二步：主动验证socket已真正bind ✓ 这替代了原来的2秒sleep，消除竞态条件
-                # 给予最多29秒（加上第一步的1秒共30秒）用于socket绑定
-                if not self._wait_for_port_binding(port, timeout=29):
-                    # socket未能在规定时间内bind
-                    logger.error(f"✗ 端口 {port} socket绑定验证失败，终止进程PID {process.pid}")
-                    try:
-                        parent = psutil.Process(process.pid)
-                        children = parent.children(recursive=True)
-
-                        # 先杀所有子进程
-                        for child in children:
-                            try:
-                                logger.info(f"   杀死子进程 PID: {child.pid}")
-                                os.kill(child.pid, signal.SIGKILL)
-                            except:
-                                pass
-
-                        # 再杀父进程
-                        os.kill(process.pid, signal.SIGKILL)
-                    except Exception as kill_err:
-                        logger.warning(f"杀死进程失败: {kill_err}")
-
-                    # ✓ 立即释放端口
-                    if actual_avatar_name in self.avatar_map and self.avatar_map[actual_avatar_name] == avatar_id:
-                        del self.avatar_map[actual_avatar_name]
-                    self._allocating_ports.discard(port)
-                    raise Exception(f"Avatar socket绑定超时（{port}），进程已杀死")
-
-                # 第三步：socket已验证成功，安全地创建实例对象
-                instance = AvatarInstance(avatar_id, port, gpu_id, process, real_avatar_name)
-                instance.connections = 1  # 初始连接数为1
+                
+                # socket未能在规定时间内bind
+                logger.error(f"✗ 端口 {port} socket绑定验证失败，终止进程PID {process.pid}")
+                self._kill_process_tree(process.pid)
+                raise Exception(f"Avatar socket绑定超时（{port}），进程已杀死")
+            
+            # socket已验证成功，安全地创建实例对象
+            with self._lock:
+                instance = AvatarInstance(avatar_id, port, gpu_id, process, actual_avatar_name)
+                instance.connections = pending.waiters
+                instance.standby = pending.waiters == 0
+                instance.startup_seconds = round(time.time() - pending.requested_at, 2)
                 self.instances[avatar_id] = instance
-
+                
                 # 建立real_avatar_name到instance_id的映射（用于实例共享）
                 self.avatar_map[actual_avatar_name] = avatar_id
-
-                # ✓ 现在安全地从"正在分配中"移除端口（socket已confirmed绑定）
-                self._allocating_ports.discard(port)
-
-                logger.info(f"✓ Avatar {avatar_id} 启动成功 (PID: {process.pid}, 端口: {port}, 真实名称: {actual_avatar_name})")
-
-                return instance.get_info()
                 
-            except Exception as e:
-                logger.error(f" 启动Avatar {avatar_id} 失败: {e}")
-                # 启动失败时，清理预占和正在分配的端口
-                if actual_avatar_name in self.avatar_map and self.avatar_map[actual_avatar_name] == avatar_id:
-                    del self.avatar_map[actual_avatar_name]
+                # 现在安全地从"正在分配中"移除端口（socket已confirmed绑定）
                 self._allocating_ports.discard(port)
-                raise
+                del self._starting[actual_avatar_name]
+                pending.state = START_READY
+                info = instance.get_info()
+                self._save_state()
+            self.scheduler.confirm(avatar_id, self._pid_tree(process.pid))
+            self.eviction.record_start(actual_avatar_name, instance.startup_seconds, cold=not pending.standby)
+            
+            logger.info(f"✓ Avatar {avatar_id} 启动成功 (PID: {process.pid}, 端口: {port}, 真实名称: {actual_avatar_name}, "
+                        f"耗时: {instance.startup_seconds}秒, 等待数: {pending.waiters})")
+            pending.future.set_result(info)
+            
+        except Exception as e:
+            logger.error(f" 启动Avatar {avatar_id} 失败: {e}")
+            # 启动失败时，清理预占和正在分配的端口
+            with self._lock:
+                self._allocating_ports.discard(port)
+                self._starting.pop(actual_avatar_name, None)
+                pending.state = START_FAILED
+            self.scheduler.release(avatar_id)
+            pending.future.set_exception(e)
     
-    def stop(self, avatar_id: str, force: bool = True):
-        """停止Avatar实例并立即释放GPU显存（默认强制关闭）
+    def stop(self, avatar_id: str, force: bool = True, wait: bool = True):
+        """停止Avatar实例（默认强制关闭），返回时进程树已退出、GPU显存已释放
+        
+        实例先在锁内从注册表摘除（之后的start/list不会再看到它），再在锁外拆除进程：
+        SIGTERM优雅退出 → 超时后SIGKILL → 等NVML中该进程树的显存消失。
+        拆除期间GPU预留保持，调度器不会把新实例放进还没腾出来的显存。
         
         Args:
             avatar_id: 实例ID或真实avatar名称
             force: 是否强制关闭（忽略连接计数）
+            wait: False时在后台拆除，立即返回
         """
         logger.info(f"请求停止Avatar: {avatar_id} (force={force})")
         
-        # 支持通过real_avatar_name停止
-        actual_instance_id = avatar_id
-        if avatar_id in self.avatar_map:
-            actual_instance_id = self.avatar_map[avatar_id]
-            logger.info(f"通过真实名称 {avatar_id} 找到实例 {actual_instance_id}")
-        
-        if actual_instance_id not in self.instances:
-            raise Exception(f"Avatar {avatar_id} 不存在")
-        
-        instance = self.instances[actual_instance_id]
-        real_avatar_name = instance.real_avatar_name
-        port = instance.port  # 保存端口号用于删除log文件
-        
-        # 如果不强制关闭，检查连接计数
-        if not force:
-            instance.connections = max(0, instance.connections - 1)
-            if instance.connections > 0:
-                logger.info(f"Avatar {actual_instance_id} 还有 {instance.connections} 个连接，不关闭")
-                return
-            logger.info(f"Avatar {actual_instance_id} 连接数为0，执行关闭")
-        
-        try:
-            # 强制终止整个进程树（包括所有子进程）
-            logger.info(f" 强制终止Avatar {avatar_id} (PID: {instance.pid}) 及其子进程")
-            try:
-                parent = psutil.Process(instance.pid)
-                children = parent.children(recursive=True)
-                
-                # 先杀所有子进程
-                for child in children:
-                    try:
-                        logger.info(f"   杀死子进程 PID: {child.pid}")
-                        os.kill(child.pid, signal.SIGKILL)
-                    except:
-                        pass
-                
-                # 再杀父进程
-                os.kill(instance.pid, signal.SIGKILL)
-            except:
-                # 如果psutil失败，直接用系统命令
-                import subprocess
-                subprocess.run(['pkill', '-9', '-f', f'app.py.*{port}'], check=False)
-            
-            # 等待GPU显存完全释放
-            logger.info(f" 等待3秒让GPU显存完全释放...")
-            time.sleep(3)
-            
-            # 清理log文件
-            log_dir = os.path.abspath(os.path.dirname(LOG_FILE))
-            log_file_path = os.path.join(log_dir, f'avatar_{avatar_id}_{port}.log')
-            if os.path.exists(log_file_path):
-                try:
-                    os.remove(log_file_path)
-                    logger.info(f" 已删除log文件: {log_file_path}")
-                except Exception as log_err:
-                    logger.warning(f" 删除log文件失败: {log_err}")
-            else:
-                logger.info(f" log文件不存在，无需删除: {log_file_path}")
-            
-            # 从列表中移除
-            del self.instances[actual_instance_id]
+        with self._lock:
+            # 支持通过real_avatar_name停止
+            actual_instance_id = avatar_id
+            if avatar_id in self.avatar_map:
+                actual_instance_id = self.avatar_map[avatar_id]
+                logger.info(f"通过真实名称 {avatar_id} 找到实例 {actual_instance_id}")
             
-            # 清理avatar_map映射
-            if real_avatar_name in self.avatar_map and self.avatar_map[real_avatar_name] == actual_instance_id:
-                del self.avatar_map[real_avatar_name]
-                logger.info(f" 已清理映射: {real_avatar_name} -> {actual_instance_id}")
+            if actual_instance_id not in self.instances:
+                raise Exception(f"Avatar {avatar_id} 不存在")
             
-            logger.info(f" Avatar {actual_instance_id} 已停止，GPU显存已释放")
+            instance = self.instances[actual_instance_id]
+            real_avatar_name = instance.real_avatar_name
             
-        except ProcessLookupError:
-            # 进程已不存在
-            #  暂时注释掉自动删除log（用于调试）
-            # log_dir = os.path.abspath(os.path.dirname(LOG_FILE))
-            # log_file_path = os.path.join(log_dir, f'avatar_{actual_instance_id}_{port}.log')
-            # if os.path.exists(log_file_path):
-            #     try:
-            #         os.remove(log_file_path)
-            #         logger.info(f" 已删除log文件: {log_file_path}")
-            #     except:
-            #         pass
+            # 如果不强制关闭，检查连接计数
+            if not force:
+                instance.connections = max(0, instance.connections - 1)
+                if instance.connections > 0:
+                    logger.info(f"Avatar {actual_instance_id} 还有 {instance.connections} 个连接，不关闭")
+                    self._save_state()
+                    return
+                if instance.is_running() and (EVICTION_POLICY == 'predictive' or real_avatar_name in self._pool_targets()):
+                    # predictive策略下实例保持空闲，需要空间时再按价值淘汰
+                    instance.standby = True
+                    instance.update_activity()
+                    logger.info(f"Avatar {actual_instance_id} 连接数为0，保留为空闲实例")
+                    self._save_state()
+                    return
+                logger.info(f"Avatar {actual_instance_id} 连接数为0，执行关闭")
             
+            # 从列表中移除
             del self.instances[actual_instance_id]
             
             # 清理avatar_map映射
             if real_avatar_name in self.avatar_map and self.avatar_map[real_avatar_name] == actual_instance_id:
                 del self.avatar_map[real_avatar_name]
+                logger.info(f" 已清理映射: {real_avatar_name} -> {actual_instance_id}")
             
-            logger.info(f"Avatar {actual_instance_id} 进程已不存在")
-        except Exception as e:
-            logger.error(f" 停止Avatar {avatar_id} 失败: {e}")
-            raise
+            # 预留改挂到"正在释放"的key上，同ID的实例可以马上重新启动
+            self.scheduler.rename(actual_instance_id, f"{actual_instance_id}#stopping-{instance.pid}")
+            self._save_state()
+        
+        if wait:
+            self._teardown(instance)
+        else:
+            self._teardown_pool.submit(self._teardown, instance)
+    
+    def _teardown(self, instance: AvatarInstance) -> bool:
+        """拆除已从注册表摘除的实例，确认进程树退出、显存释放后释放GPU预留；返回是否确认释放"""
+        start = time.time()
+        instance_id = instance.avatar_id
+        reservation_key = f"{instance_id}#stopping-{instance.pid}"
+        pids = self._pid_tree(instance.pid)
+        
+        try:
+            procs = [psutil.Process(pid) for pid in pids if psutil.pid_exists(pid)]
+        except psutil.NoSuchProcess:
+            procs = []
+        
+        # 第一步：SIGTERM，给 app.py 关闭连接、结束推理子进程的机会
+        for proc in procs:
+            try:
+                proc.send_signal(signal.SIGTERM)
+            except psutil.NoSuchProcess:
+                pass
+        _, alive = psutil.wait_procs(procs, timeout=STOP_GRACE_SECONDS)
+        
+        # 第二步：超时仍未退出的进程SIGKILL
+        if alive:
+            logger.warning(f" Avatar {instance_id} 有 {len(alive)} 个进程在 {STOP_GRACE_SECONDS} 秒内未退出，强制杀死")
+            for proc in alive:
+                try:
+                    logger.info(f"   杀死进程 PID: {proc.pid}")
+                    proc.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            _, alive = psutil.wait_procs(alive, timeout=STOP_KILL_WAIT)
+        # 回收shell进程，避免僵尸
+        if instance.process.poll() is None:
+            try:
+                instance.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                pass
+        
+        # 第三步：等NVML里这些进程的显存消失（驱动回收显存可能比进程退出稍晚）
+        released = not alive and self._wait_gpu_release(instance.gpu_id, pids, GPU_RELEASE_TIMEOUT)
+        self.scheduler.release(reservation_key)
+        
+        # 清理log文件
+        log_dir = os.path.abspath(os.path.dirname(LOG_FILE))
+        log_file_path = os.path.join(log_dir, f'avatar_{instance_id}_{instance.port}.log')
+        if os.path.exists(log_file_path):
+            try:
+                os.remove(log_file_path)
+                logger.info(f" 已删除log文件: {log_file_path}")
+            except Exception as log_err:
+                logger.warning(f" 删除log文件失败: {log_err}")
+        
+        elapsed = time.time() - start
+        if released:
+            logger.info(f" Avatar {instance_id} 已停止，GPU显存已释放 (耗时: {elapsed:.2f}秒)")
+        else:
+            logger.warning(f" Avatar {instance_id} 未能确认释放 (存活进程: {[p.pid for p in alive]}, 耗时: {elapsed:.2f}秒)")
+        return released
+    
+    def _wait_gpu_release(self, gpu_id: int, pids: List[int], timeout: float) -> bool:
+        """轮询直到pids在该GPU上都不再占用显存；拿不到进程级信息时直接返回True"""
+        deadline = time.time() + timeout
+        pid_set = set(pids)
+        while True:
+            holders = pid_set & set(self.scheduler.provider.process_memory(gpu_id))
+            if not holders:
+                return True
+            if time.time() >= deadline:
+                logger.warning(f"GPU {gpu_id} 上进程 {sorted(holders)} 的显存在 {timeout} 秒内未释放")
+                return False
+            time.sleep(0.1)
     
     def stop_all(self):
-        """停止所有Avatar"""
+        """停止所有Avatar（并行拆除，全部确认释放后返回）"""
         logger.info("停止所有Avatar实例")
         avatar_ids = list(self.instances.keys())
-        for avatar_id in avatar_ids:
+        
+        def stop_one(avatar_id):
             try:
                 self.stop(avatar_id)
             except Exception as e:
                 logger.error(f"停止 {avatar_id} 失败: {e}")
+        
+        with ThreadPoolExecutor(max_workers=max(1, len(avatar_ids))) as pool:
+            list(pool.map(stop_one, avatar_ids))
     
     def restart(self, avatar_id: str) -> dict:
         """重启Avatar"""
@@ -845,19 +1019,23 @@ class AvatarManager:
         # 保存GPU配置和真实Avatar名称
         gpu_id = self.instances[avatar_id].gpu_id
         real_avatar_name = self.instances[avatar_id].real_avatar_name
+        standby = self.instances[avatar_id].standby
         logger.info(f"  保留真实Avatar名称: {real_avatar_name}")
         
         # 停止
         self.stop(avatar_id)
         
         # 启动（使用真实Avatar名称）
-        return self.start(avatar_id, force_gpu=gpu_id, real_avatar_name=real_avatar_name)
+        return self.start(avatar_id, force_gpu=gpu_id, real_avatar_name=real_avatar_name, standby=standby)
     
     def get_info(self, avatar_id: str) -> Optional[dict]:
-        """获取Avatar信息"""
-        if avatar_id not in self.instances:
-            return None
-        return self.instances[avatar_id].get_info()
+        """获取Avatar信息（正在启动的实例返回启动状态）"""
+        if avatar_id in self.instances:
+            return self.instances[avatar_id].get_info()
+        for pending in list(self._starting.values()):
+            if avatar_id in (pending.avatar_id, pending.real_avatar_name):
+                return pending.get_info()
+        return None
     
     def list_all(self) -> list:
         """列出所有Avatar"""
@@ -866,7 +1044,8 @@ class AvatarManager:
     def get_status(self) -> dict:
         """获取系统状态"""
         running_count = len(self.instances)
-        available = self.max_instances - running_count
+        starting = [pending.get_info() for pending in list(self._starting.values())]
+        available = self.max_instances - running_count - len(starting)
         
         # GPU使用情况
         gpu_usage = {}
@@ -884,9 +1063,27 @@ class AvatarManager:
             'available': available,
             'utilization': f"{running_count}/{self.max_instances}",
             'gpu_distribution': gpu_usage,
+            'placement': self.scheduler.get_status(),
+            'health': {
+                'round_seconds': self.prober.last_round_seconds,
+                'rounds': self.prober.rounds,
+                'healthy': sum(1 for inst in self.instances.values() if inst.health.status == HEALTH_HEALTHY),
+                'degraded': sum(1 for inst in self.instances.values() if inst.health.status == HEALTH_DEGRADED),
+                'unhealthy': sum(1 for inst in self.instances.values() if inst.health.status == HEALTH_UNHEALTHY),
+                'recovering': sorted(self._recovering)
+            },
             'total_connections': total_connections,
             'shared_avatars': shared_avatars,
             'avatar_map': self.avatar_map,
+            'starting': starting,
+            'pool': {
+                'size': POOL_SIZE,
+                'targets': self._pool_targets(),
+                'standby': [inst.avatar_id for inst in self.instances.values() if inst.standby],
+                **self.pool_stats
+            },
+            'metrics': self.sampler.get_info(),
+            'eviction': {'policy': EVICTION_POLICY, **self.eviction.get_info()},
             'avatars': self.list_all()
         }
     
@@ -894,7 +1091,15 @@ class AvatarManager:
         """健康检查"""
         logger.info("执行健康检查")
         
+        # 刷新各实例的显存观测，学习模型footprint
+        for avatar_id, instance in list(self.instances.items()):
+            if instance.is_running():
+                self.scheduler.update_pids(avatar_id, self._pid_tree(instance.pid))
+        self.scheduler.sample()
+        
         for avatar_id, instance in list(self.instances.items()):
+            if avatar_id in self._recovering:
+                continue
             if not instance.is_running():
                 logger.warning(f" Avatar {avatar_id} 进程异常退出，尝试重启")
                 try:
@@ -902,14 +1107,82 @@ class AvatarManager:
                 except Exception as e:
                     logger.error(f"重启 {avatar_id} 失败: {e}")
     
+    def probe_health(self):
+        """并发探测所有实例的 /health，更新健康状态；进程还在但判定unhealthy的实例在后台重启"""
+        targets = {avatar_id: instance.port for avatar_id, instance in list(self.instances.items())
+                   if instance.is_running()}
+        results = self.prober.probe(targets)
+        for avatar_id, result in results.items():
+            instance = self.instances.get(avatar_id)
+            if instance is None:  # 探测期间已被停止
+                continue
+            previous = self.prober.apply(instance.health, result)
+            if previous is None:
+                continue
+            health = instance.health
+            logger.info(f"Avatar {avatar_id} 健康状态: {previous} -> {health.status} "
+                        f"(延迟: {health.latency_ms}ms, 会话: {health.sessions}, 错误: {health.last_error})")
+            if health.status == HEALTH_UNHEALTHY and PROBE_RESTART_UNHEALTHY:
+                self._recover_async(avatar_id)
+    
+    def _metrics_snapshot(self) -> List[dict]:
+        """各运行中实例的指标输入（MetricsSampler调用）"""
+        snapshot = []
+        for avatar_id, instance in list(self.instances.items()):
+            if not instance.is_running():
+                continue
+            health = instance.health
+            snapshot.append({
+                'avatar_id': avatar_id,
+                'gpu_id': instance.gpu_id,
+                'pids': self._pid_tree(instance.pid),
+                'connections': instance.connections,
+                'sessions': health.sessions,
+                'render_fps': health.render_fps,
+                'latency_ms': health.latency_ms,
+                'healthy': None if health.status == HEALTH_UNKNOWN else health.status == HEALTH_HEALTHY
+            })
+        return snapshot
+    
+    def sample_metrics(self):
+        """采样一轮GPU和实例指标"""
+        self.sampler.sample(extra={
+            'manager_instances': len(self.instances),
+            'manager_starting': len(self._starting)
+        })
+    
+    def _recover_async(self, avatar_id: str):
+        """在独立线程中重启实例，同一实例只重启一次"""
+        with self._lock:
+            if avatar_id in self._recovering:
+                return
+            self._recovering.add(avatar_id)
+        
+        def recover():
+            try:
+                logger.warning(f" Avatar {avatar_id} 无响应，重启")
+                self.restart(avatar_id)
+            except Exception as e:
+                logger.error(f"重启 {avatar_id} 失败: {e}")
+            finally:
+                with self._lock:
+                    self._recovering.discard(avatar_id)
+        
+        threading.Thread(target=recover, name=f"recover-{avatar_id}", daemon=True).start()
+    
     def cleanup_idle(self, idle_timeout: int):
         """清理空闲实例"""
+        if EVICTION_POLICY == 'predictive':
+            self._expire_idle(idle_timeout)
+            return
         if idle_timeout <= 0:
             return
         
         logger.info(f"检查空闲实例 (超时: {idle_timeout}秒)")
         
         for avatar_id, instance in list(self.instances.items()):
+            if instance.standby:  # 预热实例由replenish_pool管理
+                continue
             idle_seconds = instance.get_idle_seconds()
             if idle_seconds > idle_timeout:
                 logger.info(f"清理空闲Avatar {avatar_id} (空闲: {idle_seconds:.0f}秒)")
@@ -917,6 +1190,227 @@ class AvatarManager:
                     self.stop(avatar_id)
                 except Exception as e:
                     logger.error(f"清理 {avatar_id} 失败: {e}")
+    
+    def _expire_idle(self, idle_timeout: int):
+        """predictive策略的空闲检查：不因空闲关闭实例，只处理两种情况
+        
+        - 超过idle_timeout没有新请求但连接数不为0：多半是用户没有断开就离开了，连接数清零、转为空闲实例；
+          /health 仍报告有会话在推流时（用户在看，只是没有新请求）不转
+        - 空闲超过EVICTION_MAX_IDLE，且预测窗口内的复用概率低于EVICTION_KEEP_PROBABILITY：关闭
+        """
+        targets = self._pool_targets()
+        for avatar_id, instance in list(self.instances.items()):
+            idle_seconds = instance.get_idle_seconds()
+            if not instance.standby:
+                if instance.health.sessions and instance.health.status != HEALTH_UNHEALTHY:
+                    continue
+                if idle_timeout > 0 and idle_seconds > idle_timeout:
+                    logger.info(f"Avatar {avatar_id} 空闲 {idle_seconds:.0f}秒 (连接数: {instance.connections})，转为空闲实例")
+                    with self._lock:
+                        instance.connections = 0
+                        instance.standby = True
+                        self._save_state()
+                continue
+            if EVICTION_MAX_IDLE <= 0 or idle_seconds <= EVICTION_MAX_IDLE or instance.real_avatar_name in targets:
+                continue
+            probability = self.eviction.reuse_probability(instance.real_avatar_name)
+            if probability < EVICTION_KEEP_PROBABILITY:
+                logger.info(f"关闭空闲Avatar {avatar_id} (空闲: {idle_seconds:.0f}秒, 复用概率: {probability:.2f})")
+                try:
+                    self.stop(avatar_id)
+                except Exception as e:
+                    logger.error(f"清理 {avatar_id} 失败: {e}")
+    
+    def _evict(self, avatar_name: str, avatar_model: str, extra_mb: float = 0.0, reserved_slots: int = 0,
+               max_value: Optional[float] = None):
+        """实例名额或显存不够时，按淘汰策略选出空闲实例并从注册表摘除（调用方持有self._lock，负责拆除）
+        
+        Returns:
+            (腾出显存的GPU，None表示不限, 被摘除的实例列表)
+        """
+        need_slot = len(self.instances) + len(self._starting) >= self.max_instances - reserved_slots
+        shortfall = self.scheduler.shortfall(avatar_model, extra_mb)
+        if not need_slot and not shortfall:
+            return None, []
+        candidates = [
+            {'avatar_id': inst.avatar_id, 'name': inst.real_avatar_name, 'gpu_id': inst.gpu_id,
+             'memory_mb': self.scheduler.held_mb(inst.avatar_id)}
+            for inst in self.instances.values()
+            if inst.standby and inst.connections == 0 and inst.real_avatar_name != avatar_name
+            and inst.avatar_id not in self._recovering
+        ]
+        choice = self.eviction.choose_victims(candidates, shortfall, need_slot, max_value=max_value)
+        if choice is None:
+            logger.info(f"没有可淘汰的空闲实例为 {avatar_name} 腾出空间 (空闲实例: {len(candidates)})")
+            return None, []
+        gpu_id, victims = choice
+        evicted = []
+        for victim in victims:
+            instance = self.instances.pop(victim['avatar_id'])
+            if self.avatar_map.get(instance.real_avatar_name) == instance.avatar_id:
+                del self.avatar_map[instance.real_avatar_name]
+            self.scheduler.rename(instance.avatar_id, f"{instance.avatar_id}#stopping-{instance.pid}")
+            self.eviction.record('evictions')
+            logger.info(f"淘汰空闲实例 {instance.avatar_id} (价值: {victim['value']:.2f}, GPU {instance.gpu_id}, "
+                        f"显存: {victim['memory_mb']:.0f} MB)，为 {avatar_name} 腾出空间")
+            evicted.append(instance)
+        if evicted:
+            self._save_state()
+        return gpu_id, evicted
+    
+    def account_usage(self):
+        """后台调用：累计各实例占用GPU的时长，保存请求历史和每天的统计"""
+        self.eviction.tick([{'memory_mb': self.scheduler.held_mb(avatar_id), 'idle': instance.connections == 0}
+                            for avatar_id, instance in list(self.instances.items())])
+        self.eviction.save()
+    
+    # ------------------------------------------------------------------
+    # 状态日志 / 重启接管
+    # ------------------------------------------------------------------
+    
+    def _save_state(self):
+        """把实例注册表写入状态日志（原子替换）；注册表变化时调用，调用方可以持有self._lock"""
+        state = {
+            'saved_at': time.time(),
+            'instances': [inst.to_state() for inst in list(self.instances.values())],
+            'usage': {name: list(history) for name, history in list(self._usage.items())}
+        }
+        with self._state_lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(STATE_FILE)), exist_ok=True)
+                tmp_path = STATE_FILE + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=2, ensure_ascii=False)
+                os.replace(tmp_path, STATE_FILE)
+            except Exception as e:
+                logger.warning(f"保存状态日志失败: {e}")
+    
+    def _restore_state(self):
+        """manager启动时读取状态日志：PID仍存活的实例并发探测 /health 后直接接管，不重新启动"""
+        if not os.path.exists(STATE_FILE):
+            return
+        start = time.time()
+        try:
+            with open(STATE_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取状态日志 {STATE_FILE} 失败: {e}")
+            return
+        
+        now = time.time()
+        for name, timestamps in state.get('usage', {}).items():
+            recent = [t for t in timestamps if now - t <= POOL_USAGE_WINDOW]
+            if recent:
+                self._usage[name] = deque(recent)
+        
+        candidates = []
+        for entry in state.get('instances', []):
+            process = AdoptedProcess(entry['pid'], entry.get('create_time'))
+            if process.poll() is not None:
+                logger.info(f"实例 {entry['avatar_id']} (PID: {entry['pid']}) 已不存在，不接管")
+                continue
+            candidates.append((entry, process))
+        
+        results = self.prober.probe({entry['avatar_id']: entry['port'] for entry, _ in candidates})
+        for entry, process in candidates:
+            avatar_id = entry['avatar_id']
+            instance = AvatarInstance(avatar_id, entry['port'], entry['gpu_id'], process, entry['real_avatar_name'])
+            instance.connections = entry.get('connections', 0)
+            instance.standby = entry.get('standby', False)
+            instance.startup_seconds = entry.get('startup_seconds')
+            try:
+                instance.start_time = datetime.fromisoformat(entry['start_time'])
+            except (KeyError, ValueError):
+                pass
+            # 没响应的实例也接管（进程还占着端口和显存），之后由健康探测判定是否重启
+            self.prober.apply(instance.health, results[avatar_id])
+            
+            self.instances[avatar_id] = instance
+            self.avatar_map[instance.real_avatar_name] = avatar_id
+            avatar_model = self._load_avatar_config(instance.real_avatar_name).get('avatar_model', AVATAR_CONFIG['model']).lower()
+            self.scheduler.reserve(avatar_id, avatar_model, label=instance.real_avatar_name, gpu_id=instance.gpu_id)
+            self.scheduler.confirm(avatar_id, self._pid_tree(instance.pid))
+            logger.info(f"✓ 接管实例 {avatar_id} (PID: {instance.pid}, 端口: {instance.port}, GPU: {instance.gpu_id}, "
+                        f"连接数: {instance.connections}, 健康: {instance.health.status})")
+        
+        self._save_state()
+        logger.info(f"状态恢复完成: 接管 {len(self.instances)}/{len(state.get('instances', []))} 个实例，"
+                    f"耗时 {time.time() - start:.2f}秒")
+    
+    # ------------------------------------------------------------------
+    # 预热池
+    # ------------------------------------------------------------------
+    
+    def _record_usage(self, avatar_name: str):
+        """记录一次启动请求（调用方持有self._lock）"""
+        now = time.time()
+        history = self._usage.setdefault(avatar_name, deque())
+        history.append(now)
+        while history and now - history[0] > POOL_USAGE_WINDOW:
+            history.popleft()
+        self.eviction.record_request(avatar_name, now)
+    
+    def _pool_targets(self) -> List[str]:
+        """应保持预热的Avatar：固定列表优先，剩余名额按窗口内启动次数从高到低"""
+        if POOL_SIZE <= 0:
+            return []
+        if PREWARM_PREDICTED:
+            # 预测下一个窗口会被请求的Avatar（近期活跃或历史上这个时段有课）
+            ranked = [name for name, _ in self.eviction.predict(min_probability=PREWARM_MIN_PROBABILITY)]
+        else:
+            now = time.time()
+            counts = {name: sum(1 for t in list(history) if now - t <= POOL_USAGE_WINDOW)
+                      for name, history in list(self._usage.items())}
+            ranked = [name for name, count in sorted(counts.items(), key=lambda item: -item[1]) if count > 0]
+        targets = [name for name in POOL_AVATARS if os.path.isdir(os.path.join(AVATAR_DATA_PATH, name))]
+        for name in ranked:
+            if name not in targets and os.path.isdir(os.path.join(AVATAR_DATA_PATH, name)):
+                targets.append(name)
+        return targets[:POOL_SIZE]
+    
+    def _has_gpu_budget(self, avatar_name: str) -> bool:
+        """是否有GPU在扣除未兑现的预留后，还能放下该Avatar的实例并保留余量"""
+        avatar_model = self._load_avatar_config(avatar_name).get('avatar_model', AVATAR_CONFIG['model']).lower()
+        return self.scheduler.can_place(avatar_model, POOL_GPU_HEADROOM_MB)
+    
+    def replenish_pool(self):
+        """后台调用：为预热目标补启动standby实例，停掉不再是目标的standby实例"""
+        targets = self._pool_targets()
+        
+        # 不再是预热目标的空闲实例直接回收（predictive策略下保留，需要空间时再按价值淘汰）
+        for avatar_id, instance in list(self.instances.items()):
+            if EVICTION_POLICY != 'predictive' and instance.standby and instance.real_avatar_name not in targets:
+                logger.info(f"预热实例 {avatar_id} 不再是预热目标，停止")
+                try:
+                    self.stop(avatar_id)
+                except Exception as e:
+                    logger.error(f"停止预热实例 {avatar_id} 失败: {e}")
+        
+        for avatar_name in targets:
+            with self._lock:
+                instance = self.instances.get(self.avatar_map.get(avatar_name, ''))
+                if (instance and instance.is_running()) or avatar_name in self._starting:
+                    continue
+                evicted = []
+                if EVICTION_POLICY == 'predictive':
+                    # 名额或显存不够时，淘汰价值比它低的空闲实例
+                    avatar_model = self._load_avatar_config(avatar_name).get('avatar_model', AVATAR_CONFIG['model']).lower()
+                    value = self.eviction.value(avatar_name, self.scheduler.footprint(avatar_model))
+                    _, evicted = self._evict(avatar_name, avatar_model, POOL_GPU_HEADROOM_MB, POOL_RESERVED_SLOTS, value)
+                # 预热不占满实例名额，给冷启动留位置
+                full = len(self.instances) + len(self._starting) >= self.max_instances - POOL_RESERVED_SLOTS
+            for victim in evicted:
+                self._teardown(victim)
+            if full:
+                return
+            if not self._has_gpu_budget(avatar_name):
+                logger.info("GPU显存余量不足，暂不补充预热实例")
+                return
+            try:
+                self.start_async(f"{avatar_name}_pool", real_avatar_name=avatar_name, standby=True)
+                logger.info(f"补充预热实例: {avatar_name}")
+            except Exception as e:
+                logger.warning(f"补充预热实例 {avatar_name} 失败: {e}")
 
 
 # 全局管理器实例
@@ -0,0 +1,206 @@
+"""指标时间序列 - 固定长度环形缓冲 + Prometheus导出
+
+- 后台每 MONITOR_INTERVAL 秒采样一次：各GPU（显存、利用率、温度、功耗）和各Avatar实例
+  （进程树显存、会话数、连接数、渲染fps、探测延迟），用于把显存/利用率和实例启动、会话、掉帧对应起来
+- 每条序列（指标名+标签）只保留最近 capacity 个点，内存占用固定；实例停止后它的序列在保留期过后删除
+- GPU数据来自调度器的provider（scheduler.py），测试时换成FakeGpuProvider
+- /metrics 输出Prometheus文本格式（各序列的最新值），/metrics/query 按时间范围返回JSON
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger('Metrics')
+
+# 指标名 -> 说明（Prometheus HELP）
+METRICS = {
+    'gpu_memory_used_mb': 'GPU memory in use (MB)',
+    'gpu_memory_total_mb': 'GPU memory total (MB)',
+    'gpu_utilization_percent': 'GPU utilization (%)',
+    'gpu_temperature_celsius': 'GPU temperature (C)',
+    'gpu_power_watts': 'GPU power draw (W)',
+    'avatar_gpu_memory_mb': 'GPU memory used by the avatar process tree (MB)',
+    'avatar_sessions': 'WebRTC sessions reported by the avatar /health',
+    'avatar_connections': 'Users assigned to the avatar by the manager',
+    'avatar_render_fps': 'Average render fps reported by the avatar /health',
+    'avatar_probe_latency_ms': 'Latency of the last successful /health probe (ms)',
+    'avatar_healthy': '1 if the last health state is healthy, else 0',
+    'manager_instances': 'Running avatar instances',
+    'manager_starting': 'Avatar instances being started',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class RingSeries:
+    """一条时间序列：最近 capacity 个 (时间戳, 值)"""
+
+    __slots__ = ('points',)
+
+    def __init__(self, capacity: int):
+        self.points = deque(maxlen=capacity)
+
+    def append(self, ts: float, value: float):
+        self.points.append((ts, value))
+
+    def latest(self) -> Optional[Tuple[float, float]]:
+        return self.points[-1] if self.points else None
+
+    def range(self, start: float, end: float, step: Optional[float] = None) -> List[list]:
+        points = [[ts, value] for ts, value in list(self.points) if start <= ts <= end]
+        if not step or len(points) < 2:
+            return points
+        # 降采样：每个step区间保留最后一个点
+        buckets = {}
+        for point in points:
+            buckets[int((point[0] - start) // step)] = point
+        return [buckets[k] for k in sorted(buckets)]
+
+
+class MetricsStore:
+    """
+    Args:
+        capacity (int): 每条序列保留的点数
+    """
+
+    def __init__(self, capacity: int = 720):
+        self.capacity = capacity
+        self._series: Dict[Tuple[str, LabelKey], RingSeries] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Optional[dict]) -> Tuple[str, LabelKey]:
+        return name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def record(self, name: str, value, labels: Optional[dict] = None, ts: Optional[float] = None):
+        """记录一个点；value为None（该项读不到）时跳过"""
+        if value is None:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RingSeries(self.capacity)
+            series.append(time.time() if ts is None else ts, float(value))
+
+    def prune(self, older_than: float) -> int:
+        """删除最新点早于 older_than 的序列（已停止的实例），返回删除数量"""
+        with self._lock:
+            stale = [key for key, series in self._series.items() if series.latest()[0] < older_than]
+            for key in stale:
+                del self._series[key]
+        return len(stale)
+
+    def query(self, name: str, start: float, end: float, step: Optional[float] = None,
+              match: Optional[dict] = None) -> List[dict]:
+        """name的所有序列中标签匹配match的部分，返回 [{'labels', 'values': [[ts, value], ...]}]"""
+        match = {k: str(v) for k, v in (match or {}).items()}
+        with self._lock:
+            items = [(labels, series) for (metric, labels), series in self._series.items() if metric == name]
+            result = []
+            for labels, series in items:
+                labels = dict(labels)
+                if any(labels.get(k) != v for k, v in match.items()):
+                    continue
+                result.append({'labels': labels, 'values': series.range(start, end, step)})
+        return sorted(result, key=lambda r: sorted(r['labels'].items()))
+
+    def series_count(self) -> int:
+        return len(self._series)
+
+    def render_prometheus(self, stale_after: Optional[float] = None) -> str:
+        """Prometheus文本格式（0.0.4）：每条序列的最新值；超过stale_after秒没有更新的序列不输出"""
+        now = time.time()
+        with self._lock:
+            latest = {key: series.latest() for key, series in self._series.items()}
+        by_name: Dict[str, list] = {}
+        for (name, labels), (ts, value) in sorted(latest.items()):
+            if stale_after is not None and now - ts > stale_after:
+                continue
+            by_name.setdefault(name, []).append((labels, ts, value))
+        lines = []
+        for name, samples in by_name.items():
+            lines.append(f"# HELP {name} {METRICS.get(name, name)}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, ts, value in samples:
+                label_str = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{label_str}}} {value:g} {int(ts * 1000)}" if label_str
+                             else f"{name} {value:g} {int(ts * 1000)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsSampler:
+    """
+    采样一轮写入MetricsStore。
+
+    Args:
+        provider: 调度器的GPU provider（memory_info / process_memory / device_stats）
+        gpu_ids: 采样的GPU
+        snapshot: 返回各实例当前状态的函数，每项包含
+            avatar_id, gpu_id, pids, connections, sessions, render_fps, latency_ms, healthy
+        interval (float): 采样间隔（秒），只用于计算保留期和过期判断
+    """
+
+    def __init__(self, store: MetricsStore, provider, gpu_ids: Iterable[int],
+                 snapshot: Callable[[], List[dict]], interval: float):
+        self.store = store
+        self.provider = provider
+        self.gpu_ids = list(gpu_ids)
+        self.snapshot = snapshot
+        self.interval = interval
+        self.samples = 0
+        self.last_sample_seconds: Optional[float] = None
+
+    def sample(self, now: Optional[float] = None, extra: Optional[dict] = None):
+        """采样一轮；extra是不带标签的manager级指标 {name: value}"""
+        start = time.perf_counter()
+        now = time.time() if now is None else now
+        record = self.store.record
+        process_memory = {}
+        for gpu_id in self.gpu_ids:
+            labels = {'gpu': gpu_id}
+            mem = self.provider.memory_info(gpu_id)
+            if mem:
+                record('gpu_memory_used_mb', round(mem['used']), labels, now)
+                record('gpu_memory_total_mb', round(mem['total']), labels, now)
+            stats = self.provider.device_stats(gpu_id) or {}
+            record('gpu_utilization_percent', stats.get('utilization'), labels, now)
+            record('gpu_temperature_celsius', stats.get('temperature'), labels, now)
+            record('gpu_power_watts', stats.get('power_watts'), labels, now)
+            process_memory[gpu_id] = self.provider.process_memory(gpu_id)
+
+        for inst in self.snapshot():
+            labels = {'avatar': inst['avatar_id'], 'gpu': inst['gpu_id']}
+            usage = process_memory.get(inst['gpu_id'])
+            if usage is not None:
+                record('avatar_gpu_memory_mb', round(sum(usage.get(pid, 0.0) for pid in inst['pids'])), labels, now)
+            record('avatar_connections', inst.get('connections'), labels, now)
+            record('avatar_sessions', inst.get('sessions'), labels, now)
+            record('avatar_render_fps', inst.get('render_fps'), labels, now)
+            record('avatar_probe_latency_ms', inst.get('latency_ms'), labels, now)
+            record('avatar_healthy', None if inst.get('healthy') is None else int(inst['healthy']), labels, now)
+
+        for name, value in (extra or {}).items():
+            record(name, value, None, now)
+
+        # 保留期外仍没有新点的序列（已停止的实例）删除，序列数量不随历史实例增长
+        self.store.prune(now - self.store.capacity * self.interval)
+        self.samples += 1
+        self.last_sample_seconds = round(time.perf_counter() - start, 4)
+
+    def get_info(self) -> dict:
+        return {
+            'interval': self.interval,
+            'retention_seconds': self.store.capacity * self.interval,
+            'series': self.store.series_count(),
+            'samples': self.samples,
+            'last_sample_seconds': self.last_sample_seconds,
+            'provider': type(self.provider).__name__
+        }
@@ -0,0 +1,151 @@
+"""实例健康探测 - 并发请求各实例的 /health
+
+一轮探测用asyncio同时发出所有请求，每个请求有独立的超时，整轮耗时约等于单个超时，而不是实例数×超时。
+状态带滞回：连续失败若干次才判定unhealthy，连续成功若干次才恢复healthy，偶发的一次超时不会触发重启。
+只依赖标准库（asyncio原始连接发HTTP/1.0请求），manager的conda环境不需要额外安装HTTP客户端。
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger('Prober')
+
+HEALTH_UNKNOWN = 'unknown'      # 还没有探测结果
+HEALTH_HEALTHY = 'healthy'
+HEALTH_DEGRADED = 'degraded'    # 响应慢、会话已满，或刚失败过（还没到unhealthy的次数）
+HEALTH_UNHEALTHY = 'unhealthy'  # 连续失败达到阈值：不再分配新用户，由health_check重启
+
+
+class HealthState:
+    """单个实例的探测结果和滞回计数"""
+
+    def __init__(self):
+        self.status = HEALTH_UNKNOWN
+        self.consecutive_failures = 0
+        self.consecutive_successes = 0
+        self.latency_ms: Optional[float] = None
+        self.latency_ewma_ms: Optional[float] = None
+        self.sessions: Optional[int] = None
+        self.max_sessions: Optional[int] = None
+        self.render_fps: Optional[float] = None  # 实例各会话的平均渲染fps（lip-sync /health）
+        self.last_probe: Optional[float] = None
+        self.last_ok: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.probes = 0
+        self.failures = 0
+
+    def get_info(self) -> dict:
+        return {
+            'status': self.status,
+            'latency_ms': self.latency_ms,
+            'latency_ewma_ms': None if self.latency_ewma_ms is None else round(self.latency_ewma_ms, 1),
+            'sessions': self.sessions,
+            'max_sessions': self.max_sessions,
+            'render_fps': self.render_fps,
+            'consecutive_failures': self.consecutive_failures,
+            'last_probe': self.last_probe,
+            'last_ok': self.last_ok,
+            'last_error': self.last_error,
+            'probes': self.probes,
+            'failures': self.failures
+        }
+
+
+class HealthProber:
+    """
+    Args:
+        timeout (float): 单个探测的超时（秒），包括连接和读响应
+        unhealthy_after (int): 连续失败多少次判定unhealthy
+        recover_after (int): unhealthy/degraded后连续成功多少次恢复healthy
+        slow_ms (float): 响应时间超过该值视为degraded
+    """
+
+    def __init__(self, timeout: float = 1.0, unhealthy_after: int = 3, recover_after: int = 2, slow_ms: float = 500):
+        self.timeout = timeout
+        self.unhealthy_after = unhealthy_after
+        self.recover_after = recover_after
+        self.slow_ms = slow_ms
+        self.last_round_seconds: Optional[float] = None
+        self.rounds = 0
+
+    async def _probe_one(self, port: int) -> dict:
+        """GET http://127.0.0.1:<port>/health，返回解析后的JSON；失败抛异常"""
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            writer.write(f"GET /health HTTP/1.0\r\nHost: 127.0.0.1:{port}\r\n\r\n".encode())
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = raw.partition(b"\r\n\r\n")
+        status_line = head.split(b"\r\n", 1)[0].decode(errors='replace')
+        parts = status_line.split()
+        if len(parts) < 2 or parts[1] != '200':
+            raise RuntimeError(f"HTTP {status_line}")
+        return json.loads(body or b"{}")
+
+    async def _timed_probe(self, port: int):
+        start = time.perf_counter()
+        try:
+            data = await asyncio.wait_for(self._probe_one(port), self.timeout)
+            return data, (time.perf_counter() - start) * 1000, None
+        except asyncio.TimeoutError:
+            return None, None, f"timeout after {self.timeout}s"
+        except Exception as e:
+            return None, None, f"{type(e).__name__}: {e}"
+
+    async def _round(self, ports: Dict[str, int]):
+        keys = list(ports)
+        results = await asyncio.gather(*(self._timed_probe(ports[key]) for key in keys))
+        return dict(zip(keys, results))
+
+    def probe(self, ports: Dict[str, int]) -> Dict[str, tuple]:
+        """并发探测一轮，返回 {key: (响应JSON或None, 延迟ms或None, 错误或None)}"""
+        if not ports:
+            return {}
+        start = time.perf_counter()
+        results = asyncio.run(self._round(ports))
+        self.last_round_seconds = round(time.perf_counter() - start, 3)
+        self.rounds += 1
+        return results
+
+    def apply(self, state: HealthState, result: tuple) -> Optional[str]:
+        """把一次探测结果写入状态，返回状态变化前的值（没有变化返回None）"""
+        data, latency_ms, error = result
+        previous = state.status
+        state.probes += 1
+        state.last_probe = time.time()
+
+        if error is not None or (data or {}).get('status') not in (None, 'healthy'):
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.consecutive_successes = 0
+            state.last_error = error or f"status={data.get('status')}"
+            if state.consecutive_failures >= self.unhealthy_after:
+                state.status = HEALTH_UNHEALTHY
+            elif state.status != HEALTH_UNHEALTHY:
+                state.status = HEALTH_DEGRADED
+        else:
+            state.consecutive_failures = 0
+            state.consecutive_successes += 1
+            state.last_ok = state.last_probe
+            state.last_error = None
+            state.latency_ms = round(latency_ms, 1)
+            state.latency_ewma_ms = latency_ms if state.latency_ewma_ms is None else \
+                0.8 * state.latency_ewma_ms + 0.2 * latency_ms
+            state.sessions = data.get('sessions')
+            state.max_sessions = data.get('max_sessions')
+            state.render_fps = data.get('render_fps')
+            stressed = latency_ms > self.slow_ms or (
+                state.max_sessions and state.sessions is not None and state.sessions >= state.max_sessions)
+            if stressed:
+                state.consecutive_successes = 0
+                if state.status != HEALTH_UNHEALTHY:
+                    state.status = HEALTH_DEGRADED
+            elif state.status == HEALTH_UNKNOWN or state.consecutive_successes >= self.recover_after:
+                state.status = HEALTH_HEALTHY
+
+        return previous if state.status != previous else None
@@ -0,0 +1,377 @@
+"""GPU放置调度 - 按显存做best-fit装箱
+
+- 每个实例在启动前按模型类型预留显存（footprint），进程真正占用显存之前，预留一直计入设备占用，
+  避免并发启动都看到同一张"空"卡而一起OOM
+- 实例就绪后用NVML观测到的进程显存学习各模型的实际footprint
+- GPU信息来源可替换：NvmlProvider（真实GPU）、FakeGpuProvider（CPU机器上测试）、NullProvider（无GPU信息）；
+  指标采样（metrics.py）也使用同一个provider
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+try:
+    import pynvml
+    PYNVML_AVAILABLE = True
+except ImportError:
+    PYNVML_AVAILABLE = False
+
+logger = logging.getLogger('Scheduler')
+
+MB = 1024 ** 2
+
+
+class PlacementError(Exception):
+    """没有GPU能放下该实例"""
+
+
+# ============================================================================
+# GPU信息提供者
+# ============================================================================
+
+class NullProvider:
+    """无GPU信息：容量未知，只按预留量均衡"""
+
+    def memory_info(self, gpu_id: int) -> Optional[dict]:
+        return None
+
+    def process_memory(self, gpu_id: int) -> Dict[int, float]:
+        return {}
+
+    def device_stats(self, gpu_id: int) -> Optional[dict]:
+        return None
+
+
+class NvmlProvider:
+    """通过pynvml读取显存和各进程的显存占用"""
+
+    def __init__(self):
+        pynvml.nvmlInit()
+
+    def memory_info(self, gpu_id: int) -> Optional[dict]:
+        try:
+            info = pynvml.nvmlDeviceGetMemoryInfo(pynvml.nvmlDeviceGetHandleByIndex(gpu_id))
+            return {'total': info.total / MB, 'used': info.used / MB, 'free': info.free / MB}
+        except Exception as e:
+            logger.warning(f"Failed to get GPU {gpu_id} memory info: {e}")
+            return None
+
+    def process_memory(self, gpu_id: int) -> Dict[int, float]:
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
+            return {p.pid: (p.usedGpuMemory or 0) / MB
+                    for p in pynvml.nvmlDeviceGetComputeRunningProcesses(handle)}
+        except Exception as e:
+            logger.debug(f"Failed to get GPU {gpu_id} processes: {e}")
+            return {}
+
+    def device_stats(self, gpu_id: int) -> Optional[dict]:
+        """利用率、温度、功耗；单项读取失败时为None（部分卡不支持）"""
+        try:
+            handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
+        except Exception as e:
+            logger.debug(f"Failed to get GPU {gpu_id} handle: {e}")
+            return None
+        stats = {'utilization': None, 'temperature': None, 'power_watts': None}
+        try:
+            stats['utilization'] = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+        except Exception:
+            pass
+        try:
+            stats['temperature'] = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+        except Exception:
+            pass
+        try:
+            stats['power_watts'] = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000  # mW -> W
+        except Exception:
+            pass
+        return stats
+
+
+class FakeGpuProvider:
+    """内存中的假GPU，用于无GPU环境下测试调度
+
+    Args:
+        totals_mb: 每张卡的总显存（MB），下标即gpu_id
+    """
+
+    def __init__(self, totals_mb: Iterable[float] = (24576, 24576)):
+        self.totals = list(totals_mb)
+        self.usage: Dict[int, Dict[int, float]] = {i: {} for i in range(len(self.totals))}  # gpu -> pid -> MB
+        self.external: Dict[int, float] = {i: 0.0 for i in range(len(self.totals))}  # 非manager进程的占用
+        self.stats: Dict[int, dict] = {i: {'utilization': 0, 'temperature': 40, 'power_watts': 50.0}
+                                       for i in range(len(self.totals))}
+
+    def set_process(self, gpu_id: int, pid: int, used_mb: float):
+        """模拟进程在某张卡上占用显存（0表示释放）"""
+        if used_mb > 0:
+            self.usage[gpu_id][pid] = used_mb
+        else:
+            self.usage[gpu_id].pop(pid, None)
+
+    def memory_info(self, gpu_id: int) -> Optional[dict]:
+        if gpu_id >= len(self.totals):
+            return None
+        used = sum(self.usage[gpu_id].values()) + self.external[gpu_id]
+        return {'total': self.totals[gpu_id], 'used': used, 'free': max(0.0, self.totals[gpu_id] - used)}
+
+    def process_memory(self, gpu_id: int) -> Dict[int, float]:
+        return dict(self.usage.get(gpu_id, {}))
+
+    def device_stats(self, gpu_id: int) -> Optional[dict]:
+        return dict(self.stats[gpu_id]) if gpu_id in self.stats else None
+
+
+def create_provider(name: str, fake_totals_mb: Iterable[float] = (24576, 24576)):
+    """按配置创建provider：'nvml'（不可用时退回NullProvider）、'fake'、'none'"""
+    if name == 'fake':
+        return FakeGpuProvider(fake_totals_mb)
+    if name == 'nvml' and PYNVML_AVAILABLE:
+        try:
+            return NvmlProvider()
+        except Exception as e:
+            logger.warning(f"Failed to initialize pynvml: {e}, GPU placement falls back to reservation counting")
+    return NullProvider()
+
+
+# ============================================================================
+# 调度器
+# ============================================================================
+
+class Reservation:
+    """一个实例在某张卡上的显存预留"""
+
+    def __init__(self, key: str, gpu_id: int, model: str, footprint_mb: float, label: Optional[str]):
+        self.key = key
+        self.gpu_id = gpu_id
+        self.model = model
+        self.footprint_mb = footprint_mb
+        self.label = label
+        self.pids: Set[int] = set()  # 就绪后登记，用于观测实际显存
+        self.observed_mb = 0.0
+
+    @property
+    def outstanding_mb(self) -> float:
+        """尚未体现在NVML观测值中的预留量"""
+        return max(0.0, self.footprint_mb - self.observed_mb)
+
+    def get_info(self) -> dict:
+        return {
+            'key': self.key,
+            'gpu': self.gpu_id,
+            'model': self.model,
+            'label': self.label,
+            'footprint_mb': round(self.footprint_mb),
+            'observed_mb': round(self.observed_mb),
+            'confirmed': bool(self.pids)
+        }
+
+
+class PlacementScheduler:
+    """
+    Best-fit装箱：在有效空闲显存（观测空闲 - 未兑现的预留）放得下的卡中，选放下后剩余最少的那张，
+    让大块空闲留给后面的实例；同label（同一Avatar）的实例尽量不放在同一张卡（软反亲和）。
+
+    Args:
+        provider: GPU信息提供者
+        gpu_ids (list): 可调度的GPU，顺序即同等条件下的优先级
+        footprints (dict): 各模型类型的初始显存估计（MB），运行中按观测值学习
+        default_footprint_mb (float): 未知模型的显存估计
+        headroom_mb (float): 每张卡保留不分配的显存
+        strict (bool): True时放不下直接抛PlacementError；False时退回有效空闲最多的卡
+        footprint_file (str): 学习到的footprint持久化文件，None表示不保存
+        learn_rate (float): footprint指数滑动平均的系数
+    """
+
+    def __init__(self, provider, gpu_ids: List[int], footprints: Optional[Dict[str, float]] = None,
+                 default_footprint_mb: float = 11000, headroom_mb: float = 1024, strict: bool = False,
+                 footprint_file: Optional[str] = None, learn_rate: float = 0.3):
+        self.provider = provider
+        self.gpu_ids = list(gpu_ids)
+        self.footprints = dict(footprints or {})
+        self.default_footprint_mb = default_footprint_mb
+        self.headroom_mb = headroom_mb
+        self.strict = strict
+        self.footprint_file = footprint_file
+        self.learn_rate = learn_rate
+        self.reservations: Dict[str, Reservation] = {}
+        self._lock = threading.Lock()
+        self._load_footprints()
+
+    # ---------- footprint ----------
+
+    def _load_footprints(self):
+        if not self.footprint_file or not os.path.exists(self.footprint_file):
+            return
+        try:
+            with open(self.footprint_file, 'r', encoding='utf-8') as f:
+                learned = json.load(f)
+            self.footprints.update({k: float(v) for k, v in learned.items()})
+            logger.info(f"Loaded learned GPU footprints: {learned}")
+        except Exception as e:
+            logger.warning(f"Failed to load footprints from {self.footprint_file}: {e}")
+
+    def _save_footprints(self):
+        if not self.footprint_file:
+            return
+        try:
+            tmp_path = self.footprint_file + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({k: round(v) for k, v in self.footprints.items()}, f, indent=2)
+            os.replace(tmp_path, self.footprint_file)
+        except Exception as e:
+            logger.warning(f"Failed to save footprints to {self.footprint_file}: {e}")
+
+    def footprint(self, model: str) -> float:
+        return self.footprints.get(model, self.default_footprint_mb)
+
+    # ---------- 设备视图 ----------
+
+    def _device_view(self, gpu_id: int) -> dict:
+        """调用方持有self._lock"""
+        mem = self.provider.memory_info(gpu_id)
+        on_device = [r for r in self.reservations.values() if r.gpu_id == gpu_id]
+        outstanding = sum(r.outstanding_mb for r in on_device)
+        return {
+            'gpu_id': gpu_id,
+            'total_mb': mem['total'] if mem else None,
+            'observed_free_mb': mem['free'] if mem else None,
+            'reserved_mb': sum(r.footprint_mb for r in on_device),
+            'outstanding_mb': outstanding,
+            # 容量未知时为None，只能按预留量均衡
+            'effective_free_mb': mem['free'] - outstanding - self.headroom_mb if mem else None,
+            'labels': {r.label for r in on_device if r.label},
+            'instances': len(on_device)
+        }
+
+    def _choose(self, need_mb: float, label: Optional[str], extra_mb: float = 0.0) -> Optional[int]:
+        """调用方持有self._lock；返回选中的gpu_id，放不下返回None"""
+        views = [self._device_view(gpu_id) for gpu_id in self.gpu_ids]
+        known = [v for v in views if v['effective_free_mb'] is not None]
+        if not known:
+            # 没有显存信息：选预留量最少的卡，同等时避开同label
+            best = min(views, key=lambda v: (v['reserved_mb'], label in v['labels'], self.gpu_ids.index(v['gpu_id'])))
+            return best['gpu_id']
+
+        fits = [v for v in known if v['effective_free_mb'] - extra_mb >= need_mb]
+        if not fits:
+            return None
+        # 先满足反亲和，再best-fit（放下后剩余最少），最后按配置顺序
+        best = min(fits, key=lambda v: (label is not None and label in v['labels'],
+                                         v['effective_free_mb'] - need_mb,
+                                         self.gpu_ids.index(v['gpu_id'])))
+        return best['gpu_id']
+
+    # ---------- API ----------
+
+    def reserve(self, key: str, model: str, label: Optional[str] = None, gpu_id: Optional[int] = None) -> int:
+        """为实例预留显存并返回GPU；gpu_id不为None时强制放到该卡（仍然登记预留）"""
+        need_mb = self.footprint(model)
+        with self._lock:
+            if key in self.reservations:
+                return self.reservations[key].gpu_id
+            if gpu_id is None:
+                gpu_id = self._choose(need_mb, label)
+            if gpu_id is None:
+                views = [self._device_view(g) for g in self.gpu_ids]
+                summary = {v['gpu_id']: round(v['effective_free_mb'] or 0) for v in views}
+                if self.strict:
+                    raise PlacementError(f"没有GPU能放下 {model} ({need_mb:.0f} MB)，有效空闲: {summary}")
+                gpu_id = max(views, key=lambda v: v['effective_free_mb'] or 0)['gpu_id']
+                logger.warning(f"No GPU has {need_mb:.0f} MB for {model} (effective free: {summary}), "
+                               f"overcommitting GPU {gpu_id}")
+            self.reservations[key] = Reservation(key, gpu_id, model, need_mb, label)
+            view = self._device_view(gpu_id)
+        logger.info(f"Placed {key} ({model}, {need_mb:.0f} MB) on GPU {gpu_id}: "
+                    f"effective free after placement {view['effective_free_mb'] if view['effective_free_mb'] is None else round(view['effective_free_mb'])} MB")
+        return gpu_id
+
+    def can_place(self, model: str, extra_mb: float = 0.0) -> bool:
+        """现在是否有卡能放下该模型（再额外保留extra_mb），不做预留"""
+        with self._lock:
+            views = [self._device_view(gpu_id) for gpu_id in self.gpu_ids]
+            if all(v['effective_free_mb'] is None for v in views):
+                return True
+            return self._choose(self.footprint(model), None, extra_mb) is not None
+
+    def shortfall(self, model: str, extra_mb: float = 0.0) -> Dict[int, float]:
+        """各卡放下该模型（再额外保留extra_mb）还差多少显存（MB）；有卡放得下或没有显存信息时返回空dict"""
+        need_mb = self.footprint(model) + extra_mb
+        with self._lock:
+            views = [self._device_view(gpu_id) for gpu_id in self.gpu_ids]
+        missing = {v['gpu_id']: need_mb - v['effective_free_mb'] for v in views if v['effective_free_mb'] is not None}
+        if not missing or any(mb <= 0 for mb in missing.values()):
+            return {}
+        return missing
+
+    def held_mb(self, key: str) -> float:
+        """该实例停止后腾出的有效显存：观测值和未兑现预留之和"""
+        with self._lock:
+            reservation = self.reservations.get(key)
+            return max(reservation.footprint_mb, reservation.observed_mb) if reservation else 0.0
+
+    def confirm(self, key: str, pids: Iterable[int]):
+        """实例就绪：登记进程，之后预留按观测到的显存逐步兑现"""
+        with self._lock:
+            reservation = self.reservations.get(key)
+            if reservation is not None:
+                reservation.pids = set(pids)
+        self.sample()
+
+    def update_pids(self, key: str, pids: Iterable[int]):
+        with self._lock:
+            reservation = self.reservations.get(key)
+            if reservation is not None and reservation.pids:
+                reservation.pids = set(pids)
+
+    def rename(self, key: str, new_key: str):
+        """预留换key（实例停止中：显存还没释放，但同ID的新实例需要自己的预留）"""
+        with self._lock:
+            reservation = self.reservations.pop(key, None)
+            if reservation is not None:
+                reservation.key = new_key
+                self.reservations[new_key] = reservation
+
+    def release(self, key: str):
+        with self._lock:
+            self.reservations.pop(key, None)
+
+    def sample(self):
+        """读取各进程显存：更新已就绪实例的观测值，并用观测峰值学习模型footprint"""
+        with self._lock:
+            confirmed = [r for r in self.reservations.values() if r.pids]
+            if not confirmed:
+                return
+            per_gpu = {gpu_id: self.provider.process_memory(gpu_id) for gpu_id in {r.gpu_id for r in confirmed}}
+            changed = False
+            for reservation in confirmed:
+                usage = per_gpu.get(reservation.gpu_id, {})
+                observed = sum(usage.get(pid, 0.0) for pid in reservation.pids)
+                if observed <= reservation.observed_mb:
+                    continue
+                reservation.observed_mb = observed
+                old = self.footprint(reservation.model)
+                learned = old + self.learn_rate * (observed - old)
+                if abs(learned - old) >= 1:
+                    self.footprints[reservation.model] = learned
+                    changed = True
+                    logger.info(f"GPU footprint for {reservation.model}: {old:.0f} -> {learned:.0f} MB "
+                                f"(observed {observed:.0f} MB from {reservation.key})")
+            if changed:
+                self._save_footprints()
+
+    def get_status(self) -> dict:
+        with self._lock:
+            devices = []
+            for gpu_id in self.gpu_ids:
+                view = self._device_view(gpu_id)
+                view['labels'] = sorted(view['labels'])
+                devices.append({k: round(v) if isinstance(v, float) else v for k, v in view.items()})
+            return {
+                'devices': devices,
+                'footprints_mb': {k: round(v) for k, v in self.footprints.items()},
+                'reservations': [r.get_info() for r in self.reservations.values()]
+            }
@@ -36,13 +36,15 @@ from aiortc import RTCPeerConnection, RTCSessionDescription,RTCIceServer,RTCConf
 from aiortc.rtcrtpsender import RTCRtpSender
 from webrtc import HumanPlayer
 from basereal import BaseReal
-from llm import llm_response
+from llm import llm_response, close_session as close_llm_session
 from av import AudioFrame
 
 import argparse
 import random
 import shutil
 import asyncio
+import os
+import signal
 import torch
 from typing import Dict
 from logger import logger
@@ -52,6 +54,7 @@ import gc
 app = Flask(__name__)
 #sockets = Sockets(app)
 nerfreals:Dict[int, BaseReal] = {} #sessionid:BaseReal
+llm_tasks:Dict[int, set] = {} #sessionid:正在生成的LLM回答（asyncio.Task），interrupt时取消
 opt = None
 model = None
 avatar = None
@@ -60,6 +63,17 @@ avatar = None
 #####webrtc###############################
 pcs = set()
 
+def start_llm(sessionid:int, text:str):
+    task = asyncio.ensure_future(llm_response(text, nerfreals[sessionid]))
+    tasks = llm_tasks.setdefault(sessionid, set())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+def cancel_llm(sessionid:int):
+    """取消该会话还在生成的回答，之后不会再有句子进入TTS队列"""
+    for task in llm_tasks.pop(sessionid, set()):
+        task.cancel()
+
 def randN(N)->int:
     '''生成长度为 N的随机数 '''
     min = pow(10, N - 1)
@@ -82,6 +96,12 @@ def build_nerfreal(sessionid:int)->BaseReal:
         nerfreal = LightReal(opt,model,avatar)
     return nerfreal
 
+def close_nerfreal(sessionid):
+    """从会话表移除，并归还共享的自定义动作素材"""
+    nerfreal = nerfreals.pop(sessionid, None)
+    if nerfreal is not None:
+        nerfreal.release_custom()
+
 @app.route('/offer', methods=['POST'])
 async def offer(request):
     params = await request.json()
@@ -112,10 +132,12 @@ async def offer(request):
         if pc.connectionState == "failed":
             await pc.close()
             pcs.discard(pc)
-            del nerfreals[sessionid]
+            cancel_llm(sessionid)
+            close_nerfreal(sessionid)
         if pc.connectionState == "closed":
             pcs.discard(pc)
-            del nerfreals[sessionid]
+            cancel_llm(sessionid)
+            close_nerfreal(sessionid)
             gc.collect()
 
     player = HumanPlayer(nerfreals[sessionid])
@@ -197,13 +219,13 @@ async def human(request):
             )
         
         if params.get('interrupt'):
+            cancel_llm(sessionid) #先停掉还在生成的回答，再清空已排队的句子
             nerfreals[sessionid].flush_talk()
 
         if params['type']=='echo':
             nerfreals[sessionid].put_msg_txt(params['text'])
         elif params['type']=='chat':
-            asyncio.get_event_loop().run_in_executor(None, llm_response, params['text'],nerfreals[sessionid])                         
-            #nerfreals[sessionid].put_msg_txt(res)
+            start_llm(sessionid, params['text']) #边生成边说：每凑够一句就进入TTS队列
 
         return web.Response(
             content_type="application/json",
@@ -237,6 +259,7 @@ async def interrupt_talk(request):
                 status=404
             )
         
+        cancel_llm(sessionid)
         nerfreals[sessionid].flush_talk()
         
         return web.Response(
@@ -393,6 +416,43 @@ async def is_speaking(request):
             ),
         )
 
+async def session_stats(request):
+    try:
+        params = await request.json()
+
+        sessionid = params.get('sessionid',0)
+        
+        # 检查会话是否存在
+        if sessionid not in nerfreals or nerfreals[sessionid] is None:
+            logger.warning(f'Session {sessionid} not found or not initialized')
+            return web.Response(
+                content_type="application/json",
+                text=json.dumps(
+                    {"code": -1, "msg": f"Session {sessionid} not found or expired"}
+                ),
+                status=404
+            )
+        
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": 0, "data": nerfreals[sessionid].get_session_stats()}
+            ),
+        )
+    except Exception as e:
+        logger.exception('exception:')
+        return web.Response(
+            content_type="application/json",
+            text=json.dumps(
+                {"code": -1, "msg": str(e)}
+            ),
+        )
+
+def _avg_render_fps():
+    """各会话的平均渲染fps（还没统计出来的会话不计入），供avatar-manager采样"""
+    fps = [real.render_fps for real in list(nerfreals.values()) if real is not None and real.render_fps > 0]
+    return round(sum(fps) / len(fps), 2) if fps else None
+
 async def health_check(request):
     """健康检查端点 - 用于检测 WebRTC 服务是否就绪"""
     try:
@@ -403,7 +463,8 @@ async def health_check(request):
                     "status": "healthy",
                     "service": "webrtc",
                     "sessions": len(nerfreals),
-                    "max_sessions": opt.max_session if opt else 1
+                    "max_sessions": opt.max_session if opt else 1,
+                    "render_fps": _avg_render_fps()
                 }
             ),
             status=200
@@ -424,6 +485,9 @@ async def on_shutdown(app):
     coros = [pc.close() for pc in pcs]
     await asyncio.gather(*coros)
     pcs.clear()
+    for sessionid in list(llm_tasks):
+        cancel_llm(sessionid)
+    await close_llm_session()
 
 async def post(url,data):
     try:
@@ -475,6 +539,8 @@ if __name__ == '__main__':
     parser.add_argument('--avatar_id', type=str, default='avator_1', help="define which avatar in data/avatars")
     #parser.add_argument('--bbox_shift', type=int, default=5)
     parser.add_argument('--batch_size', type=int, default=16, help="infer batch")
+    parser.add_argument('--degrade', type=int, default=1, help="lower lip-sync rate when inference falls behind real time, 0 to disable")
+    parser.add_argument('--infer_mode', type=str, default='thread', help="thread or process: run inference and compositing in a worker process per session")
 
     parser.add_argument('--customvideo_config', type=str, default='', help="custom action json")
 
@@ -482,6 +548,7 @@ if __name__ == '__main__':
     parser.add_argument('--REF_FILE', type=str, default="en-US-BrianNeural")
     parser.add_argument('--REF_TEXT', type=str, default=None)
     parser.add_argument('--TTS_SERVER', type=str, default='http://127.0.0.1:9880') # http://localhost:9000
+    parser.add_argument('--LLM_SERVER', type=str, default=None, help="LLM service with /chat/stream (default: scripts/ports_config.py LLM_PORT)")
     # parser.add_argument('--CHARACTER', type=str, default='test')
     # parser.add_argument('--EMOTION', type=str, default='default')
 
@@ -509,7 +576,7 @@ if __name__ == '__main__':
         from musereal import MuseReal,load_model,load_avatar,warm_up
         logger.info(opt)
         model = load_model()
-        avatar = load_avatar(opt.avatar_id) 
+        avatar = load_avatar(opt.avatar_id,opt.batch_size) 
         warm_up(opt.batch_size,model)      
     elif opt.model == 'wav2lip':
         from lipreal import LipReal,load_model,load_avatar,warm_up
@@ -545,6 +612,7 @@ if __name__ == '__main__':
     appasync.router.add_post("/record", record)
     appasync.router.add_post("/interrupt_talk", interrupt_talk)
     appasync.router.add_post("/is_speaking", is_speaking)
+    appasync.router.add_post("/session_stats", session_stats)
     appasync.router.add_get("/health", health_check)  # 添加健康检查端点
     appasync.router.add_static('/',path='web')
 
@@ -579,7 +647,15 @@ if __name__ == '__main__':
                 if k!=0:
                     push_url = opt.push_url+str(k)
                 loop.run_until_complete(run(push_url,k))
-        loop.run_forever()    
+        # avatar-manager停止实例时先发SIGTERM：停事件循环、关闭连接、结束推理子进程，显存随进程退出释放
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        loop.run_forever()
+        logger.info('SIGTERM received, shutting down')
+        loop.run_until_complete(runner.cleanup())
+        for child in mp.active_children():
+            child.terminate()
+            child.join(timeout=2)
+        os._exit(0)  # 渲染线程不是daemon，直接退出
     #Thread(target=run_server, args=(web.AppRunner(appasync),)).start()
     run_server(web.AppRunner(appasync))
 
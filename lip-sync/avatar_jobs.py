@@ -0,0 +1,300 @@
+"""
+Avatar creation job queue.
+
+Each upload becomes a job with its own workspace under data/avatar_jobs/<job_id>/. That workspace
+holds the uploaded video, the intermediate files and job.json. A bounded pool of worker threads
+runs the jobs, so concurrent uploads queue up instead of fighting over the GPU. job.json is
+rewritten on every state change, and queued or interrupted jobs are picked up again after a
+restart.
+"""
+
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Rough share of the whole job taken by each stage, used to turn stage progress into one number
+STAGE_WEIGHTS = {"queued": 0.0, "convert": 0.1, "blur": 0.2, "extract": 0.65, "move": 0.05, "finalize": 0.0, "done": 0.0}
+
+
+class QueueFullError(Exception):
+    """Too many pending jobs; the caller should retry later"""
+
+
+class DuplicateJobError(Exception):
+    """An unfinished job already targets this avatar name"""
+
+
+class AvatarJob:
+    """One avatar creation request and its progress"""
+
+    FIELDS = ("job_id", "avatar_name", "video_path", "burr", "metadata", "status", "stage", "progress",
+              "message", "result", "created_at", "started_at", "finished_at")
+
+    def __init__(self, job_id, avatar_name, video_path, burr=False, metadata=None, workspace=None):
+        self.job_id = job_id
+        self.avatar_name = avatar_name
+        self.video_path = video_path
+        self.burr = burr
+        self.metadata = metadata or {}
+        self.workspace = workspace
+        self.status = QUEUED
+        self.stage = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = Future()
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data, workspace):
+        job = cls(data["job_id"], data["avatar_name"], data["video_path"], data.get("burr", False),
+                  data.get("metadata"), workspace)
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(job, field, data[field])
+        return job
+
+    def set_stage(self, stage, fraction=0.0):
+        """Overall progress = weights of finished stages + fraction of the current one"""
+        order = list(STAGE_WEIGHTS)
+        done = sum(STAGE_WEIGHTS[s] for s in order[:order.index(stage)]) if stage in STAGE_WEIGHTS else self.progress
+        total = sum(STAGE_WEIGHTS.values())
+        self.stage = stage
+        self.progress = round(min(1.0, (done + STAGE_WEIGHTS.get(stage, 0.0) * fraction) / total), 3)
+
+
+class AvatarJobQueue:
+    """
+    Bounded worker pool for avatar creation jobs.
+
+    Args:
+        jobs_dir (str): root folder for job workspaces and job.json files
+        runner (callable): runner(job) -> result, raises on failure; must honour job.cancel_event
+        workers (int): number of jobs that may run at the same time
+        max_pending (int): queued + running jobs accepted before submit raises QueueFullError
+        keep_days (float): finished job records older than this are removed
+        max_finished (int): finished job records kept at most, the oldest are removed first
+    """
+
+    def __init__(self, jobs_dir, runner, workers=1, max_pending=8, keep_days=7, max_finished=200):
+        self.jobs_dir = jobs_dir
+        self.runner = runner
+        self.workers = workers
+        self.max_pending = max_pending
+        self.keep_days = keep_days
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._threads = []
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    # ---------- persistence ----------
+
+    def _save(self, job):
+        path = os.path.join(job.workspace, "job.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _restore(self):
+        """Reload jobs from disk; queued and interrupted jobs go back into the queue in creation order"""
+        pending = []
+        for job_id in os.listdir(self.jobs_dir):
+            workspace = os.path.join(self.jobs_dir, job_id)
+            path = os.path.join(workspace, "job.json")
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = AvatarJob.from_dict(json.load(f), workspace)
+            except Exception as e:
+                print(f"[WARN] Skipping unreadable job record {path}: {e}")
+                continue
+            if job.status in FINISHED_STATES:
+                job.future.set_result(job.result)
+            else:
+                if job.status == RUNNING:
+                    print(f"Re-queueing interrupted avatar job {job.job_id} ({job.avatar_name})")
+                job.status = QUEUED
+                job.set_stage("queued")
+                self._save(job)
+                pending.append(job)
+            self.jobs[job.job_id] = job
+        for job in sorted(pending, key=lambda j: j.created_at):
+            self._queue.put(job.job_id)
+        self._prune()
+
+    def _prune(self):
+        """Forget finished jobs beyond max_finished or older than keep_days and delete their workspaces"""
+        cutoff = time.time() - self.keep_days * 86400
+        with self._lock:
+            finished = sorted((j for j in self.jobs.values() if j.status in FINISHED_STATES),
+                              key=lambda j: j.finished_at or 0, reverse=True)
+            expired = [j for i, j in enumerate(finished) if i >= self.max_finished or (j.finished_at or 0) < cutoff]
+            for job in expired:
+                del self.jobs[job.job_id]
+        for job in expired:
+            shutil.rmtree(job.workspace, ignore_errors=True)
+
+    # ---------- lifecycle ----------
+
+    def start(self):
+        self._restore()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"avatar-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Avatar job queue started: {self.workers} worker(s), {self._queue.qsize()} job(s) pending")
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:  # keep the worker alive, the next job must still run
+                print(f"[WARN] Avatar job {job_id}: worker error: {e}")
+
+    def _run(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        with self._lock:
+            if job.status != QUEUED:  # cancelled while waiting
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+            self._save(job)
+        print(f"Avatar job {job.job_id} started: {job.avatar_name}")
+        try:
+            result = self.runner(job)
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED, "Cancelled")
+            else:
+                self._finish(job, SUCCEEDED, "Avatar created", result)
+        except Exception as e:
+            if job.cancel_event.is_set():
+                self._finish(job, CANCELLED, "Cancelled")
+            else:
+                print(f"Avatar job {job.job_id} failed: {e}")
+                self._finish(job, FAILED, str(e))
+
+    def _mark_finished(self, job, status, message, result=None):
+        """State transition only; the caller holds self._lock"""
+        job.status = status
+        job.message = message
+        job.result = result
+        job.finished_at = time.time()
+        if status == SUCCEEDED:
+            job.set_stage("done", 1.0)
+        self._save(job)
+
+    def _finish(self, job, status, message, result=None):
+        with self._lock:
+            self._mark_finished(job, status, message, result)
+        self._release(job)
+
+    def _release(self, job):
+        """Clean up a finished job's workspace and wake up anyone waiting on it"""
+        # The upload and intermediates are no longer needed once the job is over; keep job.json for status queries
+        try:
+            for name in os.listdir(job.workspace):
+                if name != "job.json":
+                    path = os.path.join(job.workspace, name)
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+        except OSError as e:
+            print(f"[WARN] Failed to clean up workspace of avatar job {job.job_id}: {e}")
+        print(f"Avatar job {job.job_id} {job.status}: {job.message}")
+        if not job.future.done():
+            job.future.set_result(job.result)
+        self._prune()
+
+    # ---------- API ----------
+
+    def new_workspace(self):
+        """Create a private workspace for a job that is about to be submitted, returns (job_id, path)"""
+        job_id = uuid.uuid4().hex[:12]
+        workspace = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(workspace)
+        return job_id, workspace
+
+    def submit(self, job_id, avatar_name, video_path, burr=False, metadata=None):
+        with self._lock:
+            active = [j for j in self.jobs.values() if j.status not in FINISHED_STATES]
+            if any(j.avatar_name == avatar_name for j in active):
+                raise DuplicateJobError(f"Avatar '{avatar_name}' is already being created")
+            if len(active) >= self.max_pending:
+                raise QueueFullError(f"{len(active)} avatar jobs pending, please retry later")
+            job = AvatarJob(job_id, avatar_name, video_path, burr, metadata,
+                            os.path.join(self.jobs_dir, job_id))
+            self.jobs[job_id] = job
+            self._save(job)
+        self._queue.put(job_id)
+        print(f"Avatar job {job_id} queued: {avatar_name}")
+        return job
+
+    def update(self, job, stage, fraction=0.0):
+        """Progress callback used by the runner; persisted so status survives restarts"""
+        with self._lock:
+            job.set_stage(stage, fraction)
+            self._save(job)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returns the job or None if unknown"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status != QUEUED:  # running: the runner stops on cancel_event and the worker finishes the job
+                return job
+            self._mark_finished(job, CANCELLED, "Cancelled before start")
+        self._release(job)
+        return job
+
+    def _info(self, job, queued):
+        """job.to_dict() plus its queue position; the caller holds self._lock, queued from _queued_ids()"""
+        info = job.to_dict()
+        if info["status"] == QUEUED:
+            info["queue_position"] = queued.index(job.job_id) + 1
+        return info
+
+    def _queued_ids(self):
+        return [j.job_id for j in sorted((j for j in self.jobs.values() if j.status == QUEUED), key=lambda j: j.created_at)]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return self._info(job, self._queued_ids())
+
+    def list(self):
+        with self._lock:
+            queued = self._queued_ids()
+            infos = [self._info(job, queued) for job in self.jobs.values()]
+        return sorted(infos, key=lambda j: j["created_at"], reverse=True)
@@ -28,7 +28,8 @@ import resampy
 
 import queue
 from queue import Queue
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+import torch.multiprocessing as mp
 from io import BytesIO
 import soundfile as sf
 
@@ -67,6 +68,146 @@ def play_audio(quit_event,queue):
         stream.write(queue.get(block=True))
     stream.close()
 
+class CustomAsset:
+    """一个自定义动作素材（帧+音频），session创建时预加载（已加载过的直接复用），所有session只读共享"""
+
+    def __init__(self, item):
+        self.item = item
+        self.refcount = 0
+        self._lock = Lock()
+        self._frames = None
+        self._audio = None
+
+    def load(self):
+        with self._lock:
+            if self._frames is not None:
+                return
+            item = self.item
+            packed_path = os.path.join(item['imgpath'], 'frames.npy')
+            if item.get('packed') and os.path.exists(packed_path):
+                frames = np.load(packed_path, mmap_mode='r') #打包格式，按需换页，多进程共享page cache
+            else:
+                input_img_list = glob.glob(os.path.join(item['imgpath'], '*.[jpJP][pnPN]*[gG]'))
+                input_img_list = sorted(input_img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
+                frames = read_imgs(input_img_list)
+                if item.get('packed'):
+                    tmp_path = f'{packed_path}.{os.getpid()}.tmp'
+                    with open(tmp_path, 'wb') as f:
+                        np.save(f, np.stack(frames))
+                    os.replace(tmp_path, packed_path)
+                    frames = np.load(packed_path, mmap_mode='r')
+            self._audio, sample_rate = sf.read(item['audiopath'], dtype='float32')
+            self._frames = frames
+            logger.info(f"custom asset loaded: {item['imgpath']} frames={len(frames)}")
+
+    @property
+    def frames(self):
+        if self._frames is None:
+            self.load()
+        return self._frames
+
+    @property
+    def audio(self):
+        if self._audio is None:
+            self.load()
+        return self._audio
+
+
+class CustomAssetCache:
+    """进程内共享的自定义动作素材缓存，按(imgpath, audiopath)引用计数，最后一个session释放时卸载"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._assets = {}
+
+    def acquire(self, item) -> CustomAsset:
+        key = (os.path.abspath(item['imgpath']), os.path.abspath(item['audiopath']))
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is None:
+                asset = self._assets[key] = CustomAsset(item)
+            asset.refcount += 1
+            return asset
+
+    def release(self, asset: CustomAsset):
+        key = (os.path.abspath(asset.item['imgpath']), os.path.abspath(asset.item['audiopath']))
+        with self._lock:
+            asset.refcount -= 1
+            if asset.refcount <= 0 and self._assets.get(key) is asset:
+                del self._assets[key]
+
+custom_cache = CustomAssetCache()
+
+class DegradeController:
+    """推理跟不上实时时的降级策略（保证音频按时输出）
+
+    level 0: 正常，每帧推理
+    level 1: 半速口型，隔帧推理，相邻帧复用同一张嘴部图
+    level 2: 不推理，直接输出idle整帧，只保证音频连续
+    """
+    NORMAL = 0
+    HALF_RATE = 1
+    IDLE = 2
+    _rates = {NORMAL: 1.0, HALF_RATE: 0.5, IDLE: 0.0}
+
+    def __init__(self, batch_size, enabled=True, high=1.0, low=0.75, min_dwell=2.0, video_fps=25):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.budget = batch_size / video_fps  # 一个batch对应的实时时长（秒）
+        self.high = high  # 超过则升级降级等级
+        self.low = low    # 低于则恢复一级
+        self.min_dwell = min_dwell  # 每个等级最少保持时间，防止抖动
+        self.level = self.NORMAL
+        self.load = 0.0   # 全速推理一个batch耗时/实时时长 (EMA)
+        self._level_since = time.perf_counter()
+        self.events = 0
+        self.level_seconds = {self.HALF_RATE: 0.0, self.IDLE: 0.0}
+
+    def infer_count(self):
+        """当前等级下一个batch需要推理的帧数"""
+        if self.level == self.IDLE:
+            return 0
+        return max(1, int(self.batch_size * self._rates[self.level]))
+
+    def observe(self, elapsed, inferred):
+        """推理线程每个batch调用一次，elapsed为推理耗时，inferred为实际推理帧数"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if inferred > 0:
+            load = elapsed * self.batch_size / inferred / self.budget
+            self.load = load if self.load == 0 else 0.8 * self.load + 0.2 * load
+        if now - self._level_since < self.min_dwell:
+            return
+        if self.level == self.IDLE:
+            # 不推理时无法测量负载，dwell结束后试探回到半速
+            self._set_level(self.HALF_RATE, now)
+        elif self.load * self._rates[self.level] > self.high:
+            self._set_level(self.level + 1, now)
+        elif self.level > self.NORMAL and self.load * self._rates[self.level - 1] < self.low:
+            self._set_level(self.level - 1, now)
+
+    def _set_level(self, level, now):
+        if self.level != self.NORMAL:
+            self.level_seconds[self.level] += now - self._level_since
+        elif level != self.NORMAL:
+            self.events += 1
+        logger.warning(f"degrade level {self.level} -> {level}, load={self.load:.2f}")
+        self.level = level
+        self._level_since = now
+
+    def get_stats(self) -> dict:
+        level_seconds = dict(self.level_seconds)
+        if self.level != self.NORMAL:
+            level_seconds[self.level] += time.perf_counter() - self._level_since
+        return {
+            'level': self.level,
+            'load': round(self.load, 3),
+            'events': self.events,
+            'half_rate_seconds': round(level_seconds[self.HALF_RATE], 2),
+            'idle_seconds': round(level_seconds[self.IDLE], 2),
+        }
+
 class BaseReal:
     def __init__(self, opt):
         self.opt = opt
@@ -100,13 +241,19 @@ class BaseReal:
         self.width = self.height = 0
 
         self.curr_state=0
-        self.custom_img_cycle = {}
-        self.custom_audio_cycle = {}
+        self.custom_assets = {}
         self.custom_audio_index = {}
         self.custom_index = {}
         self.custom_opt = {}
+        self._custom_acquired = []
         self.__loadcustom()
 
+        self.degrade = DegradeController(opt.batch_size, enabled=bool(opt.degrade))
+        self.infer_process = opt.infer_mode == 'process'
+        self._infer_proc = None
+        self._shared_keys = []
+        self.render_fps = 0.0
+
     def put_msg_txt(self,msg,eventpoint=None):
         self.tts.put_msg_txt(msg,eventpoint)
     
@@ -145,18 +292,88 @@ class BaseReal:
 
     def is_speaking(self)->bool:
         return self.speaking
-    
+
+    def get_session_stats(self)->dict:
+        degrade = self.degrade.get_stats()
+        if self.infer_process and self.res_frame_queue.degrade_stats is not None:
+            degrade = self.res_frame_queue.degrade_stats #降级控制器在worker进程里
+        return {
+            'infer_mode': self.opt.infer_mode,
+            'render_fps': round(self.render_fps, 2),
+            'degrade': degrade,
+        }
+
+    def init_infer_transport(self, feat_frame_bytes, avatar_attrs):
+        """--infer_mode process时，把特征队列和结果帧队列换成共享内存环形缓冲
+        feat_frame_bytes: 每帧音频特征的最大字节数; avatar_attrs: 贴回需要的avatar属性名"""
+        if not self.infer_process:
+            return
+        from inferworker import FeatQueue, FrameQueue
+        self.asr.feat_queue = FeatQueue(2, self.batch_size*feat_frame_bytes)
+        self.res_frame_queue = FrameQueue(self.batch_size*2, self.frame_list_cycle[0].nbytes)
+        self._avatar_state = {name: self._share_frames(getattr(self, name), name) for name in avatar_attrs}
+
+    def _share_frames(self, frames, name):
+        """按avatar路径+名字共享，session结束时在stop_inference里释放"""
+        from inferworker import share_frames
+        key = (f"./data/avatars/{self.opt.avatar_id}", name)
+        shared = share_frames(frames, key)
+        if shared is not frames:
+            self._shared_keys.append(key)
+        return shared
+
+    def start_inference(self, target, args, quit_event=None):
+        """启动推理：默认线程；process模式下推理和贴回在独立进程里跑"""
+        if not self.infer_process:
+            Thread(target=target, args=args).start()
+            return
+        from inferworker import infer_worker
+        names = {id(v): k for k, v in vars(self).items() if isinstance(v, list)} #和avatar_attrs是同一个列表时共用一份
+        args = tuple(self._share_frames(a, names.get(id(a), f'arg{i}')) if isinstance(a, list) else a
+                     for i, a in enumerate(args)) #avatar帧列表走共享内存
+        if isinstance(quit_event, Event):
+            # threading.Event不能跨进程，换成mp.Event并由watcher线程转发
+            stop_event = mp.Event()
+            args = tuple(stop_event if a is quit_event else a for a in args)
+            Thread(target=lambda: (quit_event.wait(), stop_event.set()), daemon=True).start()
+        self._infer_proc = mp.Process(target=infer_worker, daemon=True,
+                                      args=(type(self), self._avatar_state, self.res_frame_queue, target, args))
+        self._infer_proc.start()
+        logger.info(f'session {self.sessionid} inference process pid={self._infer_proc.pid}')
+
+    def stop_inference(self, process_thread=None):
+        """quit_event置位后调用；process_thread是render里启动的process_frames线程"""
+        if self._infer_proc is None:
+            return
+        self._infer_proc.join(timeout=5)
+        if self._infer_proc.is_alive():
+            self._infer_proc.terminate()
+        self._infer_proc = None
+        if process_thread is not None:
+            process_thread.join() #它可能还在res_frame_queue.get里读共享内存，先等它退出再关闭
+        self.asr.feat_queue.close()
+        self.res_frame_queue.close()
+        from inferworker import release_frames
+        release_frames(self._shared_keys)
+        self._shared_keys = []
+
     def __loadcustom(self):
         for item in self.opt.customopt:
             logger.info(item)
-            input_img_list = glob.glob(os.path.join(item['imgpath'], '*.[jpJP][pnPN]*[gG]'))
-            input_img_list = sorted(input_img_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
-            self.custom_img_cycle[item['audiotype']] = read_imgs(input_img_list)
-            self.custom_audio_cycle[item['audiotype']], sample_rate = sf.read(item['audiopath'], dtype='float32')
+            asset = custom_cache.acquire(item)
+            self._custom_acquired.append(asset)
+            asset.load() #在创建session的线程里解码/打包，不占process_frames的实时输出
+            self.custom_assets[item['audiotype']] = asset
             self.custom_audio_index[item['audiotype']] = 0
             self.custom_index[item['audiotype']] = 0
             self.custom_opt[item['audiotype']] = item
 
+    def release_custom(self):
+        """session关闭时调用，归还素材引用；session自己仍持有素材对象，渲染线程收尾时还可以读"""
+        assets, self._custom_acquired = self._custom_acquired, []
+        for asset in assets:
+            custom_cache.release(asset)
+
     def init_customindex(self):
         self.curr_state=0
         for key in self.custom_audio_index:
@@ -281,9 +498,10 @@ class BaseReal:
     
     def get_audio_stream(self,audiotype):
         idx = self.custom_audio_index[audiotype]
-        stream = self.custom_audio_cycle[audiotype][idx:idx+self.chunk]
+        audio = self.custom_assets[audiotype].audio
+        stream = audio[idx:idx+self.chunk]
         self.custom_audio_index[audiotype] += self.chunk
-        if self.custom_audio_index[audiotype]>=self.custom_audio_cycle[audiotype].shape[0]:
+        if self.custom_audio_index[audiotype]>=audio.shape[0]:
             self.curr_state = 1  #当前视频不循环播放，切换到静音状态
         return stream
     
@@ -312,11 +530,19 @@ class BaseReal:
             audio_thread = Thread(target=play_audio, args=(quit_event,audio_tmp,), daemon=True, name="pyaudio_stream")
             audio_thread.start()
         
+        fps_count = 0
+        fps_start = time.perf_counter()
         while not quit_event.is_set():
             try:
                 res_frame,idx,audio_frames = self.res_frame_queue.get(block=True, timeout=1)
             except queue.Empty:
                 continue
+            fps_count += 1
+            if fps_count>=100:
+                self.render_fps = fps_count/(time.perf_counter()-fps_start)
+                logger.info(f"------actual avg render fps:{self.render_fps:.4f}")
+                fps_count = 0
+                fps_start = time.perf_counter()
             
             if enable_transition:
                 # 检测状态变化
@@ -330,8 +556,9 @@ class BaseReal:
                 self.speaking = False
                 audiotype = audio_frames[0][1]
                 if self.custom_index.get(audiotype) is not None: #有自定义视频
-                    mirindex = self.mirror_index(len(self.custom_img_cycle[audiotype]),self.custom_index[audiotype])
-                    target_frame = self.custom_img_cycle[audiotype][mirindex]
+                    custom_frames = self.custom_assets[audiotype].frames
+                    mirindex = self.mirror_index(len(custom_frames),self.custom_index[audiotype])
+                    target_frame = custom_frames[mirindex]
                     self.custom_index[audiotype] += 1
                 else:
                     target_frame = self.frame_list_cycle[idx]
@@ -349,11 +576,16 @@ class BaseReal:
                     combine_frame = target_frame
             else:
                 self.speaking = True
-                try:
-                    current_frame = self.paste_back_frame(res_frame,idx)
-                except Exception as e:
-                    logger.warning(f"paste_back_frame error: {e}")
-                    continue
+                if res_frame is None: #降级模式下未推理，用idle帧保证音频不断
+                    current_frame = self.frame_list_cycle[idx]
+                elif self.infer_process: #worker进程已贴回
+                    current_frame = res_frame
+                else:
+                    try:
+                        current_frame = self.paste_back_frame(res_frame,idx)
+                    except Exception as e:
+                        logger.warning(f"paste_back_frame error: {e}")
+                        current_frame = self.frame_list_cycle[idx]
                 if enable_transition:
                     # 静音→说话过渡
                     if time.time() - _transition_start < _transition_duration and _last_silent_frame is not None:
@@ -373,6 +605,8 @@ class BaseReal:
                 vircam.send(combine_frame)
             else: #webrtc
                 image = combine_frame
+                if not image.flags.writeable: #mmap的共享素材只读
+                    image = image.copy()
                 image[0,:] &= 0xFE
                 new_frame = VideoFrame.from_ndarray(image, format="bgr24")
                 asyncio.run_coroutine_threadsafe(video_track._queue.put((new_frame,None)), loop)
@@ -0,0 +1,236 @@
+"""
+bgseg.py
+
+PPHumanSeg 人像分割 + 背景模糊/替换，不依赖 jina：
+- process_video：整段视频的批量流水线（blur_server.py 的 Executor 使用）
+- BackgroundBlur：逐帧处理函数（avatar 生成的流式读帧 musetalk/simple_musetalk.py 使用）
+preprocess/postprocess/compose 是原始的逐帧浮点实现，保留作对照。
+"""
+
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "human_segmentation_pphumanseg_2023mar.onnx")
+
+
+def preprocess(frame_bgr, in_size):
+    rgb = cv.cvtColor(frame_bgr, cv.COLOR_BGR2RGB)
+    blob = cv.resize(rgb, (in_size, in_size)).astype(np.float32) / 255.0
+    return blob.transpose(2, 0, 1)[np.newaxis]
+
+
+def postprocess(mask, wh):
+    w, h = wh
+    mask = mask[0, 0].astype(np.float32)           # 0/1, 背景=1
+    mask = cv.resize(mask, (w, h), cv.INTER_NEAREST)
+    mask = 1.0 - mask                              # 人物=1
+    mask = cv.GaussianBlur(mask, (15, 15), 0)
+    return mask[..., None]                         # HW1
+
+
+def compose(frame, mask, mode, kernel, bg_img=None):
+    if mode == 'blur':
+        bg = cv.GaussianBlur(frame, (kernel, kernel), 0)
+    elif mode == 'replace' and bg_img is not None:
+        bg = bg_img
+    else:
+        bg = frame
+    comp = frame.astype(np.float32) * mask + bg.astype(np.float32) * (1 - mask)
+    return comp.astype(np.uint8)
+
+
+# ---------- 批量 / 流水线版本（uint8 定点运算） ----------
+
+class Segmenter:
+    """PPHumanSeg 批量推理，N 帧一次 forward；模型不支持 batch 维时自动退回逐帧 forward"""
+
+    def __init__(self, model_path=MODEL_PATH):
+        self.net = cv.dnn.readNet(model_path)   # CPU 推理
+        self.batched = True
+
+    def _forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def __call__(self, frames, in_size=192):
+        """返回 (N, in_size, in_size) uint8 人物 alpha（人物=255），与 postprocess 的 1-mask 语义一致"""
+        blob = cv.dnn.blobFromImages(frames, 1.0 / 255.0, (in_size, in_size), swapRB=True)
+        out = None
+        if self.batched and len(frames) > 1:
+            try:
+                out = self._forward(blob)
+                if out.shape[0] != len(frames):
+                    raise ValueError(f"batch {len(frames)} -> {out.shape[0]}")
+            except (cv.error, ValueError):
+                self.batched = False
+                out = None
+        if out is None:
+            out = np.concatenate([self._forward(blob[i:i + 1]) for i in range(len(frames))])
+        return np.clip((1.0 - out[:, 0]) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+def alpha_to_frame(alpha, wh):
+    """模型分辨率 alpha -> 原图分辨率并羽化边缘，全程 uint8"""
+    alpha = cv.resize(alpha, wh, interpolation=cv.INTER_LINEAR)
+    return cv.GaussianBlur(alpha, (15, 15), 0)
+
+
+def blur_background(frame, kernel):
+    """大核高斯模糊在缩小的图上做再放大，背景观感一致，耗时随缩放倍数平方下降"""
+    scale = max(1, kernel // 25)
+    if scale == 1:
+        return cv.GaussianBlur(frame, (kernel, kernel), 0)
+    h, w = frame.shape[:2]
+    small = cv.resize(frame, (max(1, w // scale), max(1, h // scale)), interpolation=cv.INTER_AREA)
+    k = (kernel // scale) | 1
+    small = cv.GaussianBlur(small, (k, k), 0)
+    return cv.resize(small, (w, h), interpolation=cv.INTER_LINEAR)
+
+
+def compose_u8(frame, alpha, bg):
+    """frame*a + bg*(1-a)，a=alpha/255，uint16 定点计算并四舍五入除以 255"""
+    a = alpha[..., None].astype(np.uint16)
+    x = frame.astype(np.uint16) * a
+    x += bg.astype(np.uint16) * (255 - a)
+    x += 128
+    x += x >> 8
+    x >>= 8
+    return x.astype(np.uint8)
+
+
+def compose_frame(frame, alpha, mode, kernel, bg_img=None):
+    if mode == 'blur':
+        bg = blur_background(frame, kernel)
+    elif mode == 'replace' and bg_img is not None:
+        bg = bg_img
+    else:
+        return frame
+    h, w = frame.shape[:2]
+    return compose_u8(frame, alpha_to_frame(alpha, (w, h)), bg)
+
+
+class BackgroundBlur:
+    """逐帧背景模糊（或替换为 background_image），可直接作为帧处理函数使用：out = bgblur(frame)"""
+
+    def __init__(self, model_path=MODEL_PATH, blur_kernel=101, resize=192, background_image=None):
+        self.segmenter = Segmenter(model_path)
+        self.blur_kernel = blur_kernel
+        self.resize = resize
+        self.bg_img = None
+        if background_image:
+            self.bg_img = cv.imread(background_image)
+            if self.bg_img is None:
+                raise FileNotFoundError(f"无法读取背景图 {background_image}")
+
+    def __call__(self, frame):
+        h, w = frame.shape[:2]
+        alpha = self.segmenter([frame], self.resize)[0]
+        if self.bg_img is not None:
+            if self.bg_img.shape[:2] != (h, w):
+                self.bg_img = cv.resize(self.bg_img, (w, h))
+            return compose_frame(frame, alpha, 'replace', self.blur_kernel, self.bg_img)
+        return compose_frame(frame, alpha, 'blur', self.blur_kernel)
+
+
+def process_video(inp, out, segmenter, mode='blur', kernel=101, bg_img=None, in_size=192, batch_size=8,
+                  compose_workers=2, queue_size=4, ffmpeg='/usr/bin/ffmpeg', preset='veryfast'):
+    """
+    解码 -> 批量分割 -> 合成 -> 编码 四段流水线，段间用有界队列衔接（cv 调用释放 GIL，各段可并行）。
+    合成帧直接写入 ffmpeg 的 stdin 编码，同一个 ffmpeg 进程从原视频取音轨一起封装，不产生临时文件。
+
+    :return: (处理帧数, 耗时秒)
+    """
+    cap = cv.VideoCapture(str(inp))
+    w, h = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv.CAP_PROP_FPS) or 30
+    if bg_img is not None:
+        bg_img = cv.resize(bg_img, (w, h))
+
+    encoder = subprocess.Popen([
+        ffmpeg, "-y", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{w}x{h}", "-r", str(fps), "-i", "-",   # 合成帧
+        "-i", str(inp),                                                                       # 原声
+        "-map", "0:v:0", "-map", "1:a:0?",
+        "-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p", "-c:a", "copy",
+        str(out),
+    ], stdin=subprocess.PIPE)
+
+    batches = queue.Queue(maxsize=queue_size)
+    composed = queue.Queue(maxsize=queue_size * batch_size)
+    errors = []
+    count = [0]
+    pool = ThreadPoolExecutor(max_workers=compose_workers)
+
+    def decode():
+        try:
+            batch = []
+            while not errors:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                batch.append(frame)
+                if len(batch) == batch_size:
+                    batches.put(batch)
+                    batch = []
+            if batch:
+                batches.put(batch)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cap.release()
+            batches.put(None)
+
+    def infer():
+        # 出错后继续取空上游队列直到结束标记，避免上游阻塞在满队列上
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if errors:
+                continue
+            try:
+                alphas = segmenter(batch, in_size)
+                for frame, alpha in zip(batch, alphas):
+                    composed.put(pool.submit(compose_frame, frame, alpha, mode, kernel, bg_img))
+            except Exception as e:
+                errors.append(e)
+        composed.put(None)
+
+    def encode():
+        while True:
+            future = composed.get()
+            if future is None:
+                break
+            if errors:
+                continue
+            try:
+                encoder.stdin.write(future.result().tobytes())
+                count[0] += 1
+            except Exception as e:
+                errors.append(e)
+
+    start = time.perf_counter()
+    stages = [threading.Thread(target=fn, daemon=True) for fn in (decode, infer, encode)]
+    for t in stages:
+        t.start()
+    for t in stages:
+        t.join()
+    pool.shutdown()
+    try:
+        encoder.stdin.close()
+    except BrokenPipeError:
+        pass
+    returncode = encoder.wait()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
+    return count[0], elapsed
@@ -7,21 +7,21 @@ Jina Executor: 给视频做人像抠图 → 背景模糊 / 替换 → 保留原
 客户端调用参考见文末注释。
 """
 
-import os
-import subprocess
 import multiprocessing
-import tempfile
 from pathlib import Path
 
 import cv2 as cv
-import numpy as np
 from jina import Executor, Deployment, requests, Client
 from docarray import BaseDoc, DocList
 
+from bgseg import Segmenter, process_video
+
 # ---------- 全局配置 ----------
 WORKSPACE = "./"   # 所有输入/输出文件所在根目录
 MODEL_PATH = "/workspace/murphy/capstone-project-25t3-9900-virtual-tutor-phase-2/lip-sync/blur/human_segmentation_pphumanseg_2023mar.onnx" # Download here: https://github.com/opencv/opencv_zoo/tree/main/models/human_segmentation_pphumanseg
 PORT = 23004
+FFMPEG_PATH = "/usr/bin/ffmpeg"
+BATCH_SIZE = 8     # 每次 forward 的帧数
 
 
 # ---------- Doc 定义 ----------
@@ -43,36 +43,9 @@ class Result(BaseDoc):
 class VideoBGExecutor(Executor):
     def __init__(self, model_path: str = MODEL_PATH, **kwargs):
         super().__init__(**kwargs)
-        self.net = cv.dnn.readNet(model_path)   # CPU 推理
+        self.segmenter = Segmenter(model_path)   # CPU 推理
         self.model_in = 192
 
-    # ---------- 工具 ----------
-    @staticmethod
-    def _pre(frame_bgr, in_size):
-        rgb = cv.cvtColor(frame_bgr, cv.COLOR_BGR2RGB)
-        blob = cv.resize(rgb, (in_size, in_size)).astype(np.float32) / 255.0
-        return blob.transpose(2, 0, 1)[np.newaxis]
-
-    @staticmethod
-    def _post(mask, wh):
-        w, h = wh
-        mask = mask[0, 0].astype(np.float32)           # 0/1, 背景=1
-        mask = cv.resize(mask, (w, h), cv.INTER_NEAREST)
-        mask = 1.0 - mask                              # 人物=1
-        mask = cv.GaussianBlur(mask, (15, 15), 0)
-        return mask[..., None]                         # HW1
-
-    @staticmethod
-    def _compose(frame, mask, mode, kernel, bg_img=None):
-        if mode == 'blur':
-            bg = cv.GaussianBlur(frame, (kernel, kernel), 0)
-        elif mode == 'replace' and bg_img is not None:
-            bg = bg_img
-        else:
-            bg = frame
-        comp = frame.astype(np.float32) * mask + bg.astype(np.float32) * (1 - mask)
-        return comp.astype(np.uint8)
-
     # ---------- 主入口 ----------
     @requests
     def process(self, docs: DocList[VideoBGTask], **kwargs) -> DocList[Result]:
@@ -88,65 +61,22 @@ class VideoBGExecutor(Executor):
                 if not inp.exists():
                     raise FileNotFoundError(f"找不到 {inp}")
 
-                cap = cv.VideoCapture(str(inp))
-                w, h = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
-                fps = cap.get(cv.CAP_PROP_FPS) or 30
-
-                # 2. 背景图预处理（如需要）
+                # 2. 背景图（如需要），缩放到帧尺寸在 process_video 里做
                 bg_img = None
                 if d.background_image:
                     bg_path = Path(WORKSPACE) / d.background_image
                     bg_img = cv.imread(str(bg_path))
                     if bg_img is None:
                         raise FileNotFoundError(f"无法读取背景图 {bg_path}")
-                    bg_img = cv.resize(bg_img, (w, h))
-
-                # 3. 临时无声视频
-                tmp_path = Path(tempfile.mkstemp(suffix=".mp4")[1])
-                writer = cv.VideoWriter(
-                    str(tmp_path),
-                    cv.VideoWriter_fourcc(*"mp4v"),
-                    fps,
-                    (w, h),
-                )
 
-                # 4. 帧级循环
-                while True:
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    blob = self._pre(frame, d.resize)
-                    self.net.setInput(blob)
-                    mask = self.net.forward()
-                    mask = self._post(mask, (w, h))
-                    mode = "blur" if d.blur_background else "replace"
-                    out_frame = self._compose(frame, mask, mode, d.blur_kernel, bg_img)
-                    writer.write(out_frame)
-
-                cap.release()
-                writer.release()
-
-                # 5. 合并音轨
+                # 3. 解码 -> 批量分割 -> 合成 -> ffmpeg 编码并封装原音轨，一遍完成
                 out_path = Path(WORKSPACE) / (d.output_video_path or f"{inp.stem}_out.mp4")
-                cmd = [
-                    "/usr/bin/ffmpeg",
-                    "-y",
-                    "-i",
-                    str(tmp_path),  # 无声
-                    "-i",
-                    str(inp),       # 原声
-                    "-c",
-                    "copy",
-                    "-c:v",
-                    "libx264",
-                    "-map",
-                    "0:v:0",
-                    "-map",
-                    "1:a:0?",
-                    str(out_path),
-                ]
-                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-                os.remove(tmp_path)
+                mode = "blur" if d.blur_background else "replace"
+                frames, elapsed = process_video(
+                    inp, out_path, self.segmenter, mode=mode, kernel=d.blur_kernel, bg_img=bg_img,
+                    in_size=d.resize, batch_size=BATCH_SIZE, ffmpeg=FFMPEG_PATH,
+                )
+                print(f"{inp.name}: {frames} frames, {frames / max(elapsed, 1e-6):.1f} fps")
 
                 out_docs.append(Result(result="success", info=str(out_path)))
             except Exception as e:
@@ -3,6 +3,10 @@ from calendar import c
 import subprocess
 import os
 import json
+import re
+import shlex
+import signal
+import threading
 from docarray import DocList, BaseDoc
 from jina import Client
 import multiprocessing
@@ -56,6 +60,9 @@ MUSE_TALK_BASE = get_config_value("paths.muse_talk_base", "/workspace/share/yunt
 MUSERESDIR = os.path.join(MUSE_TALK_BASE, "results", "v15", "avatars")
 LIVEVIDEODIR = os.path.join(WORKING_DIRECTORY, "data", "video")
 
+# The legacy MuseTalk flow reads/writes fixed paths inside MUSE_TALK_BASE
+MUSETALK_LOCK = threading.Lock()
+
 # Ensure necessary directories exist
 os.makedirs(LIVEVIDEODIR, exist_ok=True)
 os.makedirs(LIVEAVADIR, exist_ok=True)
@@ -77,21 +84,81 @@ class Result(BaseDoc):
 
 
 
-def convert_video_to_25fps(input_path):
+def run_streamed(command, cancel_event=None, on_line=None):
+    """
+    Run a command, echoing its output line by line.
+
+    Creation runs at lower CPU priority (video_processing.creation_nice) so that bursts of avatar
+    creation do not starve live sessions. When cancel_event is set the whole process group is killed.
+
+    Returns:
+        int: process return code (negative if killed)
+    """
+    niceness = get_config_value("video_processing.creation_nice", 10)
+    if niceness:
+        # nice(1) instead of preexec_fn: preexec_fn is not fork-safe in the threaded server
+        command = ["nice", "-n", str(niceness)] + list(command)
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        universal_newlines=True,
+        start_new_session=True
+    )
+    done = threading.Event()
+
+    def watch_cancel():
+        while not done.wait(0.5):
+            if cancel_event.is_set():
+                print(f"Cancelling process group {process.pid}")
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                return
+
+    if cancel_event is not None:
+        threading.Thread(target=watch_cancel, daemon=True).start()
+    try:
+        for line in process.stdout:
+            print(line.rstrip())  # Remove extra newline
+            if on_line is not None:
+                on_line(line)
+        return process.wait()
+    finally:
+        done.set()
+
+
+def probe_duration(video_path):
+    """Video duration in seconds via ffprobe (next to the configured ffmpeg), None if unknown"""
+    ffmpeg = get_config_value("paths.ffmpeg_path", '/usr/bin/ffmpeg')
+    ffprobe = os.path.join(os.path.dirname(ffmpeg), os.path.basename(ffmpeg).replace('ffmpeg', 'ffprobe'))
+    try:
+        result = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', video_path],
+            capture_output=True, text=True, check=True
+        )
+        return float(result.stdout.strip())
+    except Exception:
+        return None
+
+
+def convert_video_to_25fps(input_path, output_path=None, cancel_event=None):
     """
-    Convert video to 25fps and modify in place
+    Convert video to 25fps
     
     Args:
         input_path (str): input video file path
+        output_path (str): converted file path, defaults to data/video/temp.mp4
+        cancel_event (threading.Event): kills ffmpeg when set
     
     Returns:
         bool: whether conversion is successful
     """ 
-    temp_path = None
+    temp_path = output_path or os.path.join(LIVEVIDEODIR, "temp.mp4")
     try:
-        # Create temporary file path
-        temp_path = os.path.join(LIVEVIDEODIR, "temp.mp4")
-
         # Use ffmpeg to convert video to 25fps
         cmd = [
             get_config_value("paths.ffmpeg_path", '/usr/bin/ffmpeg'),
@@ -100,47 +167,48 @@ def convert_video_to_25fps(input_path):
             '-b:v', get_config_value("video_processing.bitrate", '3000k'),  # Set video bitrate
             '-c:v', get_config_value("video_processing.codec", 'libx264'),  # Video encoder
             '-y',  # Overwrite output file
+            '-v', 'error',
             temp_path
         ]
 
         # Execute command
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        returncode = run_streamed(cmd, cancel_event)
 
         # Check if successful
-        if result.returncode == 0:
+        if returncode == 0:
             print(f"Video conversion successful, temp file: {temp_path}")
             return True
         else:
-            print(f"FFmpeg error: {result.stderr}")
+            print(f"FFmpeg error, return code: {returncode}")
             return False
             
     except Exception as e:
         print(f"Error converting video: {str(e)}")
         return False
-    finally:
-        # Do not delete temp file regardless of success or failure, used by subsequent functions
-        pass
         
 
-def burr_video(input_path):
+def burr_video(input_path, tag=""):
     """
     Function to blur video
     
     Args:
         input_path (str): input video file path
+        tag (str): suffix for the files placed in the shared blur WORKSPACE, so concurrent jobs do not collide
     
     Returns:
         bool: whether blur processing is successful
     """
+    burr_input = f"burr_input{tag}.mp4"
+    burr_output = f"burr_output{tag}.mp4"
     try:
         # Copy input video to workspace
-        output_path = os.path.join(WORKSPACE, "burr_input.mp4")
+        output_path = os.path.join(WORKSPACE, burr_input)
         subprocess.run(["cp", input_path, output_path], check=True)
         print(f"Copied video file to workspace: {input_path} -> {output_path}")
         cli = Client(port=PORT)
         req = VideoBGTask(
-            input_video_path="burr_input.mp4",
-            output_video_path="burr_output.mp4",
+            input_video_path=burr_input,
+            output_video_path=burr_output,
             blur_background=True,
         )
         resp = cli.post(
@@ -152,7 +220,7 @@ def burr_video(input_path):
         # Check processing result
         if resp[0].result == "success":
             # Overwrite input video with output
-            burr_output_path = os.path.join(WORKSPACE, "burr_output.mp4")
+            burr_output_path = os.path.join(WORKSPACE, burr_output)
             subprocess.run(["cp", burr_output_path, input_path], check=True)
             print(f"Blur processing successful, original file overwritten: {input_path}")
             return True
@@ -167,8 +235,8 @@ def burr_video(input_path):
         return False
     finally:
         # Clean up temporary files in workspace
-        temp_input = os.path.join(WORKSPACE, "burr_input.mp4")
-        temp_output = os.path.join(WORKSPACE, "burr_output.mp4")
+        temp_input = os.path.join(WORKSPACE, burr_input)
+        temp_output = os.path.join(WORKSPACE, burr_output)
         for temp_file in [temp_input, temp_output]:
             if os.path.exists(temp_file):
                 try:
@@ -178,11 +246,12 @@ def burr_video(input_path):
                     print(f"Failed to delete temporary file {temp_file}: {e}")
         
 
-def start_avatar_creation_script(video_path):
+def start_avatar_creation_script(video_path, cancel_event=None):
     """
     Function to start avatar creation script
     Args:
         video_path (str): input video file path
+        cancel_event (threading.Event): kills the script when set
     
     Returns:
         bool: whether script started successfully
@@ -218,24 +287,12 @@ def start_avatar_creation_script(video_path):
             f"source {conda_init} && conda activate {conda_env} && cd {muse_talk_dir} && bash {script_path} v1.5 realtime"
         ]
         # Execute script in specified environment, display output in real time
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        # Print output to console in real time
-        for line in process.stdout:
-            print(line.rstrip())  # Remove extra newline
-        # Wait for process to finish
-        process.wait()
-        if process.returncode == 0:
+        returncode = run_streamed(command, cancel_event)
+        if returncode == 0:
             print("Script executed successfully")
             return True
         else:
-            print(f"Script execution failed, return code: {process.returncode}")
+            print(f"Script execution failed, return code: {returncode}")
             return False
     except Exception as e:
         print(f"Error occurred while executing script: {e}")
@@ -305,6 +362,89 @@ def move_avatar_files(source_dir, destination_dir, avatar_name):
         print(f"Failed to move folder: {e}")
         return False
 
+def stream_avatar_creation(video_path, avatar_name, burr=False, progress=None, cancel_event=None):
+    """
+    Single-pass avatar creation: musetalk/simple_musetalk.py decodes the upload once with ffmpeg
+    at 25fps, optionally blurs the background per frame in memory, and feeds the frames straight
+    into landmark extraction and frame/mask export. No intermediate video files are written.
+
+    The avatar is built in a hidden staging folder under LIVEAVADIR and only moved into place
+    when complete; a failed run leaves its checkpoint there so a retry resumes.
+
+    Args:
+        video_path (str): input video file path
+        avatar_name (str): avatar name
+        burr (bool): whether to blur the background
+        progress (callable): progress(stage, fraction) callback
+        cancel_event (threading.Event): kills the creation process when set
+
+    Returns:
+        bool: whether the avatar was created successfully
+    """
+    staging_dir = os.path.join(LIVEAVADIR, f".{avatar_name}.partial")
+    max_frames = get_config_value("video_processing.max_avatar_frames", 500)
+    target_avatar_dir = os.path.join(LIVEAVADIR, avatar_name)
+    conda_init = get_config_value("paths.conda_init", "/home/xinghua/workspace/share/conda/etc/profile.d/conda.sh")
+    conda_env = get_config_value("paths.muse_conda_env", "/workspace/share/yuntao/MuseTalk/home/chengxin/workspace/chengxin/conda/envs/MuseTalk")
+    script_args = [
+        "python", "musetalk/simple_musetalk.py",
+        "--file", os.path.abspath(video_path),
+        "--avatar_id", avatar_name,
+        "--output_dir", staging_dir,
+        "--fps", "25",
+        "--ffmpeg", get_config_value("paths.ffmpeg_path", "/usr/bin/ffmpeg"),
+        "--cut_frame", str(max_frames),
+        "--resume",
+    ]
+    if burr:
+        script_args.append("--blur")
+    command = [
+        "bash", "-c",
+        f"source {conda_init} && conda activate {conda_env} && cd {shlex.quote(WORKING_DIRECTORY)} && "
+        + " ".join(shlex.quote(arg) for arg in script_args)
+    ]
+    duration = probe_duration(video_path)
+    total_frames = int(duration * 25) if duration else 0
+    if max_frames > 0:
+        total_frames = min(total_frames, max_frames + 1) if total_frames else max_frames + 1
+
+    def on_line(line):
+        # simple_musetalk prints "progress <frames> frames" after every chunk
+        match = re.match(r"progress (\d+) frames", line)
+        if match and progress is not None and total_frames:
+            progress("extract", min(1.0, int(match.group(1)) / total_frames))
+
+    print("Starting streaming avatar creation...")
+    try:
+        returncode = run_streamed(command, cancel_event, on_line)
+        if returncode != 0:
+            print(f"Streaming avatar creation failed, return code: {returncode}")
+            return False
+
+        if os.path.exists(target_avatar_dir):
+            shutil.rmtree(target_avatar_dir)
+            print(f"Deleted existing target folder: {target_avatar_dir}")
+        os.replace(staging_dir, target_avatar_dir)
+
+        avator_info_path = os.path.join(target_avatar_dir, "avator_info.json")
+        with open(avator_info_path, 'r') as f:
+            avator_info = json.load(f)
+        # Keep a copy of the source video where avator_info.json points (the upload itself is
+        # deleted with the job workspace)
+        saved_video = os.path.join(LIVEVIDEODIR, f"{avatar_name}.mp4")
+        shutil.copyfile(video_path, saved_video)
+        print(f"Copied video file: {video_path} -> {saved_video}")
+        avator_info['avatar_id'] = avatar_name
+        avator_info['video_path'] = f"data/video/{avatar_name}.mp4"
+        with open(avator_info_path, 'w') as f:
+            json.dump(avator_info, f)
+        print(f"Avatar created: {target_avatar_dir}")
+        return True
+    except Exception as e:
+        print(f"Error occurred during streaming avatar creation: {e}")
+        return False
+
+
 def get_avatar_image(avatar_name):
     """
     Read image file of specified avatar
@@ -335,7 +475,7 @@ def get_avatar_image(avatar_name):
         return None
         
 
-def create_avatar(video_path, avatar_name, burr=False):
+def create_avatar(video_path, avatar_name, burr=False, workspace=None, progress=None, cancel_event=None):
     """
     Main function to create avatar
     
@@ -343,12 +483,26 @@ def create_avatar(video_path, avatar_name, burr=False):
         video_path (str): input video file path
         avatar_name (str): avatar name
         burr (bool): whether to apply blur processing
+        workspace (str): private directory for intermediate files (one per creation job);
+            defaults to the shared data/video folder
+        progress (callable): progress(stage, fraction) callback, stage in convert/blur/extract/move/done
+        cancel_event (threading.Event): abort between stages and kill running subprocesses when set
     
     Returns:
         str or False: image file path if successful, False if failed
     """
+    def report(stage, fraction=0.0):
+        if progress is not None:
+            progress(stage, fraction)
+
+    def cancelled():
+        if cancel_event is not None and cancel_event.is_set():
+            print(f"Avatar creation cancelled: {avatar_name}")
+            return True
+        return False
+
     # Check and create data/video folder
-    video_dir = LIVEVIDEODIR
+    video_dir = workspace or LIVEVIDEODIR
     if not os.path.exists(video_dir):
         try:
             os.makedirs(video_dir, exist_ok=True)
@@ -358,11 +512,27 @@ def create_avatar(video_path, avatar_name, burr=False):
             return False
     
     temp_video_path = os.path.join(video_dir, "temp.mp4")
+    tag = f"_{os.path.basename(os.path.normpath(workspace))}" if workspace else ""
+
+    if get_config_value("video_processing.streaming_ingest", False):
+        # Decode once, blur and extract in the same pass (no temp.mp4 / burr copies)
+        report("extract")
+        if not stream_avatar_creation(video_path, avatar_name, burr=burr, progress=progress, cancel_event=cancel_event):
+            print("Streaming avatar creation failed")
+            return False
+        image_path = get_avatar_image(avatar_name)
+        if image_path is None:
+            print("Failed to retrieve avatar image")
+            return False
+        report("done", 1.0)
+        print(f"Avatar creation completed, image path: {image_path}")
+        return image_path
     
     try:
         # 1. Convert video frame rate to 25fps
         print("Starting video frame rate conversion...")
-        if not convert_video_to_25fps(video_path):
+        report("convert")
+        if not convert_video_to_25fps(video_path, temp_video_path, cancel_event):
             print("Video frame rate conversion failed")
             return False
         print("Video frame rate conversion successful")
@@ -372,26 +542,33 @@ def create_avatar(video_path, avatar_name, burr=False):
         
         # 2. Optional blur processing
         if burr == True:
+            if cancelled():
+                return False
             print("Starting blur processing...")
-            burr_result = burr_video(current_video_path)
+            report("blur")
+            burr_result = burr_video(current_video_path, tag)
             if not burr_result:
                 print("Blur processing failed")
                 return False
             print("Blur processing successful")
         
-        # 3. Start avatar creation script
-        print("Starting avatar creation...")
-        if not start_avatar_creation_script(current_video_path):
-            print("Avatar creation script execution failed")
-            return False
-        print("Avatar creation script execution successful")
-        
-        # 4. Move avatar files
-        print("Starting avatar file movement...")
-        if not move_avatar_files(MUSERESDIR, LIVEAVADIR, avatar_name):
-            print("Avatar file movement failed")
-            return False
-        print("Avatar file movement successful")
+        # 3./4. MuseTalk works on fixed paths (yongen.mp4, avator_1), so only one job may use it at a time
+        with MUSETALK_LOCK:
+            if cancelled():
+                return False
+            print("Starting avatar creation...")
+            report("extract")
+            if not start_avatar_creation_script(current_video_path, cancel_event):
+                print("Avatar creation script execution failed")
+                return False
+            print("Avatar creation script execution successful")
+            
+            print("Starting avatar file movement...")
+            report("move")
+            if not move_avatar_files(MUSERESDIR, LIVEAVADIR, avatar_name):
+                print("Avatar file movement failed")
+                return False
+            print("Avatar file movement successful")
         
         # 5. Get avatar image
         print("Starting avatar image retrieval...")
@@ -400,6 +577,7 @@ def create_avatar(video_path, avatar_name, burr=False):
             print("Failed to retrieve avatar image")
             return False
         
+        report("done", 1.0)
         print(f"Avatar creation completed, image path: {image_path}")
         return image_path
         
@@ -0,0 +1,72 @@
+###############################################################################
+#  Copyright (C) 2024 LiveTalking@lipku https://github.com/lipku/LiveTalking
+#  email: lipku@foxmail.com
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+# 音频特征窗口切片：一个batch所有视频帧的窗口索引一次算好，一次gather得到连续的(B, W, ...)数组，
+# 取代逐帧逐索引的python循环 + np.concatenate/np.stack
+
+import numpy as np
+
+
+def window_indices(length, centers, left, right, clamp=True):
+    """每个中心点取[center-left, center+right)的索引，返回(B, left+right)
+
+    clamp=True时越界索引截断到[0, length-1]（复制边缘特征）；
+    clamp=False时原样返回，由调用方处理越界（如补零）
+    """
+    idx = np.asarray(centers, dtype=np.int64)[:, None] + np.arange(-left, right, dtype=np.int64)[None, :]
+    if clamp:
+        np.clip(idx, 0, length - 1, out=idx)
+    return idx
+
+
+def frame_centers(batch_size, start, fps, feat_fps=50):
+    """视频帧start..start+batch_size-1 在feat_fps特征序列上的中心索引（与int(vid_idx*50/fps)一致）"""
+    return ((np.arange(batch_size) + start) * feat_fps / fps).astype(np.int64)
+
+
+def sliced_windows(feature_array, batch_size, fps, left, right, start=0):
+    """一次gather取出batch_size个视频帧的特征窗口
+
+    :param feature_array: (T, ...) 特征序列（numpy或cpu tensor）
+    :return: (batch_size, left+right, ...) 连续数组
+    """
+    features = np.asarray(feature_array)
+    idx = window_indices(len(features), frame_centers(batch_size, start, fps), left, right)
+    return np.take(features, idx, axis=0)
+
+
+def padded_windows(feature_array, centers, left, right):
+    """窗口越界部分补零（lightreal.get_audio_features的语义），返回(B, left+right, ...)"""
+    features = np.asarray(feature_array)
+    length = len(features)
+    idx = window_indices(length, centers, left, right, clamp=False)
+    valid = (idx >= 0) & (idx < length)
+    out = np.take(features, np.clip(idx, 0, length - 1), axis=0)
+    out[~valid] = 0
+    return out
+
+
+def mel_windows(mel, num_chunks, left, step, width=16):
+    """wav2lip的mel切片：第i块从int(left + i*step)开始取width列，越过末尾时取最后width列
+
+    :param mel: (n_mels, T)
+    :return: (num_chunks, n_mels, width) 连续数组
+    """
+    starts = (left + np.arange(num_chunks) * step).astype(np.int64)
+    np.minimum(starts, mel.shape[1] - width, out=starts)
+    idx = starts[:, None] + np.arange(width, dtype=np.int64)[None, :]
+    return np.ascontiguousarray(np.take(mel, idx, axis=1).transpose(1, 0, 2))
@@ -0,0 +1,140 @@
+###############################################################################
+#  Copyright (C) 2024 LiveTalking@lipku https://github.com/lipku/LiveTalking
+#  email: lipku@foxmail.com
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+# --infer_mode process: 推理和贴回(compositing)放到独立进程里跑，避免和ASR、
+# process_frames、aiortc线程抢GIL。特征和结果帧走共享内存环形缓冲区。
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from shmring import ShmRing, SharedArray
+from logger import logger
+
+_shared_frames = {}  # (avatar路径, 名字) -> [SharedArray, 引用数]，同一进程内所有session共用一份
+
+
+def share_frames(frames, key):
+    """把avatar的帧列表放进共享内存（同一个key只放一次，引用数+1）；尺寸不一致的列表原样返回"""
+    if not frames or isinstance(frames, SharedArray):
+        return frames
+    entry = _shared_frames.get(key)
+    if entry is None:
+        if not isinstance(frames[0], np.ndarray) or any(f.shape != frames[0].shape for f in frames):
+            return frames
+        entry = _shared_frames[key] = [SharedArray(np.stack(frames)), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def release_frames(keys):
+    """share_frames的反操作：引用数归零时关闭并unlink共享内存"""
+    for key in keys:
+        entry = _shared_frames.get(key)
+        if entry is None:
+            continue
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _shared_frames[key]
+            entry[0].close()
+
+
+class FeatQueue:
+    """替代asr.feat_queue：每个batch的音频特征整体写入一个共享内存槽位"""
+
+    def __init__(self, maxsize, slot_bytes):
+        self._ring = ShmRing(maxsize, slot_bytes)
+
+    def put(self, chunks, block=True, timeout=None):
+        self._ring.put(np.asarray(chunks), block=block, timeout=timeout)
+
+    def get(self, block=True, timeout=None):
+        chunks, _ = self._ring.get(block, timeout)
+        return chunks
+
+    def qsize(self):
+        return self._ring.qsize()
+
+    def close(self):
+        self._ring.close()
+
+
+class FrameQueue:
+    """替代res_frame_queue：worker进程里先贴回整帧再写入共享内存，主进程取出的就是合成好的帧"""
+
+    STATS_EVERY = 50  # 每隔多少帧把worker里的降级统计带回主进程
+
+    def __init__(self, maxsize, slot_bytes):
+        self._ring = ShmRing(maxsize, slot_bytes)
+        self._compositor = None
+        self._degrade = None
+        self._count = 0
+        self.degrade_stats = None
+
+    def __getstate__(self):
+        return {'ring': self._ring}
+
+    def __setstate__(self, state):
+        self._ring = state['ring']
+        self._compositor = None
+        self._degrade = None
+        self._count = 0
+        self.degrade_stats = None
+
+    def bind_worker(self, compositor, degrade):
+        self._compositor = compositor
+        self._degrade = degrade
+
+    def put(self, item, block=True, timeout=None):
+        res_frame, idx, audio_frames = item
+        if res_frame is not None:
+            res_frame = self._compositor(res_frame, idx)
+        stats = None
+        self._count += 1
+        if self._degrade is not None and self._count % self.STATS_EVERY == 0:
+            stats = self._degrade.get_stats()
+        self._ring.put(res_frame, (idx, audio_frames, stats), block=block, timeout=timeout)
+
+    def get(self, block=True, timeout=None):
+        frame, (idx, audio_frames, stats) = self._ring.get(block, timeout)
+        if stats is not None:
+            self.degrade_stats = stats
+        return frame, idx, audio_frames
+
+    def qsize(self):
+        return self._ring.qsize()
+
+    def close(self):
+        self._ring.close()
+
+
+def infer_worker(real_cls, state, frame_queue, target, args):
+    """worker进程入口：用avatar静态数据构造贴回函数，然后跑原来的inference循环"""
+    from basereal import DegradeController
+    state = {k: (v.array if isinstance(v, SharedArray) else v) for k, v in state.items()}
+    avatar = SimpleNamespace(**state)
+
+    def compositor(res_frame, idx):
+        try:
+            return real_cls.paste_back_frame(avatar, res_frame, idx)
+        except Exception as e:
+            logger.warning(f"paste_back_frame error: {e}")
+            return avatar.frame_list_cycle[idx]
+
+    degrade = next((a for a in args if isinstance(a, DegradeController)), None)
+    frame_queue.bind_worker(compositor, degrade)
+    target(*args)
@@ -54,6 +54,7 @@ from transformers import Wav2Vec2Processor, HubertModel
 from torch.utils.data import DataLoader
 from ultralight.unet import Model
 from ultralight.audio2feature import Audio2Feature
+from featwindow import padded_windows
 from logger import logger
 
 device = "cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu")
@@ -102,22 +103,10 @@ def read_imgs(img_list):
     return frames
 
 def get_audio_features(features, index):
-    left = index - 8
-    right = index + 8
-    pad_left = 0
-    pad_right = 0
-    if left < 0:
-        pad_left = -left
-        left = 0
-    if right > features.shape[0]:
-        pad_right = right - features.shape[0]
-        right = features.shape[0]
-    auds = torch.from_numpy(features[left:right])
-    if pad_left > 0:
-        auds = torch.cat([torch.zeros_like(auds[:pad_left]), auds], dim=0)
-    if pad_right > 0:
-        auds = torch.cat([auds, torch.zeros_like(auds[:pad_right])], dim=0) # [8, 16]
-    return auds
+    # index可以是单个帧号或一组帧号，越界部分补零
+    if np.ndim(index) == 0:
+        return torch.from_numpy(padded_windows(features, [index], 8, 8)[0]) # [16, ...]
+    return torch.from_numpy(padded_windows(features, index, 8, 8)) # [B, 16, ...]
 
 
 def read_lms(lms_list):
@@ -145,7 +134,7 @@ def __mirror_index(size, index):
         return size - res - 1 
 
 
-def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_out_queue, res_frame_queue, model):
+def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_out_queue, res_frame_queue, model, degrade):
     length = len(face_list_cycle)
     index = 0
     count = 0
@@ -165,15 +154,19 @@ def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_o
             audio_frames.append((frame,type_,eventpoint))
             if type_==0:
                 is_all_silence=False
-        if is_all_silence:
+        infer_count = degrade.infer_count()
+        if is_all_silence or infer_count==0:
             for i in range(batch_size):
                 res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
+            if not is_all_silence:
+                degrade.observe(0,0)
         else:
             t = time.perf_counter()
+            step = batch_size//infer_count #降级时隔帧推理
             img_batch = []
 
-            for i in range(batch_size):
+            for i in range(0, batch_size, step):
                 idx = __mirror_index(length, index + i)
                 #face = face_list_cycle[idx]
                 crop_img = face_list_cycle[idx] #face[ymin:ymax, xmin:xmax]
@@ -192,8 +185,7 @@ def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_o
                 img_concat_T = torch.cat([img_real_ex_T, img_masked_T], axis=0)[None]
                 img_batch.append(img_concat_T)
 
-            reshaped_mel_batch = [arr.reshape(32, 32, 32) for arr in mel_batch]
-            mel_batch = torch.stack([torch.from_numpy(arr) for arr in reshaped_mel_batch])
+            mel_batch = torch.from_numpy(np.ascontiguousarray(mel_batch[::step]).reshape(-1, 32, 32, 32))
             img_batch = torch.stack(img_batch).squeeze(1)
 
 
@@ -201,15 +193,17 @@ def inference(quit_event, batch_size, face_list_cycle, audio_feat_queue, audio_o
                 pred = model(img_batch.cuda(),mel_batch.cuda())
             pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
 
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            degrade.observe(elapsed, len(pred))
+            counttime += elapsed
             count += batch_size
             if count >= 100:
                 logger.info(f"------actual avg infer fps:{count / counttime:.4f}")
                 count = 0
                 counttime = 0
-            for i,res_frame in enumerate(pred):
+            for i in range(batch_size):
                 #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
+                res_frame_queue.put((pred[i//step],__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
 
 #            for i, pred_frame in enumerate(pred):
@@ -244,6 +238,7 @@ class LightReal(BaseReal):
         #self.__warm_up()
         
         self.render_event = mp.Event()
+        self.init_infer_transport(32*1024*8,['frame_list_cycle','face_list_cycle','coord_list_cycle'])
     
     def __del__(self):
         logger.info(f'lightreal({self.sessionid}) delete')
@@ -270,8 +265,8 @@ class LightReal(BaseReal):
         self.init_customindex()
         process_thread = Thread(target=self.process_frames, args=(quit_event,loop,audio_track,video_track))
         process_thread.start()
-        Thread(target=inference, args=(quit_event,self.batch_size,self.face_list_cycle,self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.model,)).start()  #mp.Process
+        self.start_inference(inference, (quit_event,self.batch_size,self.face_list_cycle,self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
+                                           self.model,self.degrade), quit_event)
         
 
         #self.render_event.set() #start infer process render
@@ -296,6 +291,7 @@ class LightReal(BaseReal):
             # if delay > 0:
             #     time.sleep(delay)
         #self.render_event.clear() #end infer process render
+        self.stop_inference(process_thread)
         logger.info('lightreal thread stop')
             
 
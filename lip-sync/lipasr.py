@@ -15,6 +15,7 @@
 #  limitations under the License.
 ###############################################################################
 
+import math
 import time
 import torch
 import numpy as np
@@ -25,6 +26,7 @@ from queue import Queue
 
 from baseasr import BaseASR
 from wav2lip import audio
+from featwindow import mel_windows
 
 class LipASR(BaseASR):
 
@@ -48,16 +50,8 @@ class LipASR(BaseASR):
         right = min(len(mel[0]), len(mel[0]) - self.stride_right_size*80/50)
         mel_idx_multiplier = 80.*2/self.fps 
         mel_step_size = 16
-        i = 0
-        mel_chunks = []
-        while i < (len(self.frames)-self.stride_left_size-self.stride_right_size)/2:
-            start_idx = int(left + i * mel_idx_multiplier)
-            #print(start_idx)
-            if start_idx + mel_step_size > len(mel[0]):
-                mel_chunks.append(mel[:, len(mel[0]) - mel_step_size:])
-            else:
-                mel_chunks.append(mel[:, start_idx : start_idx + mel_step_size])
-            i += 1
+        num_chunks = math.ceil((len(self.frames)-self.stride_left_size-self.stride_right_size)/2)
+        mel_chunks = mel_windows(mel, num_chunks, left, mel_idx_multiplier, mel_step_size) # [B, 80, 16]
         self.feat_queue.put(mel_chunks)
         
         # discard the old part to save memory
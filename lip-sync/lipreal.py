@@ -111,7 +111,7 @@ def __mirror_index(size, index):
     else:
         return size - res - 1 
 
-def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,model):
+def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,model,degrade):
     
     #model = load_model("./models/wav2lip.pth")
     # input_face_list = glob.glob(os.path.join(face_imgs_path, '*.[jpJP][pnPN]*[gG]'))
@@ -140,43 +140,48 @@ def inference(quit_event,batch_size,face_list_cycle,audio_feat_queue,audio_out_q
             if type==0:
                 is_all_silence=False
 
-        if is_all_silence:
+        infer_count = degrade.infer_count()
+        if is_all_silence or infer_count==0:
             for i in range(batch_size):
                 res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
+            if not is_all_silence:
+                degrade.observe(0,0)
         else:
             # print('infer=======')
             t=time.perf_counter()
+            step = batch_size//infer_count #降级时隔帧推理
             img_batch = []
-            for i in range(batch_size):
+            for i in range(0,batch_size,step):
                 idx = __mirror_index(length,index+i)
                 face = face_list_cycle[idx]
                 img_batch.append(face)
-            img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+            img_batch = np.asarray(img_batch)
 
             img_masked = img_batch.copy()
             img_masked[:, face.shape[0]//2:] = 0
 
             img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
-            mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
             
             img_batch = torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(device)
-            mel_batch = torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(device)
+            mel_batch = torch.from_numpy(np.ascontiguousarray(mel_batch[::step], dtype=np.float32)[:, None]).to(device) # [B, 1, 80, 16]
 
             with torch.no_grad():
                 pred = model(mel_batch, img_batch)
             pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
 
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            degrade.observe(elapsed,len(pred))
+            counttime += elapsed
             count += batch_size
             #_totalframe += 1
             if count>=100:
                 logger.info(f"------actual avg infer fps:{count/counttime:.4f}")
                 count=0
                 counttime=0
-            for i,res_frame in enumerate(pred):
+            for i in range(batch_size):
                 #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
+                res_frame_queue.put((pred[i//step],__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
             #print('total batch time:',time.perf_counter()-starttime)            
     logger.info('lipreal inference processor stop')
@@ -202,6 +207,7 @@ class LipReal(BaseReal):
         self.asr.warm_up()
         
         self.render_event = mp.Event()
+        self.init_infer_transport(80*16*8,['frame_list_cycle','coord_list_cycle'])
     
     def __del__(self):
         logger.info(f'lipreal({self.sessionid}) delete')
@@ -226,9 +232,9 @@ class LipReal(BaseReal):
         process_thread = Thread(target=self.process_frames, args=(quit_event,loop,audio_track,video_track))
         process_thread.start()
 
-        Thread(target=inference, args=(quit_event,self.batch_size,self.face_list_cycle,
+        self.start_inference(inference, (quit_event,self.batch_size,self.face_list_cycle,
                                            self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.model,)).start()  #mp.Process
+                                           self.model,self.degrade), quit_event)
 
         #self.render_event.set() #start infer process render
         count=0
@@ -252,5 +258,6 @@ class LipReal(BaseReal):
             # if delay > 0:
             #     time.sleep(delay)
         #self.render_event.clear() #end infer process render
+        self.stop_inference(process_thread)
         logger.info('lipreal thread stop')
             
\ No newline at end of file
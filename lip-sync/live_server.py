@@ -5,12 +5,14 @@ import os
 import json
 import time
 import uvicorn
-import tempfile
 import shutil
 import threading
+import asyncio
+from datetime import datetime
 
 # Import create_avatar related functions
 from create_avatar import create_avatar
+from avatar_jobs import AvatarJobQueue, QueueFullError, DuplicateJobError, SUCCEEDED, CANCELLED
 
 # Global configuration variable
 CONFIG = {}
@@ -50,6 +52,95 @@ def get_config_value(key_path, default=None):
 
 app = FastAPI()
 
+job_queue = None  # AvatarJobQueue, created on startup
+
+
+def save_avatar_config(name, metadata):
+    """Write config.json for a new avatar and register it in index.json"""
+    avatar_dir = os.path.join(os.path.dirname(__file__), "data", "avatars", name)
+    config_path = os.path.join(avatar_dir, "config.json")
+    
+    # 创建配置信息
+    config_data = {
+        "avatar_id": name,
+        "video_path": f"data/video/{name}.mp4",
+        "created_at": datetime.now().isoformat(),
+        "tts_model": metadata["tts_model"],
+        "timbre": metadata["timbre"],
+        "avatar_model": metadata["avatar_model"],
+        "description": metadata["description"],
+        "support_clone": metadata["support_clone"],
+        "avatar_blur": metadata["avatar_blur"]
+    }
+    
+    # 保存配置文件
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config_data, f, indent=2, ensure_ascii=False)
+    print(f"Saved avatar config to: {config_path}")
+    
+    # 更新index.json
+    index_path = os.path.join(os.path.dirname(__file__), "data", "avatars", "index.json")
+    
+    # 读取现有的index.json
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index_data = json.load(f)
+    else:
+        index_data = []
+    
+    # 如果不存在，添加新条目
+    if not any(item.get("id") == name for item in index_data):
+        index_data.append({
+            "id": name,
+            "name": name.replace("_", " ").title(),
+            "ref": f"{name}/full_imgs/00000000.png"
+        })
+        
+        # 保存更新后的index.json
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index_data, f, indent=2, ensure_ascii=False)
+        print(f"Updated index.json with new avatar: {name}")
+
+
+def run_avatar_job(job):
+    """Job runner: create the avatar in the job's workspace, then write its config and prompt voice"""
+    result = create_avatar(
+        job.video_path, job.avatar_name, burr=job.burr, workspace=job.workspace,
+        progress=lambda stage, fraction: job_queue.update(job, stage, fraction),
+        cancel_event=job.cancel_event
+    )
+    if not result:
+        raise RuntimeError("Failed to create avatar - check video file format and content")
+
+    if job.metadata:
+        job_queue.update(job, "finalize")
+        try:
+            save_avatar_config(job.avatar_name, job.metadata)
+        except Exception as save_err:
+            print(f"[ERROR] Failed to save avatar config: {save_err}")
+        voice_filename = job.metadata.get("voice_filename")
+        if voice_filename:
+            try:
+                avatar_dir = os.path.join(os.path.dirname(__file__), "data", "avatars", job.avatar_name)
+                shutil.copyfile(os.path.join(job.workspace, voice_filename), os.path.join(avatar_dir, voice_filename))
+                print(f"Saved prompt voice to: {os.path.join(avatar_dir, voice_filename)}")
+            except Exception as voice_err:
+                print(f"[WARN] Failed to save prompt voice: {voice_err}")
+    return result
+
+
+def submit_job(job_id, workspace, avatar_name, video_path, burr, metadata=None):
+    """Queue a creation job, mapping queue errors to HTTP errors (workspace is removed on rejection)"""
+    try:
+        return job_queue.submit(job_id, avatar_name, video_path, burr, metadata)
+    except QueueFullError as e:
+        shutil.rmtree(workspace, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=str(e))
+    except DuplicateJobError as e:
+        shutil.rmtree(workspace, ignore_errors=True)
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 @app.post("/switch_avatar")
 def switch_avatar(
     avatar_id: str = Query(..., description="Avatar ID, e.g., avator_1"),
@@ -259,7 +350,8 @@ def monitor_process_output(process, avatar_id, listenport):
 def api_create_avatar_from_path(
     avatar_name: str = Query(..., description="Avatar name, e.g., avatar_1"),
     video_path: str = Query(..., description="Video file path"),
-    burr: bool = Query(False, description="Whether to apply blur processing")
+    burr: bool = Query(False, description="Whether to apply blur processing"),
+    wait: bool = Query(True, description="Wait for the creation job to finish; false returns the job id immediately")
 ):
     """
     Create avatar from a video file at specified path
@@ -268,6 +360,7 @@ def api_create_avatar_from_path(
         avatar_name: avatar name
         video_path: complete path to video file
         burr: whether to apply blur processing
+        wait: block until the job finishes (default) or return the queued job id
     
     Returns:
         Returns image path on success, error message on failure
@@ -291,22 +384,31 @@ def api_create_avatar_from_path(
                 detail="Unsupported video format, please use .mp4, .avi, .mov or .mkv files"
             )
         
-        # Call create_avatar function
-        result = create_avatar(video_path, avatar_name, burr=burr)
+        # Copy the video into the job's own workspace and queue the job
+        job_id, workspace = job_queue.new_workspace()
+        job_video_path = os.path.join(workspace, "input" + os.path.splitext(video_path)[1])
+        shutil.copyfile(video_path, job_video_path)
+        job = submit_job(job_id, workspace, avatar_name, job_video_path, burr)
+        if not wait:
+            return {"status": "queued", "message": "Avatar creation queued", **job_queue.status(job_id)}
+
+        result = job.future.result()
         
-        if result:
+        if job.status == SUCCEEDED:
             print(f"Avatar created successfully: {avatar_name}")
             print(f"Image path: {result}")
             return {
                 "status": "success",
                 "message": "Avatar created successfully",
-                "image_path": result
+                "image_path": result,
+                "job_id": job_id
             }
         else:
             print(f"Avatar creation failed: {avatar_name}")
             return {
                 "status": "error",
-                "message": f"Failed to create avatar {avatar_name}, please check input file and parameters"
+                "message": f"Failed to create avatar {avatar_name}, please check input file and parameters",
+                "job_id": job_id
             }
             
     except HTTPException:
@@ -401,6 +503,8 @@ def get_avatars():
     avatar_dict = {}
     for name in os.listdir(base):
         avatar_path = os.path.join(base, name)
+        if name.startswith("."):  # staging folders of avatars still being created
+            continue
         if os.path.isdir(avatar_path):
             # 读取avatar配置文件
             config_path = os.path.join(avatar_path, "config.json")
@@ -472,131 +576,98 @@ async def avatar_add(
     timbre: str = Form(""),
     tts_model: str = Form(""),
     avatar_model: str = Form(""),
-    description: str = Form("")
+    description: str = Form(""),
+    wait: str = Form("true")
 ):
-    """Avatar creation endpoint - handles file upload"""
-    import tempfile
-    from datetime import datetime
-    
+    """
+    Avatar creation endpoint - handles file upload.
+
+    The upload is stored in a private job workspace and queued. With wait=true (default) the
+    response is sent when the job finishes, as before; with wait=false the job id is returned
+    immediately and /avatar/jobs/{job_id} reports progress.
+    """
+    # 校验格式
+    video_suffix = os.path.splitext(prompt_face.filename)[1].lower() or ".mp4"
+    if video_suffix not in ('.mp4', '.avi', '.mov', '.mkv'):
+        raise HTTPException(status_code=400, detail="Unsupported video format.")
+
+    job_id, workspace = job_queue.new_workspace()
     try:
-        # 临时保存视频文件
-        video_suffix = os.path.splitext(prompt_face.filename)[1] or ".mp4"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=video_suffix) as tmp_vid:
-            video_content = await prompt_face.read()
-            if len(video_content) == 0:
-                raise HTTPException(status_code=400, detail="Empty video file uploaded")
-            tmp_vid.write(video_content)
-            video_path = tmp_vid.name
-        
-        # 检查文件大小
+        # 视频直接分块写入任务目录，不整体读进内存
+        video_path = os.path.join(workspace, "input" + video_suffix)
+        with open(video_path, "wb") as f:
+            while chunk := await prompt_face.read(1 << 20):
+                f.write(chunk)
         file_size = os.path.getsize(video_path)
         print(f"Received video file: {prompt_face.filename}, size: {file_size} bytes, saved to {video_path}")
-        
         if file_size == 0:
-            raise HTTPException(status_code=400, detail="Empty video file")
+            raise HTTPException(status_code=400, detail="Empty video file uploaded")
 
-        # 校验格式
-        if not video_path.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
-            raise HTTPException(status_code=400, detail="Unsupported video format.")
+        # 语音文件也先放在任务目录，创建成功后再拷到avatar目录
+        voice_filename = None
+        if prompt_voice and prompt_voice.filename:
+            voice_content = await prompt_voice.read()
+            if len(voice_content) > 0:
+                voice_filename = f"prompt_voice{os.path.splitext(prompt_voice.filename)[1]}"
+                with open(os.path.join(workspace, voice_filename), 'wb') as f:
+                    f.write(voice_content)
 
-        # 调用 create_avatar 函数
-        print(f"Starting avatar creation for: {name}")
         burr = (avatar_blur.lower() == "true")
-        result = create_avatar(video_path, name, burr=burr)
-
-        if result:
-            print(f"Avatar created successfully: {result}")
-            
-            # 使用后台任务保存配置信息，避免阻塞和崩溃
-            def save_avatar_config():
-                try:
-                    avatar_dir = os.path.join(os.path.dirname(__file__), "data", "avatars", name)
-                    config_path = os.path.join(avatar_dir, "config.json")
-                    
-                    # 创建配置信息
-                    config_data = {
-                        "avatar_id": name,
-                        "video_path": f"data/video/{name}.mp4",
-                        "created_at": datetime.now().isoformat(),
-                        "tts_model": tts_model if tts_model else "edgeTTS",
-                        "timbre": timbre if timbre else "Default",
-                        "avatar_model": avatar_model if avatar_model else "musetalk",
-                        "description": description if description else "",
-                        "support_clone": support_clone.lower() == "true",
-                        "avatar_blur": burr
-                    }
-                    
-                    # 保存配置文件
-                    with open(config_path, 'w', encoding='utf-8') as f:
-                        json.dump(config_data, f, indent=2, ensure_ascii=False)
-                    print(f"Saved avatar config to: {config_path}")
-                    
-                    # 更新index.json
-                    index_path = os.path.join(os.path.dirname(__file__), "data", "avatars", "index.json")
-                    
-                    # 读取现有的index.json
-                    if os.path.exists(index_path):
-                        with open(index_path, 'r', encoding='utf-8') as f:
-                            index_data = json.load(f)
-                    else:
-                        index_data = []
-                    
-                    # 检查是否已存在该avatar
-                    avatar_exists = False
-                    for item in index_data:
-                        if item.get("id") == name:
-                            avatar_exists = True
-                            break
-                    
-                    # 如果不存在，添加新条目
-                    if not avatar_exists:
-                        index_data.append({
-                            "id": name,
-                            "name": name.replace("_", " ").title(),
-                            "ref": f"{name}/full_imgs/00000000.png"
-                        })
-                        
-                        # 保存更新后的index.json
-                        with open(index_path, 'w', encoding='utf-8') as f:
-                            json.dump(index_data, f, indent=2, ensure_ascii=False)
-                        print(f"Updated index.json with new avatar: {name}")
-                        
-                except Exception as save_err:
-                    print(f"[ERROR] Failed to save avatar config: {save_err}")
-            
-            # 在后台线程中保存配置，不阻塞响应
-            threading.Thread(target=save_avatar_config, daemon=True).start()
-            
-            # 如果有语音文件，也保存它
-            if prompt_voice and prompt_voice.filename:
-                try:
-                    voice_content = await prompt_voice.read()
-                    if len(voice_content) > 0:
-                        avatar_dir = os.path.join(os.path.dirname(__file__), "data", "avatars", name)
-                        voice_filename = f"prompt_voice{os.path.splitext(prompt_voice.filename)[1]}"
-                        voice_path = os.path.join(avatar_dir, voice_filename)
-                        with open(voice_path, 'wb') as f:
-                            f.write(voice_content)
-                        print(f"Saved prompt voice to: {voice_path}")
-                except Exception as voice_err:
-                    print(f"[WARN] Failed to save prompt voice: {voice_err}")
-            
-            return {"status": "success", "message": "Avatar created", "image_path": result}
-        else:
-            print(f"Avatar creation failed for: {name}")
-            raise HTTPException(status_code=500, detail="Failed to create avatar - check video file format and content")
-
+        metadata = {
+            "tts_model": tts_model if tts_model else "edgeTTS",
+            "timbre": timbre if timbre else "Default",
+            "avatar_model": avatar_model if avatar_model else "musetalk",
+            "description": description if description else "",
+            "support_clone": support_clone.lower() == "true",
+            "avatar_blur": burr,
+            "voice_filename": voice_filename
+        }
+        print(f"Starting avatar creation for: {name}")
+        job = submit_job(job_id, workspace, name, video_path, burr, metadata)
     except HTTPException:
+        shutil.rmtree(workspace, ignore_errors=True)
         raise
     except Exception as e:
+        shutil.rmtree(workspace, ignore_errors=True)
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # 清理临时文件
-        try:
-            if 'video_path' in locals() and os.path.exists(video_path):
-                os.remove(video_path)
-        except Exception as cleanup_err:
-            print(f"[WARN] cleanup failed: {cleanup_err}")
+
+    if wait.lower() != "true":
+        return {"status": "queued", "message": "Avatar creation queued", **job_queue.status(job_id)}
+
+    # 等待任务完成时不占用事件循环，其他接口照常响应
+    result = await asyncio.wrap_future(job.future)
+    if job.status == SUCCEEDED:
+        print(f"Avatar created successfully: {result}")
+        return {"status": "success", "message": "Avatar created", "image_path": result, "job_id": job_id}
+    if job.status == CANCELLED:
+        raise HTTPException(status_code=409, detail="Avatar creation cancelled")
+    print(f"Avatar creation failed for: {name}")
+    raise HTTPException(status_code=500, detail=job.message or "Failed to create avatar - check video file format and content")
+
+
+@app.get("/avatar/jobs")
+def avatar_jobs():
+    """List avatar creation jobs, newest first"""
+    return {"status": "success", "jobs": job_queue.list()}
+
+
+@app.get("/avatar/jobs/{job_id}")
+def avatar_job_status(job_id: str):
+    """Status, current stage and progress (0-1) of one avatar creation job"""
+    info = job_queue.status(job_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return {"status": "success", "job": info}
+
+
+@app.post("/avatar/jobs/{job_id}/cancel")
+def avatar_job_cancel(job_id: str):
+    """Cancel a queued or running avatar creation job"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return {"status": "success", "job": job_queue.status(job_id)}
+
 
 @app.post("/avatar/delete")
 def avatar_delete(name: str = Form(...)):
@@ -620,9 +691,19 @@ def get_tts_models():
 
 @app.on_event("startup")
 async def startup_event():
-    """Load configuration when application starts"""
+    """Load configuration and start the avatar creation workers when application starts"""
+    global job_queue
     if not load_config():
         print("Warning: Configuration file loading failed, default values will be used")
+    job_queue = AvatarJobQueue(
+        os.path.join(os.path.dirname(__file__), "data", "avatar_jobs"),
+        run_avatar_job,
+        workers=get_config_value("avatar_jobs.workers", 1),
+        max_pending=get_config_value("avatar_jobs.max_pending", 8),
+        keep_days=get_config_value("avatar_jobs.keep_days", 7),
+        max_finished=get_config_value("avatar_jobs.max_finished", 200)
+    )
+    job_queue.start()
 
 if __name__ == "__main__":
     # Load configuration before startup
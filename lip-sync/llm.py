@@ -1,146 +1,167 @@
-import time
+import asyncio
+import json
 import os
-from basereal import BaseReal
-from logger import logger
-import requests
 import random
 import re
+import sys
+import time
+from typing import List, Optional
+
+import aiohttp
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from basereal import BaseReal
+
+from logger import logger
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.ports_config import get_llm_url
+
+PUNCTS = ",.!;:，。！？：；\n"
+LLM_USER_ID = 'lip-sync'
+# 首token可能要等检索/重排，只限制连接和两次读之间的间隔，不限制整段回答的时长
+LLM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=30)
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+class SentenceSplitter:
+    """
+    增量分句：按字符扫描，遇句末标点时输出；保证每句 ≥ min_len 字符，不足的和后面的文字拼在一起
+    """
+
+    def __init__(self, min_len: int = 10, puncts: str = PUNCTS):
+        self.min_len = min_len
+        self.puncts = puncts
+        self.buffer = []  # 暂存当前正在累积的句子
+
+    def feed(self, text: str) -> List[str]:
+        sentences = []
+        for ch in text:
+            self.buffer.append(ch)
+            # 如果是句末标点，尝试输出
+            if ch in self.puncts:
+                sentence = ''.join(self.buffer).strip()
+                self.buffer.clear()
+                if len(sentence) >= self.min_len:
+                    sentences.append(sentence)
+                else:
+                    # 不足 min_len，先压回 buffer，等待后续字符补齐
+                    self.buffer.extend(sentence)
+        return sentences
+
+    def flush(self) -> str:
+        """剩余的文字（回答结束时输出）"""
+        tail = ''.join(self.buffer).strip()
+        self.buffer.clear()
+        return tail
+
+
+class SseParser:
+    """text/event-stream 增量解析：每个事件的 data: 行拼起来按JSON解析"""
+
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, data: bytes) -> List[dict]:
+        self.buffer += data
+        events = []
+        while True:
+            self.buffer = self.buffer.replace(b'\r\n', b'\n')
+            end = self.buffer.find(b'\n\n')
+            if end < 0:
+                break
+            block, self.buffer = self.buffer[:end], self.buffer[end + 2:]
+            payload = b'\n'.join(line[5:].lstrip() for line in block.split(b'\n') if line.startswith(b'data:'))
+            if payload:
+                try:
+                    events.append(json.loads(payload))
+                except ValueError:
+                    logger.warning(f"llm: skipped malformed SSE event {payload[:100]!r}")
+        return events
+
+
+def clean_text(text: str) -> str:
+    """去掉TTS会念出来的markdown符号和引号"""
+    return re.sub(r'[\*\'\"]', '', text)
+
 
 def dispatch_text(response_text: str, nerfreal, min_len: int = 10):
     """
-    按字符扫描，遇句末标点立即输出；保证每句 ≥ min_len 字符
+    整段文字按句子交给TTS（规则见SentenceSplitter）
     """
-    puncts = ",.!;:，。！？：；\n"
-    buffer = []                     # 暂存当前正在累积的句子
-    first  = True
-    start  = time.perf_counter()
-
-    for ch in response_text:
-        # 记录首字符耗时
-        if first:
-            logger.info(f"llm Time to first char: {time.perf_counter() - start:.4f}s")
-            first = False
-
-        buffer.append(ch)
-
-        # 如果是句末标点，尝试输出
-        if ch in puncts:
-            sentence = ''.join(buffer).strip()
-            buffer.clear()
-
-            if len(sentence) >= min_len:
-                logger.info(sentence)
-                nerfreal.put_msg_txt(sentence)
-            else:
-                # 不足 min_len，先压回 buffer，等待后续字符补齐
-                buffer.extend(sentence)
-
-    # 扫描完毕，还有剩余
-    tail = ''.join(buffer).strip()
+    splitter = SentenceSplitter(min_len)
+    for sentence in splitter.feed(response_text):
+        logger.info(sentence)
+        nerfreal.put_msg_txt(sentence)
+    tail = splitter.flush()
     if tail:
         nerfreal.put_msg_txt(tail)
 
-    logger.info(f"llm Time to last char: {time.perf_counter() - start:.4f}s")
-
-
-
-def llm_response(message,nerfreal:BaseReal):
-    # start = time.perf_counter()
-    # from openai import OpenAI
-    # client = OpenAI(
-    #     # 如果您没有配置环境变量，请在此处用您的API Key进行替换
-    #     api_key=os.getenv("DASHSCOPE_API_KEY"),
-    #     # 填写DashScope SDK的base_url
-    #     base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    # )
-    # end = time.perf_counter()
-    # logger.info(f"llm Time init: {end-start}s")
-    # completion = client.chat.completions.create(
-    #     model="qwen-plus",
-    #     messages=[{'role': 'system', 'content': 'You are a helpful assistant.'},
-    #               {'role': 'user', 'content': message}],
-    #     stream=True,
-    #     # 通过以下设置，在流式输出的最后一行展示token使用信息
-    #     stream_options={"include_usage": True}
-    # )
-
-    # result=""
-    # first = True
-    # for chunk in completion:
-    #     if len(chunk.choices)>0:
-    #         #print(chunk.choices[0].delta.content)
-    #         if first:
-    #             end = time.perf_counter()
-    #             logger.info(f"llm Time to first chunk: {end-start}s")
-    #             first = False
-    #         msg = chunk.choices[0].delta.content
-    #         lastpos=0
-    #         #msglist = re.split('[,.!;:，。！?]',msg)
-    #         for i, char in enumerate(msg):
-    #             if char in ",.!;:，。！？：；" :
-    #                 result = result+msg[lastpos:i+1]
-    #                 lastpos = i+1
-    #                 if len(result)>10:
-    #                     logger.info(result)
-    #                     nerfreal.put_msg_txt(result)
-    #                     result=""
-    #         result = result+msg[lastpos:]
-    # end = time.perf_counter()
-    # logger.info(f"llm Time to last chunk: {end-start}s")
-    # nerfreal.put_msg_txt(result)  
-
-
-    response_data={}
-
-    session_id =  random.randint(100000, 999999)
+
+def _get_session() -> aiohttp.ClientSession:
+    """各会话共用的连接池，在aiohttp的事件循环里创建"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=LLM_TIMEOUT)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
 
 
+async def llm_response(message, nerfreal: 'BaseReal', min_len: int = 20):
+    """
+    在aiohttp事件循环上读取LLM服务 /chat/stream 的SSE token流，每凑够一句（标点 + min_len）就交给TTS，
+    不等整段回答生成完。interrupt时调用方cancel这个任务：连接随之断开，不再有新的句子进入TTS队列。
+    """
+    url = (getattr(nerfreal.opt, 'LLM_SERVER', None) or get_llm_url()).rstrip('/') + '/chat/stream'
+    payload = {'user_id': LLM_USER_ID, 'session_id': str(random.randint(100000, 999999)), 'input': message}
+    splitter = SentenceSplitter(min_len)
+    start = time.perf_counter()
+    first_token = None
+    spoken = 0
+
     try:
-        ask_response = requests.post(
-            "http://127.0.0.1:8100/ask",
-            json={"question": message,"session_id":session_id},
-            timeout=10,
-            
-        )
-        ask_response.raise_for_status()
-        response_data["text_output"] = ask_response.json().get("answer", "No answer")
-        # response_data["text_output"] = ask_response.json()
+        async with _get_session().post(url, json=payload) as response:
+            response.raise_for_status()
+            parser = SseParser()
+            finished = False
+            async for data in response.content.iter_any():
+                for event in parser.feed(data):
+                    status = event.get('status')
+                    if status == 'error':
+                        raise RuntimeError(event.get('error'))
+                    if status == 'finished':
+                        finished = True
+                        break
+                    text = event.get('chunk') or ''
+                    if text and first_token is None:
+                        first_token = time.perf_counter() - start
+                        logger.info(f"llm Time to first token: {first_token:.4f}s")
+                    for sentence in splitter.feed(clean_text(text)):
+                        if spoken == 0:
+                            logger.info(f"llm Time to first sentence: {time.perf_counter() - start:.4f}s")
+                        logger.info(sentence)
+                        nerfreal.put_msg_txt(sentence)
+                        spoken += 1
+                if finished:
+                    break
+    except asyncio.CancelledError:
+        logger.info(f"llm response cancelled after {spoken} sentences ({time.perf_counter() - start:.2f}s)")
+        raise
     except Exception as e:
-        response_data["text_output"] = f"Error contacting /ask endpoint: {e}"
-
-    response_text = response_data["text_output"]
-
-    response_text=re.sub(r'[\*\'\"]','',response_text)
-    
-    dispatch_text(response_text,nerfreal,20)
-    # result = ""
-    # first = True
-    # start = time.perf_counter()
-
-    # words = response_text.split()
-    # chunk_size = 5
-    # puncts = ",.!;:，。！？：；"
-
-
-    # for i in range(0, len(words), chunk_size):
-    #     chunk = " ".join(words[i:i + chunk_size])
-
-    #     if first:
-    #         logger.info(f"llm Time to first chunk: {time.perf_counter() - start:.4f}s")
-    #         first = False
-
-    #     lastpos = 0
-    #     for j, char in enumerate(chunk):
-    #         if char in puncts:
-    #             result += chunk[lastpos:j + 1]
-    #             lastpos = j + 1
-    #             if len(result) > 10:
-    #                 logger.info(result)
-    #                 nerfreal.put_msg_txt(result)
-    #                 result = ""
-    #     result += chunk[lastpos:]
-
-    # logger.info(f"llm Time to last chunk: {time.perf_counter() - start:.4f}s")
-    # if result:
-    #     nerfreal.put_msg_txt(result)
-  
+        logger.error(f"llm stream from {url} failed: {e}")
+        if spoken == 0:
+            nerfreal.put_msg_txt(f"Error contacting LLM service: {e}")
+            return
+
+    tail = splitter.flush()
+    if tail:
+        nerfreal.put_msg_txt(tail)
+    logger.info(f"llm Time to last char: {time.perf_counter() - start:.4f}s ({spoken + bool(tail)} sentences)")
@@ -48,10 +48,11 @@ from basereal import BaseReal
 from tqdm import tqdm
 from logger import logger
 
+device = torch.device("cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu"))
+
 def load_model():
     # load model weights
     audio_processor,vae, unet, pe = load_all_model()
-    device = torch.device("cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu"))
     timesteps = torch.tensor([0], device=device)
     
     # Convert models to half precision (float16) to reduce memory usage
@@ -65,7 +66,18 @@ def load_model():
     #unet.model.share_memory()
     return vae, unet, pe, timesteps, audio_processor
 
-def load_avatar(avatar_id):
+def stack_latents(input_latent_list_cycle, batch_size):
+    # latent cycle是静态的：堆成一个常驻推理设备的half张量，batch组装只需一次index_select
+    input_latent_cycle = torch.cat(input_latent_list_cycle, dim=0).to(device=device, dtype=torch.float16)
+    length = input_latent_cycle.shape[0]
+    # 镜像循环索引表 0..N-1,N-1..0 周期2N，后面多接batch_size个，取batch时直接切片不用取模
+    forward = torch.arange(length, device=device)
+    period = torch.cat([forward, forward.flip(0)])
+    repeats = (2*length + batch_size) // (2*length) + 1
+    mirror_table = period.repeat(repeats)[:2*length + batch_size]
+    return input_latent_cycle, mirror_table
+
+def load_avatar(avatar_id, batch_size=16):
     #self.video_path = '' #video_path
     #self.bbox_shift = opt.bbox_shift
     avatar_path = f"./data/avatars/{avatar_id}"
@@ -93,7 +105,8 @@ def load_avatar(avatar_id):
     input_mask_list = glob.glob(os.path.join(mask_out_path, '*.[jpJP][pnPN]*[gG]'))
     input_mask_list = sorted(input_mask_list, key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
     mask_list_cycle = read_imgs(input_mask_list)
-    return frame_list_cycle,mask_list_cycle,coord_list_cycle,mask_coords_list_cycle,input_latent_list_cycle
+    input_latent_cycle, mirror_table = stack_latents(input_latent_list_cycle, batch_size)
+    return frame_list_cycle,mask_list_cycle,coord_list_cycle,mask_coords_list_cycle,input_latent_cycle,mirror_table
 
 @torch.no_grad()
 def warm_up(batch_size,model):
@@ -132,8 +145,8 @@ def __mirror_index(size, index):
         return size - res - 1 
 
 @torch.no_grad()
-def inference(render_event,batch_size,input_latent_list_cycle,audio_feat_queue,audio_out_queue,res_frame_queue,
-              vae, unet, pe,timesteps): #vae, unet, pe,timesteps
+def inference(render_event,batch_size,input_latent_cycle,mirror_table,audio_feat_queue,audio_out_queue,res_frame_queue,
+              vae, unet, pe,timesteps,degrade): #vae, unet, pe,timesteps
     
     # vae, unet, pe = load_diffusion_model()
     # device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -142,7 +155,7 @@ def inference(render_event,batch_size,input_latent_list_cycle,audio_feat_queue,a
     # vae.vae = vae.vae.half()
     # unet.model = unet.model.half()
     
-    length = len(input_latent_list_cycle)
+    length = input_latent_cycle.shape[0]
     index = 0
     count=0
     counttime=0
@@ -160,27 +173,26 @@ def inference(render_event,batch_size,input_latent_list_cycle,audio_feat_queue,a
             audio_frames.append((frame,type,eventpoint))
             if type==0:
                 is_all_silence=False
-        if is_all_silence:
+        infer_count = degrade.infer_count()
+        if is_all_silence or infer_count==0:
             for i in range(batch_size):
                 res_frame_queue.put((None,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
+            if not is_all_silence:
+                degrade.observe(0,0)
         else:
             # print('infer=======')
             t=time.perf_counter()
-            whisper_batch = np.stack(whisper_chunks)
-            latent_batch = []
-            for i in range(batch_size):
-                idx = __mirror_index(length,index+i)
-                latent = input_latent_list_cycle[idx]
-                latent_batch.append(latent)
-            latent_batch = torch.cat(latent_batch, dim=0)
+            step = batch_size//infer_count #降级时隔帧推理
+            whisper_batch = whisper_chunks[::step]
+            pos = index % (2*length)
+            latent_batch = input_latent_cycle.index_select(0, mirror_table[pos:pos+batch_size:step])
             
             # for i, (whisper_batch,latent_batch) in enumerate(gen):
             audio_feature_batch = torch.from_numpy(whisper_batch)
             audio_feature_batch = audio_feature_batch.to(device=unet.device,
                                                             dtype=unet.model.dtype)
             audio_feature_batch = pe(audio_feature_batch)
-            latent_batch = latent_batch.to(dtype=unet.model.dtype)
             # print('prepare time:',time.perf_counter()-t)
             # t=time.perf_counter()
 
@@ -197,16 +209,18 @@ def inference(render_event,batch_size,input_latent_list_cycle,audio_feat_queue,a
 
             # print('vae time:',time.perf_counter()-t)
             #print('diffusion len=',len(recon))
-            counttime += (time.perf_counter() - t)
+            elapsed = time.perf_counter() - t
+            degrade.observe(elapsed,len(recon))
+            counttime += elapsed
             count += batch_size
             #_totalframe += 1
             if count>=100:
                 logger.info(f"------actual avg infer fps:{count/counttime:.4f}")
                 count=0
                 counttime=0
-            for i,res_frame in enumerate(recon):
+            for i in range(batch_size):
                 #self.__pushmedia(res_frame,loop,audio_track,video_track)
-                res_frame_queue.put((res_frame,__mirror_index(length,index),audio_frames[i*2:i*2+2]))
+                res_frame_queue.put((recon[i//step],__mirror_index(length,index),audio_frames[i*2:i*2+2]))
                 index = index + 1
             #print('total batch time:',time.perf_counter()-starttime)            
     logger.info('musereal inference processor stop')
@@ -226,13 +240,14 @@ class MuseReal(BaseReal):
         self.res_frame_queue = mp.Queue(self.batch_size*2)
 
         self.vae, self.unet, self.pe, self.timesteps, self.audio_processor = model
-        self.frame_list_cycle,self.mask_list_cycle,self.coord_list_cycle,self.mask_coords_list_cycle, self.input_latent_list_cycle = avatar
+        self.frame_list_cycle,self.mask_list_cycle,self.coord_list_cycle,self.mask_coords_list_cycle, self.input_latent_cycle, self.mirror_table = avatar
         #self.__loadavatar()
 
         self.asr = MuseASR(opt,self,self.audio_processor)
         self.asr.warm_up()
         
         self.render_event = mp.Event()
+        self.init_infer_transport(50*384*8,['frame_list_cycle','mask_list_cycle','coord_list_cycle','mask_coords_list_cycle'])
 
     def __del__(self):
         logger.info(f'musereal({self.sessionid}) delete')
@@ -250,20 +265,15 @@ class MuseReal(BaseReal):
     def __warm_up(self): 
         self.asr.run_step()
         whisper_chunks = self.asr.get_next_feat()
-        whisper_batch = np.stack(whisper_chunks)
-        latent_batch = []
-        for i in range(self.batch_size):
-            idx = self.__mirror_index(self.idx+i)
-            latent = self.input_latent_list_cycle[idx]
-            latent_batch.append(latent)
-        latent_batch = torch.cat(latent_batch, dim=0)
+        whisper_batch = whisper_chunks
+        pos = self.idx % (2*len(self.input_latent_cycle))
+        latent_batch = self.input_latent_cycle.index_select(0, self.mirror_table[pos:pos+self.batch_size])
         logger.info('infer=======')
         # for i, (whisper_batch,latent_batch) in enumerate(gen):
         audio_feature_batch = torch.from_numpy(whisper_batch)
         audio_feature_batch = audio_feature_batch.to(device=self.unet.device,
                                                         dtype=self.unet.model.dtype)
         audio_feature_batch = self.pe(audio_feature_batch)
-        latent_batch = latent_batch.to(dtype=self.unet.model.dtype)
 
         pred_latents = self.unet.model(latent_batch, 
                                     self.timesteps, 
@@ -293,9 +303,9 @@ class MuseReal(BaseReal):
         process_thread.start()
 
         self.render_event.set() #start infer process render
-        Thread(target=inference, args=(self.render_event,self.batch_size,self.input_latent_list_cycle,
+        self.start_inference(inference, (self.render_event,self.batch_size,self.input_latent_cycle,self.mirror_table,
                                            self.asr.feat_queue,self.asr.output_queue,self.res_frame_queue,
-                                           self.vae, self.unet, self.pe,self.timesteps)).start() #mp.Process
+                                           self.vae, self.unet, self.pe,self.timesteps,self.degrade))
         count=0
         totaltime=0
         _starttime=time.perf_counter()
@@ -323,5 +333,6 @@ class MuseReal(BaseReal):
             # if delay > 0:
             #     time.sleep(delay)
         self.render_event.clear() #end infer process render
+        self.stop_inference(process_thread)
         logger.info('musereal thread stop')
             
@@ -1,9 +1,14 @@
 import argparse
 import glob
+import itertools
 import json
 import os
 import pickle
 import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -12,32 +17,45 @@ import torchvision.transforms as transforms
 from PIL import Image
 from diffusers import AutoencoderKL
 from face_alignment import NetworkSize
-from mmpose.apis import inference_topdown, init_model
-from mmpose.structures import merge_data_samples
+from mmpose.apis import init_model
 from tqdm import tqdm
 
 try:
     from utils.face_parsing import FaceParsing
+    from utils.bbox_tracker import BoxTracker, detect_boxes, detect_landmark_bbox
 except ModuleNotFoundError:
     from musetalk.utils.face_parsing import FaceParsing
+    from musetalk.utils.bbox_tracker import BoxTracker, detect_boxes, detect_landmark_bbox
 
 
-def video2imgs(vid_path, save_path, ext='.png', cut_frame=500):
+def video2imgs(vid_path, save_path, ext='.png', cut_frame=500, writer=None):
+    """抽帧；传入writer(线程池)时png编码写盘异步进行"""
     cap = cv2.VideoCapture(vid_path)
     count = 0
+    pending = []
     while True:
         if count > cut_frame:
             break
         ret, frame = cap.read()
         if ret:
             cv2.putText(frame, "LiveTalking", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (128,128,128), 1)
-            cv2.imwrite(f"{save_path}/{count:08d}.png", frame)
+            if writer is None:
+                cv2.imwrite(f"{save_path}/{count:08d}.png", frame)
+            else:
+                pending.append(writer.submit(cv2.imwrite, f"{save_path}/{count:08d}.png", frame))
+                if len(pending) > 64:  # 限制排队的帧数，避免解码快于写盘时内存上涨
+                    pending.pop(0).result()
             count += 1
         else:
             break
+    cap.release()
+    for future in pending:
+        future.result()
 
 
-def read_imgs(img_list):
+def read_imgs(img_list, reader=None):
+    if reader is not None:
+        return list(reader.map(cv2.imread, img_list))
     frames = []
     print('reading images...')
     for img_path in tqdm(img_list):
@@ -46,57 +64,20 @@ def read_imgs(img_list):
     return frames
 
 
-def get_landmark_and_bbox(img_list, upperbondrange=0):
-    frames = read_imgs(img_list)
-    batch_size_fa = 1
-    batches = [frames[i:i + batch_size_fa] for i in range(0, len(frames), batch_size_fa)]
-    coords_list = []
-    landmarks = []
-    if upperbondrange != 0:
-        print('get key_landmark and face bounding boxes with the bbox_shift:', upperbondrange)
-    else:
-        print('get key_landmark and face bounding boxes with the default value')
+def get_landmark_and_bbox(frames, upperbondrange=0, keyframe_stride=5, smooth=1, tracker=None):
+    """
+    :param keyframe_stride: >1时只在关键帧上做完整检测，中间帧用BoxTracker跟踪（场景切换、跟丢时回退完整检测）；
+        默认5，框和逐帧检测相差不超过几个像素（test/test_bbox_tracker.py），1为逐帧检测
+    :param smooth: 人脸框滑动平均窗口（帧），1为不平滑
+    :param tracker: 分块调用时传入同一个BoxTracker，跟踪状态跨块延续
+    """
     average_range_minus = []
     average_range_plus = []
-    coord_placeholder = (0.0, 0.0, 0.0, 0.0)
-    for fb in tqdm(batches):
-        results = inference_topdown(model, np.asarray(fb)[0])
-        results = merge_data_samples(results)
-        keypoints = results.pred_instances.keypoints
-        face_land_mark = keypoints[0][23:91]
-        face_land_mark = face_land_mark.astype(np.int32)
-
-        # get bounding boxes by face detetion
-        bbox = fa.get_detections_for_batch(np.asarray(fb))
-
-        # adjust the bounding box refer to landmark
-        # Add the bounding box to a tuple and append it to the coordinates list
-        for j, f in enumerate(bbox):
-            if f is None:  # no face in the image
-                coords_list += [coord_placeholder]
-                continue
-
-            half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
-            range_minus = (face_land_mark[30] - face_land_mark[29])[1]
-            range_plus = (face_land_mark[29] - face_land_mark[28])[1]
-            average_range_minus.append(range_minus)
-            average_range_plus.append(range_plus)
-            if upperbondrange != 0:
-                half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
-            half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
-            upper_bond = half_face_coord[1] - half_face_dist
-
-            f_landmark = (
-                np.min(face_land_mark[:, 0]), int(upper_bond), np.max(face_land_mark[:, 0]),
-                np.max(face_land_mark[:, 1]))
-            x1, y1, x2, y2 = f_landmark
-
-            if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
-                coords_list += [f]
-                w, h = f[2] - f[0], f[3] - f[1]
-                print("error bbox:", f)
-            else:
-                coords_list += [f_landmark]
+    if tracker is None and keyframe_stride > 1:
+        tracker = BoxTracker(stride=keyframe_stride)
+    coords_list = detect_boxes(
+        frames, lambda frame: detect_landmark_bbox(frame, model, fa, upperbondrange, average_range_minus, average_range_plus),
+        tracker, smooth)
     return coords_list, frames
 
 
@@ -193,6 +174,23 @@ def get_latents_for_unet(img):
     return latent_model_input
 
 
+def preprocess_img_batch(imgs, half_mask=False):
+    """preprocess_img的批量版：(B,256,256,3) BGR uint8 -> [B, 3, 256, 256] 归一化tensor"""
+    x = torch.from_numpy(np.ascontiguousarray(np.stack(imgs)[..., ::-1])).permute(0, 3, 1, 2).float() / 255.
+    if half_mask:
+        x = x * (get_mask_tensor() > 0.5)
+    x = (x - 0.5) / 0.5
+    return x.to(device)
+
+
+def get_latents_for_unet_batch(imgs):
+    """一次VAE前向编码一批256x256裁剪图，返回与get_latents_for_unet相同的[1, 8, 32, 32]列表"""
+    masked_latents = encode_latents(preprocess_img_batch(imgs, half_mask=True))
+    ref_latents = encode_latents(preprocess_img_batch(imgs, half_mask=False))
+    latent_model_input = torch.cat([masked_latents, ref_latents], dim=1).cpu()
+    return list(latent_model_input.split(1))
+
+
 def get_crop_box(box, expand):
     x, y, x1, y1 = box
     x_c, y_c = (x + x1) // 2, (y + y1) // 2
@@ -239,6 +237,47 @@ def get_image_prepare_material(image, face_box, upper_boundary_ratio=0.5, expand
     return mask_array, crop_box
 
 
+def prepare_mask_crop(image, face_box, expand=1.2):
+    """get_image_prepare_material的前半段：取出送去人脸解析的裁剪图"""
+    body = Image.fromarray(image[:, :, ::-1])
+    crop_box, s = get_crop_box(face_box, expand)
+    return body.crop(crop_box), crop_box
+
+
+def finish_mask(parsing, face_box, crop_box, out_path=None, upper_boundary_ratio=0.5):
+    """get_image_prepare_material的后半段（缩放、贴回、截取下半脸、高斯模糊），纯CPU，在进程池里跑
+
+    :param parsing: FaceParsing.parse_batch输出的单张解析图
+    :param out_path: 给出时直接在worker里写mask png，不再把mask传回主进程
+    """
+    x, y, x1, y1 = face_box
+    x_s, y_s, x_e, y_e = crop_box
+    ori_shape = (x_e - x_s, y_e - y_s)
+
+    mask_image = Image.fromarray(parsing).resize(ori_shape)
+    mask_small = mask_image.crop((x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+    mask_image = Image.new('L', ori_shape, 0)
+    mask_image.paste(mask_small, (x - x_s, y - y_s, x1 - x_s, y1 - y_s))
+
+    # keep upper_boundary_ratio of talking area
+    width, height = mask_image.size
+    top_boundary = int(height * upper_boundary_ratio)
+    modified_mask_image = Image.new('L', ori_shape, 0)
+    modified_mask_image.paste(mask_image.crop((0, top_boundary, width, height)), (0, top_boundary))
+
+    blur_kernel_size = int(0.1 * ori_shape[0] // 2 * 2) + 1
+    mask_array = cv2.GaussianBlur(np.array(modified_mask_image), (blur_kernel_size, blur_kernel_size), 0)
+    if out_path is not None:
+        cv2.imwrite(out_path, mask_array)
+        return None
+    return mask_array
+
+
+def _mask_worker_init():
+    # 每个worker单线程跑opencv，并行度交给进程池
+    cv2.setNumThreads(1)
+
+
 ##todo 简单根据文件后缀判断  要更精确的可以自己修改 使用 magic
 def is_video_file(file_path):
     video_exts = ['.mp4', '.mkv', '.flv', '.avi', '.mov']  # 这里列出了一些常见的视频文件扩展名，可以根据需要添加更多
@@ -254,67 +293,252 @@ def create_dir(dir_path):
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
 
-def create_musetalk_human(file, avatar_id):
+def _input_id(file):
+    """断点对应的输入：路径 + 大小 + 修改时间，同名文件被覆盖后不会误用旧断点"""
+    st = os.stat(file)
+    return {'file': os.path.abspath(file), 'size': st.st_size, 'mtime': st.st_mtime}
+
+
+def _load_checkpoint(checkpoint_path, file, resume):
+    """读取断点状态；不续跑或输入换了就清空断点目录从头开始"""
+    state_path = os.path.join(checkpoint_path, 'state.json')
+    if resume and os.path.isfile(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get('input') == _input_id(file):
+            return state
+        print("checkpoint belongs to another input, starting over")
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
+    os.makedirs(checkpoint_path)
+    return {'input': _input_id(file), 'extracted': False}
+
+
+def _save_checkpoint(path, obj):
+    tmp_path = path + '.tmp'
+    if path.endswith('.json'):
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+    else:
+        torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def probe_video_size(vid_path, ffmpeg='ffmpeg'):
+    """用ffprobe取显示尺寸（考虑旋转元数据，与ffmpeg自动旋转后输出的帧一致）"""
+    ffprobe = os.path.join(os.path.dirname(ffmpeg), os.path.basename(ffmpeg).replace('ffmpeg', 'ffprobe'))
+    out = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                          'stream=width,height:stream_tags=rotate:stream_side_data=rotation', '-of', 'json', vid_path],
+                         capture_output=True, text=True, check=True)
+    stream = json.loads(out.stdout)['streams'][0]
+    width, height = stream['width'], stream['height']
+    rotation = stream.get('tags', {}).get('rotate') or next(
+        (d['rotation'] for d in stream.get('side_data_list', []) if 'rotation' in d), 0)
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    return width, height
+
+
+def iter_video_frames(vid_path, fps=25, ffmpeg='ffmpeg', max_frames=0):
+    """ffmpeg单次解码，按fps重采样后以bgr24原始帧从管道读出，不落地中间视频"""
+    width, height = probe_video_size(vid_path, ffmpeg)
+    cmd = [ffmpeg, '-v', 'error', '-i', vid_path, '-an', '-vf', f'fps={fps}',
+           '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=width * height * 3 * 4)
+    count = 0
+    try:
+        while not max_frames or count < max_frames:
+            buf = bytearray(width * height * 3)
+            if proc.stdout.readinto(buf) < len(buf):
+                break
+            yield np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+            count += 1
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+
+def _video_chunks(vid_path, chunk_size, **kwargs):
+    chunk = []
+    for frame in iter_video_frames(vid_path, **kwargs):
+        chunk.append(frame)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_musetalk_human(file, avatar_id, batch_size=16, chunk_size=256, workers=None, io_workers=4, resume=False,
+                          keyframe_stride=5, smooth=1, save_path=None, fps=25, ffmpeg='ffmpeg', cut_frame=500,
+                          frame_filter=None):
+    """
+    生成MuseTalk avatar素材，分块流水线处理：
+    读帧 -> 人脸检测 -> 批量VAE编码 -> 批量人脸解析（主进程，GPU/CPU均可） -> mask后处理（进程池） -> 写图（线程池）。
+    视频输入由ffmpeg单次解码成fps帧率的原始帧直接进流水线（frame_filter如背景模糊逐帧在内存里做），
+    不再先抽帧成png再读回来；图片输入仍按原方式拷贝到full_imgs。
+    每块处理完写一个断点文件，resume=True时跳过已完成的块。
+    keyframe_stride>1时人脸检测只在关键帧上做，中间帧跟踪（见get_landmark_and_bbox）
+
+    :param save_path: 输出目录，默认data/avatars/avator_{avatar_id}
+    :param cut_frame: 视频最多取cut_frame+1帧（与video2imgs一致），<=0不限
+    """
+    start_time = time.time()
+    timings = {'extract': 0.0, 'landmark': 0.0, 'vae': 0.0, 'parsing': 0.0, 'wait': 0.0}
     # 保存文件设置 可以不动
-    save_path = os.path.join(current_dir, f'../data/avatars/avator_{avatar_id}')
-    save_full_path = os.path.join(current_dir, f'../data/avatars/avator_{avatar_id}/full_imgs')
+    save_path = save_path or os.path.join(current_dir, f'../data/avatars/avator_{avatar_id}')
+    save_full_path = os.path.join(save_path, 'full_imgs')
     create_dir(save_path)
-    create_dir(save_full_path)
-    mask_out_path = os.path.join(current_dir, f'../data/avatars/avator_{avatar_id}/mask')
-    create_dir(mask_out_path)
+    mask_out_path = os.path.join(save_path, 'mask')
+    checkpoint_path = os.path.join(save_path, 'checkpoint')
+    from_video = os.path.isfile(file) and is_video_file(file)
 
     # 模型
-    mask_coords_path = os.path.join(current_dir, f'{save_path}/mask_coords.pkl')
-    coords_path = os.path.join(current_dir, f'{save_path}/coords.pkl')
-    latents_out_path = os.path.join(current_dir, f'{save_path}/latents.pt')
+    mask_coords_path = os.path.join(save_path, 'mask_coords.pkl')
+    coords_path = os.path.join(save_path, 'coords.pkl')
+    latents_out_path = os.path.join(save_path, 'latents.pt')
 
-    with open(os.path.join(current_dir, f'{save_path}/avator_info.json'), "w") as f:
+    with open(os.path.join(save_path, 'avator_info.json'), "w") as f:
         json.dump({
             "avatar_id": avatar_id,
             "video_path": file,
             "bbox_shift": 5
         }, f)
 
-    if os.path.isfile(file):
-        if is_video_file(file):
-            video2imgs(file, save_full_path, ext='png')
+    # 进程池先于模型加载启动，fork出来的worker不带模型和cuda上下文
+    mask_pool = ProcessPoolExecutor(max_workers=workers or max(1, (os.cpu_count() or 2) // 2),
+                                    initializer=_mask_worker_init)
+    mask_pool.submit(int).result()
+    io_pool = ThreadPoolExecutor(max_workers=io_workers)
+    init_models()
+
+    try:
+        state = _load_checkpoint(checkpoint_path, file, resume)
+        t = time.time()
+        if not state['extracted']:
+            shutil.rmtree(save_full_path, ignore_errors=True)
+            shutil.rmtree(mask_out_path, ignore_errors=True)
+            create_dir(save_full_path)
+            if os.path.isfile(file):
+                if not from_video:
+                    shutil.copyfile(file, f"{save_full_path}/{os.path.basename(file)}")
+            else:
+                files = os.listdir(file)
+                files.sort()
+                files = [file for file in files if file.split(".")[-1] == "png"]
+                for filename in files:
+                    shutil.copyfile(f"{file}/{filename}", f"{save_full_path}/{filename}")
+            state['extracted'] = True
+            _save_checkpoint(os.path.join(checkpoint_path, 'state.json'), state)
+        create_dir(mask_out_path)
+        timings['extract'] += time.time() - t
+
+        if from_video:
+            input_img_list = None
+            chunks = _video_chunks(file, chunk_size, fps=fps, ffmpeg=ffmpeg,
+                                   max_frames=cut_frame + 1 if cut_frame > 0 else 0)
         else:
-            shutil.copyfile(file, f"{save_full_path}/{os.path.basename(file)}")
-    else:
-        files = os.listdir(file)
-        files.sort()
-        files = [file for file in files if file.split(".")[-1] == "png"]
-        for filename in files:
-            shutil.copyfile(f"{file}/{filename}", f"{save_full_path}/{filename}")
-    input_img_list = sorted(glob.glob(os.path.join(save_full_path, '*.[jpJP][pnPN]*[gG]')))
-    print("extracting landmarks...")
-    coord_list, frame_list = get_landmark_and_bbox(input_img_list, 5)
-    input_latent_list = []
-    idx = -1
-    # maker if the bbox is not sufficient
-    coord_placeholder = (0.0, 0.0, 0.0, 0.0)
-    for bbox, frame in zip(coord_list, frame_list):
-        idx = idx + 1
-        if bbox == coord_placeholder:
-            continue
-        x1, y1, x2, y2 = bbox
-        crop_frame = frame[y1:y2, x1:x2]
-        resized_crop_frame = cv2.resize(crop_frame, (256, 256), interpolation=cv2.INTER_LANCZOS4)
-        latents = get_latents_for_unet(resized_crop_frame)
-        input_latent_list.append(latents)
-
-    frame_list_cycle = frame_list #+ frame_list[::-1]
-    coord_list_cycle = coord_list #+ coord_list[::-1]
-    input_latent_list_cycle = input_latent_list #+ input_latent_list[::-1]
-    mask_coords_list_cycle = []
-    mask_list_cycle = []
-    for i, frame in enumerate(tqdm(frame_list_cycle)):
-        cv2.imwrite(f"{save_full_path}/{str(i).zfill(8)}.png", frame)
-        face_box = coord_list_cycle[i]
-        mask, crop_box = get_image_prepare_material(frame, face_box)
-        cv2.imwrite(f"{mask_out_path}/{str(i).zfill(8)}.png", mask)
-        mask_coords_list_cycle += [crop_box]
-        mask_list_cycle.append(mask)
+            input_img_list = sorted(glob.glob(os.path.join(save_full_path, '*.[jpJP][pnPN]*[gG]')))
+            chunks = (input_img_list[i:i + chunk_size] for i in range(0, len(input_img_list), chunk_size))
+
+        def chunk_file(k):
+            return os.path.join(checkpoint_path, f'chunk_{k:05d}_{chunk_size}.pt')
+
+        results = []
+        done = len(glob.glob(os.path.join(checkpoint_path, f'chunk_*_{chunk_size}.pt')))
+        if done:
+            print(f"resuming: {done} chunks already done")
+        print('get key_landmark and face bounding boxes with the bbox_shift:', 5)
+
+        # maker if the bbox is not sufficient
+        coord_placeholder = (0.0, 0.0, 0.0, 0.0)
+        pending = None
+        tracker = BoxTracker(stride=keyframe_stride) if keyframe_stride > 1 else None
+
+        def finish_chunk(k, futures, result):
+            t = time.time()
+            for future in futures:
+                future.result()
+            timings['wait'] += time.time() - t
+            _save_checkpoint(chunk_file(k), result)
+            results[k] = result
+
+        chunk_start = 0
+        chunks = iter(chunks)
+        for k in tqdm(itertools.count()):
+            t = time.time()
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            start, chunk_start = chunk_start, chunk_start + len(chunk)
+            if os.path.isfile(chunk_file(k)):
+                results.append(torch.load(chunk_file(k)))
+                timings['extract'] += time.time() - t
+                if tracker is not None:
+                    tracker.reset()
+                print(f"progress {chunk_start} frames", flush=True)
+                continue
+            results.append(None)
+            if from_video:
+                frames = []
+                for frame in chunk:
+                    if frame_filter is not None:
+                        frame = frame_filter(frame)
+                    cv2.putText(frame, "LiveTalking", (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (128,128,128), 1)
+                    frames.append(frame)
+            else:
+                frames = read_imgs(chunk, io_pool)
+            timings['extract'] += time.time() - t
+
+            t = time.time()
+            coords, _ = get_landmark_and_bbox(frames, 5, smooth=smooth, tracker=tracker)
+            timings['landmark'] += time.time() - t
+
+            t = time.time()
+            crops = []
+            for bbox, frame in zip(coords, frames):
+                if bbox == coord_placeholder:
+                    continue
+                x1, y1, x2, y2 = bbox
+                crops.append(cv2.resize(frame[y1:y2, x1:x2], (256, 256), interpolation=cv2.INTER_LANCZOS4))
+            latents = []
+            for b in range(0, len(crops), batch_size):
+                latents += get_latents_for_unet_batch(crops[b:b + batch_size])
+            timings['vae'] += time.time() - t
+
+            # 上一块的mask和写图在这一块算GPU的同时完成
+            if pending is not None:
+                finish_chunk(*pending)
+                pending = None
+
+            t = time.time()
+            futures = []
+            mask_coords = []
+            for b in range(0, len(frames), batch_size):
+                batch = range(b, min(b + batch_size, len(frames)))
+                face_large, crop_boxes = zip(*[prepare_mask_crop(frames[i], coords[i]) for i in batch])
+                parsings = fp.parse_batch(face_large)
+                for i, parsing, crop_box in zip(batch, parsings, crop_boxes):
+                    idx = start + i
+                    futures.append(mask_pool.submit(finish_mask, parsing, coords[i], crop_box,
+                                                    f"{mask_out_path}/{str(idx).zfill(8)}.png"))
+                    full_img_path = f"{save_full_path}/{str(idx).zfill(8)}.png"
+                    if from_video or os.path.abspath(chunk[i]) != os.path.abspath(full_img_path):
+                        futures.append(io_pool.submit(cv2.imwrite, full_img_path, frames[i]))
+                    mask_coords.append(crop_box)
+            timings['parsing'] += time.time() - t
+            pending = (k, futures, {'coords': coords, 'mask_coords': mask_coords, 'latents': latents})
+            print(f"progress {chunk_start} frames", flush=True)  # 供create_avatar解析进度
+
+        if pending is not None:
+            finish_chunk(*pending)
+    finally:
+        mask_pool.shutdown()
+        io_pool.shutdown()
+
+    coord_list_cycle = [c for r in results for c in r['coords']]
+    mask_coords_list_cycle = [c for r in results for c in r['mask_coords']]
+    input_latent_list_cycle = [l for r in results for l in r['latents']]
 
     with open(mask_coords_path, 'wb') as f:
         pickle.dump(mask_coords_list_cycle, f)
@@ -322,18 +546,34 @@ def create_musetalk_human(file, avatar_id):
     with open(coords_path, 'wb') as f:
         pickle.dump(coord_list_cycle, f)
     torch.save(input_latent_list_cycle, os.path.join(latents_out_path))
+    shutil.rmtree(checkpoint_path, ignore_errors=True)
+
+    print(f"avatar {avatar_id}: {len(coord_list_cycle)} frames in {time.time() - start_time:.1f}s "
+          + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+    if tracker is not None:
+        print("keyframe detection:", tracker.stats)
 
 
 # initialize the mmpose model
 device = "cuda" if torch.cuda.is_available() else ("mps" if (hasattr(torch.backends, "mps") and torch.backends.mps.is_available()) else "cpu")
-fa = FaceAlignment(1, flip_input=False, device=device)
-config_file = os.path.join(current_dir, 'utils/dwpose/rtmpose-l_8xb32-270e_coco-ubody-wholebody-384x288.py')
-checkpoint_file = os.path.abspath(os.path.join(current_dir, '../models/dwpose/dw-ll_ucoco_384.pth'))
-model = init_model(config_file, checkpoint_file, device=device)
-vae = AutoencoderKL.from_pretrained(os.path.abspath(os.path.join(current_dir, '../models/sd-vae-ft-mse')))
-vae.to(device)
-fp = FaceParsing(os.path.abspath(os.path.join(current_dir, '../models/face-parse-bisent/resnet18-5c106cde.pth')),
-                 os.path.abspath(os.path.join(current_dir, '../models/face-parse-bisent/79999_iter.pth')))
+fa = model = vae = fp = None
+
+
+def init_models():
+    """加载检测/关键点/VAE/人脸解析模型（只加载一次；mask进程池的worker不需要模型）"""
+    global fa, model, vae, fp
+    if fa is not None:
+        return
+    fa = FaceAlignment(1, flip_input=False, device=device)
+    config_file = os.path.join(current_dir, 'utils/dwpose/rtmpose-l_8xb32-270e_coco-ubody-wholebody-384x288.py')
+    checkpoint_file = os.path.abspath(os.path.join(current_dir, '../models/dwpose/dw-ll_ucoco_384.pth'))
+    model = init_model(config_file, checkpoint_file, device=device)
+    vae = AutoencoderKL.from_pretrained(os.path.abspath(os.path.join(current_dir, '../models/sd-vae-ft-mse')))
+    vae.to(device)
+    fp = FaceParsing(os.path.abspath(os.path.join(current_dir, '../models/face-parse-bisent/resnet18-5c106cde.pth')),
+                     os.path.abspath(os.path.join(current_dir, '../models/face-parse-bisent/79999_iter.pth')))
+
+
 if __name__ == '__main__':
     # 视频文件地址
     parser = argparse.ArgumentParser()
@@ -345,5 +585,28 @@ if __name__ == '__main__':
                         type=str,
                         default='3',
                         )
+    parser.add_argument("--batch_size", type=int, default=16, help="VAE编码和人脸解析的batch大小")
+    parser.add_argument("--chunk_size", type=int, default=256, help="每块帧数，也是断点保存的粒度")
+    parser.add_argument("--workers", type=int, default=0, help="mask后处理进程数，0为cpu核数的一半")
+    parser.add_argument("--io_workers", type=int, default=4, help="读写图片的线程数")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的块继续")
+    parser.add_argument("--keyframe_stride", type=int, default=5, help="每隔多少帧做一次完整人脸检测，1为逐帧检测（原来的行为）")
+    parser.add_argument("--smooth", type=int, default=1, help="人脸框滑动平均窗口（帧），1为不平滑")
+    parser.add_argument("--output_dir", type=str, default="", help="输出目录，默认data/avatars/avator_{avatar_id}")
+    parser.add_argument("--fps", type=int, default=25, help="视频输入解码时重采样到的帧率")
+    parser.add_argument("--ffmpeg", type=str, default="ffmpeg", help="ffmpeg可执行文件（同目录下需有ffprobe）")
+    parser.add_argument("--cut_frame", type=int, default=500, help="视频最多取cut_frame+1帧，<=0不限")
+    parser.add_argument("--blur", action="store_true", help="读帧时逐帧做背景模糊（PPHumanSeg）")
+    parser.add_argument("--background_image", type=str, default="", help="读帧时把背景替换为该图片")
     args = parser.parse_args()
-    create_musetalk_human(args.file, args.avatar_id)
+
+    frame_filter = None
+    if args.blur or args.background_image:
+        sys.path.insert(0, os.path.abspath(os.path.join(current_dir, '..', 'blur')))
+        from bgseg import BackgroundBlur
+        frame_filter = BackgroundBlur(background_image=args.background_image or None)
+    create_musetalk_human(args.file, args.avatar_id, batch_size=args.batch_size, chunk_size=args.chunk_size,
+                          workers=args.workers or None, io_workers=args.io_workers, resume=args.resume,
+                          keyframe_stride=args.keyframe_stride, smooth=args.smooth,
+                          save_path=args.output_dir or None, fps=args.fps, ffmpeg=args.ffmpeg,
+                          cut_frame=args.cut_frame, frame_filter=frame_filter)
@@ -0,0 +1,184 @@
+import cv2
+import numpy as np
+
+# 关键帧人脸检测：只在关键帧上跑SFD+DWPose，中间帧用模板匹配平移上一关键帧的框。
+# 触发完整检测的条件：到达固定间隔、画面突变（场景切换）、模板匹配得分过低（漂移）。
+# 完整检测本身(detect_landmark_bbox)也放在这里，preprocessing.py和simple_musetalk.py共用。
+
+coord_placeholder = (0.0, 0.0, 0.0, 0.0)
+
+
+def detect_landmark_bbox(frame, model, fa, upperbondrange, average_range_minus, average_range_plus):
+    """单帧完整检测（DWPose关键点 + SFD人脸框），返回该帧的人脸框或占位符
+    :param model: mmpose DWPose模型
+    :param fa: FaceAlignment人脸检测器
+    """
+    from mmpose.apis import inference_topdown
+    from mmpose.structures import merge_data_samples
+    results = inference_topdown(model, frame)
+    results = merge_data_samples(results)
+    keypoints = results.pred_instances.keypoints
+    face_land_mark = keypoints[0][23:91]
+    face_land_mark = face_land_mark.astype(np.int32)
+
+    # get bounding boxes by face detetion
+    f = fa.get_detections_for_batch(np.asarray([frame]))[0]
+
+    # adjust the bounding box refer to landmark
+    if f is None:  # no face in the image
+        return coord_placeholder
+
+    half_face_coord = face_land_mark[29]  # np.mean([face_land_mark[28], face_land_mark[29]], axis=0)
+    range_minus = (face_land_mark[30] - face_land_mark[29])[1]
+    range_plus = (face_land_mark[29] - face_land_mark[28])[1]
+    average_range_minus.append(range_minus)
+    average_range_plus.append(range_plus)
+    if upperbondrange != 0:
+        half_face_coord[1] = upperbondrange + half_face_coord[1]  # 手动调整  + 向下（偏29）  - 向上（偏28）
+    half_face_dist = np.max(face_land_mark[:, 1]) - half_face_coord[1]
+    upper_bond = half_face_coord[1] - half_face_dist
+
+    f_landmark = (
+        np.min(face_land_mark[:, 0]), int(upper_bond), np.max(face_land_mark[:, 0]),
+        np.max(face_land_mark[:, 1]))
+    x1, y1, x2, y2 = f_landmark
+
+    if y2 - y1 <= 0 or x2 - x1 <= 0 or x1 < 0:  # if the landmark bbox is not suitable, reuse the bbox
+        print("error bbox:", f)
+        return f
+    return f_landmark
+
+
+class BoxTracker:
+    def __init__(self, stride=8, scene_threshold=12.0, match_threshold=0.6, search_margin=0.25, work_width=320):
+        """
+        :param stride: 关键帧间隔（帧）
+        :param scene_threshold: 缩略图灰度平均绝对差超过该值视为场景切换
+        :param match_threshold: 模板匹配归一化相关系数低于该值视为跟丢，回退到完整检测
+        :param search_margin: 搜索窗口相对人脸框尺寸向外扩展的比例
+        :param work_width: 跟踪在缩小到该宽度的灰度图上进行
+        """
+        self.stride = stride
+        self.scene_threshold = scene_threshold
+        self.match_threshold = match_threshold
+        self.search_margin = search_margin
+        self.work_width = work_width
+        self.stats = {'keyframes': 0, 'tracked': 0, 'scene_cuts': 0, 'drift': 0}
+        self._box = None
+        self._template = None
+        self._thumb = None
+        self._since_key = 0
+        self.segment = 0  # 场景编号，平滑不跨场景
+
+    def _gray(self, frame):
+        scale = min(1.0, self.work_width / frame.shape[1])
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    @staticmethod
+    def _thumbnail(frame):
+        return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def need_keyframe(self, frame):
+        """当前帧是否需要完整检测"""
+        if self._template is None or self._since_key >= self.stride:
+            return True
+        if np.mean(np.abs(self._thumbnail(frame) - self._thumb)) > self.scene_threshold:
+            self.stats['scene_cuts'] += 1
+            self.segment += 1
+            return True
+        return False
+
+    def reset(self):
+        """丢弃跟踪状态，下一帧强制完整检测（如跳过了中间的帧）"""
+        self._box = self._template = self._thumb = None
+
+    def update(self, frame, box):
+        """关键帧检测结果回填；box为占位符（没检测到人脸）时下一帧继续完整检测"""
+        self.stats['keyframes'] += 1
+        self._since_key = 0
+        self._thumb = self._thumbnail(frame)
+        if box == coord_placeholder:
+            self._box = self._template = None
+            return
+        gray, scale = self._gray(frame)
+        x1, y1, x2, y2 = [int(round(v * scale)) for v in box]
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(gray.shape[1], x2), min(gray.shape[0], y2)
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            self._box = self._template = None
+            return
+        self._box = box
+        self._template = (gray[y1:y2, x1:x2].copy(), (x1, y1), scale)
+
+    def track(self, frame):
+        """在上一关键帧框附近做模板匹配，返回平移后的框；得分过低返回None（调用方应做完整检测）"""
+        template, (tx, ty), scale = self._template
+        gray, _ = self._gray(frame)
+        th, tw = template.shape
+        mx, my = int(tw * self.search_margin) + 1, int(th * self.search_margin) + 1
+        sx1, sy1 = max(0, tx - mx), max(0, ty - my)
+        sx2, sy2 = min(gray.shape[1], tx + tw + mx), min(gray.shape[0], ty + th + my)
+        search = gray[sy1:sy2, sx1:sx2]
+        if search.shape[0] < th or search.shape[1] < tw:
+            return None
+        result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (bx, by) = cv2.minMaxLoc(result)
+        if score < self.match_threshold:
+            self.stats['drift'] += 1
+            return None
+        self._since_key += 1
+        self.stats['tracked'] += 1
+        dx = (sx1 + bx - tx) / scale
+        dy = (sy1 + by - ty) / scale
+        x1, y1, x2, y2 = self._box
+        return (int(round(x1 + dx)), int(round(y1 + dy)), int(round(x2 + dx)), int(round(y2 + dy)))
+
+
+def detect_boxes(frames, detect, tracker=None, smooth=1):
+    """
+    逐帧取人脸框：tracker为None时每帧调用detect(frame)；否则只在关键帧调用，中间帧用tracker跟踪
+    :param smooth: 人脸框滑动平均窗口（帧），1为不平滑
+    """
+    coords_list = []
+    segments = []
+    for frame in frames:
+        box = None
+        if tracker is not None and not tracker.need_keyframe(frame):
+            box = tracker.track(frame)
+        if box is None:
+            box = detect(frame)
+            if tracker is not None:
+                tracker.update(frame, box)
+        coords_list.append(box)
+        segments.append(tracker.segment if tracker is not None else 0)
+    if smooth > 1:
+        coords_list = smooth_boxes(coords_list, segments, smooth)
+    return coords_list
+
+
+def smooth_boxes(coords, segments, window=5):
+    """对连续有效框做居中滑动平均去抖；占位符和场景切换处断开，不跨段平均"""
+    if window <= 1:
+        return list(coords)
+    out = list(coords)
+    half = window // 2
+    window = 2 * half + 1
+    n = len(coords)
+    start = 0
+    while start < n:
+        end = start
+        while end < n and coords[end] != coord_placeholder and segments[end] == segments[start]:
+            end += 1
+        if end > start:
+            run = np.asarray(coords[start:end], dtype=np.float64)
+            padded = np.pad(run, ((half, half), (0, 0)), mode='edge')
+            kernel = np.ones(window) / window
+            smoothed = np.stack([np.convolve(padded[:, c], kernel, mode='valid') for c in range(4)], axis=1)
+            out[start:end] = [tuple(int(round(v)) for v in box) for box in smoothed]
+            start = end
+        else:
+            start += 1
+    return out
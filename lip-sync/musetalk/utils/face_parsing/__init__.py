@@ -50,6 +50,16 @@ class FaceParsing():
         parsing = Image.fromarray(parsing.astype(np.uint8))
         return parsing
 
+    def parse_batch(self, images, size=(512, 512)):
+        """一次前向解析多张PIL图，返回(B, size[1], size[0]) uint8数组，语义与__call__一致（未缩放回原尺寸）"""
+        with torch.no_grad():
+            img = torch.stack([self.preprocess(image.resize(size, Image.BILINEAR)) for image in images])
+            if torch.cuda.is_available():
+                img = img.cuda()
+            out = self.net(img)[0]
+            parsing = out.argmax(1).cpu().numpy()
+        return np.where((parsing >= 1) & (parsing <= 13), 255, 0).astype(np.uint8)
+
 if __name__ == "__main__":
     fp = FaceParsing()
     segmap = fp('154_small.png')
@@ -5,6 +5,7 @@ import numpy as np
 import time
 import sys
 sys.path.append("..")
+from featwindow import window_indices, sliced_windows
 
 class Audio2Feature():
     def __init__(self, 
@@ -25,24 +26,12 @@ class Audio2Feature():
         :param audio_feat_length:
         :return: 
         """
-        length = len(feature_array)
-        selected_feature = []
-        selected_idx = []
-        
         center_idx = int(vid_idx*50/fps) 
-        left_idx = center_idx-audio_feat_length[0]*2
-        right_idx = center_idx + (audio_feat_length[1]+1)*2
-        
-        for idx in range(left_idx,right_idx):
-            idx = max(0, idx)
-            idx = min(length-1, idx)
-            x = feature_array[idx]
-            selected_feature.append(x)
-            selected_idx.append(idx)
-        
-        selected_feature = np.concatenate(selected_feature, axis=0)
+        selected_idx = window_indices(len(feature_array), [center_idx],
+                                      audio_feat_length[0]*2, (audio_feat_length[1]+1)*2)[0]
+        selected_feature = np.take(feature_array, selected_idx, axis=0)
         selected_feature = selected_feature.reshape(-1, 384)# 50*384
-        return selected_feature,selected_idx
+        return selected_feature,selected_idx.tolist()
 
     def get_sliced_feature_sparse(self,feature_array, vid_idx, audio_feat_length= [2,2],fps = 25):
         """
@@ -80,21 +69,13 @@ class Audio2Feature():
     
 
     def feature2chunks(self,feature_array,fps,batch_size,audio_feat_length = [2,2],start=0):
-        whisper_chunks = []
-        whisper_idx_multiplier = 50./fps 
-        i = 0
-        #print(f"video in {fps} FPS, audio idx in 50FPS")
-        for _ in range(batch_size):
-            # start_idx = int(i * whisper_idx_multiplier)
-            # if start_idx>=len(feature_array):
-            #     break
-            selected_feature,selected_idx = self.get_sliced_feature(feature_array= feature_array,vid_idx = i+start,audio_feat_length=audio_feat_length,fps=fps)
-            #print(f"i:{i},selected_idx {selected_idx}")
-            whisper_chunks.append(selected_feature)
-            i += 1
-            
-
-        return whisper_chunks
+        """
+        Get the sliced features of batch_size video frames starting at start with one gather
+        :return: contiguous (batch_size, 50, 384) array
+        """
+        whisper_chunks = sliced_windows(feature_array, batch_size, fps,
+                                        audio_feat_length[0]*2, (audio_feat_length[1]+1)*2, start=start)
+        return whisper_chunks.reshape(batch_size, -1, 384)
 
     def audio2feat(self,audio_path):
         # get the sample rate of the audio
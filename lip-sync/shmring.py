@@ -0,0 +1,121 @@
+###############################################################################
+#  Copyright (C) 2024 LiveTalking@lipku https://github.com/lipku/LiveTalking
+#  email: lipku@foxmail.com
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+# 进程间传帧用的共享内存结构：数据放在multiprocessing.shared_memory里，
+# 进程间队列只传槽位索引和少量元数据，避免每帧pickle大数组
+
+import numpy as np
+from multiprocessing import shared_memory
+import torch.multiprocessing as mp
+
+
+class SharedArray:
+    """放在共享内存里的只读numpy数组，pickle时只传共享内存名字（用于avatar帧等静态数据）"""
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self._owner = True
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self.array[...] = array
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        return self.array[idx]
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class ShmRing:
+    """固定槽位的共享内存环形缓冲区
+
+    每个槽位slot_bytes字节；空闲槽位和就绪槽位各用一个进程队列传索引，
+    put时阻塞等待空闲槽位，所以slots就是队列的最大长度（与原来Queue(maxsize)语义一致）。
+    array为None（结束标记等）也占一个槽位，只是不写数据，队列始终有上限。
+    """
+
+    def __init__(self, slots, slot_bytes):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._owner = True
+        self._free = mp.Queue()
+        self._ready = mp.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'slots': self.slots, 'slot_bytes': self.slot_bytes,
+                'free': self._free, 'ready': self._ready}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.slot_bytes = state['slot_bytes']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = False
+        self._free = state['free']
+        self._ready = state['ready']
+
+    def put(self, array, meta=None, block=True, timeout=None):
+        if array is None:
+            slot = self._free.get(block, timeout)
+            self._ready.put((slot, None, None, meta))
+            return
+        array = np.asarray(array)
+        if array.nbytes > self.slot_bytes:
+            raise ValueError(f'array of {array.nbytes} bytes does not fit slot of {self.slot_bytes} bytes')
+        slot = self._free.get(block, timeout)
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf, offset=slot * self.slot_bytes)
+        view[...] = array
+        self._ready.put((slot, array.shape, array.dtype.str, meta))
+
+    def get(self, block=True, timeout=None):
+        """返回(array, meta)；array是槽位数据的拷贝，槽位随即归还"""
+        slot, shape, dtype, meta = self._ready.get(block, timeout)
+        if shape is None:
+            self._free.put(slot)
+            return None, meta
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self._shm.buf, offset=slot * self.slot_bytes)
+        array = view.copy()
+        self._free.put(slot)
+        return array, meta
+
+    def qsize(self):
+        return self._ready.qsize()
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
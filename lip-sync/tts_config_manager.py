@@ -21,6 +21,8 @@ class TTSConfigManager:
             working_directory = os.path.dirname(os.path.abspath(__file__))
         self.working_directory = working_directory
         self.avatars_dir = os.path.join(working_directory, "data", "avatars")
+        # 常驻TTS引擎host（tts/tts.py）：多个模型同时常驻，按模型名路由
+        self.tts_host_url = "http://127.0.0.1:8604"
         
         # TTS模型到启动命令的映射
         self.tts_commands = {
@@ -197,6 +199,34 @@ nohup python {os.path.basename(server_path)} {' '.join(config['args'])} > /tmp/t
             logger.error(f"Failed to start TTS service: {e}")
             return False
     
+    def ensure_resident_tts(self, model_name: str) -> Optional[str]:
+        """
+        在常驻引擎host中加载（或复用）指定模型，不停止其他模型
+        
+        Args:
+            model_name: TTS模型名称
+            
+        Returns:
+            该模型的服务URL（host的 /engines/<model> 路由），host未运行或加载失败返回None
+        """
+        try:
+            response = requests.get(f"{self.tts_host_url}/tts/engines", timeout=2)
+            if response.status_code != 200:
+                return None
+        except requests.RequestException:
+            return None
+        
+        try:
+            response = requests.post(f"{self.tts_host_url}/tts/start", data={"model_name": model_name}, timeout=180)
+            if response.status_code != 200:
+                logger.error(f"TTS host failed to load {model_name}: {response.text}")
+                return None
+            logger.info(f"TTS model {model_name} is resident (resident: {response.json().get('resident')})")
+            return f"{self.tts_host_url}/engines/{model_name}"
+        except requests.RequestException as e:
+            logger.error(f"Failed to load {model_name} on TTS host: {e}")
+            return None
+    
     def ensure_correct_tts(self, avatar_id: str) -> Tuple[bool, str]:
         """
         确保正确的TTS服务在运行
@@ -218,6 +248,12 @@ nohup python {os.path.basename(server_path)} {' '.join(config['args'])} > /tmp/t
         
         logger.info(f"Avatar {avatar_id} requires TTS model: {required_tts}")
         
+        # 常驻引擎host在运行时直接路由，切换Avatar不会重启TTS
+        resident_url = self.ensure_resident_tts(required_tts)
+        if resident_url:
+            return True, resident_url
+        
+        # 没有host时退回单模型服务：停止当前服务再启动所需模型
         # 检查当前TTS
         current_tts = self.get_current_tts()
         
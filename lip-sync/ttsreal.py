@@ -23,6 +23,7 @@ import asyncio
 import edge_tts
 
 import os
+import sys
 import hmac
 import hashlib
 import base64
@@ -44,6 +45,10 @@ if TYPE_CHECKING:
     from basereal import BaseReal
 
 from logger import logger
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.pcm_protocol import AudioFormat, FrameDecoder
+
 class State(Enum):
     RUNNING=0
     PAUSE=1
@@ -491,6 +496,27 @@ class CosyVoiceTTS(BaseTTS):
         super().__init__(opt, parent)
         # 添加音频缓冲区，避免数据丢失
         self.audio_buffer = np.array([], dtype=np.float32)
+        # 参考音频只上传一次：服务端缓存提示特征，之后每句只传speaker_id
+        self.speaker_id = None
+        # 协商的输出格式：服务端直接给出16k、每帧self.chunk个样本的float32帧，热路径上不做重采样
+        self.request_format = AudioFormat(self.sample_rate, 'f32le', self.chunk)
+        self.audio_format = None  # 本句响应实际使用的格式，None表示旧服务端的24k PCM
+
+    def register_speaker(self, reffile, reftext, server_url):
+        """上传参考音频到CosyVoice服务的说话人注册表，返回speaker_id；服务不支持时返回None（退回每句上传）"""
+        try:
+            with open(reffile, 'rb') as f:
+                res = requests.post(f"{server_url}/speakers", data={'prompt_text': reftext or ''},
+                                    files=[('prompt_wav', ('prompt_wav', f, 'application/octet-stream'))], timeout=30)
+            if res.status_code != 200:
+                logger.warning(f"cosy_voice speaker registration unavailable ({res.status_code}), uploading reference per request")
+                return None
+            speaker_id = res.json()['speaker_id']
+            logger.info(f"cosy_voice speaker registered: {speaker_id}")
+            return speaker_id
+        except Exception:
+            logger.exception('cosyvoice speaker registration')
+            return None
     
     def txt_to_audio(self,msg):
         text,textevent = msg 
@@ -509,11 +535,26 @@ class CosyVoiceTTS(BaseTTS):
         start = time.perf_counter()
         payload = {
             'tts_text': text,
-            'prompt_text': reftext
+            'prompt_text': reftext,
+            **self.request_format.to_form()
         }
+        self.audio_format = None
         try:
-            files = [('prompt_wav', ('prompt_wav', open(reffile, 'rb'), 'application/octet-stream'))]
-            res = requests.request("POST", f"{server_url}/inference_zero_shot", data=payload, files=files, stream=True)
+            if self.speaker_id is None:
+                self.speaker_id = self.register_speaker(reffile, reftext, server_url)
+            res = None
+            if self.speaker_id:
+                res = requests.post(f"{server_url}/inference_zero_shot", data={**payload, 'speaker_id': self.speaker_id}, stream=True)
+                if res.status_code == 404:
+                    # 服务端缓存已淘汰该说话人（或服务重启），重新注册一次
+                    self.speaker_id = self.register_speaker(reffile, reftext, server_url)
+                    res = None
+                    if self.speaker_id:
+                        res = requests.post(f"{server_url}/inference_zero_shot", data={**payload, 'speaker_id': self.speaker_id}, stream=True)
+            if res is None:
+                with open(reffile, 'rb') as f:
+                    files = [('prompt_wav', ('prompt_wav', f.read(), 'application/octet-stream'))]
+                res = requests.request("POST", f"{server_url}/inference_zero_shot", data=payload, files=files, stream=True)
             
             end = time.perf_counter()
             logger.info(f"cosy_voice Time to make POST: {end-start}s")
@@ -521,6 +562,10 @@ class CosyVoiceTTS(BaseTTS):
             if res.status_code != 200:
                 logger.error("Error:%s", res.text)
                 return
+
+            self.audio_format = AudioFormat.parse_header(res.headers.get('X-Audio-Format'))
+            if self.audio_format is not None and self.audio_format != self.request_format:
+                logger.warning(f"cosy_voice server answered {self.audio_format}, expected {self.request_format}; converting")
                 
             first = True
         
@@ -540,28 +585,54 @@ class CosyVoiceTTS(BaseTTS):
         
         # 重置缓冲区
         self.audio_buffer = np.array([], dtype=np.float32)
+        decoder = None
         
         for chunk in audio_stream:
-            if chunk is not None and len(chunk)>0:          
+            if self.audio_format is not None:
+                decoder = decoder or FrameDecoder(self.audio_format)
+                events = decoder.feed(chunk)
+                for kind, value in events:
+                    if kind == 'end':
+                        logger.info(f"cosy_voice utterance done: {value.get('duration')}s")
+                if self.audio_format == self.request_format:
+                    # 服务端已按协商格式分好20ms帧，直接转发；结束标记之后统一发送end事件
+                    for kind, value in events:
+                        if kind == 'frame' and self.state == State.RUNNING:
+                            eventpoint=None
+                            if first:
+                                eventpoint={'status':'start','text':text,'msgevent':textevent}
+                                first = False
+                            self.parent.put_audio_frame(value, eventpoint)
+                    continue
+                # 服务端回复的格式与请求不同：按回复的格式解码，必要时重采样，再按self.chunk重新分帧
+                frames = [value for kind, value in events if kind == 'frame']
+                if not frames:
+                    continue
+                stream = np.concatenate(frames).astype(np.float32)
+                if self.audio_format.sample_rate != self.sample_rate:
+                    stream = resampy.resample(x=stream, sr_orig=self.audio_format.sample_rate, sr_new=self.sample_rate)
+            elif chunk is not None and len(chunk)>0:
                 stream = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 32767
                 stream = resampy.resample(x=stream, sr_orig=24000, sr_new=self.sample_rate)
-                
-                # 将新数据加入缓冲区
-                self.audio_buffer = np.concatenate([self.audio_buffer, stream])
-                
-                # 发送完整的chunk
-                idx = 0
-                while len(self.audio_buffer) >= self.chunk and self.state == State.RUNNING:
-                    eventpoint=None
-                    if first:
-                        eventpoint={'status':'start','text':text,'msgevent':textevent}
-                        first = False
-                    # 提取一个chunk并发送
-                    chunk_to_send = self.audio_buffer[:self.chunk]
-                    self.parent.put_audio_frame(chunk_to_send, eventpoint)
-                    # 移除已发送的数据
-                    self.audio_buffer = self.audio_buffer[self.chunk:]
-                    idx += 1
+            else:
+                continue
+
+            # 将新数据加入缓冲区
+            self.audio_buffer = np.concatenate([self.audio_buffer, stream])
+            
+            # 发送完整的chunk
+            idx = 0
+            while len(self.audio_buffer) >= self.chunk and self.state == State.RUNNING:
+                eventpoint=None
+                if first:
+                    eventpoint={'status':'start','text':text,'msgevent':textevent}
+                    first = False
+                # 提取一个chunk并发送
+                chunk_to_send = self.audio_buffer[:self.chunk]
+                self.parent.put_audio_frame(chunk_to_send, eventpoint)
+                # 移除已发送的数据
+                self.audio_buffer = self.audio_buffer[self.chunk:]
+                idx += 1
         
         # 处理缓冲区中剩余的音频（重要：避免数据丢失）
         if len(self.audio_buffer) > 0:
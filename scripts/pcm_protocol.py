@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Framed PCM streaming protocol between TTS servers and lip-sync (ttsreal.py).
+
+The client negotiates the output format with form fields (see AudioFormat.to_form):
+    audio_protocol=pcm-frames, sample_rate=16000, sample_format=f32le, frame_ms=20
+A server that supports it answers with the header
+    X-Audio-Format: pcm-frames; rate=16000; format=f32le; frame=320
+and a body of messages, each a 1-byte type + uint32 little-endian length + payload:
+    b'S'  utterance start, JSON payload
+    b'A'  audio, a whole number of frames (frame_samples samples each, sample_format)
+    b'E'  utterance end, JSON payload with the real sample count (the last frame is zero-padded)
+Servers resample once with StreamResampler (polyphase, state kept across chunks), so the
+client only reinterprets bytes as ready 20 ms frames.
+
+Servers that do not know the fields ignore them and reply without X-Audio-Format; clients
+then fall back to the old raw PCM handling. That raw reply (a WAV header of unknown length,
+then 16-bit mono PCM) is built with wav_header / to_pcm16 below.
+"""
+
+import functools
+import json
+import math
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+PROTOCOL = 'pcm-frames'
+SAMPLE_TYPES = {'f32le': np.dtype('<f4'), 's16le': np.dtype('<i2')}
+
+MSG_START = b'S'
+MSG_AUDIO = b'A'
+MSG_END = b'E'
+_MSG_HEADER = struct.Struct('<cI')
+
+
+class AudioFormat:
+    """Negotiated output format: sample rate, sample type and frame size (20 ms at 16 kHz = 320 samples)"""
+
+    def __init__(self, sample_rate: int = 16000, sample_format: str = 'f32le', frame_samples: int = 320):
+        if sample_format not in SAMPLE_TYPES:
+            raise ValueError(f"Unsupported sample_format: {sample_format}")
+        if sample_rate <= 0 or frame_samples <= 0:
+            raise ValueError(f"Invalid audio format: rate={sample_rate}, frame={frame_samples}")
+        self.sample_rate = int(sample_rate)
+        self.sample_format = sample_format
+        self.frame_samples = int(frame_samples)
+        self.dtype = SAMPLE_TYPES[sample_format]
+
+    @classmethod
+    def from_request(cls, audio_protocol: Optional[str], sample_rate: Optional[int] = None,
+                     sample_format: Optional[str] = None, frame_ms: Optional[int] = None) -> Optional['AudioFormat']:
+        """Server side: the format asked for in the request, or None for the legacy output"""
+        if audio_protocol != PROTOCOL:
+            return None
+        sample_rate = int(sample_rate or 16000)
+        return cls(sample_rate, sample_format or 'f32le', sample_rate * int(frame_ms or 20) // 1000)
+
+    def to_form(self) -> dict:
+        """Client side: request fields"""
+        return {
+            'audio_protocol': PROTOCOL,
+            'sample_rate': self.sample_rate,
+            'sample_format': self.sample_format,
+            'frame_ms': self.frame_samples * 1000 // self.sample_rate,
+        }
+
+    def header(self) -> str:
+        return f"{PROTOCOL}; rate={self.sample_rate}; format={self.sample_format}; frame={self.frame_samples}"
+
+    @classmethod
+    def parse_header(cls, value: Optional[str]) -> Optional['AudioFormat']:
+        if not value:
+            return None
+        parts = [p.strip() for p in value.split(';')]
+        if parts[0] != PROTOCOL:
+            return None
+        fields = dict(p.split('=', 1) for p in parts[1:] if '=' in p)
+        return cls(int(fields['rate']), fields['format'], int(fields['frame']))
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.frame_samples * self.dtype.itemsize
+
+    def __eq__(self, other):
+        return isinstance(other, AudioFormat) and self.header() == other.header()
+
+    def __repr__(self):
+        return f"AudioFormat({self.header()})"
+
+
+class StreamResampler:
+    """
+    Polyphase FIR resampler (Kaiser-windowed sinc) that keeps its input history between push()
+    calls, so resampling a stream chunk by chunk gives the same samples as resampling it whole.
+    """
+
+    def __init__(self, source_rate: int, target_rate: int, zero_crossings: int = 16, beta: float = 8.6):
+        g = math.gcd(int(source_rate), int(target_rate))
+        self.up, self.down = target_rate // g, source_rate // g
+        self.passthrough = self.up == self.down
+        if self.passthrough:
+            return
+        # 半长取down的整数倍，滤波器延迟正好是整数个输出样本
+        half = self.down * math.ceil(zero_crossings * max(self.up, self.down) / self.down)
+        taps = np.arange(-half, half + 1)
+        cutoff = 0.5 / max(self.up, self.down)  # 相对上采样后的采样率
+        h = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.kaiser(len(taps), beta)
+        h *= self.up / h.sum()
+        # 按相位拆分：相位φ的第k个系数是 h[φ + k*up]
+        self.taps_per_phase = math.ceil(len(h) / self.up)
+        h = np.concatenate([h, np.zeros(self.taps_per_phase * self.up - len(h))])
+        self.phases = h.reshape(self.taps_per_phase, self.up).T.astype(np.float32)
+        self.delay = half // self.down  # 以输出样本计
+        self.reset()
+
+    def reset(self):
+        if self.passthrough:
+            return
+        self.history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self.consumed = 0  # 已处理的输入样本数
+        self.next_out = 0  # 下一个输出样本序号（含滤波器延迟）
+        self.total_in = 0
+        self.emitted = 0
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.passthrough:
+            return samples
+        self.total_in += len(samples)
+        out = self._process(samples)
+        self.emitted += len(out)
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Emit the filter tail and reset for the next utterance"""
+        if self.passthrough:
+            return np.zeros(0, dtype=np.float32)
+        tail = self._process(np.zeros(self.delay * self.down // self.up + 2, dtype=np.float32))
+        expected = math.ceil(self.total_in * self.up / self.down)
+        out = tail[:max(0, expected - self.emitted)]
+        self.reset()
+        return out
+
+    def _process(self, samples: np.ndarray) -> np.ndarray:
+        buf = np.concatenate([self.history, samples])
+        # buf[i] 是第 first_index + i 个输入样本，开头的history初始为零
+        first_index = self.consumed - len(self.history)
+        last_index = first_index + len(buf) - 1
+        start = self.next_out
+        self.next_out = (last_index * self.up) // self.down + 1  # 现有输入能算出的输出上限
+        n = np.arange(start, self.next_out)
+        t = n * self.down
+        p_max = t // self.up
+        idx = (p_max - first_index)[:, None] - np.arange(self.taps_per_phase)[None, :]
+        out = np.einsum('nk,nk->n', self.phases[t - p_max * self.up], buf[idx]).astype(np.float32)
+        self.history = buf[len(buf) - (self.taps_per_phase - 1):]
+        self.consumed = last_index + 1
+        # 去掉开头的滤波器延迟
+        return out[max(0, self.delay - start):]
+
+
+class FrameEncoder:
+    """
+    Server side. Feed float32 audio at source_rate; returns protocol bytes with whole frames only.
+    """
+
+    def __init__(self, fmt: AudioFormat, source_rate: int):
+        self.fmt = fmt
+        self.resampler = StreamResampler(source_rate, fmt.sample_rate)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.samples = 0
+        self._odd_byte = b''
+
+    def start(self, **meta) -> bytes:
+        meta.update(sample_rate=self.fmt.sample_rate, sample_format=self.fmt.sample_format,
+                    frame_samples=self.fmt.frame_samples)
+        return _message(MSG_START, json.dumps(meta).encode())
+
+    def push(self, samples: np.ndarray) -> bytes:
+        return self._frames(self.resampler.push(samples))
+
+    def push_pcm16(self, data: bytes) -> bytes:
+        """Raw little-endian int16 bytes, chunk boundaries may split a sample"""
+        data = self._odd_byte + data
+        cut = len(data) - len(data) % 2
+        self._odd_byte = data[cut:]
+        return self.push(np.frombuffer(data[:cut], dtype='<i2').astype(np.float32) / 32768.0)
+
+    def end(self, **meta) -> bytes:
+        out = self._frames(self.resampler.flush())
+        if len(self.pending):
+            frame = np.zeros(self.fmt.frame_samples, dtype=np.float32)
+            frame[:len(self.pending)] = self.pending
+            self.samples += len(self.pending)
+            self.pending = np.zeros(0, dtype=np.float32)
+            out += _message(MSG_AUDIO, self._encode(frame))
+        meta.update(samples=self.samples, duration=round(self.samples / self.fmt.sample_rate, 3))
+        return out + _message(MSG_END, json.dumps(meta).encode())
+
+    def _frames(self, samples: np.ndarray) -> bytes:
+        buf = np.concatenate([self.pending, samples]) if len(self.pending) else samples
+        whole = len(buf) - len(buf) % self.fmt.frame_samples
+        self.pending = buf[whole:]
+        if not whole:
+            return b''
+        self.samples += whole
+        return _message(MSG_AUDIO, self._encode(buf[:whole]))
+
+    def _encode(self, samples: np.ndarray) -> bytes:
+        if self.fmt.sample_format == 's16le':
+            return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+        return samples.astype('<f4').tobytes()
+
+
+class FrameDecoder:
+    """
+    Client side. feed() network chunks, get back events:
+        ('start', meta) / ('frame', float32 array of frame_samples) / ('end', meta)
+    """
+
+    def __init__(self, fmt: AudioFormat):
+        self.fmt = fmt
+        self.buf = b''
+
+    def feed(self, data: bytes) -> List[Tuple[str, object]]:
+        self.buf += data
+        events = []
+        while len(self.buf) >= _MSG_HEADER.size:
+            kind, length = _MSG_HEADER.unpack_from(self.buf)
+            if len(self.buf) < _MSG_HEADER.size + length:
+                break
+            payload = self.buf[_MSG_HEADER.size:_MSG_HEADER.size + length]
+            self.buf = self.buf[_MSG_HEADER.size + length:]
+            if kind == MSG_AUDIO:
+                frames = np.frombuffer(payload, dtype=self.fmt.dtype).reshape(-1, self.fmt.frame_samples)
+                if self.fmt.sample_format == 's16le':
+                    frames = frames.astype(np.float32) / 32767
+                events.extend(('frame', frame) for frame in frames)
+            elif kind == MSG_START:
+                events.append(('start', json.loads(payload)))
+            elif kind == MSG_END:
+                events.append(('end', json.loads(payload)))
+        return events
+
+
+def _message(kind: bytes, payload: bytes) -> bytes:
+    return _MSG_HEADER.pack(kind, len(payload)) + payload
+
+
+def wav_header(sample_rate: int, data_size: int = 0xFFFFFFFF - 36) -> bytes:
+    """16-bit mono WAV header; the default size marks a stream of unknown length."""
+    return (b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", data_size))
+
+
+def to_pcm16(samples) -> bytes:
+    """Mono float samples in [-1, 1] (numpy array or CPU tensor) -> 16-bit little-endian PCM."""
+    samples = np.clip(np.asarray(samples, dtype=np.float32).reshape(-1), -1.0, 1.0)
+    return (samples * 32767).astype('<i2').tobytes()
+
+
+@functools.lru_cache(maxsize=None)
+def torch_resampler(source_rate: int, target_rate: int):
+    """torchaudio Resample for one rate pair, built once per process (its kernel is costly to set up)."""
+    import torchaudio  # 只有TTS服务端需要，lip-sync 客户端不依赖 torch
+    return torchaudio.transforms.Resample(orig_freq=source_rate, new_freq=target_rate)
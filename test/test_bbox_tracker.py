@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Keyframe Face Detection Parity Test & Benchmark
+
+Drives lip-sync/musetalk/utils/bbox_tracker.py on a synthetic talking-head clip (a textured
+face patch with a moving mouth, drifting over a textured background, one scene cut, a few
+frames without a face). The detector is a stub that returns the ground-truth box and costs
+DETECT_COST seconds, about what SFD + DWPose take per frame on a GPU:
+
+- keyframe_stride=1 calls the detector on every frame (the previous behaviour)
+- keyframe_stride=5 (the default in simple_musetalk) stays within a few pixels of per-frame
+  detection and calls the detector on about a fifth of the frames
+- scene cuts and missing faces force a full detection, smoothing never crosses them
+
+Only numpy and opencv are required.
+
+    python -m pytest test/test_bbox_tracker.py   # parity
+    python test/test_bbox_tracker.py             # benchmark
+"""
+
+import os
+import sys
+import time
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lip-sync', 'musetalk', 'utils')))
+from bbox_tracker import BoxTracker, coord_placeholder, detect_boxes, smooth_boxes
+
+W, H = 1280, 720
+FACE_W, FACE_H = 220, 280
+FRAMES = 150
+SCENE_CUT = 80
+NO_FACE = range(120, 124)
+DETECT_COST = 0.02
+
+
+def texture(rng, h, w, blur):
+    noise = cv2.GaussianBlur(rng.random((h, w, 3)).astype(np.float32), (0, 0), blur)
+    return cv2.normalize(noise, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+
+@lru_cache(maxsize=None)
+def make_clip(seed=0):
+    """returns (frames, ground-truth boxes)"""
+    rng = np.random.default_rng(seed)
+    backgrounds = [texture(rng, H, W, 40), texture(rng, H, W, 40)]  # 大块明暗，场景切换时缩略图明显不同
+    face = texture(rng, FACE_H, FACE_W, 5)
+    frames, boxes = [], []
+    for i in range(FRAMES):
+        scene = int(i >= SCENE_CUT)
+        frame = backgrounds[scene].copy()
+        if i in NO_FACE:
+            frames.append(frame)
+            boxes.append(coord_placeholder)
+            continue
+        t = i - SCENE_CUT * scene
+        x = int(300 + 500 * scene + 40 * np.sin(t / 15))
+        y = int(150 + 100 * scene + 15 * np.sin(t / 9))
+        patch = face.copy()
+        mouth_h = 10 + int(20 * abs(np.sin(i / 2)))  # 嘴部开合
+        cv2.ellipse(patch, (FACE_W // 2, 215), (40, mouth_h), 0, 0, 360, (30, 20, 90), -1)
+        frame[y:y + FACE_H, x:x + FACE_W] = patch
+        frames.append(frame)
+        boxes.append((x, y, x + FACE_W, y + FACE_H))
+    return frames, boxes
+
+
+class StubDetector:
+    def __init__(self, frames, boxes, cost=0.0):
+        self.truth = {id(f): b for f, b in zip(frames, boxes)}
+        self.cost = cost
+        self.calls = 0
+
+    def __call__(self, frame):
+        self.calls += 1
+        if self.cost:
+            time.sleep(self.cost)
+        return self.truth[id(frame)]
+
+
+def run(stride, smooth=1, cost=0.0):
+    frames, boxes = make_clip()
+    detect = StubDetector(frames, boxes, cost)
+    tracker = BoxTracker(stride=stride) if stride > 1 else None
+    start = time.perf_counter()
+    coords = detect_boxes(frames, detect, tracker, smooth)
+    return coords, boxes, detect.calls, time.perf_counter() - start, tracker
+
+
+def max_error(coords, boxes):
+    return max(max(abs(a - b) for a, b in zip(c, g)) for c, g in zip(coords, boxes) if g != coord_placeholder)
+
+
+def test_stride_one_is_per_frame_detection():
+    coords, boxes, calls, _, _ = run(stride=1)
+    assert coords == boxes and calls == FRAMES
+
+
+def test_keyframes_match_per_frame_detection():
+    coords, boxes, calls, _, tracker = run(stride=5)
+    assert max_error(coords, boxes) <= 2, max_error(coords, boxes)
+    assert [c == coord_placeholder for c in coords] == [b == coord_placeholder for b in boxes]
+    assert calls <= FRAMES // 5 + 10, (calls, tracker.stats)  # 场景切换和无脸帧会多几次完整检测
+    assert tracker.stats['scene_cuts'] == 1, tracker.stats
+    assert tracker.stats['drift'] == 1, tracker.stats  # 只有人脸离开画面那一帧跟丢
+
+
+def test_scene_cut_forces_detection():
+    frames, boxes = make_clip()
+    detect = StubDetector(frames, boxes)
+    tracker = BoxTracker(stride=50)
+    coords = detect_boxes(frames[:SCENE_CUT + 1], detect, tracker)
+    assert coords[SCENE_CUT] == boxes[SCENE_CUT]  # 没有跟着上一个场景的框平移
+    assert tracker.segment == 1 and detect.calls == 3  # 第0帧、第50帧、场景切换
+
+
+def test_smoothing_does_not_cross_cuts_or_missing_faces():
+    coords = [(0, 0, 10, 10), (2, 0, 12, 10), coord_placeholder, (100, 100, 110, 110), (102, 100, 112, 110),
+              (500, 0, 510, 10)]
+    segments = [0, 0, 0, 0, 0, 1]
+    out = smooth_boxes(coords, segments, window=3)
+    assert out[2] == coord_placeholder and out[5] == coords[5]
+    assert out[0][0] in (0, 1) and out[3][0] in (100, 101)  # 只和同一段的邻居平均
+    _, boxes, _, _, _ = run(stride=1)
+    smoothed, _, _, _, _ = run(stride=5, smooth=3)
+    assert max_error(smoothed, boxes) <= 3
+
+
+if __name__ == "__main__":
+    print(f"{'stride':>6} {'detections':>10} {'max err px':>10} {'seconds':>8}")
+    base = None
+    for stride in (1, 3, 5, 8):
+        coords, boxes, calls, seconds, _ = run(stride, cost=DETECT_COST)
+        base = base or seconds
+        print(f"{stride:>6} {calls:>10} {max_error(coords, boxes):>10} {seconds:>8.2f}  ({base / seconds:.1f}x)")
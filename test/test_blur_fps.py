@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Background Blur Throughput Benchmark (CPU)
+
+Runs the same input video through
+  1. the original serial loop (one frame per forward, float32 compose,
+     cv.VideoWriter mp4v, then an ffmpeg remux for audio), and
+  2. the batched pipeline in lip-sync/blur/bgseg.py (decode / batched
+     forward / uint8 compose / ffmpeg encode+mux as overlapping stages),
+and reports frames per second for each.
+
+The pytest checks compare the uint8 compose path against the float one on a synthetic frame
+and mask (no model or video needed): the blend itself is within 1 LSB, the whole frame with
+the downscaled blur within MAX_ERROR (mean under 1 LSB).
+
+    python -m pytest test/test_blur_fps.py                        # parity
+    python test/test_blur_fps.py input.mp4 [model.onnx] [batch_size]   # benchmark
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2 as cv
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lip-sync', 'blur')))
+from bgseg import MODEL_PATH, Segmenter, process_video, preprocess, postprocess, compose, compose_frame, compose_u8
+
+FFMPEG = os.environ.get("FFMPEG", "ffmpeg")
+MAX_ERROR = 10  # 缩小后模糊 + 线性插值的alpha，和逐像素float路径的最大差（LSB）
+
+
+def serial_reference(inp, out, model_path, kernel=101, in_size=192):
+    """The pre-pipeline VideoBGExecutor.process loop, kept here as the baseline"""
+    start = time.perf_counter()
+    net = cv.dnn.readNet(model_path)
+    cap = cv.VideoCapture(inp)
+    w, h = int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv.CAP_PROP_FPS) or 30
+    tmp_path = tempfile.mkstemp(suffix=".mp4")[1]
+    writer = cv.VideoWriter(tmp_path, cv.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+    frames = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        net.setInput(preprocess(frame, in_size))
+        mask = postprocess(net.forward(), (w, h))
+        writer.write(compose(frame, mask, 'blur', kernel))
+        frames += 1
+    cap.release()
+    writer.release()
+    subprocess.run([FFMPEG, "-y", "-i", tmp_path, "-i", inp, "-c", "copy", "-c:v", "libx264",
+                    "-map", "0:v:0", "-map", "1:a:0?", out],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    os.remove(tmp_path)
+    return frames, time.perf_counter() - start
+
+
+def synthetic_frame_and_mask(w=1280, h=720, in_size=192):
+    """textured frame + model output (background=1) with a person-shaped ellipse"""
+    rng = np.random.default_rng(0)
+    noise = cv.GaussianBlur(rng.random((h, w, 3)).astype(np.float32), (0, 0), 20)
+    frame = cv.normalize(noise, None, 0, 255, cv.NORM_MINMAX).astype(np.uint8)
+    out = np.ones((1, 1, in_size, in_size), np.float32)
+    cv.ellipse(out[0, 0], (in_size // 2, in_size * 4 // 7), (in_size // 4, in_size * 3 // 8), 0, 0, 360, 0, -1)
+    return frame, out
+
+
+def test_compose_u8_matches_float_blend():
+    frame, out = synthetic_frame_and_mask()
+    h, w = frame.shape[:2]
+    alpha = np.clip(postprocess(out, (w, h))[..., 0] * 255 + 0.5, 0, 255).astype(np.uint8)
+    bg = cv.GaussianBlur(frame, (101, 101), 0)
+    ref = compose(frame, alpha[..., None] / 255.0, 'replace', 101, bg)
+    assert np.abs(ref.astype(int) - compose_u8(frame, alpha, bg)).max() <= 1
+
+
+def test_compose_frame_matches_float_compose():
+    frame, out = synthetic_frame_and_mask()
+    h, w = frame.shape[:2]
+    ref = compose(frame, postprocess(out, (w, h)), 'blur', 101)
+    alpha = np.clip((1.0 - out[:, 0]) * 255.0 + 0.5, 0, 255).astype(np.uint8)[0]  # Segmenter 的输出
+    diff = np.abs(ref.astype(int) - compose_frame(frame, alpha, 'blur', 101))
+    assert diff.max() <= MAX_ERROR and diff.mean() < 1.0, (diff.max(), diff.mean())
+    assert (compose_frame(frame, alpha, 'none', 101) == frame).all()
+
+
+def run_benchmark(inp, model_path, batch_size=8):
+    print(f"\n{'='*60}")
+    print(" Background Blur Throughput Benchmark (CPU)")
+    print(f"{'='*60}")
+    print(f"Input: {inp}")
+    print(f"Model: {model_path}")
+    print(f"Batch size: {batch_size}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        frames, elapsed = serial_reference(inp, os.path.join(tmp, "serial.mp4"), model_path)
+        serial_fps = frames / elapsed
+        print(f"\n  serial    {frames} frames in {elapsed:7.2f}s  -> {serial_fps:6.1f} fps")
+
+        segmenter = Segmenter(model_path)
+        frames, elapsed = process_video(inp, os.path.join(tmp, "pipeline.mp4"), segmenter,
+                                        batch_size=batch_size, ffmpeg=FFMPEG)
+        pipeline_fps = frames / elapsed
+        print(f"  pipeline  {frames} frames in {elapsed:7.2f}s  -> {pipeline_fps:6.1f} fps"
+              f"  (batched forward: {segmenter.batched})")
+
+    print(f"\nSpeedup: {pipeline_fps / serial_fps:.2f}x")
+    return serial_fps, pipeline_fps
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    model = sys.argv[2] if len(sys.argv) > 2 else MODEL_PATH
+    batch = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    run_benchmark(sys.argv[1], model, batch)
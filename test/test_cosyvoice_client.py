@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+CosyVoice Framed Stream Client Test
+
+Feeds a scripts/pcm_protocol.py frame stream (what tts/cosyvoice answers when the client asks
+for pcm-frames) through CosyVoiceTTS.stream_tts in lip-sync/ttsreal.py with a stub parent:
+the 20 ms frames reach put_audio_frame unchanged, with the start event on the first frame and
+the end event after the server's end marker. A server answering another format is decoded as
+announced and re-chunked instead of dropping the utterance.
+
+    python -m pytest test/test_cosyvoice_client.py
+
+Needs the lip-sync env (ttsreal imports resampy, requests, edge_tts).
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lip-sync')))
+from ttsreal import CosyVoiceTTS, State
+from scripts.pcm_protocol import AudioFormat, FrameEncoder
+
+SERVER_RATE = 24000
+
+
+class StubParent:
+    def __init__(self):
+        self.frames = []  # (samples, eventpoint)
+
+    def put_audio_frame(self, frame, eventpoint=None):
+        self.frames.append((frame, eventpoint))
+
+
+def make_tts():
+    parent = StubParent()
+    tts = CosyVoiceTTS(SimpleNamespace(fps=50), parent)
+    tts.audio_format = tts.request_format  # 服务端按协商格式回复
+    return tts, parent
+
+
+def server_stream(tts, seconds=0.5, split=777):
+    audio = (0.3 * np.sin(2 * np.pi * 220 * np.arange(int(SERVER_RATE * seconds)) / SERVER_RATE)).astype(np.float32)
+    encoder = FrameEncoder(tts.audio_format, SERVER_RATE)
+    body = encoder.start(text='hello') + encoder.push(audio[:5000]) + encoder.push(audio[5000:]) + encoder.end()
+    return [body[i:i + split] for i in range(0, len(body), split)]  # 网络分块和消息边界无关
+
+
+def test_frames_forwarded_with_events():
+    tts, parent = make_tts()
+    tts.stream_tts(iter(server_stream(tts)), ('hello', 'evt'))
+    frames = parent.frames
+    assert all(len(f) == tts.chunk and f.dtype == np.float32 for f, _ in frames)
+    assert frames[0][1] == {'status': 'start', 'text': 'hello', 'msgevent': 'evt'}
+    assert all(e is None for _, e in frames[1:-1])
+    assert frames[-1][1] == {'status': 'end', 'text': 'hello', 'msgevent': 'evt'}
+    speech = len(frames) - 1  # 最后是结束事件的静音帧
+    assert speech == -(-8000 // tts.chunk), speech  # 0.5 s @ 16 kHz
+    audio = np.concatenate([f for f, _ in frames[:speech]])
+    t = np.arange(len(audio)) / tts.sample_rate
+    expected = 0.3 * np.sin(2 * np.pi * 220 * t)
+    assert np.abs(audio[200:7800] - expected[200:7800]).max() < 0.01  # 不经过客户端重采样
+
+
+def test_paused_stream_drops_frames():
+    tts, parent = make_tts()
+    tts.state = State.PAUSE  # flush_talk
+    tts.stream_tts(iter(server_stream(tts)), ('hello', None))
+    assert len(parent.frames) == 1 and parent.frames[0][1]['status'] == 'end'
+
+
+def test_other_answered_format_is_rechunked():
+    tts, parent = make_tts()
+    tts.audio_format = AudioFormat(tts.sample_rate, 's16le', 640)  # 同采样率，但是s16le的40ms帧
+    tts.stream_tts(iter(server_stream(tts)), ('hello', 'evt'))
+    frames = parent.frames
+    assert all(len(f) == tts.chunk and f.dtype == np.float32 for f, _ in frames)
+    assert frames[0][1]['status'] == 'start' and frames[-1][1]['status'] == 'end'
+    audio = np.concatenate([f for f, _ in frames])
+    t = np.arange(len(audio)) / tts.sample_rate
+    expected = 0.3 * np.sin(2 * np.pi * 220 * t)
+    assert np.abs(audio[200:7800] - expected[200:7800]).max() < 0.01
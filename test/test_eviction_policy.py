@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Avatar Eviction Policy Test & Simulation
+
+Drives avatar-manager/eviction.py (and the scheduler's shortfall/held_mb) without GPUs or
+instances: weekly schedules are predicted, login bursts are not all-day demand, the cheapest
+idle instance is evicted, pre-warming never evicts anything worth more, and the daily report
+survives a restart. The idle-expiry test imports manager.py and needs psutil.
+
+    python -m pytest test/test_eviction_policy.py   # checks
+    python test/test_eviction_policy.py             # last week of a simulated term, fixed pool vs predictive
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'avatar-manager')))
+from eviction import DAY, WEEK, EvictionPolicy, UsageHistory, UsageReport
+from scheduler import FakeGpuProvider, PlacementScheduler
+
+HOUR = 3600
+MONDAY = datetime(2026, 1, 5).timestamp()  # local midnight, a Monday
+
+
+def make_policy(**kwargs):
+    return EvictionPolicy(UsageHistory(900, 14, 3600), horizon=HOUR, default_cold_start=30, **kwargs)
+
+
+def attend(policy, name, start, users=20):
+    """users log in during the first 10 minutes of a class"""
+    for i in range(users):
+        policy.record_request(name, start + i * 600 / users)
+
+
+def test_weekly_schedule_predicted():
+    policy = make_policy()
+    for week in range(2):
+        attend(policy, 'networks', MONDAY + week * WEEK + 1 * DAY + 10 * HOUR)  # Tuesdays 10:00
+        attend(policy, 'compilers', MONDAY + week * WEEK + 3 * DAY + 14 * HOUR)  # Thursdays 14:00
+    week3 = MONDAY + 2 * WEEK
+    assert policy.reuse_probability('networks', week3 + 1 * DAY + 9.5 * HOUR) > 0.9
+    assert policy.reuse_probability('networks', week3 + 2 * DAY + 9.5 * HOUR) < 0.2  # Wednesday
+    assert policy.reuse_probability('compilers', week3 + 1 * DAY + 9.5 * HOUR) < 0.2
+    predicted = [name for name, _ in policy.predict(week3 + 3 * DAY + 13.5 * HOUR, min_probability=0.3)]
+    assert predicted == ['compilers'], predicted
+
+
+def test_login_burst_is_not_all_day_demand():
+    policy = make_policy()
+    attend(policy, 'big', MONDAY + 10 * HOUR, users=200)
+    attend(policy, 'small', MONDAY + 10 * HOUR, users=2)
+    for hours in (10.5, 16):
+        assert policy.reuse_probability('big', MONDAY + hours * HOUR) == policy.reuse_probability('small', MONDAY + hours * HOUR)
+    assert policy.reuse_probability('big', MONDAY + 10.5 * HOUR) > 0.3  # class still going
+    assert policy.reuse_probability('big', MONDAY + 16 * HOUR) < 0.1
+
+
+def test_lowest_value_evicted_first():
+    policy = make_policy()
+    now = MONDAY + 2 * WEEK + 1 * DAY + 9.5 * HOUR
+    for week in range(2):
+        attend(policy, 'networks', MONDAY + week * WEEK + 1 * DAY + 10 * HOUR)
+    policy.record_request('old', now - 6 * HOUR)
+    candidates = [
+        {'avatar_id': 'networks_user_1', 'name': 'networks', 'gpu_id': 0, 'memory_mb': 11000},
+        {'avatar_id': 'old_user_1', 'name': 'old', 'gpu_id': 0, 'memory_mb': 11000},
+        {'avatar_id': 'never_user_1', 'name': 'never', 'gpu_id': 1, 'memory_mb': 11000},
+    ]
+    gpu, victims = policy.choose_victims(candidates, {}, need_slot=True, now=now)
+    assert gpu is None and [v['avatar_id'] for v in victims] == ['never_user_1']
+    # memory is short on GPU 0 only: the class-time instance is kept, the stale one goes
+    gpu, victims = policy.choose_victims(candidates, {0: 8000}, need_slot=False, now=now)
+    assert gpu == 0 and [v['avatar_id'] for v in victims] == ['old_user_1'], victims
+    # nothing to evict -> no room
+    assert policy.choose_victims([], {0: 8000}, need_slot=False, now=now) is None
+    assert policy.choose_victims(candidates, {}, need_slot=False, now=now) == (None, [])
+
+
+def test_cheaper_gpu_chosen_and_prewarm_threshold():
+    policy = make_policy()
+    now = MONDAY + 12 * HOUR
+    policy.record_request('busy', now - 600)
+    candidates = [
+        {'avatar_id': 'busy_1', 'name': 'busy', 'gpu_id': 0, 'memory_mb': 11000},
+        {'avatar_id': 'small_1', 'name': 'a', 'gpu_id': 1, 'memory_mb': 4000},
+        {'avatar_id': 'small_2', 'name': 'b', 'gpu_id': 1, 'memory_mb': 4000},
+    ]
+    gpu, victims = policy.choose_victims(candidates, {0: 6000, 1: 6000}, need_slot=False, now=now)
+    assert gpu == 1 and len(victims) == 2  # two worthless instances beat one that is about to be reused
+    busy_value = policy.value('busy', 11000, now)
+    assert policy.choose_victims(candidates[:1], {0: 6000}, False, now=now, max_value=busy_value) is None
+
+
+def test_scheduler_shortfall():
+    provider = FakeGpuProvider((24576, 24576))
+    scheduler = PlacementScheduler(provider, [0, 1], footprints={'musetalk': 11000}, headroom_mb=1024)
+    assert scheduler.shortfall('musetalk') == {}
+    for key in ('a', 'b', 'c', 'd'):
+        scheduler.reserve(key, 'musetalk')
+    missing = scheduler.shortfall('musetalk')
+    assert set(missing) == {0, 1} and all(mb > 0 for mb in missing.values()), missing
+    provider.set_process(scheduler.reservations['a'].gpu_id, 4242, 12000)
+    scheduler.confirm('a', [4242])
+    assert scheduler.held_mb('a') == 12000
+    assert scheduler.held_mb('missing') == 0
+
+
+def test_report_and_persistence():
+    path = os.path.join(tempfile.mkdtemp(), 'usage_history.json')
+    policy = make_policy(state_file=path, report=UsageReport(max_gap=600))
+    day = MONDAY + 9 * HOUR
+    policy.record_request('networks', day)
+    policy.record_start('networks', 24.0, cold=True, ts=day)
+    policy.record_start('compilers', 20.0, cold=False, ts=day)
+    policy.record('evictions', day)
+    policy.tick([], day)
+    for step in range(1, 13):  # one hour in 5-minute ticks, one busy and one idle instance
+        policy.tick([{'memory_mb': 11264, 'idle': False}, {'memory_mb': 4096, 'idle': True}], day + step * 300)
+    policy.tick([{'memory_mb': 11264, 'idle': False}], day + 3 * HOUR)  # manager was down: capped at max_gap
+    policy.save()
+
+    restored = make_policy(state_file=path)
+    [report] = restored.get_report(7)
+    assert report['cold_starts'] == 1 and report['prewarms'] == 1 and report['evictions'] == 1
+    assert report['avg_cold_start_seconds'] == 24.0
+    assert abs(report['gpu_hours'] - (2 + 600 / HOUR)) < 1e-3, report
+    assert abs(report['idle_gpu_hours'] - 1) < 1e-3
+    assert abs(report['gpu_gb_hours'] - (11 + 4 + 11 * 600 / HOUR)) < 1e-3
+    assert restored.cold_start == {'networks': 24.0, 'compilers': 20.0}
+    assert restored.history.slots == policy.history.slots
+
+
+def test_streaming_instances_not_demoted():
+    """_expire_idle trusts /health sessions over the request clock (needs psutil, the avatar env)"""
+    import threading
+    from datetime import timedelta
+    from prober import HEALTH_HEALTHY, HEALTH_UNHEALTHY
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs('logs')  # manager.py 导入时打开 logs/avatar_manager.log
+    try:
+        import manager
+    finally:
+        os.chdir(cwd)
+
+    mgr = manager.AvatarManager.__new__(manager.AvatarManager)
+    mgr._lock = threading.Lock()
+    mgr._save_state = lambda: None
+    mgr._pool_targets = lambda: []
+    mgr.instances = {}
+    for avatar_id, sessions, status in [('watching', 1, HEALTH_HEALTHY), ('left', 0, HEALTH_HEALTHY),
+                                        ('never_probed', None, None), ('stale', 2, HEALTH_UNHEALTHY)]:
+        instance = manager.AvatarInstance(avatar_id, 0, 0, manager.AdoptedProcess(os.getpid()))
+        instance.connections = 1
+        instance.last_activity -= timedelta(hours=1)  # 一小时没有新请求
+        instance.health.sessions = sessions
+        instance.health.status = status or instance.health.status
+        mgr.instances[avatar_id] = instance
+    mgr._expire_idle(idle_timeout=600)
+    demoted = sorted(a for a, inst in mgr.instances.items() if inst.standby)
+    assert demoted == ['left', 'never_probed', 'stale'], demoted
+    assert mgr.instances['watching'].connections == 1
+
+
+def simulate(predictive, slots=4, weeks=3, seed=1):
+    """
+    A term of weekly classes (8 courses, two 90-minute sessions a week, some office hours) on a
+    box with room for `slots` instances. Returns (cold starts, GPU-hours) of the last week.
+    """
+    rng = random.Random(seed)
+    courses = [f"course{i}" for i in range(8)]
+    sessions = []
+    for i, name in enumerate(courses):
+        for weekday in rng.sample(range(5), 2):
+            sessions.append((name, weekday * DAY + rng.choice([8, 10, 13, 15]) * HOUR + (i % 2) * 1800, 5400))
+        sessions.append((name, rng.randrange(5) * DAY + 19 * HOUR, 1800))  # office hours
+
+    policy = make_policy(report=UsageReport(max_gap=DAY))
+    step, pool_size = 900, 2
+    running = {}  # name -> users connected (0 = idle)
+    usage = {}  # old pool: name -> request times
+    measured_from = MONDAY + (weeks - 1) * WEEK
+    for t in range(int(MONDAY), int(MONDAY + weeks * WEEK), step):
+        week_start = MONDAY + (t - MONDAY) // WEEK * WEEK
+        starting = [s for s in sessions if week_start + s[1] == t]
+        ending = [s for s in sessions if week_start + s[1] + s[2] == t]
+        for name, _, _ in ending:
+            running[name] -= 1
+            if not predictive and running[name] == 0 and name not in old_targets(usage, t, pool_size):
+                del running[name]
+        for name, _, _ in starting:
+            policy.record_request(name, t)
+            usage.setdefault(name, []).append(t)
+            if name not in running:
+                if len(running) >= slots:
+                    idle = [{'avatar_id': n, 'name': n, 'gpu_id': 0, 'memory_mb': 11000}
+                            for n, users in running.items() if users == 0]
+                    choice = policy.choose_victims(idle, {}, True, now=t)
+                    if choice is None:
+                        continue  # over capacity: rejected in both policies
+                    del running[choice[1][0]['avatar_id']]
+                policy.record_start(name, 30, cold=True, ts=t)
+                running[name] = 0
+            running[name] += 1
+        # 预热：old = top-N by 24 h count, predictive = predicted for the next hour
+        targets = (old_targets(usage, t, pool_size) if not predictive else
+                   [n for n, _ in policy.predict(t, min_probability=0.3)][:pool_size])
+        for name in targets:
+            if name in running:
+                continue
+            if predictive and len(running) >= slots - 1:
+                # same as replenish_pool: only evict instances worth less than the one being pre-warmed
+                idle = [{'avatar_id': n, 'name': n, 'gpu_id': 0, 'memory_mb': 11000}
+                        for n, users in running.items() if users == 0]
+                choice = policy.choose_victims(idle, {}, True, now=t, max_value=policy.value(name, 11000, t))
+                if choice:
+                    del running[choice[1][0]['avatar_id']]
+            if len(running) < slots - 1:
+                running[name] = 0
+                policy.record_start(name, 30, cold=False, ts=t)
+        policy.tick([{'memory_mb': 11000, 'idle': users == 0} for users in running.values()], t)
+    days = [d for d in policy.get_report(7 * weeks) if datetime.strptime(d['date'], '%Y-%m-%d').timestamp() >= measured_from]
+    return sum(d['cold_starts'] for d in days), sum(d['gpu_hours'] for d in days)
+
+
+def old_targets(usage, now, pool_size):
+    counts = {n: sum(1 for t in ts if now - t <= DAY) for n, ts in usage.items()}
+    return [n for n, c in sorted(counts.items(), key=lambda item: -item[1]) if c > 0][:pool_size]
+
+
+def test_predictive_has_fewer_cold_starts():
+    old_cold, old_hours = simulate(predictive=False)
+    new_cold, new_hours = simulate(predictive=True)
+    assert new_cold < old_cold, (old_cold, new_cold)
+
+
+if __name__ == "__main__":
+    for label, predictive in (("fixed pool", False), ("predictive", True)):
+        cold, hours = simulate(predictive=predictive)
+        print(f"{label:>10}: {cold} cold starts / {hours:.0f} GPU-h in the last simulated week")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Audio Feature Windowing Parity Test & Microbenchmark
+
+Checks that the vectorized windowing in lip-sync/featwindow.py matches the
+original per-index Python loops for all three model families:
+
+- musetalk:   whisper feature2chunks (T, 5, 384)  -> (B, 50, 384)
+- ultralight: hubert feature2chunks  (T, 1024)    -> (B, 32, 1024), get_audio_features
+- wav2lip:    LipASR mel chunks      (80, T)      -> (B, 80, 16)
+
+Only numpy is required.
+
+    python -m pytest test/test_feature_windowing.py   # parity
+    python test/test_feature_windowing.py             # microbenchmark
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lip-sync')))
+from featwindow import sliced_windows, padded_windows, mel_windows
+
+
+# ---------------------------------------------------------------------------
+# Original loop implementations (reference)
+# ---------------------------------------------------------------------------
+
+def loop_sliced_feature(feature_array, vid_idx, left, right, fps, dim):
+    length = len(feature_array)
+    selected_feature = []
+    center_idx = int(vid_idx * 50 / fps)
+    for idx in range(center_idx - left, center_idx + right):
+        idx = max(0, idx)
+        idx = min(length - 1, idx)
+        selected_feature.append(feature_array[idx])
+    return np.concatenate(selected_feature, axis=0).reshape(-1, dim)
+
+
+def loop_feature2chunks(feature_array, fps, batch_size, left, right, dim, start=0):
+    return [loop_sliced_feature(feature_array, i + start, left, right, fps, dim) for i in range(batch_size)]
+
+
+def loop_audio_features(features, index):
+    left = index - 8
+    right = index + 8
+    pad_left = max(0, -left)
+    pad_right = max(0, right - features.shape[0])
+    auds = features[max(0, left):min(right, features.shape[0])]
+    return np.concatenate([np.zeros_like(features[:pad_left]), auds, np.zeros_like(features[:pad_right])], axis=0)
+
+
+def loop_mel_chunks(mel, num_frames, left, mel_idx_multiplier, mel_step_size=16):
+    i = 0
+    mel_chunks = []
+    while i < num_frames / 2:
+        start_idx = int(left + i * mel_idx_multiplier)
+        if start_idx + mel_step_size > len(mel[0]):
+            mel_chunks.append(mel[:, len(mel[0]) - mel_step_size:])
+        else:
+            mel_chunks.append(mel[:, start_idx: start_idx + mel_step_size])
+        i += 1
+    return mel_chunks
+
+
+# ---------------------------------------------------------------------------
+# Parity
+# ---------------------------------------------------------------------------
+
+def musetalk_features(T=52):
+    return np.random.rand(T, 5, 384).astype(np.float32)
+
+
+def hubert_features(T=52):
+    return np.random.rand(T, 1024).astype(np.float32)
+
+
+def test_musetalk_windowing_parity():
+    features = musetalk_features()
+    for start in (0, 5.0, 20):
+        expected = np.stack(loop_feature2chunks(features, 25.0, 16, 4, 6, 384, start=start))
+        actual = sliced_windows(features, 16, 25.0, 4, 6, start=start).reshape(16, -1, 384)
+        assert actual.shape == (16, 50, 384)
+        assert actual.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_ultralight_windowing_parity():
+    features = hubert_features()
+    for start in (0, 5.0, 20):
+        expected = np.stack(loop_feature2chunks(features, 25.0, 16, 16, 16, 1024, start=start))
+        actual = sliced_windows(features, 16, 25.0, 16, 16, start=start)
+        assert actual.shape == (16, 32, 1024)
+        np.testing.assert_array_equal(actual, expected)
+
+
+def test_ultralight_audio_features_parity():
+    features = hubert_features(20)
+    indices = [0, 3, 10, 17, 19]
+    actual = padded_windows(features, indices, 8, 8)
+    for i, index in enumerate(indices):
+        np.testing.assert_array_equal(actual[i], loop_audio_features(features, index))
+
+
+def test_wav2lip_mel_windowing_parity():
+    mel = np.random.rand(80, 210).astype(np.float32)
+    for num_frames in (32, 31, 50):
+        expected = np.stack(loop_mel_chunks(mel, num_frames, 16.0, 80. * 2 / 50))
+        actual = mel_windows(mel, -(-num_frames // 2), 16.0, 80. * 2 / 50)
+        assert actual.shape == expected.shape
+        assert actual.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(actual, expected)
+
+
+# ---------------------------------------------------------------------------
+# Microbenchmark
+# ---------------------------------------------------------------------------
+
+def bench(name, loop_fn, vec_fn, repeat=200):
+    loop_fn(), vec_fn()
+    t = time.perf_counter()
+    for _ in range(repeat):
+        loop_fn()
+    loop_ms = (time.perf_counter() - t) / repeat * 1000
+    t = time.perf_counter()
+    for _ in range(repeat):
+        vec_fn()
+    vec_ms = (time.perf_counter() - t) / repeat * 1000
+    print(f"  {name:<12} loop: {loop_ms:8.3f} ms   vectorized: {vec_ms:8.3f} ms   speedup: {loop_ms / vec_ms:6.1f}x")
+
+
+if __name__ == "__main__":
+    print(f"\n{'='*60}")
+    print(" Feature Windowing Microbenchmark (batch_size=16, per batch)")
+    print(f"{'='*60}")
+    whisper = musetalk_features()
+    hubert = hubert_features()
+    mel = np.random.rand(80, 210).astype(np.float32)
+    bench("musetalk",
+          lambda: np.stack(loop_feature2chunks(whisper, 25.0, 16, 4, 6, 384, start=5.0)),
+          lambda: sliced_windows(whisper, 16, 25.0, 4, 6, start=5.0).reshape(16, -1, 384))
+    bench("ultralight",
+          lambda: np.stack(loop_feature2chunks(hubert, 25.0, 16, 16, 16, 1024, start=5.0)),
+          lambda: sliced_windows(hubert, 16, 25.0, 16, 16, start=5.0))
+    bench("wav2lip",
+          lambda: np.stack(loop_mel_chunks(mel, 32, 16.0, 3.2)),
+          lambda: mel_windows(mel, 16, 16.0, 3.2))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Instance Health Prober Test
+
+Probes local fake instances (healthy, hung, closed port) with avatar-manager/prober.py: one
+round takes about one timeout however many instances hang, and status changes use hysteresis.
+
+    python -m pytest test/test_health_probe.py   # checks
+    python test/test_health_probe.py             # round time with 10 hung instances
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'avatar-manager')))
+from prober import HealthProber, HealthState, HEALTH_HEALTHY, HEALTH_DEGRADED, HEALTH_UNHEALTHY
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake_instances(healthy=1, hung=1):
+    """Run fake instances on a background event loop, returns {name: port}"""
+    loop = asyncio.new_event_loop()
+    ports = {}
+
+    async def answer(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        body = json.dumps({"status": "healthy", "sessions": 1, "max_sessions": 4}).encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    async def hang(reader, writer):
+        await asyncio.sleep(3600)
+
+    async def setup():
+        for i in range(healthy):
+            port = free_port()
+            await asyncio.start_server(answer, '127.0.0.1', port)
+            ports[f"healthy_{i}"] = port
+        for i in range(hung):
+            port = free_port()
+            await asyncio.start_server(hang, '127.0.0.1', port)
+            ports[f"hung_{i}"] = port
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(setup(), loop).result()
+    ports["closed"] = free_port()
+    return ports
+
+
+def probe_round(healthy=3, hung=10, timeout=0.5):
+    ports = start_fake_instances(healthy=healthy, hung=hung)
+    start = time.perf_counter()
+    results = HealthProber(timeout=timeout).probe(ports)
+    return ports, results, time.perf_counter() - start
+
+
+def test_round_is_bounded_by_timeout():
+    ports, results, elapsed = probe_round()
+    assert elapsed < 1.0, elapsed  # serial probing would take ~5 s
+    assert all(results[k][0] is not None for k in ports if k.startswith('healthy'))
+    assert all(results[k][2] for k in ports if not k.startswith('healthy'))
+
+
+def test_hysteresis():
+    prober = HealthProber(unhealthy_after=3, recover_after=2, slow_ms=500)
+    state = HealthState()
+    ok = ({"status": "healthy", "sessions": 1, "max_sessions": 4}, 5.0, None)
+    fail = (None, None, "timeout")
+
+    prober.apply(state, ok)
+    assert state.status == HEALTH_HEALTHY
+    prober.apply(state, fail)
+    assert state.status == HEALTH_DEGRADED  # one miss is not enough to restart
+    prober.apply(state, ok)
+    assert state.status == HEALTH_DEGRADED  # needs recover_after successes
+    prober.apply(state, ok)
+    assert state.status == HEALTH_HEALTHY
+    for _ in range(3):
+        prober.apply(state, fail)
+    assert state.status == HEALTH_UNHEALTHY
+    prober.apply(state, ok)
+    assert state.status == HEALTH_UNHEALTHY
+    prober.apply(state, ok)
+    assert state.status == HEALTH_HEALTHY
+
+    prober.apply(state, ({"status": "healthy", "sessions": 4, "max_sessions": 4}, 5.0, None))
+    assert state.status == HEALTH_DEGRADED  # full sessions
+    prober.apply(state, ({"status": "healthy", "sessions": 0, "max_sessions": 4}, 900.0, None))
+    assert state.status == HEALTH_DEGRADED  # slow
+    assert state.latency_ms == 900.0 and state.sessions == 0
+
+
+if __name__ == "__main__":
+    ports, _, elapsed = probe_round()
+    print(f"{len(ports)} instances ({sum(k.startswith('hung') for k in ports)} hung, timeout 0.5 s) probed in {elapsed:.2f}s")
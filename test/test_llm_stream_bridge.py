@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Lip-sync LLM Streaming Bridge Test
+
+Drives lip-sync/llm.py against a local fake LLM service that streams tokens over SSE the way
+llm/api_interface_optimized.py /chat/stream does: sentences reach the TTS queue as soon as they
+are complete, interrupting closes the upstream connection, and errors are reported once.
+Needs aiohttp (the avatar env).
+
+    python -m pytest test/test_llm_stream_bridge.py   # checks
+    python test/test_llm_stream_bridge.py             # time to first sentence vs whole answer
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lip-sync')))
+from llm import SentenceSplitter, SseParser, close_session, llm_response
+
+TOKEN_DELAY = 0.02
+ANSWER = ("Routers forward packets hop by hop, using a table of prefixes. "
+          "Each entry maps a prefix to an outgoing link; the longest match wins. "
+          "Tables are filled by routing protocols such as OSPF and BGP. "
+          "That is all for today.")
+
+
+class FakeReal:
+    def __init__(self, url):
+        self.opt = SimpleNamespace(LLM_SERVER=url)
+        self.spoken = []  # (seconds since start, text)
+        self.start = time.perf_counter()
+
+    def put_msg_txt(self, msg, eventpoint=None):
+        self.spoken.append((time.perf_counter() - self.start, msg))
+
+
+async def start_llm_service(error=None):
+    state = {'disconnected': asyncio.Event(), 'tokens_sent': 0}
+
+    async def chat_stream(request):
+        data = await request.json()
+        assert data['input'] and data['session_id'] and data['user_id']
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        try:
+            if error:
+                await response.write(f"data: {json.dumps({'status': 'error', 'error': error})}\n\n".encode())
+                return response
+            for token in ANSWER.split(' '):
+                await asyncio.sleep(TOKEN_DELAY)
+                event = f"data: {json.dumps({'chunk': token + ' ', 'status': 'streaming'})}\r\n\r\n".encode()
+                await response.write(event[:7])  # 事件跨两次读
+                await response.write(event[7:])
+                state['tokens_sent'] += 1
+            await response.write(f"data: {json.dumps({'status': 'finished'})}\n\n".encode())
+        except ConnectionResetError:  # 客户端断开
+            state['disconnected'].set()
+        except asyncio.CancelledError:
+            state['disconnected'].set()
+            raise
+        return response
+
+    app = web.Application()
+    app.router.add_post('/chat/stream', chat_stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", state
+
+
+def test_splitter_rule():
+    splitter = SentenceSplitter(min_len=20)
+    out = []
+    for token in ANSWER.split(' '):
+        out += splitter.feed(token + ' ')
+    tail = splitter.flush()
+    assert out[0] == "Routers forward packets hop by hop,", out
+    assert all(len(s) >= 20 for s in out)
+    assert tail == '' and ' '.join(out) == ANSWER.strip()
+
+
+def test_sse_parser():
+    parser = SseParser()
+    events = []
+    for piece in [b'data: {"chunk": "a"', b', "status": "streaming"}\r\n', b'\r\ndata: {"status"', b': "finished"}\n\n']:
+        events += parser.feed(piece)
+    assert events == [{'chunk': 'a', 'status': 'streaming'}, {'status': 'finished'}], events
+
+
+def speak_answer():
+    """(seconds, text) of every sentence handed to TTS for the full ANSWER"""
+    async def run():
+        runner, url, _ = await start_llm_service()
+        nerfreal = FakeReal(url)
+        try:
+            await llm_response("How do routers work?", nerfreal)
+        finally:
+            await close_session()
+            await runner.cleanup()
+        return nerfreal.spoken
+    return asyncio.run(run())
+
+
+def test_first_sentence_before_answer_completes():
+    spoken = speak_answer()
+    first_sentence_tokens = len("Routers forward packets hop by hop,".split(' '))
+    first, last = spoken[0][0], spoken[-1][0]
+    assert first < (first_sentence_tokens + 5) * TOKEN_DELAY, first
+    assert first < last / 3
+    assert ' '.join(text for _, text in spoken) == ANSWER.strip()
+
+
+def test_cancel_stops_speaking():
+    async def run():
+        runner, url, state = await start_llm_service()
+        nerfreal = FakeReal(url)
+        try:
+            task = asyncio.ensure_future(llm_response("How do routers work?", nerfreal))
+            while not nerfreal.spoken:
+                await asyncio.sleep(0.005)
+            task.cancel()  # /human with interrupt
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            spoken_at_cancel = len(nerfreal.spoken)
+            await asyncio.wait_for(state['disconnected'].wait(), 1.0)
+            await asyncio.sleep(10 * TOKEN_DELAY)
+            return spoken_at_cancel, len(nerfreal.spoken), state['tokens_sent']
+        finally:
+            await close_session()
+            await runner.cleanup()
+
+    at_cancel, after, tokens_sent = asyncio.run(run())
+    assert at_cancel == after == 1, (at_cancel, after)
+    assert tokens_sent < len(ANSWER.split(' ')) // 2, tokens_sent
+
+
+def test_error_reported_once():
+    async def run():
+        runner, url, _ = await start_llm_service(error="model not loaded")
+        nerfreal = FakeReal(url)
+        try:
+            await llm_response("hello", nerfreal)
+        finally:
+            await close_session()
+            await runner.cleanup()
+        return [text for _, text in nerfreal.spoken]
+
+    spoken = asyncio.run(run())
+    assert len(spoken) == 1 and "model not loaded" in spoken[0], spoken
+
+
+if __name__ == "__main__":
+    spoken = speak_answer()
+    print(f"first sentence after {spoken[0][0] * 1000:.0f} ms, answer complete after {spoken[-1][0] * 1000:.0f} ms "
+          f"({len(ANSWER.split(' '))} tokens x {TOKEN_DELAY * 1000:.0f} ms)")
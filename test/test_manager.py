@@ -279,6 +279,61 @@ def run_concurrent_test():
     print("\n Concurrent Test Completed")
 
 
+def run_burst_test(users: int = 8, avatar_count: int = 2):
+    """Login burst: many users start a few avatars at the same moment, report time-to-ready"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    print("\n" + "="*70)
+    print(" Avatar Manager Login Burst Test")
+    print("="*70)
+    
+    if not test_health():
+        return
+    
+    available_avatars = get_available_avatars()
+    if not available_avatars:
+        print("\n No available avatars found")
+        return
+    avatar_names = available_avatars[:avatar_count]
+    print(f"\n{users} users -> {len(avatar_names)} avatar(s): {', '.join(avatar_names)}")
+    
+    def login(user: int):
+        avatar_name = avatar_names[user % len(avatar_names)]
+        start = time.time()
+        try:
+            response = requests.post(
+                f"{BASE_URL}/avatar/start",
+                json={'avatar_id': f"{avatar_name}_user_{user}", 'avatar_name': avatar_name},
+                timeout=120
+            )
+            ok = response.status_code == 200 and response.json().get('status') == 'success'
+        except Exception as e:
+            print(f"  user {user}: request failed: {e}")
+            ok = False
+        return avatar_name, ok, time.time() - start
+    
+    wall_start = time.time()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(login, range(users)))
+    wall = time.time() - wall_start
+    
+    latencies = sorted(elapsed for _, ok, elapsed in results if ok)
+    print(f"\nSucceeded: {len(latencies)}/{users}, wall time: {wall:.2f}s")
+    if latencies:
+        print(f"Time-to-ready  p50: {latencies[len(latencies) // 2]:.2f}s"
+              f"  p95: {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.2f}s"
+              f"  max: {latencies[-1]:.2f}s")
+    for avatar in test_list_avatars():
+        print(f"  {avatar['real_avatar_name']}: connections={avatar['connections']}, "
+              f"startup={avatar.get('startup_seconds')}s")
+    
+    print("\nCleaning up test Avatars...")
+    for avatar_name in avatar_names:
+        test_stop_avatar(avatar_name)
+    
+    print("\n Burst Test Completed")
+
+
 if __name__ == "__main__":
     import sys
     
@@ -297,10 +352,15 @@ if __name__ == "__main__":
             test_stop_avatar(sys.argv[2])
         elif command == "concurrent":
             run_concurrent_test()
+        elif command == "burst":
+            users = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+            avatar_count = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+            run_burst_test(users, avatar_count)
         else:
             print("Usage:")
             print("  python test_manager.py              # Run basic test")
             print("  python test_manager.py concurrent   # Run concurrent test")
+            print("  python test_manager.py burst [users] [avatars]  # Login burst, time-to-ready")
             print("  python test_manager.py health       # Health check")
             print("  python test_manager.py list         # List Avatars")
             print("  python test_manager.py status       # System status")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Avatar Manager Metrics Test
+
+Drives avatar-manager/metrics.py with FakeGpuProvider: GPU and per-avatar sampling (including
+the avatar's process tree), bounded ring buffers, range queries, Prometheus exposition and
+pruning of stopped avatars. No GPU or NVML is required.
+
+    python -m pytest test/test_manager_metrics.py
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'avatar-manager')))
+from metrics import MetricsSampler, MetricsStore
+from scheduler import FakeGpuProvider, NullProvider
+
+T0 = 1_700_000_000.0
+
+
+def make_sampler(capacity=100, interval=10):
+    provider = FakeGpuProvider((24576, 24576))
+    instances = [
+        {'avatar_id': 'g_user_1', 'gpu_id': 1, 'pids': [100, 101], 'connections': 2, 'sessions': 2,
+         'render_fps': 24.5, 'latency_ms': 3.2, 'healthy': True},
+    ]
+    store = MetricsStore(capacity)
+    sampler = MetricsSampler(store, provider, [1, 0], lambda: instances, interval)
+    return provider, instances, store, sampler
+
+
+def test_samples_gpu_and_avatar_series():
+    provider, _, store, sampler = make_sampler()
+    provider.set_process(1, 101, 9000)  # the python child of the avatar's bash process
+    provider.external[1] = 2000
+    provider.stats[1].update(utilization=87, temperature=71)
+    sampler.sample(now=T0, extra={'manager_instances': 1})
+
+    def value(name, **labels):
+        series = store.query(name, T0 - 1, T0 + 1, match=labels)
+        assert len(series) == 1, (name, series)
+        return series[0]['values'][-1][1]
+    assert value('gpu_memory_used_mb', gpu=1) == 11000
+    assert value('gpu_utilization_percent', gpu=1) == 87
+    assert value('gpu_temperature_celsius', gpu=1) == 71
+    assert value('avatar_gpu_memory_mb', avatar='g_user_1') == 9000
+    assert value('avatar_render_fps', avatar='g_user_1') == 24.5
+    assert value('avatar_healthy', avatar='g_user_1') == 1
+    assert value('manager_instances') == 1
+    assert sampler.get_info()['provider'] == 'FakeGpuProvider'
+
+
+def test_ring_buffer_is_bounded():
+    _, _, store, sampler = make_sampler(capacity=50)
+    for i in range(200):
+        sampler.sample(now=T0 + i * 10)
+    values = store.query('gpu_memory_total_mb', 0, T0 + 10_000, match={'gpu': 0})[0]['values']
+    assert len(values) == 50
+    assert values[0][0] == T0 + 150 * 10
+
+
+def test_range_query_and_step():
+    provider, instances, store, sampler = make_sampler()
+    for i in range(60):
+        instances[0]['render_fps'] = 25 - i % 5
+        sampler.sample(now=T0 + i * 10)
+    fps = store.query('avatar_render_fps', T0 + 100, T0 + 290, match={'avatar': 'g_user_1'})[0]['values']
+    assert [ts for ts, _ in fps] == [T0 + t for t in range(100, 300, 10)]
+    coarse = store.query('avatar_render_fps', T0, T0 + 590, step=60)[0]['values']
+    assert len(coarse) == 10
+    assert store.query('avatar_render_fps', T0, T0 + 590, match={'avatar': 'nobody'}) == []
+
+
+def test_prometheus_exposition():
+    provider, _, store, sampler = make_sampler()
+    provider.set_process(1, 100, 1234)
+    sampler.sample(now=time.time(), extra={'manager_instances': 1})
+    text = store.render_prometheus(stale_after=30)
+    sample_line = re.compile(r'^[a-z_]+(\{([a-z_]+="[^"]*",?)*\})? -?[0-9.e+]+ \d+$')
+    for line in text.strip().splitlines():
+        assert line.startswith('# HELP ') or line.startswith('# TYPE ') or sample_line.match(line), line
+    assert 'avatar_gpu_memory_mb{avatar="g_user_1",gpu="1"} 1234 ' in text
+    assert '# TYPE gpu_utilization_percent gauge' in text
+    assert re.search(r'^manager_instances 1 \d+$', text, re.M)
+
+
+def test_stopped_avatar_goes_stale_then_pruned():
+    _, instances, store, sampler = make_sampler(capacity=10, interval=10)
+    sampler.sample(now=T0)
+    instances.clear()  # the avatar stops
+    for i in range(1, 5):
+        sampler.sample(now=T0 + i * 10)
+    assert store.query('avatar_sessions', 0, T0 + 1000)  # history still queryable within retention
+    for i in range(5, 15):
+        sampler.sample(now=T0 + i * 10)
+    assert store.query('avatar_sessions', 0, T0 + 1000) == []
+    assert store.query('gpu_memory_total_mb', 0, T0 + 1000)  # GPUs keep being sampled
+
+
+def test_null_provider():
+    store = MetricsStore(10)
+    sampler = MetricsSampler(store, NullProvider(), [0], lambda: [], 10)
+    sampler.sample(now=T0, extra={'manager_instances': 0})
+    assert store.query('gpu_memory_used_mb', 0, T0 + 1) == []
+    assert store.query('manager_instances', 0, T0 + 1)[0]['values'] == [[T0, 0.0]]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Avatar Manager State Restore Test
+
+Drives AvatarManager._restore_state (avatar-manager/manager.py) on CPU with FakeGpuProvider and a
+stub prober: a state file lists one live instance, one whose process is gone and one whose PID now
+belongs to another process. Only the live one is adopted, with its port, GPU and connection count,
+a fresh /health result and a scheduler reservation on its GPU.
+
+Needs psutil (the avatar-manager env).
+
+    python -m pytest test/test_manager_restore.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+import psutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'avatar-manager')))
+from prober import HEALTH_HEALTHY, HealthProber
+from scheduler import FakeGpuProvider, PlacementScheduler
+
+FOOTPRINTS = {'musetalk': 11000, 'wav2lip': 6000, 'ultralight': 4000}
+
+
+def load_manager():
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs('logs')  # manager.py 导入时打开 logs/avatar_manager.log
+    try:
+        import manager
+    finally:
+        os.chdir(cwd)
+    return manager
+
+
+class StubProber(HealthProber):
+    def probe(self, ports):
+        self.probed = dict(ports)
+        return {avatar_id: ({'status': 'healthy', 'sessions': 1, 'max_sessions': 4}, 3.0, None) for avatar_id in ports}
+
+
+def make_manager(manager, state_file):
+    mgr = manager.AvatarManager.__new__(manager.AvatarManager)
+    mgr._lock = threading.Lock()
+    mgr._state_lock = threading.Lock()
+    mgr._usage = {}
+    mgr.instances = {}
+    mgr.avatar_map = {}
+    mgr.prober = StubProber()
+    mgr.scheduler = PlacementScheduler(FakeGpuProvider((24576, 24576)), [0, 1], footprints=FOOTPRINTS)
+    mgr._load_avatar_config = lambda name: {'avatar_model': 'wav2lip'}
+    mgr._pid_tree = lambda pid: [pid]
+    manager.STATE_FILE = state_file
+    return mgr
+
+
+def entry(avatar_id, pid, create_time, port, gpu_id, connections):
+    return {'avatar_id': avatar_id, 'real_avatar_name': avatar_id.split('_')[0], 'port': port, 'gpu_id': gpu_id,
+            'pid': pid, 'create_time': create_time, 'start_time': '2026-01-05T09:00:00', 'connections': connections,
+            'startup_seconds': 12.5, 'standby': False}
+
+
+def test_only_live_instances_adopted():
+    manager = load_manager()
+    live = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    try:
+        state_file = os.path.join(tempfile.mkdtemp(), 'manager_state.json')
+        with open(state_file, 'w', encoding='utf-8') as f:
+            json.dump({'saved_at': 0, 'usage': {}, 'instances': [
+                entry('g_live', live.pid, psutil.Process(live.pid).create_time(), 8615, 1, 2),
+                entry('h_dead', dead.pid, None, 8616, 0, 1),
+                entry('k_reused', os.getpid(), 1.0, 8617, 0, 3),  # PID已被别的进程复用
+            ]}, f)
+        mgr = make_manager(manager, state_file)
+        mgr._restore_state()
+
+        assert list(mgr.instances) == ['g_live'] and mgr.avatar_map == {'g': 'g_live'}
+        assert mgr.prober.probed == {'g_live': 8615}
+        inst = mgr.instances['g_live']
+        assert (inst.port, inst.gpu_id, inst.connections, inst.pid) == (8615, 1, 2, live.pid)
+        assert inst.adopted and inst.startup_seconds == 12.5 and inst.is_running()
+        assert inst.health.status == HEALTH_HEALTHY and inst.health.sessions == 1
+        assert mgr.scheduler.reservations['g_live'].gpu_id == 1 and mgr.scheduler.held_mb('g_live') > 0
+        with open(state_file, encoding='utf-8') as f:
+            assert [e['avatar_id'] for e in json.load(f)['instances']] == ['g_live']  # 日志只剩接管的实例
+    finally:
+        live.kill()
+        live.wait()
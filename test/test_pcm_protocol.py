@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+PCM Framing Protocol Test & Benchmark
+
+Checks scripts/pcm_protocol.py, the negotiated 16 kHz frame stream between the TTS servers and
+lip-sync: polyphase resampling, encoder/decoder round trips over split network chunks, format
+negotiation and the raw WAV fallback. Only numpy is required.
+
+    python -m pytest test/test_pcm_protocol.py   # checks
+    python test/test_pcm_protocol.py             # resampler throughput
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.pcm_protocol import AudioFormat, FrameDecoder, FrameEncoder, StreamResampler, to_pcm16, wav_header
+
+
+def sine(freq, sample_rate, seconds=1.0, amplitude=0.5):
+    return (amplitude * np.sin(2 * np.pi * freq * np.arange(int(sample_rate * seconds)) / sample_rate)).astype(np.float32)
+
+
+def resample_chunked(x, source_rate, target_rate, chunk):
+    r = StreamResampler(source_rate, target_rate)
+    return np.concatenate([r.push(x[i:i + chunk]) for i in range(0, len(x), chunk)] + [r.flush()])
+
+
+def test_resampler_chunked_matches_whole():
+    x = sine(1000, 24000)
+    whole = resample_chunked(x, 24000, 16000, len(x))
+    chunked = resample_chunked(x, 24000, 16000, 777)
+    assert len(whole) == len(chunked) == 16000, (len(whole), len(chunked))
+    assert np.abs(whole - chunked).max() < 1e-6
+
+
+def test_resampler_sine_accuracy():
+    for source_rate, freq in [(24000, 1000), (22050, 440), (32000, 3000)]:
+        y = resample_chunked(sine(freq, source_rate), source_rate, 16000, 4096)
+        ref = sine(freq, 16000)
+        assert len(y) == len(ref), (source_rate, len(y))
+        err = np.abs(y[400:-400] - ref[400:-400]).max()  # 两端是滤波器的起止过渡
+        assert err < 1e-3, (source_rate, err)
+
+
+def test_round_trip_with_markers():
+    fmt = AudioFormat(16000, 'f32le', 320)
+    x = sine(500, 24000, seconds=0.77)
+    encoder = FrameEncoder(fmt, 24000)
+    stream = encoder.start(text='hello') + b''.join(encoder.push(x[i:i + 1000]) for i in range(0, len(x), 1000))
+    stream += encoder.end()
+
+    decoder = FrameDecoder(AudioFormat.parse_header(fmt.header()))
+    events = []
+    for i in range(0, len(stream), 333):  # 切碎，模拟网络分块
+        events += decoder.feed(stream[i:i + 333])
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == 'start' and kinds[-1] == 'end' and kinds.count('frame') == len(kinds) - 2
+    assert events[0][1]['text'] == 'hello' and events[0][1]['frame_samples'] == 320
+    frames = [value for kind, value in events if kind == 'frame']
+    assert all(f.shape == (320,) and f.dtype == np.float32 for f in frames)
+    samples = events[-1][1]['samples']
+    assert samples == round(len(x) * 16000 / 24000), samples
+    assert len(frames) == -(-samples // 320)  # 最后一帧补零
+    audio = np.concatenate(frames)
+    assert not audio[samples:].any()
+    assert np.abs(audio[:samples] - resample_chunked(x, 24000, 16000, len(x))).max() < 1e-6
+
+
+def test_negotiation_fields():
+    fmt = AudioFormat(16000, 'f32le', 320)
+    form = fmt.to_form()
+    assert AudioFormat.from_request(form['audio_protocol'], form['sample_rate'], form['sample_format'],
+                                    form['frame_ms']) == fmt
+    assert AudioFormat.from_request(None) is None  # 旧客户端：服务端按原样输出
+    assert AudioFormat.parse_header(None) is None  # 旧服务端：客户端走原来的重采样路径
+    assert AudioFormat.parse_header(fmt.header()) == fmt
+    try:
+        AudioFormat.from_request('pcm-frames', 16000, 'mp3', 20)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+def test_s16le_and_odd_byte_chunks():
+    fmt = AudioFormat(16000, 's16le', 320)
+    pcm = (sine(300, 16000, seconds=0.5) * 32768).astype('<i2').tobytes()
+    encoder = FrameEncoder(fmt, 16000)  # 同采样率：不重采样，只分帧
+    stream = encoder.start() + b''.join(encoder.push_pcm16(pcm[i:i + 101]) for i in range(0, len(pcm), 101))
+    stream += encoder.end()
+    events = FrameDecoder(fmt).feed(stream)
+    audio = np.concatenate([value for kind, value in events if kind == 'frame'])
+    assert events[-1][1]['samples'] == len(pcm) // 2 == len(audio)
+    assert np.abs(audio - np.frombuffer(pcm, '<i2') / 32768).max() < 2e-4
+
+
+def test_raw_wav_reply():
+    import io
+    import wave
+    pcm = to_pcm16(np.array([[0.0, 0.5, -1.5, 1.0]], dtype=np.float32))  # (1, n) 和越界样本
+    assert np.frombuffer(pcm, '<i2').tolist() == [0, 16383, -32767, 32767]
+    with wave.open(io.BytesIO(wav_header(24000, len(pcm)) + pcm)) as w:
+        assert (w.getframerate(), w.getnchannels(), w.getsampwidth(), w.readframes(4)) == (24000, 1, 2, pcm)
+
+
+def resample_seconds(seconds=10):
+    x = np.random.default_rng(0).standard_normal(24000 * seconds).astype(np.float32) * 0.1
+    start = time.perf_counter()
+    resample_chunked(x, 24000, 16000, 4800)
+    return time.perf_counter() - start
+
+
+def test_resampler_throughput():
+    assert resample_seconds() < 5.0
+
+
+if __name__ == "__main__":
+    print(f"10 s of 24 kHz audio resampled to 16 kHz in {resample_seconds() * 1000:.1f} ms")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Lip-sync Render FPS Benchmark
+
+Open N concurrent WebRTC sessions against a running lip-sync instance, keep
+every session speaking, and report per-session render fps from /session_stats.
+
+Run once against an instance started with --infer_mode thread and once with
+--infer_mode process (same avatar, same --max_session) to compare the modes:
+
+    python test_render_fps.py http://localhost:8615 4
+"""
+
+import asyncio
+import statistics
+import sys
+
+import aiohttp
+from aiortc import RTCPeerConnection, RTCSessionDescription
+
+SPEECH_TEXT = "This sentence keeps the avatar talking so that every frame goes through lip-sync inference."
+
+
+async def open_session(http, base_url):
+    """Create one receive-only WebRTC session, return (pc, sessionid)"""
+    pc = RTCPeerConnection()
+    pc.addTransceiver("video", direction="recvonly")
+    pc.addTransceiver("audio", direction="recvonly")
+
+    @pc.on("track")
+    def on_track(track):
+        async def drain():
+            while True:
+                try:
+                    await track.recv()
+                except Exception:
+                    return
+        asyncio.ensure_future(drain())
+
+    await pc.setLocalDescription(await pc.createOffer())
+    async with http.post(f"{base_url}/offer", json={
+        "sdp": pc.localDescription.sdp,
+        "type": pc.localDescription.type,
+    }) as response:
+        answer = await response.json()
+    if "sessionid" not in answer:
+        raise RuntimeError(f"offer rejected: {answer}")
+    await pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+    return pc, answer["sessionid"]
+
+
+async def keep_speaking(http, base_url, sessionid, stop):
+    while not stop.is_set():
+        async with http.post(f"{base_url}/human", json={
+            "sessionid": sessionid, "type": "echo", "text": SPEECH_TEXT,
+        }) as response:
+            await response.read()
+        await asyncio.sleep(3)
+
+
+async def run_benchmark(base_url, num_sessions, duration=30):
+    print(f"\n{'='*60}")
+    print(f" Render FPS Benchmark")
+    print(f"{'='*60}")
+    print(f"Target: {base_url}")
+    print(f"Sessions: {num_sessions}")
+    print(f"Duration: {duration}s")
+
+    async with aiohttp.ClientSession() as http:
+        sessions = [await open_session(http, base_url) for _ in range(num_sessions)]
+        stop = asyncio.Event()
+        speakers = [asyncio.ensure_future(keep_speaking(http, base_url, sid, stop)) for _, sid in sessions]
+
+        await asyncio.sleep(duration)
+        stop.set()
+
+        results = []
+        for _, sid in sessions:
+            async with http.post(f"{base_url}/session_stats", json={"sessionid": sid}) as response:
+                results.append((await response.json())["data"])
+
+        for task in speakers:
+            task.cancel()
+        for pc, _ in sessions:
+            await pc.close()
+
+    fps = [r["render_fps"] for r in results]
+    print(f"\nInfer mode: {results[0]['infer_mode']}")
+    for (_, sid), r in zip(sessions, results):
+        degrade = r["degrade"]
+        print(f"  session {sid}: {r['render_fps']:.2f} fps, degrade events={degrade['events']}")
+    print(f"\nMean render fps: {statistics.mean(fps):.2f}")
+    print(f"Min render fps:  {min(fps):.2f}")
+    return fps
+
+
+if __name__ == "__main__":
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8615"
+    num_sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    asyncio.run(run_benchmark(base_url, num_sessions))
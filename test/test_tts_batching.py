@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tacotron Micro-Batching Test & Benchmark
+
+Checks tts/taco/batcher.py (results per caller, length buckets, no added latency for a lone
+request, error propagation) and compares throughput at concurrency 1 / 4 / 16, one request at
+a time (max_batch=1, the old behaviour) vs micro-batched.
+
+The benchmark model is a synthetic autoregressive decoder (numpy, one recurrent step per output
+frame) that batches the way Tacotron2 does; --real loads the speechbrain Tacotron2 + HiFi-GAN
+models on CPU (needs the taco conda env).
+
+    python -m pytest test/test_tts_batching.py                # checks
+    python test/test_tts_batching.py --real --requests 32     # benchmark
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tts', 'taco')))
+from batcher import MicroBatcher
+
+SENTENCES = [
+    "Hello and welcome to the course.",
+    "Today we look at how packets are routed across the internet.",
+    "Any questions so far?",
+    "Each router keeps a forwarding table that maps prefixes to outgoing links.",
+    "Let us move on.",
+    "The transport layer gives processes on different hosts a logical connection.",
+    "Good.",
+    "Congestion control keeps senders from overwhelming the network.",
+]
+
+
+class SyntheticTacotron:
+    """One recurrent step per output frame; a batch runs as many steps as its longest input."""
+
+    def __init__(self, dim=512, frames_per_char=4, seed=0):
+        rng = np.random.default_rng(seed)
+        self.w = (rng.standard_normal((dim, dim)) / np.sqrt(dim)).astype(np.float32)
+        self.dim = dim
+        self.frames_per_char = frames_per_char
+
+    def __call__(self, texts):
+        lengths = [len(t) * self.frames_per_char for t in texts]
+        h = np.ones((len(texts), self.dim), dtype=np.float32)
+        frames = []
+        for _ in range(max(lengths)):
+            h = np.tanh(h @ self.w)
+            frames.append(h[:, 0].copy())
+        frames = np.stack(frames, axis=1)
+        return [frames[i, :n] for i, n in enumerate(lengths)]
+
+
+def load_real_model():
+    import torch
+    from speechbrain.inference.TTS import Tacotron2
+    from speechbrain.inference.vocoders import HIFIGAN
+    torch.set_num_threads(os.cpu_count() or 1)
+    taco_dir = os.path.join(os.path.dirname(__file__), '..', 'tts', 'taco')
+    tacotron2 = Tacotron2.from_hparams(source="speechbrain/tts-tacotron2-ljspeech",
+                                       savedir=os.path.join(taco_dir, "tmpdir_tts"), run_opts={"device": "cpu"})
+    hifi_gan = HIFIGAN.from_hparams(source="speechbrain/tts-hifigan-ljspeech",
+                                    savedir=os.path.join(taco_dir, "tmpdir_vocoder"), run_opts={"device": "cpu"})
+
+    def batch_fn(texts):
+        # same as synthesize_batch in tts/taco/server.py
+        lengths = [tacotron2.text_to_seq(text)[1] for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+        mel_outputs, mel_lengths, _ = tacotron2.encode_batch([texts[i] for i in order])
+        waveforms = hifi_gan.decode_batch(mel_outputs).squeeze(1)
+        results = [None] * len(texts)
+        for rank, i in enumerate(order):
+            results[i] = waveforms[rank, :int(mel_lengths[rank]) * 256]
+        return results
+    return batch_fn
+
+
+async def run_load(batcher, concurrency, n_requests):
+    """concurrency clients, each sending its share of n_requests one after another"""
+    latencies = []
+
+    async def client(cid):
+        for i in range(cid, n_requests, concurrency):
+            start = time.perf_counter()
+            await batcher.submit(SENTENCES[i % len(SENTENCES)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(concurrency)))
+    return n_requests / (time.perf_counter() - start), float(np.mean(latencies))
+
+
+def benchmark(batch_fn, n_requests=48, concurrencies=(1, 4, 16), max_batch=8):
+    batch_fn(SENTENCES[:2])  # 预热
+    rows = []
+    for concurrency in concurrencies:
+        row = [concurrency]
+        for mb in (1, max_batch):
+            batcher = MicroBatcher(batch_fn, max_batch=mb, max_wait_ms=10)
+            throughput, latency = asyncio.run(run_load(batcher, concurrency, n_requests))
+            row += [throughput, latency * 1000, batcher.get_stats()["avg_batch"]]
+        rows.append(row)
+    print(f"  {'conc':>4} | {'serial req/s':>12} {'lat ms':>8} | {'batched req/s':>13} {'lat ms':>8} {'avg batch':>9} | speedup")
+    for c, s_tp, s_lat, _, b_tp, b_lat, b_avg in rows:
+        print(f"  {c:>4} | {s_tp:>12.1f} {s_lat:>8.1f} | {b_tp:>13.1f} {b_lat:>8.1f} {b_avg:>9.2f} | {b_tp / s_tp:.2f}x")
+    return rows
+
+
+def echo_batches(calls):
+    def batch_fn(texts):
+        calls.append(list(texts))
+        time.sleep(0.01)
+        return [t.upper() for t in texts]
+    return batch_fn
+
+
+def test_results_go_back_to_each_caller():
+    calls = []
+
+    async def run():
+        batcher = MicroBatcher(echo_batches(calls), max_batch=8, max_wait_ms=20)
+        return await asyncio.gather(*(batcher.submit(s) for s in SENTENCES))
+    assert asyncio.run(run()) == [s.upper() for s in SENTENCES]
+    assert sum(len(c) for c in calls) == len(SENTENCES)
+    assert len(calls) < len(SENTENCES), "expected concurrent requests to be batched"
+
+
+def test_buckets_sorted_and_length_matched():
+    batcher = MicroBatcher(lambda texts: texts, max_batch=3, length_ratio=0.5)
+    buckets = batcher.make_buckets([(s, None) for s in SENTENCES])
+    for bucket in buckets:
+        lengths = [len(text) for text, _ in bucket]
+        assert lengths == sorted(lengths, reverse=True)
+        assert len(bucket) <= 3
+        assert lengths[-1] >= 0.5 * lengths[0], lengths
+    assert sum(len(b) for b in buckets) == len(SENTENCES)
+
+
+def test_lone_request_not_held_back():
+    async def run():
+        batcher = MicroBatcher(lambda texts: texts, max_batch=8, max_wait_ms=30)
+        start = time.perf_counter()
+        await batcher.submit("hello")
+        return time.perf_counter() - start
+    assert asyncio.run(run()) < 0.02  # 空闲时不等窗口
+
+
+def test_errors_and_cancelled_callers():
+    calls = []
+
+    def batch_fn(texts):
+        calls.append(list(texts))
+        if "boom" in texts:
+            raise RuntimeError("synthesis failed")
+        return texts
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_batch=8, max_wait_ms=20)
+        gone = asyncio.ensure_future(batcher.submit("gone away"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        results = await asyncio.gather(batcher.submit("boom"), batcher.submit("bang"), return_exceptions=True)
+        return results
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results), results
+    assert all("gone away" not in c for c in calls), calls
+
+
+def test_batching_improves_throughput():
+    rows = benchmark(SyntheticTacotron(), n_requests=32, concurrencies=(16,))
+    _, serial, _, _, batched, _, avg_batch = rows[0]
+    assert avg_batch > 2, avg_batch
+    assert batched > serial * 1.2, (serial, batched)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--real', action='store_true', help="speechbrain Tacotron2 + HiFi-GAN on CPU")
+    parser.add_argument('--requests', type=int, default=48)
+    parser.add_argument('--max_batch', type=int, default=8)
+    args = parser.parse_args()
+    print(f"Throughput ({'speechbrain Tacotron2 + HiFi-GAN' if args.real else 'synthetic decoder'}, "
+          f"{args.requests} requests)")
+    benchmark(load_real_model() if args.real else SyntheticTacotron(), args.requests, max_batch=args.max_batch)
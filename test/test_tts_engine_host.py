@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Resident TTS Engine Host Test
+
+Drives tts/engine_host.py with fake engines (no conda envs, models or GPU): engines stay
+resident and load once, LRU unloading within the memory budget never touches busy engines,
+streamed WAV is converted to PCM incrementally, and a failing model server releases its engine.
+
+    python -m pytest test/test_tts_engine_host.py
+"""
+
+import asyncio
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tts')))
+from engine_host import Engine, EngineHost, EngineUnavailable, open_stream, wav_to_pcm
+
+MODEL_INFOS = {
+    'edgeTTS': {'status': 'active', 'memory_mb': 0},
+    'tacotron': {'status': 'active', 'memory_mb': 1500},
+    'sovits': {'status': 'active', 'memory_mb': 3500},
+    'cosyvoice': {'status': 'active', 'memory_mb': 4000},
+}
+
+
+def make_wav(pcm, sample_rate=24000):
+    fmt = struct.pack('<HHIIHH', 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    return (b'RIFF' + struct.pack('<I', 36 + len(pcm)) + b'WAVE' + b'fmt ' + struct.pack('<I', 16) + fmt
+            + b'data' + struct.pack('<I', len(pcm)) + pcm)
+
+
+class FakeEngine(Engine):
+    loads = []
+    unloads = []
+
+    async def load(self):
+        FakeEngine.loads.append(self.model_name)
+        await asyncio.sleep(0.05)
+
+    async def unload(self):
+        FakeEngine.unloads.append(self.model_name)
+
+    async def stream_wav(self, tts_text, prompt_text, prompt_wav, speaker_id=None):
+        wav = make_wav(tts_text.encode())
+        for i in range(0, len(wav), 7):  # 切碎，模拟网络分块
+            yield wav[i:i + 7]
+
+
+class CrashingEngine(FakeEngine):
+    """Model server that dies after `fail_after` body chunks (like httpx.ConnectError / ReadTimeout)"""
+    fail_after = 0
+    closed = False
+
+    async def stream_wav(self, tts_text, prompt_text, prompt_wav, speaker_id=None):
+        try:
+            yield make_wav(b'')[:40] + struct.pack('<I', 0xFFFFFFFF - 36)
+            for i in range(self.fail_after):
+                yield b'seg%d' % i
+            raise ConnectionError("model server connection reset")
+        finally:
+            CrashingEngine.closed = True
+
+
+def make_host(budget_mb=6000, engine_cls=FakeEngine):
+    FakeEngine.loads, FakeEngine.unloads = [], []
+    host = EngineHost(lambda: MODEL_INFOS, budget_mb, base_port=5033)
+    host.create_engine = lambda name, info, use_gpu: engine_cls(name, info)
+    return host
+
+
+def test_switching_keeps_engines_resident():
+    async def run():
+        host = make_host()
+        for name in ['tacotron', 'edgeTTS', 'tacotron', 'edgeTTS', 'sovits', 'tacotron']:
+            async with host.session(name):
+                pass
+        return host
+    host = asyncio.run(run())
+    assert FakeEngine.loads == ['tacotron', 'edgeTTS', 'sovits'], FakeEngine.loads
+    assert not FakeEngine.unloads
+    assert host.used_mb() == 5000
+
+
+def test_concurrent_requests_share_one_load():
+    async def run():
+        host = make_host()
+        engines = await asyncio.gather(*(host.ensure('cosyvoice') for _ in range(8)))
+        assert all(e is engines[0] for e in engines)
+    asyncio.run(run())
+    assert FakeEngine.loads == ['cosyvoice'], FakeEngine.loads
+
+
+def test_lru_eviction():
+    async def run():
+        host = make_host(budget_mb=6000)
+        for name in ['tacotron', 'sovits']:
+            await host.ensure(name)
+        await host.ensure('tacotron')  # tacotron is now the most recently used
+        await host.ensure('cosyvoice')  # 1500 + 3500 + 4000 > 6000: sovits goes
+        return host
+    host = asyncio.run(run())
+    assert FakeEngine.unloads == ['sovits'], FakeEngine.unloads
+    assert list(host.engines) == ['tacotron', 'cosyvoice']
+    assert host.evictions == 1
+
+
+def test_busy_engines_are_not_evicted():
+    async def run():
+        host = make_host(budget_mb=5000)
+        async with host.session('sovits'):
+            try:
+                await host.ensure('cosyvoice')
+            except EngineUnavailable:
+                return True
+        return False
+    assert asyncio.run(run()), "expected EngineUnavailable while sovits is busy"
+    assert not FakeEngine.unloads
+
+
+def test_engine_released_when_first_chunk_fails():
+    async def run():
+        host = make_host(engine_cls=CrashingEngine)
+        CrashingEngine.fail_after, CrashingEngine.closed = 0, False
+        try:
+            await open_stream(host, 'sovits', 'hello', '', None, pcm=True)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("expected the upstream error")
+        assert host.engines['sovits'].inflight == 0 and CrashingEngine.closed
+        await host.ensure('cosyvoice')  # 3500 + 4000 > 6000: sovits must still be evictable
+    asyncio.run(run())
+    assert FakeEngine.unloads == ['sovits'], FakeEngine.unloads
+
+
+def test_engine_released_when_stream_fails_midway():
+    async def run():
+        host = make_host(engine_cls=CrashingEngine)
+        CrashingEngine.fail_after, CrashingEngine.closed = 3, False
+        sample_rate, first, rest = await open_stream(host, 'sovits', 'hello', '', None, pcm=True)
+        assert (sample_rate, first) == (24000, b'seg0') and host.engines['sovits'].inflight == 1
+        received = [first]
+        try:
+            async for chunk in rest:
+                received.append(chunk)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("expected the upstream error")
+        assert received == [b'seg0', b'seg1', b'seg2'], received
+        assert host.engines['sovits'].inflight == 0 and CrashingEngine.closed
+
+        CrashingEngine.closed = False  # 客户端中途断开：StreamingResponse 关闭 rest
+        _, _, rest = await open_stream(host, 'sovits', 'hello', '', None, pcm=True)
+        await rest.__anext__()
+        await rest.aclose()
+        assert host.engines['sovits'].inflight == 0 and CrashingEngine.closed
+    asyncio.run(run())
+
+
+def test_engine_is_abstract():
+    class Incomplete(Engine):
+        async def load(self):
+            pass
+    try:
+        Incomplete('x', {})
+    except TypeError:
+        return
+    raise AssertionError("Engine without stream_wav should not be instantiable")
+
+
+def test_wav_to_pcm():
+    async def run():
+        host = make_host()
+        async with host.session('tacotron') as engine:
+            stream = wav_to_pcm(engine.stream_wav('hello world', '', None))
+            sample_rate = await stream.__anext__()
+            pcm = b''.join([chunk async for chunk in stream])
+        return sample_rate, pcm
+    sample_rate, pcm = asyncio.run(run())
+    assert sample_rate == 24000
+    assert pcm == b'hello world', pcm
+
+
+def test_wav_to_pcm_streamed_header():
+    """Model servers streaming with stream=true send a header of unknown length first"""
+    async def body():
+        yield make_wav(b'')[:40] + struct.pack('<I', 0xFFFFFFFF - 36)
+        yield b'seg1'
+        yield b'seg2'
+
+    async def run():
+        stream = wav_to_pcm(body())
+        sample_rate = await stream.__anext__()
+        return sample_rate, b''.join([chunk async for chunk in stream])
+    assert asyncio.run(run()) == (24000, b'seg1seg2')
+
+
+def test_wav_to_pcm_is_incremental():
+    """/tts/response proxies PCM as it arrives: the first chunk goes out before the engine is done"""
+    produced = []
+
+    async def body():
+        yield make_wav(b'')[:40] + struct.pack('<I', 0xFFFFFFFF - 36)
+        for i in range(5):
+            produced.append(i)
+            yield b'seg%d' % i
+
+    async def run():
+        stream = wav_to_pcm(body())
+        await stream.__anext__()
+        first = await stream.__anext__()
+        return first, len(produced)
+    first, produced_so_far = asyncio.run(run())
+    assert first == b'seg0'
+    assert produced_so_far == 1, f"upstream read ahead {produced_so_far} segments"
@@ -1,6 +1,12 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from collections import OrderedDict
+from typing import Optional
+import hashlib
 import io
+import threading
+import time
 import uvicorn
 import torchaudio
 import soundfile as sf
@@ -13,6 +19,8 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MAT_DIR = os.path.join(BASE_DIR, "third_party", "Matcha-TTS")
 MODEL05B_DIR = os.path.join(BASE_DIR, "pretrained_models", "CosyVoice2-0.5B")
 sys.path.append(MAT_DIR)  # 若有第三方子模块
+sys.path.insert(0, os.path.abspath(os.path.join(BASE_DIR, "..", "..", "..")))
+from scripts.pcm_protocol import AudioFormat, FrameEncoder, to_pcm16, torch_resampler, wav_header
 from cosyvoice.cli.cosyvoice import CosyVoice2
 import torchaudio
 from IPython.display import Audio
@@ -41,77 +49,246 @@ print(f">>> Model loaded from {model_dir}!")
 
 app = FastAPI()
 
+SPEAKER_CACHE_SIZE = 32  # 缓存的说话人数量，超出按LRU淘汰
 
-def generate_tts(tts_text: str, ref_wav_bytes: bytes, prompt_text: str) -> bytes:
-    ref_audio_buf = io.BytesIO(ref_wav_bytes)
-    prompt_speech, sr = torchaudio.load(ref_audio_buf)
-    print(f">>> Reference audio sample rate: {sr}")
-    # 强制重采样为 16000Hz
-    resampler = torchaudio.transforms.Resample(orig_freq=sr, new_freq=16000)
-    prompt_speech = resampler(prompt_speech)
+# 同一模型实例上的推理串行执行（流式响应在线程池里迭代）；说话人注册和淘汰也在这把锁下改动 frontend.spk2info
+infer_lock = threading.Lock()
 
-    # 生成 TTS 音频
-    print(">>> Generating TTS output...")
-    print(f">>> TTS text: {tts_text}")
-    chunks = list(
-        model.inference_instruct2(
-            tts_text,
-            "",
-            prompt_speech,
-            stream=False
-        )
-    )
-    waveform = chunks[0]["tts_speech"]
 
-    # 将 waveform 写入内存中的 WAV 二进制流
-    out_buf = io.BytesIO()
-    torchaudio.save(out_buf, waveform, model.sample_rate, format="wav")
-    out_wav_bytes = out_buf.getvalue()
+class SpeakerRegistry:
+    """
+    Reference audio -> speaker_id (content hash). Each speaker keeps its 16 kHz prompt speech, so
+    synthesis requests skip upload, decode and resample.
 
-    return out_wav_bytes
+    By default synthesis stays in the instruct2 mode the server has always used (the reference
+    only sets the voice, prompt_text is ignored). zero_shot=True is opt-in for callers whose
+    prompt_text is the exact transcript of the reference: the zero-shot prompt features are then
+    extracted once (model.add_zero_shot_spk) and reused.
+    """
 
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.speakers = OrderedDict()  # speaker_id -> entry，LRU顺序
+        self.hits = 0
+        self.misses = 0
 
-@app.post("/generate")
-async def tts_zero_shot(
-        tts_text: str = Form(...),
-        prompt_text: str = Form(...),
-        prompt_wav: UploadFile = File(...)
+    def _to_16k(self, ref_wav_bytes: bytes):
+        prompt_speech, sr = torchaudio.load(io.BytesIO(ref_wav_bytes))
+        print(f">>> Reference audio sample rate: {sr}")
+        if prompt_speech.shape[0] > 1:
+            prompt_speech = prompt_speech.mean(dim=0, keepdim=True)
+        if sr == 16000:
+            return prompt_speech
+        return torch_resampler(sr, 16000)(prompt_speech)
+
+    def register(self, ref_wav_bytes: bytes, prompt_text: str = "", zero_shot: bool = False):
+        """
+        Return (entry, created). Registering the same audio (and, for zero_shot, transcript) again is
+        a cache hit. Blocking (decode, resample, feature extraction): call it from the thread pool.
+        """
+        prompt_text = prompt_text or ""
+        zero_shot = zero_shot and bool(prompt_text) and hasattr(model, "add_zero_shot_spk")
+        key = ref_wav_bytes + (b"zero_shot:" + prompt_text.encode() if zero_shot else b"")
+        speaker_id = hashlib.sha256(key).hexdigest()[:16]
+        with infer_lock:
+            entry = self.speakers.get(speaker_id)
+            if entry is not None:
+                self.speakers.move_to_end(speaker_id)
+                return entry, False
+
+            start = time.time()
+            prompt_speech = self._to_16k(ref_wav_bytes)
+            if zero_shot:
+                model.add_zero_shot_spk(prompt_text, prompt_speech, speaker_id)
+            entry = {
+                "speaker_id": speaker_id,
+                "prompt_speech": prompt_speech,
+                "prompt_text": prompt_text if zero_shot else "",
+                "features": zero_shot,
+                "created": time.time(),
+                "uses": 0,
+            }
+            self.speakers[speaker_id] = entry
+            while len(self.speakers) > self.capacity:
+                old_id, _ = self.speakers.popitem(last=False)
+                model.frontend.spk2info.pop(old_id, None)
+                print(f">>> Speaker {old_id} evicted from cache")
+        print(f">>> Speaker {speaker_id} registered in {time.time() - start:.3f}s (zero-shot features: {zero_shot})")
+        return entry, True
+
+    def get(self, speaker_id: str):
+        entry = self.speakers.get(speaker_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["uses"] += 1
+        self.speakers.move_to_end(speaker_id)
+        return entry
+
+    def remove(self, speaker_id: str) -> bool:
+        with infer_lock:
+            if self.speakers.pop(speaker_id, None) is None:
+                return False
+            model.frontend.spk2info.pop(speaker_id, None)
+        return True
+
+    def get_info(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "speakers": {
+                sid: {"prompt_text": e["prompt_text"], "features": e["features"], "uses": e["uses"], "created": e["created"]}
+                for sid, e in list(self.speakers.items())
+            },
+        }
+
+
+speakers = SpeakerRegistry(SPEAKER_CACHE_SIZE)
+
+
+def synthesize(tts_text: str, entry: dict, stream: bool = True):
+    """Yield waveform segments (float tensor [1, n]) as the model produces them."""
+    speaker_id = entry["speaker_id"]
+    print(f">>> TTS text: {tts_text} (speaker: {speaker_id}, stream: {stream})")
+    with infer_lock:
+        if not entry["features"]:
+            outputs = model.inference_instruct2(tts_text, "", entry["prompt_speech"], stream=stream)
+            for output in outputs:
+                yield output["tts_speech"]
+            return
+        # 请求解析到entry之后可能已被LRU淘汰：用entry里的参考音频临时补回特征，用完再去掉
+        readded = speaker_id not in model.frontend.spk2info
+        if readded:
+            model.add_zero_shot_spk(entry["prompt_text"], entry["prompt_speech"], speaker_id)
+        try:
+            for output in model.inference_zero_shot(tts_text, "", "", zero_shot_spk_id=speaker_id, stream=stream):
+                yield output["tts_speech"]
+        finally:
+            if readded and speaker_id not in speakers.speakers:
+                model.frontend.spk2info.pop(speaker_id, None)
+
+
+def timed_segments(tts_text: str, entry: dict):
+    """synthesize(stream=True) with time-to-first-audio and RTF logging."""
+    start = time.time()
+    samples = 0
+    for waveform in synthesize(tts_text, entry, stream=True):
+        if samples == 0:
+            print(f">>> Time to first audio: {time.time() - start:.3f}s")
+        samples += waveform.shape[-1]
+        yield waveform
+    if samples:
+        print(f">>> RTF: {(time.time() - start) / (samples / model.sample_rate):.4f} (Real-Time Factor)")
+
+
+def pcm_stream(tts_text: str, entry: dict):
+    """Raw 16-bit PCM at model.sample_rate, one chunk per synthesized segment (no disk writes)."""
+    for waveform in timed_segments(tts_text, entry):
+        yield to_pcm16(waveform.float().cpu())
+
+
+def framed_stream(tts_text: str, entry: dict, fmt: AudioFormat):
+    """
+    Frames in the negotiated format (scripts/pcm_protocol.py). Resampling from model.sample_rate
+    happens once here, so the client only slices ready frames.
+    """
+    encoder = FrameEncoder(fmt, model.sample_rate)
+    yield encoder.start(text=tts_text, speaker_id=entry["speaker_id"])
+    for waveform in timed_segments(tts_text, entry):
+        data = encoder.push(waveform.squeeze(0).float().cpu().numpy())
+        if data:
+            yield data
+    yield encoder.end()
+
+
+def negotiate_format(audio_protocol: Optional[str], sample_rate: Optional[int],
+                     sample_format: Optional[str], frame_ms: Optional[int]) -> Optional[AudioFormat]:
+    try:
+        return AudioFormat.from_request(audio_protocol, sample_rate, sample_format, frame_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def resolve_speaker(speaker_id: Optional[str], prompt_wav: Optional[UploadFile], prompt_text: str,
+                          zero_shot: bool = False) -> dict:
+    """
+    已注册的speaker_id，或上传的参考音频（按内容哈希注册，重复上传命中缓存）。
+    返回说话人条目本身，之后即使被LRU淘汰，本次请求仍然可用。
+    """
+    if speaker_id:
+        entry = speakers.get(speaker_id)
+        if entry is None:
+            # 被LRU淘汰或服务重启过，客户端需要重新注册
+            raise HTTPException(status_code=404, detail=f"Unknown speaker_id: {speaker_id}")
+        return entry
+    try:
+        ref_wav_bytes = await prompt_wav.read() if prompt_wav else b""
+        if not ref_wav_bytes:
+            raise ValueError("prompt_wav or speaker_id is required")
+        entry, _ = await run_in_threadpool(speakers.register, ref_wav_bytes, prompt_text, zero_shot)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Load wav failed : {e}")
+    return entry
+
+
+@app.post("/speakers")
+async def register_speaker(
+        prompt_wav: UploadFile = File(...),
+        prompt_text: str = Form(""),
+        zero_shot: bool = Form(False)
 ):
-    # 1. 读取上传的参考音频
+    """
+    Upload a reference once; synthesis requests then pass the returned speaker_id instead of the wav.
+    zero_shot=true (prompt_text must be the transcript of the reference) caches zero-shot prompt features.
+    """
     try:
         ref_wav_bytes = await prompt_wav.read()
+        entry, created = await run_in_threadpool(speakers.register, ref_wav_bytes, prompt_text, zero_shot)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Load wav failed : {e}")
+    return {"speaker_id": entry["speaker_id"], "created": created, "zero_shot": entry["features"]}
+
+
+@app.get("/speakers")
+def list_speakers():
+    return speakers.get_info()
+
+
+@app.delete("/speakers/{speaker_id}")
+def delete_speaker(speaker_id: str):
+    if not speakers.remove(speaker_id):
+        raise HTTPException(status_code=404, detail=f"Unknown speaker_id: {speaker_id}")
+    return {"status": "deleted", "speaker_id": speaker_id}
+
+
+@app.post("/generate")
+async def tts_zero_shot(
+        tts_text: str = Form(...),
+        prompt_text: str = Form(""),
+        prompt_wav: Optional[UploadFile] = File(None),
+        speaker_id: Optional[str] = Form(None),
+        stream: bool = Form(False),
+        zero_shot: bool = Form(False)
+):
+    entry = await resolve_speaker(speaker_id, prompt_wav, prompt_text, zero_shot)
+
+    # stream=true: WAV头（长度未知）+ 逐段PCM，分块传输
+    if stream:
+        def wav_stream():
+            yield wav_header(model.sample_rate)
+            yield from pcm_stream(tts_text, entry)
+        return StreamingResponse(wav_stream(), media_type="audio/wav")
 
-    # 2. 调用你的 TTS 生成函数
     try:
-        import time
-        start = time.time()
-        out_wav: bytes = generate_tts(tts_text, ref_wav_bytes, prompt_text)
-        end = time.time()
-
-        info_out = sf.info(io.BytesIO(out_wav))
-        sample_rate = info_out.samplerate
-        duration_out = info_out.frames / sample_rate
-        print(f">>> Generated wav sample rate: {sample_rate}")
-
-        # calc rtf
-        rtf = (end - start) / duration_out
-        print(f">>> RTF: {rtf:.4f} (Real-Time Factor)")
-
-        # save output in temp file
-        with open("temp_out.wav", "wb") as f:
-            f.write(out_wav)
-        print(f">>> Output saved to temp_out.wav")
-
-        import torch
-        torch.cuda.empty_cache()
+        pcm = await run_in_threadpool(lambda: b"".join(pcm_stream(tts_text, entry)))
     except Exception as e:
         # 内部运算失败
         raise HTTPException(status_code=500, detail=f"TTS generation failed: {e}")
 
-    # 3. 返回整个 WAV 二进制流
-    return Response(content=out_wav, media_type="audio/wav")
+    # 返回整个 WAV 二进制流
+    return Response(content=wav_header(model.sample_rate, len(pcm)) + pcm, media_type="audio/wav")
 
 
 @app.get('/health')
@@ -119,14 +296,27 @@ def health():
     return {"status": "running"}
 
 
-# Alias for /generate to support /inference_zero_shot endpoint
-@app.get("/inference_zero_shot")
-async def tts_zero_shot_get(
+# Streaming endpoint for lip-sync: raw 16-bit mono PCM at model.sample_rate, yielded per segment,
+# or with audio_protocol=pcm-frames, frames already resampled to the requested format
+@app.post("/inference_zero_shot")
+async def tts_inference_streaming(
         tts_text: str = Form(...),
-        prompt_text: str = Form(...),
-        prompt_wav: UploadFile = File(...)
+        prompt_text: str = Form(""),
+        prompt_wav: Optional[UploadFile] = File(None),
+        speaker_id: Optional[str] = Form(None),
+        audio_protocol: Optional[str] = Form(None),
+        sample_rate: Optional[int] = Form(None),
+        sample_format: Optional[str] = Form(None),
+        frame_ms: Optional[int] = Form(None),
+        zero_shot: bool = Form(False)
 ):
-    return await tts_zero_shot(tts_text, prompt_text, prompt_wav)
+    fmt = negotiate_format(audio_protocol, sample_rate, sample_format, frame_ms)
+    entry = await resolve_speaker(speaker_id, prompt_wav, prompt_text, zero_shot)
+    if fmt:
+        return StreamingResponse(framed_stream(tts_text, entry, fmt), media_type="application/octet-stream",
+                                 headers={"X-Audio-Format": fmt.header()})
+    return StreamingResponse(pcm_stream(tts_text, entry), media_type="application/octet-stream",
+                             headers={"X-Sample-Rate": str(model.sample_rate)})
 
 
 if __name__ == '__main__':
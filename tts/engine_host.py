@@ -0,0 +1,425 @@
+"""
+Resident TTS engine host.
+
+Keeps several TTS engines loaded at the same time under a memory budget and routes
+requests by model name, so switching avatars (and therefore voices) never stops one
+model to cold-start another.
+
+- EdgeEngine runs in-process (edge-tts is a thin network client, nothing to load).
+- ServerEngine runs an existing model server (taco/sovits/cosyvoice server.py) in its
+  own conda env on an internal port; the host owns the process and proxies to it.
+- When loading an engine would exceed the budget, the least recently used idle engine
+  (no requests in flight) is unloaded first.
+"""
+
+import abc
+import asyncio
+import io
+import os
+import signal
+import socket
+import struct
+import subprocess
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+DEFAULT_ENGINE_MEMORY_MB = 2000  # model_info.json 未填写 memory_mb 时的估计值
+
+
+class EngineUnavailable(Exception):
+    """Engine could not be loaded or served the request (unknown model, budget exhausted, start failure)."""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Engine(abc.ABC):
+    """
+    Base engine. Subclasses implement load/unload and stream_wav, which yields a WAV
+    byte stream (header first) for one utterance.
+    """
+
+    def __init__(self, model_name: str, info: dict):
+        self.model_name = model_name
+        self.info = info
+        self.memory_mb = int(info.get("memory_mb", DEFAULT_ENGINE_MEMORY_MB))
+        self.state = STATE_LOADING
+        self.inflight = 0
+        self.requests = 0
+        self.loaded_at: Optional[float] = None
+        self.last_used = time.time()
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @abc.abstractmethod
+    async def load(self):
+        """Make the engine ready to serve; raise EngineUnavailable on failure."""
+
+    async def unload(self):
+        pass
+
+    @abc.abstractmethod
+    def stream_wav(self, tts_text: str, prompt_text: str, prompt_wav: Optional[tuple],
+                   speaker_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Async generator of WAV bytes (header first) for one utterance."""
+
+    async def register_speaker(self, prompt_wav: tuple, prompt_text: str) -> dict:
+        raise EngineUnavailable(f"Model '{self.model_name}' does not support speaker registration", 404)
+
+    def get_info(self) -> dict:
+        return {
+            "state": self.state,
+            "memory_mb": self.memory_mb,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class EdgeEngine(Engine):
+    """edgeTTS in the host process: mp3 from the edge-tts SDK, converted to WAV per utterance."""
+
+    async def load(self):
+        import edge_tts  # noqa: F401  只在使用edgeTTS时需要
+        from pydub import AudioSegment  # noqa: F401
+
+    async def stream_wav(self, tts_text, prompt_text, prompt_wav, speaker_id=None):
+        import edge_tts
+        from pydub import AudioSegment
+
+        communicate = edge_tts.Communicate(tts_text, prompt_text or "en-US-GuyNeural")
+        mp3_buf = io.BytesIO()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                mp3_buf.write(chunk["data"])
+        audio = AudioSegment.from_file(io.BytesIO(mp3_buf.getvalue()), format="mp3")
+        wav_buf = io.BytesIO()
+        audio.export(wav_buf, format="wav")
+        yield wav_buf.getvalue()
+
+
+class ServerEngine(Engine):
+    """One model server process (server.py --model_name --port --use_gpu) owned by the host."""
+
+    def __init__(self, model_name: str, info: dict, port: int, use_gpu: bool, log_dir: str,
+                 start_timeout: float = 120):
+        super().__init__(model_name, info)
+        self.port = port
+        self.use_gpu = use_gpu
+        self.log_dir = log_dir
+        self.start_timeout = start_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.client = None
+
+    async def load(self):
+        import httpx
+
+        env_path = self.info.get("env_path")
+        server_path = self.info.get("server_path")
+        if not env_path or not os.path.exists(env_path):
+            raise EngineUnavailable(f"Model '{self.model_name}' does not have a valid environment path.")
+        if not server_path or not os.path.exists(server_path):
+            raise EngineUnavailable(f"Model '{self.model_name}' server path is not valid.")
+
+        env = os.environ.copy()
+        env["PATH"] = os.path.join(env_path, "bin") + ":" + env["PATH"]
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_file = open(os.path.join(self.log_dir, f"engine_{self.model_name}.log"), "ab")
+        command = [
+            os.path.join(env_path, "bin", "python"), server_path,
+            "--model_name", self.model_name,
+            "--port", str(self.port),
+            "--use_gpu", str(self.use_gpu)
+        ]
+        # 独立进程组：卸载时连同模型服务的子进程一起结束
+        self.process = subprocess.Popen(command, env=env, cwd=os.path.dirname(server_path),
+                                        stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+        log_file.close()
+        print(f">>> [EngineHost] Loading '{self.model_name}' (PID {self.process.pid}) on internal port {self.port} ...")
+
+        # 每个引擎一个长连接池，所有请求复用，不再每个请求新建客户端
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{self.port}",
+                                        timeout=httpx.Timeout(60.0, connect=2.0),
+                                        limits=httpx.Limits(max_connections=32, max_keepalive_connections=8))
+        deadline = time.time() + self.start_timeout
+        while True:
+            if self.process.poll() is not None:
+                raise EngineUnavailable(f"Model server '{self.model_name}' exited with code {self.process.returncode}")
+            try:
+                resp = await self.client.get("/health", timeout=2.0)
+                if resp.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                raise EngineUnavailable(f"Model server '{self.model_name}' failed to start within {self.start_timeout} seconds")
+            await asyncio.sleep(0.5)
+
+    async def unload(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        for _ in range(50):
+            if self.process.poll() is not None:
+                return
+            await asyncio.sleep(0.1)
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def stream_wav(self, tts_text, prompt_text, prompt_wav, speaker_id=None):
+        files = {
+            "tts_text": (None, tts_text),
+            "prompt_text": (None, prompt_text or ""),
+            "stream": (None, "true"),  # 支持分段流式的模型服务边合成边返回WAV，其他服务忽略该字段
+        }
+        if speaker_id:
+            files["speaker_id"] = (None, speaker_id)
+        else:
+            # 各模型服务的 /generate 都要求 prompt_wav 字段
+            files["prompt_wav"] = prompt_wav or ("prompt_wav", b"", "application/octet-stream")
+        async with self.client.stream("POST", "/generate", files=files) as response:
+            if response.status_code != 200:
+                detail = (await response.aread()).decode(errors="replace")
+                raise EngineUnavailable(f"Model server '{self.model_name}' returned {response.status_code}: {detail}",
+                                        response.status_code)
+            async for chunk in response.aiter_bytes():
+                yield chunk
+
+    async def register_speaker(self, prompt_wav, prompt_text):
+        response = await self.client.post("/speakers", files={"prompt_wav": prompt_wav, "prompt_text": (None, prompt_text)})
+        if response.status_code != 200:
+            raise EngineUnavailable(f"Model server '{self.model_name}' returned {response.status_code}: {response.text}",
+                                    response.status_code)
+        return response.json()
+
+    def get_info(self) -> dict:
+        info = super().get_info()
+        info["port"] = self.port
+        info["pid"] = self.process.pid if self.process else None
+        return info
+
+
+class EngineHost:
+    """
+    Args:
+        load_model_infos (Callable): returns model_info.json contents (re-read on every load)
+        budget_mb (int): total memory the resident engines may hold
+        base_port (int): first internal port for model server processes
+        use_gpu (bool): passed to model servers
+        log_dir (str): where model server output goes
+    """
+
+    def __init__(self, load_model_infos: Callable[[], Optional[dict]], budget_mb: int, base_port: int,
+                 use_gpu: bool = True, log_dir: str = "logs"):
+        self.load_model_infos = load_model_infos
+        self.budget_mb = budget_mb
+        self.base_port = base_port
+        self.use_gpu = use_gpu
+        self.log_dir = log_dir
+        self.engines: "OrderedDict[str, Engine]" = OrderedDict()  # LRU顺序：最久未使用的在前
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._lock = asyncio.Lock()
+        self.evictions = 0
+
+    def create_engine(self, model_name: str, info: dict, use_gpu: bool) -> Engine:
+        if model_name == "edgeTTS":
+            return EdgeEngine(model_name, info)
+        return ServerEngine(model_name, info, self._free_port(), use_gpu, self.log_dir)
+
+    def _free_port(self) -> int:
+        used = {e.port for e in self.engines.values() if isinstance(e, ServerEngine)}
+        port = self.base_port
+        while True:
+            if port not in used:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    if s.connect_ex(("127.0.0.1", port)) != 0:
+                        return port
+            port += 1
+
+    def used_mb(self) -> int:
+        return sum(e.memory_mb for e in self.engines.values())
+
+    async def ensure(self, model_name: str, use_gpu: Optional[bool] = None) -> Engine:
+        """Return a ready engine for model_name, loading it (and evicting LRU idle engines) if needed."""
+        async with self._lock:
+            engine = self.engines.get(model_name)
+            if engine is not None and engine.state == STATE_READY:
+                self.engines.move_to_end(model_name)
+                return engine
+            task = self._loading.get(model_name)
+            if task is None:
+                infos = self.load_model_infos() or {}
+                info = infos.get(model_name)
+                if info is None:
+                    raise EngineUnavailable(f"Model '{model_name}' not found in available models.")
+                if info.get("status") != "active":
+                    raise EngineUnavailable(f"Model '{model_name}' is not valid to use.")
+                engine = self.create_engine(model_name, info, self.use_gpu if use_gpu is None else use_gpu)
+                await self._make_room(engine.memory_mb)
+                self.engines[model_name] = engine
+                task = asyncio.ensure_future(self._load(engine))
+                self._loading[model_name] = task
+        # 同一模型的并发请求共享一次加载
+        return await asyncio.shield(task)
+
+    async def _make_room(self, needed_mb: int):
+        """Unload least recently used idle engines until needed_mb fits in the budget. Caller holds _lock."""
+        while self.used_mb() + needed_mb > self.budget_mb:
+            victim = next((e for e in self.engines.values() if e.state == STATE_READY and e.inflight == 0), None)
+            if victim is None:
+                raise EngineUnavailable(
+                    f"TTS memory budget exhausted ({self.used_mb()}/{self.budget_mb} MB in use, {needed_mb} MB needed)")
+            print(f">>> [EngineHost] Unloading LRU engine '{victim.model_name}' to free {victim.memory_mb} MB")
+            del self.engines[victim.model_name]
+            self.evictions += 1
+            await victim.unload()
+
+    async def _load(self, engine: Engine) -> Engine:
+        start = time.time()
+        try:
+            await engine.load()
+        except Exception as e:
+            engine.state = STATE_FAILED
+            engine.error = str(e)
+            await engine.unload()
+            async with self._lock:
+                if self.engines.get(engine.model_name) is engine:
+                    del self.engines[engine.model_name]
+            raise e if isinstance(e, EngineUnavailable) else EngineUnavailable(str(e))
+        finally:
+            self._loading.pop(engine.model_name, None)
+        engine.state = STATE_READY
+        engine.loaded_at = time.time()
+        engine.load_seconds = round(engine.loaded_at - start, 2)
+        print(f">>> [EngineHost] Engine '{engine.model_name}' ready in {engine.load_seconds}s "
+              f"({self.used_mb()}/{self.budget_mb} MB)")
+        return engine
+
+    @asynccontextmanager
+    async def session(self, model_name: str):
+        """Hold an engine for one request; an engine with requests in flight is never evicted."""
+        engine = await self.ensure(model_name)
+        engine.inflight += 1
+        engine.requests += 1
+        try:
+            yield engine
+        finally:
+            engine.inflight -= 1
+            engine.last_used = time.time()
+
+    async def unload(self, model_name: str) -> bool:
+        async with self._lock:
+            engine = self.engines.pop(model_name, None)
+        if engine is None:
+            return False
+        await engine.unload()
+        return True
+
+    async def shutdown(self):
+        for model_name in list(self.engines):
+            await self.unload(model_name)
+
+    def get_status(self) -> dict:
+        return {
+            "budget_mb": self.budget_mb,
+            "used_mb": self.used_mb(),
+            "evictions": self.evictions,
+            "lru_order": list(self.engines),
+            "engines": {name: engine.get_info() for name, engine in self.engines.items()},
+        }
+
+
+async def open_stream(host: EngineHost, model_name: str, tts_text: str, prompt_text: str,
+                      prompt_wav: Optional[tuple], speaker_id: Optional[str] = None, pcm: bool = False,
+                      wrap: Optional[Callable[[AsyncIterator[bytes], int], AsyncIterator[bytes]]] = None
+                      ) -> Tuple[Optional[int], bytes, AsyncIterator[bytes]]:
+    """
+    Start one utterance on a resident engine and read up to its first chunk, so that errors
+    (unknown speaker, crashed model server) surface before a response is committed.
+
+    Returns (sample_rate, first, rest): sample_rate is None unless pcm; rest yields the remaining
+    chunks. The engine is held (never unloaded) until rest is exhausted or closed. On any error
+    the upstream body is closed and the engine released before the exception propagates.
+
+    Args:
+        pcm (bool): strip the WAV header and yield raw PCM
+        wrap (Callable): wrap(pcm_body, sample_rate) -> body, e.g. resample and frame the PCM
+    """
+    stack = AsyncExitStack()
+    try:
+        engine = await stack.enter_async_context(host.session(model_name))
+        body = engine.stream_wav(tts_text, prompt_text, prompt_wav, speaker_id)
+        stack.push_async_callback(body.aclose)  # 关闭模型服务的响应体（httpx stream）
+        sample_rate = None
+        if pcm:
+            body = wav_to_pcm(body)
+            stack.push_async_callback(body.aclose)
+            sample_rate = await body.__anext__()  # 第一个值是采样率
+            if wrap is not None:
+                body = wrap(body, sample_rate)
+                stack.push_async_callback(body.aclose)
+        try:
+            first = await body.__anext__()
+        except StopAsyncIteration:
+            first = b""
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def rest():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            await stack.aclose()
+
+    return sample_rate, first, rest()
+
+
+async def wav_to_pcm(wav_stream: AsyncIterator[bytes]):
+    """
+    Strip the WAV header from a streamed WAV body.
+    Yields the sample rate first, then raw PCM chunks.
+    """
+    buf = b""
+    sample_rate = None
+    async for chunk in wav_stream:
+        if buf is None:
+            yield chunk
+            continue
+        buf += chunk
+        # RIFF头之后逐个chunk查找 fmt 和 data
+        pos = 12
+        while pos + 8 <= len(buf):
+            chunk_id, size = buf[pos:pos + 4], struct.unpack("<I", buf[pos + 4:pos + 8])[0]
+            if chunk_id == b"fmt " and pos + 16 <= len(buf):
+                sample_rate = struct.unpack("<I", buf[pos + 12:pos + 16])[0]
+            if chunk_id == b"data":
+                if sample_rate is None:
+                    raise ValueError("WAV stream has no fmt chunk before data")
+                yield sample_rate
+                if len(buf) > pos + 8:
+                    yield buf[pos + 8:]
+                buf = None
+                break
+            pos += 8 + size
+    if buf is not None:
+        raise ValueError("WAV stream ended before the data chunk")
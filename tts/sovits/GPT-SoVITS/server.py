@@ -1,14 +1,15 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
+from typing import Optional
+import hashlib
+import threading
+import time
 import os
 import sys
 import torch
-import tempfile
 import traceback
-import torchaudio
 import numpy as np
 import soundfile as sf
-from soundfile import info as sf_info
 import argparse
 # 添加 GPT-SoVITS 模块路径
 import sys
@@ -27,6 +28,8 @@ os.chdir(BASE_DIR)  # sv.py 中使用 os.getcwd() 拼接相对路径，必须这
 # 设置 sys.path，确保模块可以 import
 sys.path.append(BASE_DIR)
 sys.path.append(os.path.join(BASE_DIR, "GPT_SoVITS"))
+sys.path.insert(0, os.path.abspath(os.path.join(BASE_DIR, "..", "..", "..")))
+from scripts.pcm_protocol import AudioFormat, FrameEncoder, to_pcm16, torch_resampler, wav_header
 
 from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
 print(">>> Initializing GPT-SoVITS model...")
@@ -38,14 +41,55 @@ print(">>> GPT-SoVITS model loaded!")
 
 app = FastAPI()
 
-def generate_tts_sovits(tts_text: str, ref_wav_bytes: bytes, prompt_text: str) -> bytes:
-    import time
+OUTPUT_SAMPLE_RATE = 24000
+REF_DIR = os.path.join(BASE_DIR, "ref_cache")  # 参考音频按内容哈希保存一次，之后直接复用路径
+REF_CACHE_SIZE = 32  # ref_cache 中保留的参考音频数，超出按LRU删除
+infer_lock = threading.Lock()  # TTS 实例不是线程安全的
+_ref_lock = threading.Lock()
+
+
+def ref_audio_path_for(ref_wav_bytes: bytes) -> str:
+    """
+    GPT-SoVITS needs a file path for the reference; write each distinct reference once. The file
+    mtime marks its last use, and files beyond REF_CACHE_SIZE are removed least recently used first.
+    """
+    os.makedirs(REF_DIR, exist_ok=True)
+    path = os.path.join(REF_DIR, hashlib.sha256(ref_wav_bytes).hexdigest()[:16] + ".wav")
+    with _ref_lock:
+        if os.path.exists(path):
+            os.utime(path)
+            return path
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(ref_wav_bytes)
+        os.replace(tmp_path, path)
+        cached = sorted((os.path.join(REF_DIR, name) for name in os.listdir(REF_DIR) if name.endswith(".wav")),
+                        key=os.path.getmtime, reverse=True)
+        for stale in cached[REF_CACHE_SIZE:]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return path
+
+
+def to_mono_float(audio: np.ndarray) -> np.ndarray:
+    if audio.dtype != np.float32:
+        audio = audio.astype(np.float32) / 32768.0  # 归一化
+    return audio if audio.ndim == 1 else audio.mean(axis=1)
+
+
+def fragment_pcm16(sr: int, audio: np.ndarray) -> bytes:
+    """One fragment from TTS.run -> 16-bit mono PCM at OUTPUT_SAMPLE_RATE."""
+    audio_tensor = torch.from_numpy(to_mono_float(audio)).unsqueeze(0)
+    if sr != OUTPUT_SAMPLE_RATE:
+        audio_tensor = torch_resampler(sr, OUTPUT_SAMPLE_RATE)(audio_tensor)
+    return to_pcm16(audio_tensor)
+
+
+def fragments_sovits(tts_text: str, ref_audio_path: str, prompt_text: str):
+    """Yield (sr, audio) per text segment as GPT-SoVITS produces it (return_fragment), no output files."""
     start = time.time()
-    # 将参考音频保存为临时文件
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_wav:
-        tmp_wav.write(ref_wav_bytes)
-        ref_audio_path = tmp_wav.name
-
     req = {
         "text": tts_text,
         "text_lang": 'en',
@@ -56,64 +100,84 @@ def generate_tts_sovits(tts_text: str, ref_wav_bytes: bytes, prompt_text: str) -
         "top_k": 5,
         "top_p": 1.0,
         "temperature": 1.0,
-        "text_split_method": "cut1",
+        "text_split_method": "cut5",  # 按标点切分，每段合成完就返回
         "batch_size": 1,
         "batch_threshold": 0.75,
-        "split_bucket": True,
+        "split_bucket": False,
         "speed_factor": 1.0,
         "fragment_interval": 0.3,
         "seed": -1,
         "media_type": "wav",
         "streaming_mode": False,
+        "return_fragment": True,
         "parallel_infer": True,
         "repetition_penalty": 1.35,
         "sample_steps": 32,
         "super_sampling": False,
     }
+    duration = 0.0
+    with infer_lock:
+        for sr, audio in sovits_model.run(req):
+            if duration == 0:
+                print(f">>> Time to first audio: {time.time() - start:.3f}s")
+            duration += len(audio) / sr
+            yield sr, audio
+    if duration:
+        print(f">>> RTF: {(time.time() - start) / duration:.4f}")
+
+
+def pcm_stream_sovits(tts_text: str, ref_audio_path: str, prompt_text: str):
+    """16-bit PCM at OUTPUT_SAMPLE_RATE, one chunk per text segment."""
+    for sr, audio in fragments_sovits(tts_text, ref_audio_path, prompt_text):
+        yield fragment_pcm16(sr, audio)
+
+
+def framed_stream_sovits(tts_text: str, ref_audio_path: str, prompt_text: str, fmt: AudioFormat):
+    """
+    Frames in the negotiated format (scripts/pcm_protocol.py), resampled once from the model's
+    native rate (no intermediate 24 kHz step), so the client only slices ready frames.
+    """
+    encoder = None
+    yield FrameEncoder(fmt, fmt.sample_rate).start(text=tts_text)
+    for sr, audio in fragments_sovits(tts_text, ref_audio_path, prompt_text):
+        if encoder is None:
+            encoder = FrameEncoder(fmt, sr)
+        data = encoder.push(to_mono_float(audio))
+        if data:
+            yield data
+    yield (encoder or FrameEncoder(fmt, fmt.sample_rate)).end()
 
-    try:
-        generator = sovits_model.run(req)
-        sr, audio = next(generator)
-
-        if audio.dtype != np.float32:
-            audio = audio.astype(np.float32) / 32768.0  # 归一化
-
-        audio_tensor = torch.from_numpy(audio).unsqueeze(0) if audio.ndim == 1 else torch.from_numpy(audio.T)
-
-        # 采样率转换为 24000
-        if sr != 24000:
-            resampler = torchaudio.transforms.Resample(orig_freq=sr, new_freq=24000)
-            audio_tensor = resampler(audio_tensor)
-            sr = 24000
 
-        out_buf = tempfile.NamedTemporaryFile(delete=False, suffix=".wav")
-        torchaudio.save(out_buf.name, audio_tensor, sr)
-
-        with open(out_buf.name, "rb") as f:
-            result = f.read()
-
-        duration = sf_info(out_buf.name).frames / sr
-        end = time.time()
-        print(f">>> RTF: {(end - start)/duration:.4f}")
-
-        return result
+def generate_tts_sovits(tts_text: str, ref_wav_bytes: bytes, prompt_text: str) -> bytes:
+    try:
+        pcm = b"".join(pcm_stream_sovits(tts_text, ref_audio_path_for(ref_wav_bytes), prompt_text))
+        return wav_header(OUTPUT_SAMPLE_RATE, len(pcm)) + pcm
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"TTS 推理失败: {e}")
-    finally:
-        os.remove(ref_audio_path)
+
 
 @app.post("/generate")
 async def tts_zero_shot(
     tts_text: str = Form(...),
     prompt_text: str = Form(...),
-    prompt_wav: UploadFile = File(...)
+    prompt_wav: UploadFile = File(...),
+    stream: bool = Form(False)
 ):
     try:
         ref_wav_bytes = await prompt_wav.read()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"读取参考音频失败: {e}")
 
+    # stream=true: WAV头（长度未知）+ 逐段PCM，分块传输
+    if stream:
+        ref_audio_path = ref_audio_path_for(ref_wav_bytes)
+
+        def wav_stream():
+            yield wav_header(OUTPUT_SAMPLE_RATE)
+            yield from pcm_stream_sovits(tts_text, ref_audio_path, prompt_text)
+        return StreamingResponse(wav_stream(), media_type="audio/wav")
+
     try:
         out_wav = generate_tts_sovits(tts_text, ref_wav_bytes, prompt_text)
     except Exception as e:
@@ -121,6 +185,35 @@ async def tts_zero_shot(
 
     return Response(content=out_wav, media_type="audio/wav")
 
+
+# Streaming endpoint: raw 16-bit mono PCM at 24 kHz, yielded per text segment,
+# or with audio_protocol=pcm-frames, frames already resampled to the requested format
+@app.post("/inference_zero_shot")
+async def tts_inference_streaming(
+    tts_text: str = Form(...),
+    prompt_text: str = Form(...),
+    prompt_wav: UploadFile = File(...),
+    audio_protocol: Optional[str] = Form(None),
+    sample_rate: Optional[int] = Form(None),
+    sample_format: Optional[str] = Form(None),
+    frame_ms: Optional[int] = Form(None)
+):
+    try:
+        fmt = AudioFormat.from_request(audio_protocol, sample_rate, sample_format, frame_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        ref_audio_path = ref_audio_path_for(await prompt_wav.read())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"读取参考音频失败: {e}")
+    if fmt:
+        return StreamingResponse(framed_stream_sovits(tts_text, ref_audio_path, prompt_text, fmt),
+                                 media_type="application/octet-stream",
+                                 headers={"X-Audio-Format": fmt.header()})
+    return StreamingResponse(pcm_stream_sovits(tts_text, ref_audio_path, prompt_text),
+                             media_type="application/octet-stream",
+                             headers={"X-Sample-Rate": str(OUTPUT_SAMPLE_RATE)})
+
 @app.get('/health')
 def health():
     return {"status": "running"}
@@ -0,0 +1,104 @@
+"""
+Micro-batching for the Tacotron2 server.
+
+Synthesis requests that arrive within max_wait_ms of each other (or until max_batch are waiting)
+are grouped into length buckets and run as one batched inference on a single worker thread;
+each caller gets back only its own result. Requests arriving while a batch is running queue up
+and form the next batch, so batches grow with load and stay at size 1 when idle. The window is
+only waited for while the previous batch had company, so a lone request is dispatched at once.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+
+class MicroBatcher:
+    """
+    batch_fn(texts) -> results, called with texts sorted by length_fn, longest first
+    (speechbrain's Tacotron2.encode_batch requires decreasing input lengths).
+    """
+
+    def __init__(self, batch_fn: Callable[[List[str]], Sequence], max_batch: int = 8, max_wait_ms: float = 10.0,
+                 length_ratio: float = 0.5, length_fn: Callable[[str], int] = len):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        # 同一批里最短的输入至少是最长的 length_ratio 倍，避免短句陪长句做大量padding计算
+        self.length_ratio = length_ratio
+        self.length_fn = length_fn
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="taco-batch")
+        self.batches = 0
+        self.items = 0
+        self.last_batch = 0
+
+    async def submit(self, text: str):
+        """Queue one input and wait for its result."""
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.ensure_future(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    def make_buckets(self, items: list) -> List[list]:
+        items = sorted(items, key=lambda item: self.length_fn(item[0]), reverse=True)
+        buckets = []
+        for item in items:
+            if (buckets and len(buckets[-1]) < self.max_batch
+                    and self.length_fn(item[0]) >= self.length_ratio * self.length_fn(buckets[-1][0][0])):
+                buckets[-1].append(item)
+            else:
+                buckets.append([item])
+        return buckets
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            # 上一批只有一个请求说明负载低，不再等窗口，单个请求没有额外延迟
+            deadline = loop.time() + (self.max_wait if self.last_batch > 1 else 0)
+            while len(pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0 or not self.queue.empty():
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # 上一批推理期间排队的请求全部拿出来一起分桶，长度相近的才能凑成满批
+            while not self.queue.empty() and len(pending) < self.max_batch * 4:
+                pending.append(self.queue.get_nowait())
+            self.last_batch = len(pending)
+            for bucket in self.make_buckets(pending):
+                await self._infer(loop, bucket)
+
+    async def _infer(self, loop, bucket: list):
+        # 客户端已断开的请求不再计算
+        bucket = [(text, future) for text, future in bucket if not future.done()]
+        if not bucket:
+            return
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn, [text for text, _ in bucket])
+        except Exception as e:
+            for _, future in bucket:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(bucket)
+        for (_, future), result in zip(bucket, results):
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "queued": self.queue.qsize() if self.queue else 0,
+        }
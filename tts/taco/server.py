@@ -1,20 +1,29 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from speechbrain.inference.TTS import Tacotron2
 from speechbrain.inference.vocoders import HIFIGAN
-import torchaudio
 import torch
-import io
+import asyncio
+import re
 import tempfile
 import subprocess
 import time
-import torchaudio.transforms as T
 import librosa
 import soundfile as sf
 import numpy as np
 import argparse
 import os
+import sys
 import uvicorn
+from batcher import MicroBatcher
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from scripts.pcm_protocol import to_pcm16, torch_resampler, wav_header
+
+OUTPUT_SAMPLE_RATE = 24000
+HOP_LENGTH = 256  # speechbrain/tts-hifigan-ljspeech: 每个mel帧对应的采样点数
+MAX_BATCH = 8  # 一次批量推理的最大句子数
+BATCH_WAIT_MS = 10  # 第一个请求到达后等待凑批的时间
 
 
 def scale(x):
@@ -28,28 +37,40 @@ def scale(x):
         return 1.0
 
 
-def resample(sample_rate, resample_rate, audio_bytes):
-    if sample_rate == resample_rate:
-        return audio_bytes
+def waveform_pcm16(waveform: torch.Tensor, sample_rate: int) -> bytes:
+    """
+    One synthesized waveform -> 16-bit PCM at OUTPUT_SAMPLE_RATE. The waveform is treated as
+    sample_rate audio (the timbre scale), so resampling also shifts speed and pitch.
+    """
+    if sample_rate != OUTPUT_SAMPLE_RATE:
+        waveform = torch_resampler(sample_rate, OUTPUT_SAMPLE_RATE)(waveform.unsqueeze(0)).squeeze(0)
+    return to_pcm16(waveform)
+
 
-    # 读取音频
-    audio_tensor, sr = torchaudio.load(io.BytesIO(audio_bytes))
-    resampler = T.Resample(orig_freq=sample_rate, new_freq=resample_rate)
-    audio_resampled = resampler(audio_tensor)
+def split_sentences(text: str):
+    """句子是批处理的单位：长文本的各句一起批量推理，并按顺序逐句返回"""
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?;])\s+", text) if s.strip()]
+    return sentences or [text]
 
-    # 保存为 bytes
-    buffer = io.BytesIO()
-    torchaudio.save(buffer, audio_resampled.cpu(), resample_rate, format="wav")
-    return buffer.getvalue()
 
+def synthesize_batch(texts):
+    """
+    Batched Tacotron2 + HiFi-GAN. Returns one CPU waveform (1-D tensor) per text, in input order.
+    Runs on the batcher's worker thread.
+    """
+    # encode_batch 要求按编码后的长度降序排列
+    lengths = [tacotron2.text_to_seq(text)[1] for text in texts]
+    order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+    mel_outputs, mel_lengths, _ = tacotron2.encode_batch([texts[i] for i in order])
+    waveforms = hifi_gan.decode_batch(mel_outputs).squeeze(1).cpu()
+    results = [None] * len(texts)
+    for rank, i in enumerate(order):
+        # 去掉padding部分
+        results[i] = waveforms[rank, :int(mel_lengths[rank]) * HOP_LENGTH]
+    return results
 
-def generate_tts(tts_text: str, sample_rate: int):
-    mel_output, mel_length, alignment = tacotron2.encode_text(tts_text)
-    waveforms = hifi_gan.decode_batch(mel_output)
-    duration = waveforms.shape[-1] / sample_rate
-    buffer = io.BytesIO()
-    torchaudio.save(buffer, waveforms.squeeze(1).cpu(), sample_rate, format="wav")
-    return buffer.getvalue(), duration
+
+batcher = MicroBatcher(synthesize_batch, max_batch=MAX_BATCH, max_wait_ms=BATCH_WAIT_MS)
 
 
 app = FastAPI()
@@ -59,38 +80,51 @@ app = FastAPI()
 async def tts_zero_shot(
         tts_text: str = Form(...),
         prompt_text: str = Form(...),
-        prompt_wav: UploadFile = File(...)
+        prompt_wav: UploadFile = File(...),
+        stream: bool = Form(False)
 ):
-    try:
-        # 读取参考音频（即使不使用也要处理）
-        # ref_wav_bytes = await prompt_wav.read()
-
-        # 处理 prompt_text 为整数，用于控制采样率
-        prompt_int = int(prompt_text) if prompt_text.isdigit() else 45
-        print(f">>> Using scale factor: {prompt_int}")
-        scale_factor = scale(prompt_int)
-        sample_rate = int(scale_factor * 24000)
-        sample_rate = (sample_rate // 100) * 100
+    # 读取参考音频（即使不使用也要处理）
+    # ref_wav_bytes = await prompt_wav.read()
+
+    # 处理 prompt_text 为整数，用于控制采样率
+    prompt_int = int(prompt_text) if prompt_text.isdigit() else 45
+    print(f">>> Using scale factor: {prompt_int}")
+    scale_factor = scale(prompt_int)
+    sample_rate = int(scale_factor * 24000)
+    sample_rate = (sample_rate // 100) * 100
+
+    # 每句单独提交给批处理器，和其他并发请求的句子一起批量推理
+    start = time.time()
+    tasks = [asyncio.ensure_future(batcher.submit(sentence)) for sentence in split_sentences(tts_text)]
+
+    # stream=true: WAV头（长度未知）+ 按顺序逐句返回PCM
+    if stream:
+        async def wav_stream():
+            try:
+                yield wav_header(OUTPUT_SAMPLE_RATE)
+                for task in tasks:
+                    yield waveform_pcm16(await task, sample_rate)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(wav_stream(), media_type="audio/wav")
 
-        # 生成音频
-        start = time.time()
-        out_wav, duration = generate_tts(tts_text, sample_rate)
-        out_wav_resampled = resample(sample_rate, 24000, out_wav)
-        end = time.time()
-
-        rtf = (end - start) / duration if duration > 0 else float('inf')
-        print(f">>> Generated audio duration: {duration:.2f}s, RTF: {rtf:.4f}")
+    try:
+        waveforms = await asyncio.gather(*tasks)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"TTS generation failed: {e}")
 
-        # 保存临时输出（可选）
-        with open("temp_out.wav", "wb") as f:
-            f.write(out_wav_resampled)
+    pcm = b"".join(waveform_pcm16(waveform, sample_rate) for waveform in waveforms)
+    duration = len(pcm) / 2 / OUTPUT_SAMPLE_RATE
+    rtf = (time.time() - start) / duration if duration > 0 else float('inf')
+    print(f">>> Generated audio duration: {duration:.2f}s, RTF: {rtf:.4f}, batching: {batcher.get_stats()}")
 
-        torch.cuda.empty_cache()
+    return Response(content=wav_header(OUTPUT_SAMPLE_RATE, len(pcm)) + pcm, media_type="audio/wav")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"TTS generation failed: {e}")
 
-    return Response(content=out_wav_resampled, media_type="audio/wav")
+@app.get("/batching")
+def batching_stats():
+    return batcher.get_stats()
 
 
 @app.get("/health")
@@ -103,8 +137,12 @@ if __name__ == '__main__':
     parser.add_argument('--model_name', required=True)
     parser.add_argument('--port', type=int, default=5033)
     parser.add_argument('--use_gpu', type=bool, default=True)
+    parser.add_argument('--max_batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--batch_wait_ms', type=float, default=BATCH_WAIT_MS)
 
     args = parser.parse_args()
+    batcher.max_batch = args.max_batch
+    batcher.max_wait = args.batch_wait_ms / 1000.0
     if args.model_name == 'tacotron':
         print(f">>> Using Tacotron2 model: {args.model_name}")
     else:
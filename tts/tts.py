@@ -3,16 +3,18 @@ from fastapi.responses import Response
 from typing import Optional
 import subprocess
 import asyncio
-import psutil
-import httpx
 import json
 import time
 import os
+import sys
 import numpy as np
-import io
 import soundfile as sf  # pip install soundfile
 from fastapi import Response, HTTPException
 from fastapi.responses import StreamingResponse
+from engine_host import EngineHost, EngineUnavailable, open_stream
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from scripts.pcm_protocol import AudioFormat, FrameEncoder
 
 # ========== Configuration =========
 CURENT_TTS_SERVER = None
@@ -20,6 +22,7 @@ TTS_SERVER_PORT = 5033
 TTS_SERVER_PID = None
 TTS_SERVER_USE_GPU = True
 TTS_TIMBRE = None
+ENGINE_MEMORY_BUDGET_MB = 10000  # 常驻引擎（model_info.json memory_mb 之和）的内存预算，超出时按LRU卸载
 
 PROJ_ROOT = os.path.dirname(os.path.abspath(__file__))
 CONFIG_FILE = os.path.join(PROJ_ROOT, "config.json")
@@ -92,58 +95,31 @@ def load_avatars():
     return contents
 
 
-def find_pid_on_port(port):
-    for conn in psutil.net_connections(kind='inet'):
-        if conn.status == psutil.CONN_LISTEN and conn.laddr.port == port:
-            return conn.pid
-    return None
-
-
-def stop_tts_server():
-    """ Stop the currently running TTS server if it exists.
-    用port找到运行中的process, 然后kill掉它
-    trick: 不应该kill掉记录的进程, 因为运行的进程并不是服务器的实际进程, 而是server脚本的进程!!
-    实际上记录进程号这件事完全没有必要！
-    """
-    global CURENT_TTS_SERVER, TTS_SERVER_PID, TTS_SERVER_PORT, TTS_SERVER_USE_GPU, TTS_TIMBRE
-    if TTS_SERVER_PORT and CURENT_TTS_SERVER:
-        pid = find_pid_on_port(TTS_SERVER_PORT)
-        if pid:
-            print(f">>> Stopping TTS server [{CURENT_TTS_SERVER}] on port {TTS_SERVER_PORT} ...")
-            os.kill(pid, 9)  # 强制终止进程
-            print(f">>> TTS server on port {TTS_SERVER_PORT} stopped successfully.")
-        else:
-            print(f">>> No TTS server is running on port {TTS_SERVER_PORT}.")
-
-    # Reset global variables
-    CURENT_TTS_SERVER = None
-    TTS_SERVER_PID = None
-    TTS_SERVER_PORT = None
-    TTS_SERVER_USE_GPU = True
-    TTS_TIMBRE = None
-    print(">>> TTS server stopped and reset global variables.")
+def resolve_prompt_text(model_name, timbre, prompt_text=None):
+    """Map a timbre name to the prompt_text each model server expects."""
+    if model_name == "edgeTTS":
+        return EDGE_TIMVRES_MAP.get(timbre, "en-US-GuyNeural") if timbre else "en-US-GuyNeural"
+    elif model_name == "tacotron":
+        return TACO_TIMVRES_MAP.get(timbre, "40") if timbre else "40"
+    elif model_name == "sovits":
+        return timbre if timbre else "The course name COMP9331 is simply compained 3331."
+    return prompt_text
 
 
-def generate_pcm_stream(wav_bytes: bytes, chunk_size=4096):
-    import wave
-    with wave.open(io.BytesIO(wav_bytes), 'rb') as wav_file:
-        while True:
-            chunk = wav_file.readframes(chunk_size // 2)  # 每帧是2字节
-            if not chunk:
-                break
-            yield chunk
+# ========== FastAPI Application =========
+app = FastAPI()
 
+# 所有模型常驻在同一个host下，按模型名路由；切换模型不再停止其他模型
+engine_host = EngineHost(load_model_info, ENGINE_MEMORY_BUDGET_MB, TTS_SERVER_PORT, TTS_SERVER_USE_GPU,
+                         log_dir=os.path.join(PROJ_ROOT, "logs"))
 
-def generate_pcm_bytes(wav_bytes: bytes) -> bytes:
-    import wave
-    with wave.open(io.BytesIO(wav_bytes), 'rb') as wav_file:
-        return wav_file.readframes(wav_file.getnframes())
 
-# ========== FastAPI Application =========
-app = FastAPI()
+@app.on_event("shutdown")
+async def shutdown_engines():
+    await engine_host.shutdown()
 
 
-# start a new TTS server, and stop old tts server if it exists
+# load a TTS model into the engine host and make it the default model
 @app.post("/tts/start")
 async def start_tts_server(
         model_name: str = Form(...),
@@ -151,11 +127,12 @@ async def start_tts_server(
         use_gpu: bool = Form(TTS_SERVER_USE_GPU),
 ):
     """
-    Start a TTS server with the specified model and port.
-    If a TTS server is already running, it will be stopped before starting a new one.
+    Make sure a TTS model is resident in the engine host and use it as the default model.
+    Other resident models keep running; least recently used idle models are unloaded only
+    when the memory budget requires it.
     Args:
         model_name (str): The name of the TTS model to use.
-        port (int): The port on which the TTS server will run (optional, default as 5033).
+        port (int): Kept for compatibility; internal ports are assigned by the engine host.
         use_gpu (bool): Whether to use GPU for TTS processing (optional, default as True).
     Returns:
         {
@@ -164,11 +141,10 @@ async def start_tts_server(
             "port": int
             "model_name": str
             "use_gpu": bool
+            "resident": list
         }
     """
     global CURENT_TTS_SERVER, TTS_SERVER_PID, TTS_SERVER_PORT, TTS_SERVER_USE_GPU, TTS_TIMBRE
-    env_path = None
-    server_path = None
 
     # 1. check model_name is valid
     model_infos = load_model_info()
@@ -176,70 +152,23 @@ async def start_tts_server(
         raise HTTPException(status_code=500, detail="Model information not found.")
     if model_name not in model_infos:
         raise HTTPException(status_code=400, detail=f"Model '{model_name}' not found in available models.")
+    model_info = model_infos[model_name]
+    if not model_info.get("status", None) == "active":
+        raise HTTPException(status_code=400, detail=f"Model '{model_name}' is not valid to use.")
+
+    # 2. load into the engine host (no-op if already resident)
+    try:
+        engine = await engine_host.ensure(model_name, use_gpu)
+    except EngineUnavailable as e:
+        print(f"TTS model '{model_name}' failed to load: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
 
-    if model_name in model_infos:
-        model_info = model_infos[model_name]
-
-        if not model_info.get("status", None) == "active":
-            raise HTTPException(status_code=400, detail=f"Model '{model_name}' is not valid to use.")
-
-        env_path = model_info.get("env_path", None)
-        if not env_path:
-            raise HTTPException(status_code=400, detail=f"Model '{model_name}' does not have a valid environment path.")
-        if not os.path.exists(env_path):
-            raise HTTPException(status_code=400, detail=f"Model '{model_name}' does not have a valid environment path.")
-
-        server_path = model_info.get("server_path", None)
-        if not server_path or not os.path.exists(server_path):
-            raise HTTPException(status_code=400, detail=f"Model '{model_name}' server path is not valid.")
-
-    # 2. stop the current TTS server if it exists (even if it is the same model)
-    if CURENT_TTS_SERVER:
-        stop_tts_server()
-
-    # 3. Check if the port is already in use
-    if find_pid_on_port(port):
-        raise HTTPException(status_code=400, detail=f"Port {port} is already in use. Please choose a different port.")
-
-    # 4. start a new TTS server
-    python_exec = os.path.join(env_path, "bin", "python")
-    command = [
-        python_exec, server_path,
-        "--model_name", model_name,
-        "--port", str(port),
-        "--use_gpu", str(use_gpu)
-    ]
-    env = os.environ.copy()
-    env["PATH"] = os.path.join(env_path, "bin") + ":" + env["PATH"]
-
-    process = subprocess.Popen(command, env=env)
     CURENT_TTS_SERVER = model_name
-    TTS_SERVER_PID = process.pid
-    TTS_SERVER_PORT = port
+    TTS_SERVER_PID = getattr(engine, "process", None) and engine.process.pid
+    TTS_SERVER_PORT = getattr(engine, "port", None)
     TTS_SERVER_USE_GPU = use_gpu
     TTS_TIMBRE = model_info.get("cur_timbre", None)  # Get the current timbre if available
 
-    # 5. 等待 TTS 端口启动成功
-    timeout = 60
-    interval = 0.5
-    start_time = time.time()
-    while True:
-        try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"http://localhost:{port}/health",
-                                        timeout=2.0)  # 假设 TTS server 有个 /ping 或 /health 接口
-                if resp.status_code == 200:
-                    break
-        except Exception:
-            pass
-
-        if time.time() - start_time > timeout:
-            stop_tts_server()  # 启动失败，自动关闭刚开的进程
-            print(f"TTS server '{model_name}' failed to start within {timeout} seconds.")
-            raise HTTPException(status_code=500, detail=f"TTS 模型服务启动超时（超过 {timeout} 秒）")
-
-        await asyncio.sleep(interval)
-
     # write config
     config = {
         "tts_server_port": TTS_SERVER_PORT,
@@ -250,17 +179,15 @@ async def start_tts_server(
     }
     save_config(config)
 
-    if CURENT_TTS_SERVER:
-        return {
-            "status": "success",
-            "message": f"TTS server '{model_name}' started successfully.",
-            "port": port,
-            "model_name": model_name,
-            "use_gpu": use_gpu,
-            "timbre": TTS_TIMBRE
-        }
-    else:
-        raise HTTPException(status_code=500, detail="Failed to start TTS server.")
+    return {
+        "status": "success",
+        "message": f"TTS model '{model_name}' is ready.",
+        "port": TTS_SERVER_PORT,
+        "model_name": model_name,
+        "use_gpu": use_gpu,
+        "timbre": TTS_TIMBRE,
+        "resident": list(engine_host.engines)
+    }
 
 
 # generate TTS response
@@ -277,46 +204,159 @@ async def get_tts_response(
         prompt_text (str): The text prompt for the TTS model.
         prompt_wav (UploadFile): An optional audio file to use as a prompt.
     Returns:
-        Response: The generated audio file in WAV format.
+        StreamingResponse: Raw 16-bit mono PCM, proxied chunk by chunk as the engine produces it.
     """
     # Check if a TTS server is running
-    global CURENT_TTS_SERVER, TTS_SERVER_PID, TTS_TIMBRE
     if not CURENT_TTS_SERVER:
         raise HTTPException(status_code=503, detail="No TTS server is currently running.")
 
-    if CURENT_TTS_SERVER == "edgeTTS":
-        prompt_text = EDGE_TIMVRES_MAP[TTS_TIMBRE] if TTS_TIMBRE else "en-US-GuyNeural"  # todo
-        print(f">>> Using timbre: {prompt_text} for edgeTTS")
-    elif CURENT_TTS_SERVER == "tacotron":
-        prompt_text = TACO_TIMVRES_MAP[TTS_TIMBRE] if TTS_TIMBRE else "40"  # todo
-        print(f">>> Using timbre: {prompt_text} for tacotron")
-    elif CURENT_TTS_SERVER == "sovits":
-        prompt_text = TTS_TIMBRE if TTS_TIMBRE else "The course name COMP9331 is simply compained 3331."
-        print(f">>> prompt text is : {prompt_text} for sovits")
-
-    # Prepare the request data
-    files = {
-        "tts_text": (None, tts_text),
-        "prompt_text": (None, prompt_text or "")
-    }
+    # 不再整段缓冲：上游WAV边收边去头转发，首段音频一到就发给调用方
+    return await _open_engine_stream(CURENT_TTS_SERVER, tts_text, TTS_TIMBRE, prompt_text, prompt_wav, pcm=True)
+
+
+def negotiate_format(audio_protocol, sample_rate, sample_format, frame_ms) -> Optional[AudioFormat]:
+    try:
+        return AudioFormat.from_request(audio_protocol, sample_rate, sample_format, frame_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def encode_frames(pcm_body, encoder: FrameEncoder, tts_text: str):
+    """16-bit PCM chunks -> negotiated frames (scripts/pcm_protocol.py) with utterance start/end markers."""
+    yield encoder.start(text=tts_text)
+    async for chunk in pcm_body:
+        data = encoder.push_pcm16(chunk)
+        if data:
+            yield data
+    yield encoder.end()
+
+
+async def _open_engine_stream(model_name, tts_text, timbre, prompt_text, prompt_wav, pcm, speaker_id=None, fmt=None):
+    """
+    Start streaming one utterance from a resident engine; the engine stays held until the body is sent.
+    With fmt (pcm only) the PCM is resampled and framed here, so the client does no DSP.
+    """
+    if model_name is None:
+        raise HTTPException(status_code=400, detail="model_name is required (no default TTS model started).")
+    model_info = (load_model_info() or {}).get(model_name, {})
+    prompt_text = resolve_prompt_text(model_name, timbre or model_info.get("cur_timbre"), prompt_text)
+    wav = (prompt_wav.filename, await prompt_wav.read(), prompt_wav.content_type) if prompt_wav else None
+
+    wrap = (lambda body, sample_rate: encode_frames(body, FrameEncoder(fmt, sample_rate), tts_text)) if fmt else None
+    try:
+        # 先取到第一块再返回响应头，模型服务的错误（如未知speaker_id）能以正确的状态码返回
+        sample_rate, first, rest = await open_stream(engine_host, model_name, tts_text, prompt_text, wav,
+                                                     speaker_id, pcm=pcm, wrap=wrap)
+    except EngineUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=f"TTS generation failed: {e}")
+    except Exception as e:  # 模型服务崩溃、超时等；open_stream已释放引擎
+        raise HTTPException(status_code=500, detail=f"TTS generation failed: {e}")
+    headers = {"X-TTS-Model": model_name}
+    if fmt:
+        headers["X-Audio-Format"] = fmt.header()
+    elif pcm:
+        headers["X-Sample-Rate"] = str(sample_rate)
+
+    async def stream():
+        try:
+            yield first
+            async for chunk in rest:
+                yield chunk
+        finally:
+            await rest.aclose()  # 调用方断开时也释放引擎
+
+    return StreamingResponse(stream(), media_type="application/octet-stream" if pcm else "audio/wav", headers=headers)
+
+
+# common streaming API: route by model name to a resident engine
+@app.post("/tts/stream")
+async def stream_tts_response(
+        tts_text: str = Form(...),
+        model_name: Optional[str] = Form(None),
+        timbre: Optional[str] = Form(None),
+        prompt_text: Optional[str] = Form(None),
+        prompt_wav: Optional[UploadFile] = File(None),
+        speaker_id: Optional[str] = Form(None),
+        audio_protocol: Optional[str] = Form(None),
+        sample_rate: Optional[int] = Form(None),
+        sample_format: Optional[str] = Form(None),
+        frame_ms: Optional[int] = Form(None)
+):
+    """
+    Stream 16-bit mono PCM for tts_text from the named model (default: the model from /tts/start).
+    The model is loaded on first use and stays resident; the sample rate is in the X-Sample-Rate header.
+    With audio_protocol=pcm-frames the body is framed in the requested format instead (X-Audio-Format header).
+    """
+    fmt = negotiate_format(audio_protocol, sample_rate, sample_format, frame_ms)
+    return await _open_engine_stream(model_name or CURENT_TTS_SERVER, tts_text, timbre, prompt_text, prompt_wav,
+                                     pcm=True, speaker_id=speaker_id, fmt=fmt)
+
+
+# per-model compatibility routes: TTS_SERVER=http://<host>:8604/engines/<model> works with the existing lip-sync clients
+@app.post("/engines/{model_name}/generate")
+async def engine_generate(
+        model_name: str,
+        tts_text: str = Form(...),
+        prompt_text: Optional[str] = Form(None),
+        prompt_wav: Optional[UploadFile] = File(None),
+        speaker_id: Optional[str] = Form(None)
+):
+    return await _open_engine_stream(model_name, tts_text, None, prompt_text, prompt_wav, pcm=False, speaker_id=speaker_id)
+
+
+# same contract as the model servers' /inference_zero_shot: raw 16-bit PCM streamed per segment, or negotiated frames
+@app.post("/engines/{model_name}/inference_zero_shot")
+async def engine_inference_streaming(
+        model_name: str,
+        tts_text: str = Form(...),
+        prompt_text: Optional[str] = Form(None),
+        prompt_wav: Optional[UploadFile] = File(None),
+        speaker_id: Optional[str] = Form(None),
+        audio_protocol: Optional[str] = Form(None),
+        sample_rate: Optional[int] = Form(None),
+        sample_format: Optional[str] = Form(None),
+        frame_ms: Optional[int] = Form(None)
+):
+    fmt = negotiate_format(audio_protocol, sample_rate, sample_format, frame_ms)
+    return await _open_engine_stream(model_name, tts_text, None, prompt_text, prompt_wav, pcm=True,
+                                     speaker_id=speaker_id, fmt=fmt)
+
+
+@app.post("/engines/{model_name}/speakers")
+async def engine_register_speaker(
+        model_name: str,
+        prompt_wav: UploadFile = File(...),
+        prompt_text: str = Form("")
+):
+    """Register a reference speaker on a model server that caches prompt features (cosyvoice)."""
+    try:
+        async with engine_host.session(model_name) as engine:
+            result = await engine.register_speaker(
+                (prompt_wav.filename, await prompt_wav.read(), prompt_wav.content_type), prompt_text)
+    except EngineUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return result
+
 
-    if prompt_wav:
-        files["prompt_wav"] = (prompt_wav.filename, await prompt_wav.read(), prompt_wav.content_type)
+@app.get("/engines/{model_name}/health")
+async def engine_health(model_name: str):
+    engine = engine_host.engines.get(model_name)
+    if engine is None:
+        raise HTTPException(status_code=404, detail=f"Model '{model_name}' is not resident.")
+    return {"status": "running", "model": model_name, **engine.get_info()}
 
-    async with httpx.AsyncClient() as client:
-        # TODO: change to actual api
-        response = await client.post(f"http://localhost:{TTS_SERVER_PORT}/generate", files=files, timeout=30.0)
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Failed to get response from TTS server")
+# resident engines, memory budget and LRU order
+@app.get("/tts/engines")
+async def get_tts_engines():
+    return engine_host.get_status()
 
-    wav_bytes = response.content
-    # totalyly return wav bytes
-    pcm_data = generate_pcm_bytes(wav_bytes)
-    return Response(content=pcm_data, media_type="application/octet-stream")
 
-    # stream response as PCM data
-    return StreamingResponse(generate_pcm_stream(wav_bytes), media_type="application/octet-stream")
+@app.post("/tts/unload")
+async def unload_tts_engine(model_name: str = Form(...)):
+    if not await engine_host.unload(model_name):
+        raise HTTPException(status_code=404, detail=f"Model '{model_name}' is not resident.")
+    return {"status": "success", "resident": list(engine_host.engines)}
 
 
 # get all valid TTS models